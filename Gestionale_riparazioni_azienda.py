@@ -1,8 +1,37 @@
+import array
+import bisect
+import codecs
+import cProfile
+import csv
 import datetime
+import functools
+import heapq
+import inspect
+import io
 import json
+import math
+import mmap
 import os
+import re
+import sqlite3
+import struct
+import sys
+import threading
+import time
+import urllib.request
+import zlib
+from collections import Counter, OrderedDict, deque
+from collections.abc import Mapping, MutableMapping
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 from enum import Enum
-from typing import List, Dict, Optional
+from typing import Callable, List, Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
 
 
 class StatoRiparazione(Enum):
@@ -14,188 +43,4319 @@ class StatoRiparazione(Enum):
     ANNULLATO = "Annullato"
 
 
-class TipoIntervento(Enum):
-    RIPARAZIONE = "Riparazione"
-    MANUTENZIONE = "Manutenzione Preventiva"
-    SOSTITUZIONE = "Sostituzione Componenti"
-    ISPEZIONE = "Ispezione"
+class TipoIntervento(Enum):
+    RIPARAZIONE = "Riparazione"
+    MANUTENZIONE = "Manutenzione Preventiva"
+    SOSTITUZIONE = "Sostituzione Componenti"
+    ISPEZIONE = "Ispezione"
+
+
+# Stati che chiudono una richiesta: con l'archivio freddo escono dalla memoria
+STATI_CHIUSI = (StatoRiparazione.CONSEGNATO, StatoRiparazione.ANNULLATO)
+
+# Rappresentazione compatta in memoria: gli enum e le priorità più comuni sono
+# salvati come piccoli interi, le date come microsecondi dall'epoca
+STATI = tuple(StatoRiparazione)
+CODICE_STATO = {stato: codice for codice, stato in enumerate(STATI)}
+TIPI = tuple(TipoIntervento)
+CODICE_TIPO = {tipo: codice for codice, tipo in enumerate(TIPI)}
+PRIORITA = ("Bassa", "Media", "Alta", "Urgente")
+CODICE_PRIORITA = {priorita: codice for codice, priorita in enumerate(PRIORITA)}
+
+EPOCA = datetime.datetime(1970, 1, 1)
+UN_MICROSECONDO = datetime.timedelta(microseconds=1)
+FORMATO_TIMESTAMP_NOTA = "%Y-%m-%d %H:%M"
+
+
+def in_microsecondi(data: datetime.datetime) -> int:
+    return (data - EPOCA) // UN_MICROSECONDO
+
+
+def da_microsecondi(microsecondi: int) -> datetime.datetime:
+    return EPOCA + datetime.timedelta(microseconds=microsecondi)
+
+
+def interna(testo: str) -> str:
+    """Una sola copia in memoria per i testi ripetuti (clienti, modelli, tecnici...)"""
+    return sys.intern(testo) if type(testo) is str else testo
+
+
+class NotaTecnica:
+    """Nota tecnica senza dizionario per istanza; resta leggibile come nota['campo']"""
+
+    __slots__ = ('_minuti', 'nota', 'tecnico')
+
+    def __init__(self, timestamp: str, nota: str, tecnico: str = ""):
+        self.timestamp = timestamp
+        self.nota = nota
+        self.tecnico = interna(tecnico)
+
+    @property
+    def timestamp(self) -> str:
+        if type(self._minuti) is int:
+            return da_microsecondi(self._minuti * 60_000_000).strftime(FORMATO_TIMESTAMP_NOTA)
+        return self._minuti
+
+    @timestamp.setter
+    def timestamp(self, valore: str):
+        try:
+            data = datetime.datetime.strptime(valore, FORMATO_TIMESTAMP_NOTA)
+        except (TypeError, ValueError):
+            # Formato inatteso: si conserva il testo così com'è
+            self._minuti = valore
+            return
+        self._minuti = in_microsecondi(data) // 60_000_000
+
+    def __getitem__(self, campo: str):
+        if campo not in ('timestamp', 'nota', 'tecnico'):
+            raise KeyError(campo)
+        return getattr(self, campo)
+
+    def to_dict(self):
+        return {
+            'timestamp': self.timestamp,
+            'nota': self.nota,
+            'tecnico': self.tecnico
+        }
+
+    @classmethod
+    def from_dict(cls, dati_nota: dict) -> 'NotaTecnica':
+        return cls(dati_nota['timestamp'], dati_nota['nota'], dati_nota['tecnico'])
+
+
+class Pezzo:
+    __slots__ = ('id_pezzo', 'nome', 'modello', 'numero_serie', 'cliente', '_data_creazione')
+
+    def __init__(self, id_pezzo: str, nome: str, modello: str,
+                 numero_serie: str, cliente: str):
+        self.id_pezzo = id_pezzo
+        self.nome = interna(nome)
+        self.modello = interna(modello)
+        self.numero_serie = numero_serie
+        self.cliente = interna(cliente)
+        self.data_creazione = datetime.datetime.now()
+
+    @property
+    def data_creazione(self) -> datetime.datetime:
+        return da_microsecondi(self._data_creazione)
+
+    @data_creazione.setter
+    def data_creazione(self, valore: datetime.datetime):
+        self._data_creazione = in_microsecondi(valore)
+
+    def to_dict(self):
+        return {
+            'id_pezzo': self.id_pezzo,
+            'nome': self.nome,
+            'modello': self.modello,
+            'numero_serie': self.numero_serie,
+            'cliente': self.cliente,
+            'data_creazione': self.data_creazione.isoformat()
+        }
+
+    @classmethod
+    def from_dict(cls, dati_pezzo: dict) -> 'Pezzo':
+        pezzo = cls(
+            dati_pezzo['id_pezzo'],
+            dati_pezzo['nome'],
+            dati_pezzo['modello'],
+            dati_pezzo['numero_serie'],
+            dati_pezzo['cliente']
+        )
+        if dati_pezzo.get('data_creazione'):
+            pezzo.data_creazione = datetime.datetime.fromisoformat(dati_pezzo['data_creazione'])
+        return pezzo
+
+
+class RichiestaRiparazione:
+    __slots__ = ('id_richiesta', 'pezzo', 'descrizione_problema', '_tipo', '_stato', '_priorita',
+                 '_data_richiesta', '_data_completamento', '_note', 'costo_stimato', 'costo_finale',
+                 '_tecnico', 'osservatore', '_note_differite', 'versione')
+
+    def __init__(self, id_richiesta: str, pezzo: Pezzo,
+                 descrizione_problema: str, tipo_intervento: TipoIntervento,
+                 priorita: str = "Media"):
+        self.id_richiesta = id_richiesta
+        self.pezzo = pezzo
+        self.descrizione_problema = descrizione_problema
+        self.tipo_intervento = tipo_intervento
+        self._stato = CODICE_STATO[StatoRiparazione.RICEVUTO]
+        self.priorita = priorita
+        self.data_richiesta = datetime.datetime.now()
+        self._data_completamento = None
+        self._note: List[NotaTecnica] = []
+        self._note_differite = None
+        # Incrementata a ogni modifica: serve al controllo delle modifiche concorrenti
+        self.versione = 1
+        self.costo_stimato = 0.0
+        self.costo_finale = 0.0
+        self.tecnico_assegnato = ""
+        # Funzione chiamata dopo ogni cambio di stato (es. per aggiornare gli indici)
+        self.osservatore = None
+
+    @property
+    def stato(self) -> StatoRiparazione:
+        return STATI[self._stato]
+
+    @stato.setter
+    def stato(self, valore: StatoRiparazione):
+        self._stato = CODICE_STATO[valore]
+
+    @property
+    def tipo_intervento(self) -> TipoIntervento:
+        return TIPI[self._tipo]
+
+    @tipo_intervento.setter
+    def tipo_intervento(self, valore: TipoIntervento):
+        self._tipo = CODICE_TIPO[valore]
+
+    @property
+    def priorita(self) -> str:
+        # Le priorità fuori elenco restano memorizzate come testo
+        return PRIORITA[self._priorita] if type(self._priorita) is int else self._priorita
+
+    @priorita.setter
+    def priorita(self, valore: str):
+        self._priorita = CODICE_PRIORITA.get(valore, interna(valore))
+
+    @property
+    def data_richiesta(self) -> datetime.datetime:
+        return da_microsecondi(self._data_richiesta)
+
+    @data_richiesta.setter
+    def data_richiesta(self, valore: datetime.datetime):
+        self._data_richiesta = in_microsecondi(valore)
+
+    @property
+    def data_completamento(self) -> Optional[datetime.datetime]:
+        if self._data_completamento is None:
+            return None
+        return da_microsecondi(self._data_completamento)
+
+    @data_completamento.setter
+    def data_completamento(self, valore: Optional[datetime.datetime]):
+        self._data_completamento = in_microsecondi(valore) if valore else None
+
+    @property
+    def tecnico_assegnato(self) -> str:
+        return self._tecnico
+
+    @tecnico_assegnato.setter
+    def tecnico_assegnato(self, valore: str):
+        self._tecnico = interna(valore)
+
+    @property
+    def note_tecniche(self) -> List[NotaTecnica]:
+        if self._note is None:
+            # Richiesta archiviata: le note vengono lette solo ora
+            self.note_tecniche = self._note_differite()
+            self._note_differite = None
+        return self._note
+
+    @note_tecniche.setter
+    def note_tecniche(self, note: Optional[list]):
+        if note is None:
+            self._note = None
+            return
+        self._note = [nota if isinstance(nota, NotaTecnica) else NotaTecnica.from_dict(nota)
+                      for nota in note]
+
+    def valori_colonnari(self) -> tuple:
+        """Codici di stato e tipo e date in microsecondi (None se non completata),
+        come memorizzati: servono a chi copia le richieste in colonne (es. i report)"""
+        return self._stato, self._tipo, self._data_richiesta, self._data_completamento
+
+    def aggiungi_nota(self, nota: str, tecnico: str = ""):
+        timestamp = datetime.datetime.now().strftime(FORMATO_TIMESTAMP_NOTA)
+        self.note_tecniche.append(NotaTecnica(timestamp, nota, tecnico))
+
+    def aggiorna_stato(self, nuovo_stato: StatoRiparazione):
+        self.stato = nuovo_stato
+        if nuovo_stato == StatoRiparazione.COMPLETATO:
+            self.data_completamento = datetime.datetime.now()
+        if self.osservatore:
+            self.osservatore(self)
+
+    def to_dict(self, con_versione: bool = False):
+        # La versione resta fuori dal formato di riparazioni.json: lo snapshot
+        # JSON la salva a parte, in 'versioni'
+        dati = {
+            'id_richiesta': self.id_richiesta,
+            'pezzo': self.pezzo.to_dict(),
+            'descrizione_problema': self.descrizione_problema,
+            'tipo_intervento': self.tipo_intervento.value,
+            'stato': self.stato.value,
+            'priorita': self.priorita,
+            'data_richiesta': self.data_richiesta.isoformat(),
+            'data_completamento': self.data_completamento.isoformat() if self.data_completamento else None,
+            'note_tecniche': [nota.to_dict() for nota in self.note_tecniche],
+            'costo_stimato': self.costo_stimato,
+            'costo_finale': self.costo_finale,
+            'tecnico_assegnato': self.tecnico_assegnato
+        }
+        if con_versione:
+            dati['versione'] = self.versione
+        return dati
+
+    @classmethod
+    def from_dict(cls, dati_richiesta: dict) -> 'RichiestaRiparazione':
+        # Ricostruisce il pezzo
+        pezzo = Pezzo.from_dict(dati_richiesta['pezzo'])
+
+        # Ricostruisce la richiesta senza passare da __init__ (che leggerebbe l'orologio)
+        richiesta = cls.__new__(cls)
+        richiesta.id_richiesta = dati_richiesta['id_richiesta']
+        richiesta.pezzo = pezzo
+        richiesta.descrizione_problema = dati_richiesta['descrizione_problema']
+        richiesta.tipo_intervento = TipoIntervento(dati_richiesta['tipo_intervento'])
+        richiesta.osservatore = None
+        richiesta._note_differite = None
+
+        # Ripristina i dati aggiuntivi
+        richiesta.stato = StatoRiparazione(dati_richiesta['stato'])
+        richiesta.priorita = dati_richiesta['priorita']
+        richiesta.data_richiesta = datetime.datetime.fromisoformat(dati_richiesta['data_richiesta'])
+        richiesta._data_completamento = None
+        if dati_richiesta['data_completamento']:
+            richiesta.data_completamento = datetime.datetime.fromisoformat(
+                dati_richiesta['data_completamento'])
+        richiesta.note_tecniche = dati_richiesta['note_tecniche']
+        richiesta.costo_stimato = dati_richiesta['costo_stimato']
+        richiesta.costo_finale = dati_richiesta['costo_finale']
+        richiesta.tecnico_assegnato = dati_richiesta['tecnico_assegnato']
+        richiesta.versione = dati_richiesta.get('versione', 1)
+        return richiesta
+
+
+class ConflittoVersione(Exception):
+    """La richiesta è stata modificata da un altro processo dopo l'ultima lettura"""
+
+    def __init__(self, id_richiesta: str, versione_attesa: int, versione_attuale: int):
+        super().__init__(f"La richiesta {id_richiesta} è stata modificata da un altro utente "
+                         f"(versione {versione_attuale}, attesa {versione_attesa})")
+        self.id_richiesta = id_richiesta
+        self.versione_attesa = versione_attesa
+        self.versione_attuale = versione_attuale
+
+
+class ErroreSalvataggio(Exception):
+    """Una modifica non può essere resa durevole: la copia in memoria non è quella salvata"""
+
+
+@contextmanager
+def blocco_file(percorso: str):
+    """Lock esclusivo consultivo su un file, condiviso tra processi diversi"""
+    with open(percorso, 'a+b') as f:
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield f
+        finally:
+            if fcntl:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class FileSequenze:
+    """Contatori condivisi tra processi in un piccolo file JSON protetto da lock"""
+
+    def __init__(self, percorso: str):
+        self.percorso = percorso
+
+    def riserva(self, prefisso: str, quantita: int, minimo: int) -> int:
+        """Riserva `quantita` numeri consecutivi dopo `minimo` e restituisce il primo"""
+        with blocco_file(self.percorso + ".lock"):
+            contatori = {}
+            if os.path.exists(self.percorso):
+                with open(self.percorso, 'r', encoding='utf-8') as f:
+                    contatori = json.load(f)
+            primo = max(contatori.get(prefisso, 0), minimo) + 1
+            contatori[prefisso] = primo + quantita - 1
+
+            file_temporaneo = self.percorso + ".tmp"
+            with open(file_temporaneo, 'w', encoding='utf-8') as f:
+                json.dump(contatori, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(file_temporaneo, self.percorso)
+        return primo
+
+
+class AllocatoreSequenze:
+    """Numeri progressivi per prefisso (es. "RIP20250906") assegnati in tempo costante.
+
+    I contatori vivono in memoria e vengono salvati insieme ai dati; se è
+    indicata una `riserva_esterna` (file condiviso o database) è quella a
+    garantire l'unicità tra processi diversi. Il lock interno rende sicura
+    l'allocazione da più thread.
+    """
+
+    FORMATO_ID = re.compile(r'^([A-Z]+\d{8})(\d+)$')
+
+    def __init__(self, riserva_esterna: Optional[Callable[[str, int, int], int]] = None):
+        self.contatori: Dict[str, int] = {}
+        self.riserva_esterna = riserva_esterna
+        self._lock = threading.Lock()
+
+    def osserva(self, identificativo: str):
+        """Allinea il contatore a un ID già esistente, così non verrà mai riassegnato"""
+        corrispondenza = self.FORMATO_ID.match(identificativo)
+        if corrispondenza:
+            prefisso, numero = corrispondenza.group(1), int(corrispondenza.group(2))
+            if numero > self.contatori.get(prefisso, 0):
+                self.contatori[prefisso] = numero
+
+    def riserva(self, prefisso: str, quantita: int = 1) -> range:
+        """Riserva un blocco di numeri consecutivi (utile per le importazioni massive)"""
+        if quantita < 1:
+            raise ValueError("La quantità da riservare deve essere positiva")
+        with self._lock:
+            ultimo = self.contatori.get(prefisso, 0)
+            if self.riserva_esterna:
+                primo = self.riserva_esterna(prefisso, quantita, ultimo)
+            else:
+                primo = ultimo + 1
+            self.contatori[prefisso] = primo + quantita - 1
+        return range(primo, primo + quantita)
+
+    def prossimo(self, prefisso: str) -> int:
+        return self.riserva(prefisso, 1).start
+
+
+class LettoreJSONIncrementale:
+    """Legge uno snapshot {"richieste": {...}, ...} una voce alla volta.
+
+    Invece di json.load sull'intero file, decodifica a blocchi e restituisce
+    ogni richiesta appena è completa: in memoria restano solo il blocco
+    corrente e la voce in costruzione, non l'intero albero di dizionari.
+    """
+
+    SPAZI = ' \t\n\r'
+
+    def __init__(self, percorso: str, dimensione_blocco: int = 1 << 20,
+                 avanzamento: Optional[Callable[[int, int], None]] = None):
+        self.percorso = percorso
+        self.dimensione_blocco = dimensione_blocco
+        self.avanzamento = avanzamento
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._pos = 0
+        self._fine_file = False
+        self._letti = 0
+        self._totale = 0
+
+    def _riempi(self, f, decodifica) -> bool:
+        """Aggiunge al buffer il blocco successivo; False a fine file"""
+        if self._fine_file:
+            return False
+        blocco = f.read(self.dimensione_blocco)
+        self._letti += len(blocco)
+        if not blocco:
+            self._fine_file = True
+            self._buffer = self._buffer[self._pos:] + decodifica(b'', final=True)
+        else:
+            # Scarta la parte già consumata per non far crescere il buffer
+            self._buffer = self._buffer[self._pos:] + decodifica(blocco)
+        self._pos = 0
+        if self.avanzamento:
+            self.avanzamento(self._letti, self._totale)
+        return True
+
+    def _carattere(self, f, decodifica) -> str:
+        """Primo carattere significativo (senza consumarlo), "" a fine file"""
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in self.SPAZI:
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._riempi(f, decodifica):
+                return ""
+
+    def _consuma(self, f, decodifica, atteso: str):
+        carattere = self._carattere(f, decodifica)
+        if carattere != atteso:
+            raise ValueError(f"JSON non valido in {self.percorso}: atteso '{atteso}', "
+                             f"trovato '{carattere or 'fine file'}'")
+        self._pos += 1
+
+    def _valore(self, f, decodifica):
+        """Decodifica il valore JSON successivo, leggendo altri blocchi finché è incompleto"""
+        self._carattere(f, decodifica)
+        while True:
+            try:
+                valore, fine = self._decoder.raw_decode(self._buffer, self._pos)
+                # Un numero che termina col buffer potrebbe continuare nel blocco successivo
+                if fine < len(self._buffer) or self._fine_file:
+                    self._pos = fine
+                    return valore
+            except json.JSONDecodeError:
+                if self._fine_file:
+                    raise
+            self._riempi(f, decodifica)
+
+    def voci(self):
+        """Genera ('richiesta', id, dati) per ogni richiesta e ('campo', chiave, valore) per il resto"""
+        self._totale = os.path.getsize(self.percorso)
+        decodifica = codecs.getincrementaldecoder('utf-8')().decode
+        with open(self.percorso, 'rb') as f:
+            self._consuma(f, decodifica, '{')
+            if self._carattere(f, decodifica) == '}':
+                return
+            while True:
+                chiave = self._valore(f, decodifica)
+                self._consuma(f, decodifica, ':')
+
+                if chiave == 'richieste' and self._carattere(f, decodifica) == '{':
+                    self._pos += 1
+                    if self._carattere(f, decodifica) != '}':
+                        while True:
+                            id_richiesta = self._valore(f, decodifica)
+                            self._consuma(f, decodifica, ':')
+                            yield 'richiesta', id_richiesta, self._valore(f, decodifica)
+                            if self._carattere(f, decodifica) != ',':
+                                break
+                            self._pos += 1
+                    self._consuma(f, decodifica, '}')
+                else:
+                    yield 'campo', chiave, self._valore(f, decodifica)
+
+                if self._carattere(f, decodifica) != ',':
+                    break
+                self._pos += 1
+            self._consuma(f, decodifica, '}')
+
+
+ESTENSIONE_COLONNARE = ".ripc"
+# Criteri di suddivisione dell'archivio JSON in più file (shard)
+CRITERI_SHARD = ('mese', 'hash')
+
+
+class SnapshotColonnare:
+    """Snapshot binario a colonne (estensione .ripc), leggibile tramite mmap.
+
+    Ogni campo delle richieste è una colonna contigua little-endian, allineata
+    a 8 byte: stato e tipo come codici da un byte, date come microsecondi
+    dall'epoca (int64, MANCANTE se assenti), costi come float64. Clienti,
+    modelli, nomi dei pezzi, tecnici e priorità sono indici nel dizionario
+    delle stringhe; i testi liberi sono concatenati con le posizioni di
+    inizio (in caratteri). Le note restano JSON compatto, decodificato solo
+    quando servono. Le colonne numeriche si leggono senza copie come
+    memoryview (colonna()), adatte a elaborazioni vettoriali.
+    """
+
+    MAGICO = b"RIPC"
+    VERSIONE = 1
+    INTESTAZIONE = struct.Struct("<4sHHII")
+    SEZIONE = struct.Struct("<32sQQ")
+    MANCANTE = -(1 << 63)
+
+    # nome colonna -> codice array
+    NUMERICHE = {
+        'stato': 'B', 'tipo': 'B', 'priorita': 'I', 'versione': 'I',
+        'data_richiesta': 'q', 'data_completamento': 'q', 'data_creazione': 'q',
+        'costo_stimato': 'd', 'costo_finale': 'd',
+        'cliente': 'I', 'modello': 'I', 'nome': 'I', 'tecnico': 'I',
+    }
+    TESTUALI = ('id_richiesta', 'id_pezzo', 'numero_serie', 'descrizione', 'note')
+
+    def __init__(self, percorso: str, contenuto: Optional[bytes] = None):
+        # Con `contenuto` lo snapshot è già in memoria (es. prodotto da un altro processo)
+        self.percorso = percorso
+        if contenuto is None:
+            self._file = open(percorso, 'rb')
+            self._mappa = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._file = None
+            self._mappa = contenuto
+        self._vista = memoryview(self._mappa)
+
+        magico, versione, _, self.numero, numero_sezioni = self.INTESTAZIONE.unpack_from(self._mappa, 0)
+        if magico != self.MAGICO or versione != self.VERSIONE:
+            self.chiudi()
+            raise ValueError(f"{percorso} non è uno snapshot colonnare valido")
+        self.sezioni: Dict[str, tuple] = {}
+        for i in range(numero_sezioni):
+            nome, offset, lunghezza = self.SEZIONE.unpack_from(
+                self._mappa, self.INTESTAZIONE.size + i * self.SEZIONE.size)
+            self.sezioni[nome.rstrip(b"\x00").decode('ascii')] = (offset, lunghezza)
+
+        self.dizionario = [sys.intern(testo) for testo in self.testi('dizionario')]
+        self.metadati = json.loads(bytes(self._sezione('metadati')) or b"{}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *eccezione):
+        self.chiudi()
+
+    def chiudi(self):
+        # Le viste sulla mappa vanno rilasciate prima di chiuderla
+        self._vista.release()
+        if self._file is not None:
+            self._mappa.close()
+            self._file.close()
+
+    def _sezione(self, nome: str) -> memoryview:
+        offset, lunghezza = self.sezioni[nome]
+        return self._vista[offset:offset + lunghezza]
+
+    def colonna(self, nome: str):
+        """Colonna numerica senza copie (memoryview); copia in array sulle macchine big-endian"""
+        vista = self._sezione(nome)
+        if sys.byteorder == 'little':
+            return vista.cast(self.NUMERICHE[nome])
+        valori = array.array(self.NUMERICHE[nome], vista)
+        valori.byteswap()
+        return valori
+
+    def testi(self, nome: str) -> List[str]:
+        posizioni = self._sezione(nome + ".pos")
+        if sys.byteorder == 'little':
+            posizioni = posizioni.cast('Q')
+        else:
+            posizioni = array.array('Q', posizioni)
+            posizioni.byteswap()
+        testo = str(self._sezione(nome + ".dati"), 'utf-8')
+        return [testo[inizio:fine] for inizio, fine in zip(posizioni, posizioni[1:])]
+
+    def conteggi(self, nome: str) -> Counter:
+        """Numero di richieste per valore di una colonna codificata (stato, tipo, cliente, ...)"""
+        conteggi = Counter(self.colonna(nome))
+        if nome == 'stato':
+            return Counter({STATI[codice].value: n for codice, n in conteggi.items()})
+        if nome == 'tipo':
+            return Counter({TIPI[codice].value: n for codice, n in conteggi.items()})
+        if nome in ('priorita', 'cliente', 'modello', 'nome', 'tecnico'):
+            return Counter({self.dizionario[codice]: n for codice, n in conteggi.items()})
+        return conteggi
+
+    def richieste(self):
+        """Ricostruisce le richieste; le note vengono decodificate solo al primo accesso"""
+        stati = self.colonna('stato')
+        tipi = self.colonna('tipo')
+        priorita = self.colonna('priorita')
+        versioni = self.colonna('versione')
+        date_richiesta = self.colonna('data_richiesta')
+        date_completamento = self.colonna('data_completamento')
+        date_creazione = self.colonna('data_creazione')
+        costi_stimati = self.colonna('costo_stimato')
+        costi_finali = self.colonna('costo_finale')
+        clienti = self.colonna('cliente')
+        modelli = self.colonna('modello')
+        nomi = self.colonna('nome')
+        tecnici = self.colonna('tecnico')
+        id_richieste = self.testi('id_richiesta')
+        id_pezzi = self.testi('id_pezzo')
+        numeri_serie = self.testi('numero_serie')
+        descrizioni = self.testi('descrizione')
+        note = self.testi('note')
+
+        dizionario = self.dizionario
+        # Le priorità dell'elenco standard tornano al loro codice compatto
+        valori_priorita = [CODICE_PRIORITA.get(testo, testo) for testo in dizionario]
+        mancante = self.MANCANTE
+        for i in range(self.numero):
+            pezzo = Pezzo.__new__(Pezzo)
+            pezzo.id_pezzo = id_pezzi[i]
+            pezzo.nome = dizionario[nomi[i]]
+            pezzo.modello = dizionario[modelli[i]]
+            pezzo.numero_serie = numeri_serie[i]
+            pezzo.cliente = dizionario[clienti[i]]
+            pezzo._data_creazione = date_creazione[i]
+
+            richiesta = RichiestaRiparazione.__new__(RichiestaRiparazione)
+            richiesta.id_richiesta = id_richieste[i]
+            richiesta.pezzo = pezzo
+            richiesta.descrizione_problema = descrizioni[i]
+            richiesta._tipo = tipi[i]
+            richiesta._stato = stati[i]
+            richiesta._priorita = valori_priorita[priorita[i]]
+            richiesta._data_richiesta = date_richiesta[i]
+            completamento = date_completamento[i]
+            richiesta._data_completamento = None if completamento == mancante else completamento
+            richiesta.costo_stimato = costi_stimati[i]
+            richiesta.costo_finale = costi_finali[i]
+            richiesta._tecnico = dizionario[tecnici[i]]
+            richiesta.versione = versioni[i]
+            richiesta.osservatore = None
+            if note[i]:
+                richiesta._note = None
+                richiesta._note_differite = functools.partial(json.loads, note[i])
+            else:
+                richiesta._note = []
+                richiesta._note_differite = None
+            yield richiesta
+
+    @classmethod
+    def prepara(cls, richieste, metadati: dict) -> dict:
+        """Colonne pronte da scrivere: solo array e stringhe, quindi scrivibili da un altro thread"""
+        numeriche = {nome: array.array(codice) for nome, codice in cls.NUMERICHE.items()}
+        testuali = {nome: [] for nome in cls.TESTUALI}
+        codici: Dict[str, int] = {}
+
+        def codice(testo: str) -> int:
+            valore = codici.get(testo)
+            if valore is None:
+                valore = codici[testo] = len(codici)
+            return valore
+
+        for richiesta in richieste:
+            pezzo = richiesta.pezzo
+            numeriche['stato'].append(richiesta._stato)
+            numeriche['tipo'].append(richiesta._tipo)
+            numeriche['priorita'].append(codice(richiesta.priorita))
+            numeriche['versione'].append(richiesta.versione)
+            numeriche['data_richiesta'].append(richiesta._data_richiesta)
+            completamento = richiesta._data_completamento
+            numeriche['data_completamento'].append(cls.MANCANTE if completamento is None else completamento)
+            numeriche['data_creazione'].append(pezzo._data_creazione)
+            numeriche['costo_stimato'].append(richiesta.costo_stimato)
+            numeriche['costo_finale'].append(richiesta.costo_finale)
+            numeriche['cliente'].append(codice(pezzo.cliente))
+            numeriche['modello'].append(codice(pezzo.modello))
+            numeriche['nome'].append(codice(pezzo.nome))
+            numeriche['tecnico'].append(codice(richiesta.tecnico_assegnato))
+            testuali['id_richiesta'].append(richiesta.id_richiesta)
+            testuali['id_pezzo'].append(pezzo.id_pezzo)
+            testuali['numero_serie'].append(pezzo.numero_serie)
+            testuali['descrizione'].append(richiesta.descrizione_problema)
+            note = richiesta.note_tecniche
+            testuali['note'].append(json.dumps([nota.to_dict() for nota in note], ensure_ascii=False,
+                                               separators=(',', ':')) if note else "")
+        testuali['dizionario'] = list(codici)
+        return {'numero': len(testuali['id_richiesta']), 'numeriche': numeriche,
+                'testuali': testuali, 'metadati': metadati}
+
+    @classmethod
+    def scrivi(cls, f, preparato: dict):
+        """Scrive le colonne preparate nel file binario aperto `f`"""
+        sezioni = []
+        for nome, valori in preparato['numeriche'].items():
+            if sys.byteorder != 'little':
+                valori = array.array(valori.typecode, valori)
+                valori.byteswap()
+            sezioni.append((nome, valori.tobytes()))
+        for nome, testi in preparato['testuali'].items():
+            posizioni = array.array('Q', [0])
+            for testo in testi:
+                posizioni.append(posizioni[-1] + len(testo))
+            if sys.byteorder != 'little':
+                posizioni.byteswap()
+            sezioni.append((nome + ".pos", posizioni.tobytes()))
+            sezioni.append((nome + ".dati", "".join(testi).encode('utf-8')))
+        sezioni.append(('metadati', json.dumps(preparato['metadati'], ensure_ascii=False).encode('utf-8')))
+
+        offset = cls.INTESTAZIONE.size + len(sezioni) * cls.SEZIONE.size
+        tabella = []
+        for nome, contenuto in sezioni:
+            offset += -offset % 8
+            tabella.append(cls.SEZIONE.pack(nome.encode('ascii'), offset, len(contenuto)))
+            offset += len(contenuto)
+
+        f.write(cls.INTESTAZIONE.pack(cls.MAGICO, cls.VERSIONE, 0, preparato['numero'], len(sezioni)))
+        f.write(b"".join(tabella))
+        posizione = cls.INTESTAZIONE.size + len(sezioni) * cls.SEZIONE.size
+        for nome, contenuto in sezioni:
+            riempimento = -posizione % 8
+            f.write(b"\x00" * riempimento)
+            f.write(contenuto)
+            posizione += riempimento + len(contenuto)
+
+
+class Strumentazione:
+    """Conteggi, istogrammi delle latenze e byte scritti delle operazioni principali.
+
+    Gli istogrammi hanno classi a potenze di 2 in microsecondi: registrare
+    una durata costa un incremento, e i percentili si leggono con
+    l'approssimazione di un fattore 2. Spenta, ogni operazione paga solo il
+    controllo di `attiva`.
+    """
+
+    CLASSI = 32  # fino a 2^31 µs, circa 36 minuti
+
+    def __init__(self, attiva: bool = False, soglia_lenta_ms: float = 200.0,
+                 massimo_lente: int = 100, file_lente: Optional[str] = None):
+        self.attiva = attiva
+        # Le operazioni più lente della soglia finiscono in operazioni_lente
+        # (le ultime `massimo_lente`) e, se indicato, in file_lente (una riga JSON ciascuna)
+        self.soglia_lenta_ms = soglia_lenta_ms
+        self.file_lente = file_lente
+        self.operazioni_lente: deque = deque(maxlen=massimo_lente)
+        self.conteggi: Dict[str, int] = {}
+        self.tempi_totali: Dict[str, float] = {}
+        self.tempi_massimi: Dict[str, float] = {}
+        self.istogrammi: Dict[str, List[int]] = {}
+        self.byte_scritti: Dict[str, int] = {}
+        # Operazioni in corso, separate per thread: il servizio HTTP esegue le
+        # stesse operazioni nel thread dell'event loop e in quello dell'executor
+        self._locale = threading.local()
+        # Le scritture del servizio HTTP arrivano da un thread dell'executor
+        self._lock = threading.Lock()
+        self._profilo = None
+
+    @property
+    def in_corso(self) -> set:
+        """Le operazioni misurate in corso nel thread corrente"""
+        in_corso = getattr(self._locale, 'in_corso', None)
+        if in_corso is None:
+            in_corso = self._locale.in_corso = set()
+        return in_corso
+
+    def registra(self, operazione: str, secondi: float):
+        classe = min(int(secondi * 1e6).bit_length(), self.CLASSI - 1)
+        with self._lock:
+            istogramma = self.istogrammi.get(operazione)
+            if istogramma is None:
+                istogramma = self.istogrammi[operazione] = [0] * self.CLASSI
+            istogramma[classe] += 1
+            self.conteggi[operazione] = self.conteggi.get(operazione, 0) + 1
+            self.tempi_totali[operazione] = self.tempi_totali.get(operazione, 0.0) + secondi
+            if secondi > self.tempi_massimi.get(operazione, 0.0):
+                self.tempi_massimi[operazione] = secondi
+
+    def registra_lenta(self, operazione: str, secondi: float, parametri: dict):
+        voce = {'operazione': operazione, 'ms': round(secondi * 1000, 3),
+                'quando': datetime.datetime.now().isoformat(timespec='milliseconds'),
+                'parametri': {nome: valore.value if isinstance(valore, Enum)
+                              else valore if isinstance(valore, (str, int, float, bool, type(None)))
+                              else repr(valore)
+                              for nome, valore in parametri.items()}}
+        self.operazioni_lente.append(voce)
+        if self.file_lente:
+            try:
+                with open(self.file_lente, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(voce, ensure_ascii=False) + '\n')
+            except OSError as e:
+                print(f"Impossibile scrivere il log delle operazioni lente: {e}")
+
+    def conta_byte(self, destinazione: str, quantita: int):
+        if self.attiva:
+            with self._lock:
+                self.byte_scritti[destinazione] = self.byte_scritti.get(destinazione, 0) + quantita
+
+    def percentile(self, operazione: str, q: float) -> Optional[float]:
+        """Limite superiore in ms della classe che contiene il percentile q"""
+        istogramma = self.istogrammi.get(operazione)
+        if not istogramma:
+            return None
+        obiettivo = q * sum(istogramma)
+        cumulato = 0
+        for classe, conteggio in enumerate(istogramma):
+            cumulato += conteggio
+            if conteggio and cumulato >= obiettivo:
+                return (1 << classe) / 1000
+        return None
+
+    def riepilogo(self) -> dict:
+        """Tutte le misure in un dizionario serializzabile in JSON"""
+        operazioni = {}
+        for operazione, conteggio in sorted(self.conteggi.items()):
+            totale = self.tempi_totali[operazione]
+            operazioni[operazione] = {
+                'conteggio': conteggio,
+                'totale_ms': round(totale * 1000, 3),
+                'media_ms': round(totale * 1000 / conteggio, 3),
+                'p50_ms': self.percentile(operazione, 0.5),
+                'p90_ms': self.percentile(operazione, 0.9),
+                'p99_ms': self.percentile(operazione, 0.99),
+                'max_ms': round(self.tempi_massimi[operazione] * 1000, 3),
+            }
+        return {'attiva': self.attiva, 'soglia_lenta_ms': self.soglia_lenta_ms,
+                'operazioni': operazioni, 'byte_scritti': dict(self.byte_scritti),
+                'operazioni_lente': list(self.operazioni_lente)}
+
+    def azzera(self):
+        with self._lock:
+            self.conteggi.clear()
+            self.tempi_totali.clear()
+            self.tempi_massimi.clear()
+            self.istogrammi.clear()
+            self.byte_scritti.clear()
+            self.operazioni_lente.clear()
+
+    def avvia_profilo(self, modalita: str = "cprofile", intervallo: float = 0.005):
+        """Profila il thread chiamante fino a ferma_profilo().
+
+        "cprofile" registra ogni chiamata (file per pstats o snakeviz);
+        "campionamento" legge lo stack ogni `intervallo` secondi da un altro
+        thread, con un rallentamento trascurabile, e produce stack "piegati"
+        per flamegraph.pl o speedscope.
+        """
+        if self._profilo is not None:
+            raise RuntimeError("Un profilo è già in corso")
+        if modalita == "cprofile":
+            profilo = cProfile.Profile()
+            profilo.enable()
+            self._profilo = profilo
+        elif modalita == "campionamento":
+            self._profilo = CampionatoreStack(threading.get_ident(), intervallo)
+            self._profilo.start()
+        else:
+            raise ValueError(f"Modalità di profilo non supportata: {modalita}")
+
+    def ferma_profilo(self, percorso: str) -> str:
+        """Ferma il profilo in corso e lo scrive in `percorso`"""
+        profilo, self._profilo = self._profilo, None
+        if profilo is None:
+            raise RuntimeError("Nessun profilo in corso")
+        if isinstance(profilo, cProfile.Profile):
+            profilo.disable()
+            profilo.dump_stats(percorso)
+        else:
+            profilo.ferma()
+            with open(percorso, 'w', encoding='utf-8') as f:
+                for stack, conteggio in sorted(profilo.campioni.items()):
+                    f.write(f"{stack} {conteggio}\n")
+        return percorso
+
+    @property
+    def profilo_in_corso(self) -> bool:
+        return self._profilo is not None
+
+
+class CampionatoreStack(threading.Thread):
+    """Thread che campiona lo stack di un altro thread e conta gli stack uguali"""
+
+    def __init__(self, id_thread: int, intervallo: float):
+        super().__init__(name="campionatore-stack", daemon=True)
+        self.id_thread = id_thread
+        self.intervallo = intervallo
+        self.campioni: Counter = Counter()
+        self._fermo = threading.Event()
+
+    def run(self):
+        while not self._fermo.wait(self.intervallo):
+            frame = sys._current_frames().get(self.id_thread)
+            funzioni = []
+            while frame is not None:
+                codice = frame.f_code
+                funzioni.append(f"{os.path.basename(codice.co_filename)}:{codice.co_name}")
+                frame = frame.f_back
+            if funzioni:
+                # Formato "piegato": dalla radice alla foglia, separati da ';'
+                self.campioni[";".join(reversed(funzioni))] += 1
+
+    def ferma(self):
+        self._fermo.set()
+        self.join()
+
+
+def strumentato(operazione: str):
+    """Misura con sistema.strumentazione le chiamate al metodo decorato.
+
+    Le chiamate annidate alla stessa operazione (es. la ripetizione dentro
+    la transazione) contano una volta sola. Quelle più lente della soglia
+    finiscono nel log delle operazioni lente con i loro parametri.
+    """
+    def decoratore(metodo):
+        firma = inspect.signature(metodo)
+
+        @functools.wraps(metodo)
+        def misurato(self, *args, **kwargs):
+            strumentazione = self.strumentazione
+            if not strumentazione.attiva:
+                return metodo(self, *args, **kwargs)
+            in_corso = strumentazione.in_corso
+            if operazione in in_corso:
+                return metodo(self, *args, **kwargs)
+            in_corso.add(operazione)
+            inizio = time.perf_counter()
+            try:
+                return metodo(self, *args, **kwargs)
+            finally:
+                secondi = time.perf_counter() - inizio
+                in_corso.discard(operazione)
+                strumentazione.registra(operazione, secondi)
+                if secondi * 1000 >= strumentazione.soglia_lenta_ms:
+                    parametri = firma.bind(self, *args, **kwargs).arguments
+                    parametri.pop('self', None)
+                    for nome, parametro in firma.parameters.items():
+                        if parametro.kind is inspect.Parameter.VAR_KEYWORD:
+                            parametri.update(parametri.pop(nome, {}))
+                    strumentazione.registra_lenta(operazione, secondi, parametri)
+        return misurato
+    return decoratore
+
+
+class JournalModifiche:
+    """Registro append-only delle modifiche: una riga JSON compatta per ogni operazione"""
+
+    def __init__(self, percorso: str, strumentazione: Optional[Strumentazione] = None):
+        self.percorso = percorso
+        self.strumentazione = strumentazione
+
+    def aggiungi(self, record: dict):
+        """Accoda un record e lo forza su disco prima di restituire il controllo"""
+        self.aggiungi_molti([record])
+
+    def aggiungi_molti(self, records: List[dict]):
+        """Accoda più record con una sola scrittura e un solo fsync"""
+        righe = ''.join(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n'
+                        for record in records).encode('utf-8')
+        with open(self.percorso, 'ab') as f:
+            f.write(righe)
+            f.flush()
+            os.fsync(f.fileno())
+        if self.strumentazione:
+            self.strumentazione.conta_byte('journal', len(righe))
+
+    def leggi(self, ripara: bool = True) -> List[dict]:
+        """Legge tutti i record completi del journal.
+
+        Un crash durante la scrittura può lasciare un'ultima riga troncata:
+        viene scartata e, con ripara=True, il file riparato, così le aggiunte
+        successive ripartono da una riga pulita.
+        """
+        if not os.path.exists(self.percorso):
+            return []
+
+        with open(self.percorso, 'rb') as f:
+            contenuto = f.read()
+
+        fine_valida = contenuto.rfind(b'\n') + 1
+        if fine_valida < len(contenuto) and ripara:
+            print(f"Journal: scartata una riga incompleta in coda a {self.percorso}")
+            with open(self.percorso, 'r+b') as f:
+                f.truncate(fine_valida)
+                f.flush()
+                os.fsync(f.fileno())
+
+        record = []
+        for riga in contenuto[:fine_valida].decode('utf-8').splitlines():
+            if riga.strip():
+                record.append(json.loads(riga))
+        return record
+
+    def leggi_da(self, posizione: int) -> tuple:
+        """Legge i record completi accodati dopo `posizione` (in byte).
+
+        Restituisce i record e la posizione da cui ripartire alla lettura
+        successiva; un'eventuale riga incompleta in coda viene lasciata lì.
+        """
+        if not os.path.exists(self.percorso):
+            return [], 0
+
+        with open(self.percorso, 'rb') as f:
+            f.seek(posizione)
+            contenuto = f.read()
+
+        fine_valida = contenuto.rfind(b'\n') + 1
+        record = [json.loads(riga) for riga in contenuto[:fine_valida].decode('utf-8').splitlines()
+                  if riga.strip()]
+        return record, posizione + fine_valida
+
+    def svuota(self):
+        """Tronca il journal dopo che il suo contenuto è stato consolidato nello snapshot"""
+        with open(self.percorso, 'w', encoding='utf-8') as f:
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class IscrizioneEventi:
+    """Un iscritto al bus: coda limitata degli eventi non ancora consegnati"""
+
+    def __init__(self, callback: Callable[[List[dict]], None], tipi: Optional[set],
+                 dimensione_lotto: int, capacita: int):
+        self.callback = callback
+        self.tipi = tipi
+        self.dimensione_lotto = dimensione_lotto
+        self.coda: deque = deque()
+        self.capacita = capacita
+        self.consegnati = 0
+        # Eventi scartati perché la coda era piena: chi li vuole tutti li
+        # rilegge dal feed a partire dall'offset dell'ultimo ricevuto
+        self.persi = 0
+        self.errori = 0
+
+
+class BusEventi:
+    """Pub/sub in processo per gli eventi di modifica delle richieste.
+
+    pubblica() non chiama mai gli iscritti: mette gli eventi nelle loro code
+    e torna subito. Un thread dedicato li consegna a lotti di al più
+    dimensione_lotto eventi; se un iscritto è troppo lento e la sua coda
+    supera la capacità, gli eventi più vecchi vengono scartati e contati in
+    `persi`, così chi modifica i dati non resta mai bloccato.
+    """
+
+    def __init__(self):
+        self.iscrizioni: List[IscrizioneEventi] = []
+        self._condizione = threading.Condition()
+        self._in_consegna = 0
+        self._thread: Optional[threading.Thread] = None
+        self._chiuso = False
+
+    def __bool__(self) -> bool:
+        return bool(self.iscrizioni)
+
+    def iscrivi(self, callback: Callable[[List[dict]], None], tipi=None,
+                dimensione_lotto: int = 100, capacita: int = 10000) -> IscrizioneEventi:
+        """Registra callback(lotto di eventi); con `tipi` riceve solo quei tipi di evento"""
+        iscrizione = IscrizioneEventi(callback, set(tipi) if tipi else None, dimensione_lotto, capacita)
+        with self._condizione:
+            self.iscrizioni = self.iscrizioni + [iscrizione]
+            if self._thread is None:
+                self._chiuso = False
+                self._thread = threading.Thread(target=self._consegna, name="bus-eventi", daemon=True)
+                self._thread.start()
+        return iscrizione
+
+    def disiscrivi(self, iscrizione: IscrizioneEventi):
+        with self._condizione:
+            self.iscrizioni = [altra for altra in self.iscrizioni if altra is not iscrizione]
+
+    def pubblica(self, eventi: List[dict]):
+        if not self.iscrizioni or not eventi:
+            return
+        with self._condizione:
+            for iscrizione in self.iscrizioni:
+                for evento in eventi:
+                    if iscrizione.tipi is None or evento['tipo'] in iscrizione.tipi:
+                        if len(iscrizione.coda) >= iscrizione.capacita:
+                            iscrizione.coda.popleft()
+                            iscrizione.persi += 1
+                        iscrizione.coda.append(evento)
+            self._condizione.notify()
+
+    def attendi_consegna(self, timeout: Optional[float] = None) -> bool:
+        """Aspetta che tutti gli eventi pubblicati siano stati consegnati"""
+        with self._condizione:
+            return self._condizione.wait_for(
+                lambda: not self._in_consegna and not any(i.coda for i in self.iscrizioni), timeout)
+
+    def chiudi(self):
+        """Consegna quanto resta in coda e ferma il thread"""
+        with self._condizione:
+            self._chiuso = True
+            self._condizione.notify_all()
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+
+    def _consegna(self):
+        while True:
+            with self._condizione:
+                self._condizione.wait_for(lambda: self._chiuso or any(i.coda for i in self.iscrizioni))
+                lotti = []
+                for iscrizione in self.iscrizioni:
+                    if iscrizione.coda:
+                        quanti = min(len(iscrizione.coda), iscrizione.dimensione_lotto)
+                        lotti.append((iscrizione, [iscrizione.coda.popleft() for _ in range(quanti)]))
+                if not lotti and self._chiuso:
+                    return
+                self._in_consegna += 1
+            for iscrizione, lotto in lotti:
+                try:
+                    iscrizione.callback(lotto)
+                    iscrizione.consegnati += len(lotto)
+                except Exception as e:
+                    iscrizione.errori += 1
+                    print(f"Errore nella consegna degli eventi: {e}")
+            with self._condizione:
+                self._in_consegna -= 1
+                self._condizione.notify_all()
+
+
+class FeedModifiche:
+    """Feed durevole degli eventi di modifica: una riga JSON per evento, con offset crescente.
+
+    Chi consuma il feed ricorda l'ultimo offset letto e chiede solo quelli
+    successivi con leggi(dopo=offset). Il file è append-only; le posizioni
+    di un evento ogni PASSO_INDICE sono tenute in memoria, così una lettura
+    salta direttamente vicino all'offset richiesto.
+    """
+
+    PASSO_INDICE = 256
+
+    def __init__(self, percorso: str, strumentazione: Optional[Strumentazione] = None):
+        self.percorso = percorso
+        self.strumentazione = strumentazione
+        self.ultimo_offset = 0
+        self._indice: List[tuple] = []   # (offset, posizione in byte), ogni PASSO_INDICE eventi
+        self._posizione_letta = 0        # fin dove il file è stato indicizzato
+        # Il servizio HTTP scrive dal thread dell'executor e legge da quello dell'event loop
+        self._lock = threading.Lock()
+        self._aggiorna_indice()
+
+    def _aggiorna_indice(self):
+        """Indicizza le righe accodate dopo l'ultima lettura (anche da altri processi)"""
+        if not os.path.exists(self.percorso):
+            self._indice, self._posizione_letta, self.ultimo_offset = [], 0, 0
+            return
+        dimensione = os.path.getsize(self.percorso)
+        if dimensione < self._posizione_letta:
+            # Il file è stato ricreato: si ricomincia
+            self._indice, self._posizione_letta, self.ultimo_offset = [], 0, 0
+        if dimensione == self._posizione_letta:
+            return
+        with open(self.percorso, 'rb') as f:
+            f.seek(self._posizione_letta)
+            posizione = self._posizione_letta
+            for riga in f:
+                if not riga.endswith(b'\n'):
+                    break   # riga incompleta: verrà riletta quando sarà finita
+                offset = json.loads(riga)['offset']
+                if offset % self.PASSO_INDICE == 1 or not self._indice:
+                    self._indice.append((offset, posizione))
+                self.ultimo_offset = offset
+                posizione += len(riga)
+            self._posizione_letta = posizione
+
+    def aggiungi_molti(self, eventi: List[dict]):
+        """Assegna gli offset agli eventi e li accoda con un solo fsync.
+
+        Con più processi va chiamato sotto il lock del file dati: l'ultimo
+        offset viene riletto dal file prima di numerare.
+        """
+        if not eventi:
+            return
+        with self._lock:
+            self._aggiorna_indice()
+            posizione = self._posizione_letta
+            righe = bytearray()
+            for evento in eventi:
+                self.ultimo_offset += 1
+                evento['offset'] = self.ultimo_offset
+                if self.ultimo_offset % self.PASSO_INDICE == 1 or not self._indice:
+                    self._indice.append((self.ultimo_offset, posizione + len(righe)))
+                righe += json.dumps(evento, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+            with open(self.percorso, 'ab') as f:
+                f.write(righe)
+                f.flush()
+                os.fsync(f.fileno())
+            self._posizione_letta = posizione + len(righe)
+        if self.strumentazione:
+            self.strumentazione.conta_byte('feed_modifiche', len(righe))
+
+    def leggi(self, dopo: int = 0, massimo: int = 1000) -> tuple:
+        """Gli eventi con offset maggiore di `dopo` (al più `massimo`) e l'offset da cui ripartire"""
+        with self._lock:
+            self._aggiorna_indice()
+            if dopo >= self.ultimo_offset or not self._indice:
+                return [], dopo
+            punto = bisect.bisect_right(self._indice, (dopo + 1, float('inf'))) - 1
+            posizione = self._indice[max(punto, 0)][1]
+        eventi = []
+        with open(self.percorso, 'rb') as f:
+            f.seek(posizione)
+            for riga in f:
+                if len(eventi) >= massimo or not riga.endswith(b'\n'):
+                    break
+                evento = json.loads(riga)
+                if evento['offset'] > dopo:
+                    eventi.append(evento)
+        return eventi, eventi[-1]['offset'] if eventi else dopo
+
+
+class ArchivioFreddo:
+    """Segmento append-only delle richieste chiuse, letto solo quando serve.
+
+    Ogni richiesta archiviata occupa una riga JSON in `percorso` e le sue note
+    una riga in `percorso.note`; l'indice `percorso.indice` associa a ogni ID
+    le posizioni nei due file e il contributo alle statistiche, così le
+    statistiche restano complete senza caricare l'archivio.
+    """
+
+    def __init__(self, percorso: str, dimensione_cache: int = 256):
+        self.percorso = percorso
+        self.percorso_note = percorso + ".note"
+        self.percorso_indice = percorso + ".indice"
+        # id -> [offset, lunghezza, offset note, lunghezza note, contributo statistiche,
+        #        apparato (modello, numero di serie, data richiesta in µs)]
+        self.indice: Dict[str, list] = {}
+        self._cache = OrderedDict()
+        self.dimensione_cache = dimensione_cache
+        self._indice_modificato = False
+
+        if os.path.exists(self.percorso_indice):
+            with open(self.percorso_indice, 'r', encoding='utf-8') as f:
+                self.indice = json.load(f)
+
+    def __contains__(self, id_richiesta: str) -> bool:
+        return id_richiesta in self.indice
+
+    def __len__(self) -> int:
+        return len(self.indice)
+
+    @staticmethod
+    def _leggi(percorso: str, offset: int, lunghezza: int):
+        with open(percorso, 'rb') as f:
+            f.seek(offset)
+            return json.loads(f.read(lunghezza))
+
+    def _richiesta_da_voce(self, id_richiesta: str, dati: dict, voce: list) -> 'RichiestaRiparazione':
+        dati['note_tecniche'] = []
+        richiesta = RichiestaRiparazione.from_dict(dati)
+        # Le note vengono lette dal disco solo al primo accesso
+        offset_note, lunghezza_note = voce[2], voce[3]
+        richiesta.note_tecniche = None
+        richiesta._note_differite = lambda: self._leggi(self.percorso_note, offset_note, lunghezza_note)
+        return richiesta
+
+    def carica(self, id_richiesta: str) -> 'RichiestaRiparazione':
+        if id_richiesta in self._cache:
+            self._cache.move_to_end(id_richiesta)
+            return self._cache[id_richiesta]
+        voce = self.indice[id_richiesta]
+        richiesta = self._richiesta_da_voce(id_richiesta, self._leggi(self.percorso, voce[0], voce[1]), voce)
+        self._cache[id_richiesta] = richiesta
+        while len(self._cache) > self.dimensione_cache:
+            self._cache.popitem(last=False)
+        return richiesta
+
+    def scorri(self):
+        """Tutte le richieste archiviate, con una lettura sequenziale del segmento.
+
+        L'indice viene copiato subito: la lettura può proseguire in un altro
+        thread anche se nel frattempo si archiviano o riaprono richieste.
+        """
+        per_offset = {voce[0]: (id_richiesta, voce) for id_richiesta, voce in self.indice.items()}
+        return self._scorri(per_offset)
+
+    def _scorri(self, per_offset: dict):
+        if not per_offset:
+            return
+        with open(self.percorso, 'rb') as f:
+            offset = 0
+            for riga in f:
+                # Le righe non più indicizzate (richieste riaperte) vengono saltate
+                voce = per_offset.get(offset)
+                if voce is not None:
+                    id_richiesta, voce = voce
+                    richiesta = self._cache.get(id_richiesta)
+                    yield (richiesta if richiesta is not None
+                           else self._richiesta_da_voce(id_richiesta, json.loads(riga), voce))
+                offset += len(riga)
+
+    def archivia(self, richieste: List['RichiestaRiparazione'], contributi: List[list]) -> int:
+        """Accoda le richieste ai segmenti e aggiorna l'indice (un fsync per file).
+
+        Restituisce i byte accodati ai segmenti.
+        """
+        righe = bytearray()
+        righe_note = bytearray()
+        voci = []
+        with open(self.percorso, 'ab') as f, open(self.percorso_note, 'ab') as f_note:
+            offset = f.tell()
+            offset_note = f_note.tell()
+            for richiesta, contributo in zip(richieste, contributi):
+                dati = richiesta.to_dict(con_versione=True)
+                note = dati.pop('note_tecniche')
+                riga = json.dumps(dati, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+                riga_note = json.dumps(note, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+                voci.append((richiesta.id_richiesta, [offset + len(righe), len(riga),
+                                                      offset_note + len(righe_note), len(riga_note),
+                                                      contributo, self._apparato(richiesta)]))
+                righe += riga
+                righe_note += riga_note
+            for file, dati in ((f, righe), (f_note, righe_note)):
+                file.write(dati)
+                file.flush()
+                os.fsync(file.fileno())
+
+        for id_richiesta, voce in voci:
+            self.indice[id_richiesta] = voce
+        self._indice_modificato = True
+        self.salva_indice()
+        return len(righe) + len(righe_note)
+
+    @staticmethod
+    def _apparato(richiesta: 'RichiestaRiparazione') -> list:
+        return [richiesta.pezzo.modello, richiesta.pezzo.numero_serie, richiesta._data_richiesta]
+
+    def apparato(self, id_richiesta: str) -> list:
+        """Modello, numero di serie e data della richiesta archiviata, senza leggere il segmento"""
+        voce = self.indice[id_richiesta]
+        if len(voce) < 6:
+            # Voce scritta prima del registro degli apparati: si completa una volta sola
+            voce.append(self._apparato(self.carica(id_richiesta)))
+            self._indice_modificato = True
+        return voce[5]
+
+    def rimuovi(self, id_richiesta: str):
+        """Toglie una richiesta dall'archivio (es. perché è stata riaperta)"""
+        if self.indice.pop(id_richiesta, None) is not None:
+            self._cache.pop(id_richiesta, None)
+            self._indice_modificato = True
+
+    def salva_indice(self):
+        if not self._indice_modificato:
+            return
+        file_temporaneo = self.percorso_indice + ".tmp"
+        with open(file_temporaneo, 'w', encoding='utf-8') as f:
+            json.dump(self.indice, f, ensure_ascii=False, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(file_temporaneo, self.percorso_indice)
+        self._indice_modificato = False
+
+
+class RichiesteStratificate(MutableMapping):
+    """Richieste attive in memoria più quelle chiuse nell'archivio freddo, caricate su richiesta"""
+
+    def __init__(self, freddo: ArchivioFreddo):
+        self.attive: Dict[str, RichiestaRiparazione] = {}
+        self.freddo = freddo
+
+    def __getitem__(self, id_richiesta: str) -> RichiestaRiparazione:
+        richiesta = self.attive.get(id_richiesta)
+        if richiesta is None:
+            richiesta = self.freddo.carica(id_richiesta)
+        return richiesta
+
+    def __setitem__(self, id_richiesta: str, richiesta: RichiestaRiparazione):
+        # Una richiesta scritta tra le attive prevale sulla copia archiviata
+        self.attive[id_richiesta] = richiesta
+        self.freddo.rimuovi(id_richiesta)
+
+    def __delitem__(self, id_richiesta: str):
+        if id_richiesta in self.attive:
+            del self.attive[id_richiesta]
+        elif id_richiesta in self.freddo:
+            self.freddo.rimuovi(id_richiesta)
+        else:
+            raise KeyError(id_richiesta)
+
+    def __contains__(self, id_richiesta) -> bool:
+        return id_richiesta in self.attive or id_richiesta in self.freddo
+
+    def __iter__(self):
+        yield from self.attive
+        yield from list(self.freddo.indice)
+
+    def __len__(self) -> int:
+        return len(self.attive) + len(self.freddo)
+
+
+class IndiceTestuale:
+    """Indice invertito a trigrammi sui campi della ricerca libera.
+
+    Per ogni richiesta conserva i campi già in minuscolo (separati da un
+    carattere nullo, così una sottostringa non può attraversare due campi)
+    e registra ogni trigramma nella lista delle richieste che lo contengono.
+    Una ricerca interseca le liste dei trigrammi del termine e verifica solo
+    i candidati rimasti, con la stessa semantica di sottostringa di prima.
+
+    cerca() restituisce un insieme e cerca_richieste() lo ordina per data,
+    come la scansione lineare. Per chi vuole i risultati per rilevanza,
+    punteggio() valuta le parole del termine contro le parole dei campi di
+    un risultato: costa quanto i risultati, non quanto l'archivio, e non
+    richiede liste per parola in memoria.
+    """
+
+    LUNGHEZZA_NGRAMMA = 3
+    SEPARATORE = '\x00'
+    PAROLA = re.compile(r"\w+")
+
+    def __init__(self):
+        self.postings: Dict[str, set] = {}
+        self.testi: Dict[int, str] = {}
+        # Numeri progressivi al posto degli ID: occupano meno memoria nei set
+        # e conservano l'ordine di inserimento del dizionario delle richieste
+        self.numeri: Dict[str, int] = {}
+        self.id_per_numero: Dict[int, str] = {}
+        self._prossimo_numero = 0
+
+    @classmethod
+    def testo_indicizzato(cls, richiesta: 'RichiestaRiparazione') -> str:
+        return cls.SEPARATORE.join((
+            richiesta.id_richiesta.lower(),
+            richiesta.pezzo.nome.lower(),
+            richiesta.pezzo.modello.lower(),
+            richiesta.pezzo.numero_serie.lower(),
+            richiesta.descrizione_problema.lower()
+        ))
+
+    @classmethod
+    def _ngrammi(cls, testo: str) -> set:
+        n = cls.LUNGHEZZA_NGRAMMA
+        ngrammi = set()
+        for campo in testo.split(cls.SEPARATORE):
+            ngrammi.update({campo[i:i + n] for i in range(len(campo) - n + 1)})
+        return ngrammi
+
+    def aggiorna(self, richiesta: 'RichiestaRiparazione'):
+        """Indicizza una richiesta nuova o reindicizza una esistente se i suoi testi sono cambiati"""
+        testo = self.testo_indicizzato(richiesta)
+        numero = self.numeri.get(richiesta.id_richiesta)
+
+        if numero is None:
+            numero = self._prossimo_numero
+            self._prossimo_numero += 1
+            self.numeri[richiesta.id_richiesta] = numero
+            self.id_per_numero[numero] = richiesta.id_richiesta
+        elif self.testi[numero] == testo:
+            return
+        else:
+            self._rimuovi_ngrammi(numero)
+
+        self.testi[numero] = testo
+        postings = self.postings
+        for ngramma in self._ngrammi(testo):
+            richieste = postings.get(ngramma)
+            if richieste is None:
+                postings[ngramma] = {numero}
+            else:
+                richieste.add(numero)
+
+    def _rimuovi_ngrammi(self, numero: int):
+        for ngramma in self._ngrammi(self.testi[numero]):
+            richieste = self.postings.get(ngramma)
+            if richieste is not None:
+                richieste.discard(numero)
+                if not richieste:
+                    del self.postings[ngramma]
+
+    def rimuovi(self, id_richiesta: str):
+        numero = self.numeri.pop(id_richiesta, None)
+        if numero is None:
+            return
+        self._rimuovi_ngrammi(numero)
+        del self.testi[numero]
+        del self.id_per_numero[numero]
+
+    def cerca(self, termine_ricerca: str) -> set:
+        """Insieme degli ID delle richieste che contengono il termine"""
+        termine = termine_ricerca.lower()
+        id_per_numero = self.id_per_numero
+
+        if len(termine) < self.LUNGHEZZA_NGRAMMA:
+            # Termini troppo corti per i trigrammi: scansione dei testi già normalizzati
+            return {id_per_numero[numero] for numero, testo in self.testi.items() if termine in testo}
+
+        liste = []
+        for ngramma in self._ngrammi(termine):
+            richieste = self.postings.get(ngramma)
+            if not richieste:
+                return set()
+            liste.append(richieste)
+
+        # Parte dalla lista più corta: il costo dipende dai candidati, non dall'archivio
+        liste.sort(key=len)
+        candidati = liste[0]
+        for richieste in liste[1:]:
+            candidati = candidati & richieste
+            if not candidati:
+                return set()
+
+        testi = self.testi
+        return {id_per_numero[numero] for numero in candidati if termine in testi[numero]}
+
+    @classmethod
+    def punteggio(cls, testo: str, termine_ricerca: str) -> int:
+        """Rilevanza di un testo indicizzato (testo_indicizzato()) per il termine.
+
+        Per ogni parola del termine: 3 se è una parola di un campo, 2 se ne è
+        l'inizio, 1 se compare solo dentro una parola; 4 in più se il termine
+        è un campo intero (es. l'ID o il numero di serie esatto).
+        """
+        termine = termine_ricerca.lower()
+        campi = testo.split(cls.SEPARATORE)
+        punti = 4 if termine.strip() in campi else 0
+        parole = [parola for campo in campi for parola in cls.PAROLA.findall(campo)]
+        for cercata in cls.PAROLA.findall(termine):
+            if cercata in parole:
+                punti += 3
+            elif any(parola.startswith(cercata) for parola in parole):
+                punti += 2
+            elif any(cercata in parola for parola in parole):
+                punti += 1
+        return punti
+
+
+def distanza_modifica(a: str, b: str, massimo: int) -> int:
+    """Distanza di Damerau-Levenshtein (con trasposizioni di caratteri vicini).
+
+    Il calcolo si ferma appena la distanza supera `massimo`: in quel caso
+    restituisce massimo + 1.
+    """
+    if abs(len(a) - len(b)) > massimo:
+        return massimo + 1
+    # Servono solo le celle entro `massimo` dalla diagonale: le altre valgono
+    # già più del limite e restano a `oltre`
+    oltre = massimo + 1
+    lunghezza_b = len(b)
+    penultima = None
+    precedente = [j if j <= massimo else oltre for j in range(lunghezza_b + 1)]
+    for i in range(1, len(a) + 1):
+        corrente = [oltre] * (lunghezza_b + 1)
+        if i <= massimo:
+            corrente[0] = i
+        minimo_riga = corrente[0]
+        carattere = a[i - 1]
+        for j in range(max(1, i - massimo), min(lunghezza_b, i + massimo) + 1):
+            valore = precedente[j - 1] + (carattere != b[j - 1])
+            if precedente[j] + 1 < valore:
+                valore = precedente[j] + 1
+            if corrente[j - 1] + 1 < valore:
+                valore = corrente[j - 1] + 1
+            if (i > 1 and j > 1 and carattere == b[j - 2] and a[i - 2] == b[j - 1]
+                    and penultima[j - 2] + 1 < valore):
+                valore = penultima[j - 2] + 1
+            corrente[j] = valore
+            if valore < minimo_riga:
+                minimo_riga = valore
+        if minimo_riga > massimo:
+            return oltre
+        penultima, precedente = precedente, corrente
+    return min(precedente[-1], oltre)
+
+
+class IndiceApprossimato:
+    """Valori distinti di un campo (clienti, modelli, nomi) cercabili anche con errori di battitura.
+
+    Ogni valore è registrato nelle liste dei suoi trigrammi. Una modifica
+    (inserimento, cancellazione, sostituzione o scambio di due caratteri)
+    cambia al più 4 trigrammi, quindi un valore entro k modifiche dal testo
+    cercato condivide almeno T - 4k dei suoi T trigrammi e ha una lunghezza
+    diversa di al più k caratteri. Le liste sono separate per lunghezza: si
+    contano le occorrenze solo in quelle delle 2k + 1 lunghezze compatibili e
+    i valori che raggiungono la soglia vengono confrontati con la distanza di
+    modifica. Quando T - 4k non è positivo (testi corti) si chiede comunque
+    un trigramma in comune: sfuggono solo i valori in cui le modifiche
+    toccano ogni trigramma, invece di confrontare tutti quelli di lunghezza
+    compatibile.
+    """
+
+    TRIGRAMMI_PER_MODIFICA = 4
+
+    def __init__(self):
+        self.valori: List[str] = []      # numero -> grafia della prima occorrenza
+        self.chiavi: List[str] = []      # numero -> forma normalizzata
+        self.frequenze: List[int] = []   # numero -> richieste con quel valore
+        self.numeri: Dict[str, int] = {}
+        self.postings: Dict[int, Dict[str, set]] = {}   # lunghezza -> trigramma -> numeri
+
+    def __len__(self) -> int:
+        return len(self.valori)
+
+    def __contains__(self, valore: str) -> bool:
+        return self.normalizza(valore) in self.numeri
+
+    @staticmethod
+    def normalizza(testo: str) -> str:
+        return " ".join(testo.split()).casefold()
+
+    @staticmethod
+    def _trigrammi(chiave: str) -> set:
+        # Gli spazi ai bordi danno trigrammi anche a inizio e fine parola
+        testo = f"  {chiave} "
+        return {testo[i:i + 3] for i in range(len(testo) - 2)}
+
+    def aggiungi(self, valore: str, volte: int = 1):
+        chiave = self.normalizza(valore)
+        if not chiave:
+            return
+        numero = self.numeri.get(chiave)
+        if numero is not None:
+            self.frequenze[numero] += volte
+            return
+        numero = self.numeri[chiave] = len(self.valori)
+        self.valori.append(valore.strip())
+        self.chiavi.append(chiave)
+        self.frequenze.append(volte)
+        postings = self.postings.setdefault(len(chiave), {})
+        for trigramma in self._trigrammi(chiave):
+            numeri = postings.get(trigramma)
+            if numeri is None:
+                postings[trigramma] = {numero}
+            else:
+                numeri.add(numero)
+
+    @staticmethod
+    def distanza_predefinita(chiave: str) -> int:
+        return 1 if len(chiave) <= 5 else 2 if len(chiave) <= 20 else 3
+
+    def suggerisci(self, testo: str, limite: int = 5,
+                   distanza_massima: Optional[int] = None) -> List[tuple]:
+        """(valore, distanza, frequenza) dei valori più vicini, prima i più simili e poi i più usati"""
+        chiave = self.normalizza(testo)
+        if not chiave:
+            return []
+        if distanza_massima is None:
+            distanza_massima = self.distanza_predefinita(chiave)
+
+        trigrammi = self._trigrammi(chiave)
+        minimo_comuni = max(len(trigrammi) - self.TRIGRAMMI_PER_MODIFICA * distanza_massima, 1)
+        comuni = Counter()
+        for lunghezza in range(len(chiave) - distanza_massima, len(chiave) + distanza_massima + 1):
+            postings = self.postings.get(lunghezza)
+            if not postings:
+                continue
+            for trigramma in trigrammi:
+                numeri = postings.get(trigramma)
+                if numeri:
+                    comuni.update(numeri)
+        candidati = [numero for numero, volte in comuni.items() if volte >= minimo_comuni]
+
+        trovati = []
+        for numero in candidati:
+            distanza = distanza_modifica(chiave, self.chiavi[numero], distanza_massima)
+            if distanza <= distanza_massima:
+                trovati.append((distanza, -self.frequenze[numero], self.valori[numero]))
+        trovati.sort()
+        return [(valore, distanza, -frequenza) for distanza, frequenza, valore in trovati[:limite]]
+
+
+class IndiciSecondari:
+    """Indici hash su stato, tipo intervento e cliente, più l'elenco ordinato per data.
+
+    Ogni richiesta ricorda le chiavi con cui è indicizzata: un aggiornamento
+    sposta l'ID solo dagli insiemi delle chiavi cambiate, in tempo costante.
+    """
+
+    def __init__(self):
+        self.per_stato: Dict[StatoRiparazione, set] = {}
+        self.per_tipo: Dict[TipoIntervento, set] = {}
+        self.per_cliente: Dict[str, set] = {}
+        self.chiavi: Dict[str, tuple] = {}
+        # Ordine di inserimento: a parità di data conserva l'ordine della scansione lineare
+        self.ordinali: Dict[str, int] = {}
+        self.data_di: Dict[str, datetime.datetime] = {}
+        # (data_richiesta, -ordinale, id) in ordine crescente; riordinato solo
+        # quando serve, così il caricamento di un file non ordinato costa N log N
+        self._ordine_data: List[tuple] = []
+        self._da_riordinare = False
+
+    @staticmethod
+    def chiave_cliente(cliente: str) -> str:
+        return cliente.lower()
+
+    @staticmethod
+    def _sposta(indice: dict, vecchia, nuova, id_richiesta: str):
+        if vecchia == nuova:
+            return
+        if vecchia is not None:
+            ids = indice[vecchia]
+            ids.discard(id_richiesta)
+            if not ids:
+                del indice[vecchia]
+        indice.setdefault(nuova, set()).add(id_richiesta)
+
+    def aggiorna(self, richiesta: 'RichiestaRiparazione'):
+        id_richiesta = richiesta.id_richiesta
+        nuove = (richiesta.stato, richiesta.tipo_intervento,
+                 self.chiave_cliente(richiesta.pezzo.cliente))
+        vecchie = self.chiavi.get(id_richiesta)
+        if vecchie == nuove:
+            return
+
+        if vecchie is None:
+            vecchie = (None, None, None)
+            ordinale = len(self.ordinali)
+            self.ordinali[id_richiesta] = ordinale
+            self.data_di[id_richiesta] = richiesta.data_richiesta
+            voce = (richiesta.data_richiesta, -ordinale, id_richiesta)
+            # Le richieste nuove sono le più recenti: di norma si accoda in fondo
+            if self._ordine_data and voce < self._ordine_data[-1]:
+                self._da_riordinare = True
+            self._ordine_data.append(voce)
+
+        self._sposta(self.per_stato, vecchie[0], nuove[0], id_richiesta)
+        self._sposta(self.per_tipo, vecchie[1], nuove[1], id_richiesta)
+        self._sposta(self.per_cliente, vecchie[2], nuove[2], id_richiesta)
+        self.chiavi[id_richiesta] = nuove
+
+    def rimuovi_molti(self, ids: set):
+        """Toglie più richieste in una sola passata sull'elenco ordinato per data"""
+        for id_richiesta in ids:
+            chiavi = self.chiavi.pop(id_richiesta, None)
+            if chiavi is None:
+                continue
+            for indice, chiave in zip((self.per_stato, self.per_tipo, self.per_cliente), chiavi):
+                indice[chiave].discard(id_richiesta)
+                if not indice[chiave]:
+                    del indice[chiave]
+            del self.ordinali[id_richiesta]
+            del self.data_di[id_richiesta]
+        self._ordine_data = [voce for voce in self._ordine_data if voce[2] not in ids]
+
+    @property
+    def ordine_data(self) -> List[tuple]:
+        if self._da_riordinare:
+            self._ordine_data.sort()
+            self._da_riordinare = False
+        return self._ordine_data
+
+    def clienti_che_contengono(self, cliente: str) -> set:
+        """ID dei clienti il cui nome contiene il testo: scorre i clienti distinti, non le richieste"""
+        testo = self.chiave_cliente(cliente)
+        esatti = self.per_cliente.get(testo)
+        risultato = set(esatti) if esatti else set()
+        for chiave, ids in self.per_cliente.items():
+            if chiave != testo and testo in chiave:
+                risultato |= ids
+        return risultato
+
+    def ordina_per_data(self, ids: set) -> List[str]:
+        """Dal più recente; a parità di data nell'ordine di inserimento, come la scansione lineare"""
+        ordine_data = self.ordine_data
+        if len(ids) * 16 > len(ordine_data):
+            # Risultati numerosi: scorrere l'elenco già ordinato costa meno che riordinarli
+            return [voce[2] for voce in reversed(ordine_data) if voce[2] in ids]
+        ordinali = self.ordinali
+        return [voce[2] for voce in sorted(
+            ((self.data_di[id_richiesta], -ordinali[id_richiesta], id_richiesta) for id_richiesta in ids),
+            reverse=True)]
+
+    def ids_per_data(self) -> List[str]:
+        return [voce[2] for voce in reversed(self.ordine_data)]
+
+
+class AccumulatoreCosti:
+    """Conteggio, somma, minimo, massimo e media dei costi finali di un gruppo di richieste"""
+
+    def __init__(self):
+        self.conteggio = 0
+        # Come in mostra_statistiche, contano solo le riparazioni con costo finale > 0
+        self.fatturate = 0
+        self.somma = 0.0
+        self.valori = Counter()
+        self._minimo = None
+        self._massimo = None
+        self._estremi_validi = True
+
+    def aggiungi(self, costo: float):
+        self.conteggio += 1
+        if costo > 0:
+            self.fatturate += 1
+            self.somma += costo
+            self.valori[costo] += 1
+            if self._estremi_validi:
+                if self._minimo is None or costo < self._minimo:
+                    self._minimo = costo
+                if self._massimo is None or costo > self._massimo:
+                    self._massimo = costo
+
+    def rimuovi(self, costo: float):
+        self.conteggio -= 1
+        if costo > 0:
+            self.fatturate -= 1
+            self.somma -= costo
+            self.valori[costo] -= 1
+            if not self.valori[costo]:
+                del self.valori[costo]
+                # Il minimo/massimo è uscito dal gruppo: verrà ricalcolato alla prossima lettura
+                if costo == self._minimo or costo == self._massimo:
+                    self._estremi_validi = False
+            if not self.fatturate:
+                self.somma = 0.0
+
+    def _ricalcola_estremi(self):
+        if not self._estremi_validi:
+            self._minimo = min(self.valori) if self.valori else None
+            self._massimo = max(self.valori) if self.valori else None
+            self._estremi_validi = True
+
+    @property
+    def minimo(self) -> Optional[float]:
+        self._ricalcola_estremi()
+        return self._minimo
+
+    @property
+    def massimo(self) -> Optional[float]:
+        self._ricalcola_estremi()
+        return self._massimo
+
+    @property
+    def media(self) -> Optional[float]:
+        return self.somma / self.fatturate if self.fatturate else None
+
+
+class SketchQuantili:
+    """Quantili approssimati in memoria limitata (bucket logaritmici, come DDSketch).
+
+    Ogni valore finisce nel bucket ceil(log_gamma(x)): il quantile stimato ha un
+    errore relativo non superiore a `precisione` e il numero di bucket cresce
+    solo con il logaritmo dell'intervallo dei valori. Supporta anche la
+    rimozione, necessaria quando una richiesta esce dallo stato completato.
+    """
+
+    def __init__(self, precisione: float = 0.01):
+        self.precisione = precisione
+        self.gamma = (1 + precisione) / (1 - precisione)
+        self.log_gamma = math.log(self.gamma)
+        self.bucket = Counter()
+        self.zeri = 0
+        self.conteggio = 0
+
+    def _indice(self, valore: float) -> int:
+        return math.ceil(math.log(valore) / self.log_gamma)
+
+    def aggiungi(self, valore: float):
+        self.conteggio += 1
+        if valore <= 0:
+            self.zeri += 1
+        else:
+            self.bucket[self._indice(valore)] += 1
+
+    def rimuovi(self, valore: float):
+        self.conteggio -= 1
+        if valore <= 0:
+            self.zeri -= 1
+        else:
+            indice = self._indice(valore)
+            self.bucket[indice] -= 1
+            if not self.bucket[indice]:
+                del self.bucket[indice]
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.conteggio:
+            return None
+        rango = q * (self.conteggio - 1)
+        cumulato = self.zeri
+        if rango < cumulato:
+            return 0.0
+        for indice in sorted(self.bucket):
+            cumulato += self.bucket[indice]
+            if rango < cumulato:
+                # Punto medio del bucket, nel senso dell'errore relativo
+                return 2 * self.gamma ** indice / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.bucket) / (self.gamma + 1)
+
+
+class StatisticheIncrementali:
+    """Contatori e costi per stato, tipo, cliente e tecnico, aggiornati a ogni modifica.
+
+    Per ogni richiesta si ricorda il contributo già conteggiato: un
+    aggiornamento toglie quello vecchio e aggiunge quello nuovo, quindi la
+    lettura delle statistiche non richiede scansioni dell'archivio.
+    """
+
+    QUANTILI = (0.5, 0.9, 0.99)
+
+    def __init__(self):
+        self.totale = AccumulatoreCosti()
+        self.per_stato: Dict[StatoRiparazione, AccumulatoreCosti] = {}
+        self.per_tipo: Dict[TipoIntervento, AccumulatoreCosti] = {}
+        self.per_cliente: Dict[str, AccumulatoreCosti] = {}
+        self.per_tecnico: Dict[str, AccumulatoreCosti] = {}
+        # Tempi di lavorazione (ore tra richiesta e completamento) per tipo intervento
+        self.tempi_per_tipo: Dict[TipoIntervento, SketchQuantili] = {}
+        self.contributi: Dict[str, tuple] = {}
+
+    @staticmethod
+    def contributo(richiesta: 'RichiestaRiparazione') -> tuple:
+        ore_lavorazione = None
+        if richiesta.data_completamento:
+            ore_lavorazione = (richiesta.data_completamento -
+                               richiesta.data_richiesta).total_seconds() / 3600
+        return (richiesta.stato, richiesta.tipo_intervento, richiesta.pezzo.cliente,
+                richiesta.tecnico_assegnato, richiesta.costo_finale, ore_lavorazione)
+
+    def _applica(self, contributo: tuple, segno: int):
+        stato, tipo, cliente, tecnico, costo, ore_lavorazione = contributo
+        gruppi = ((self.per_stato, stato), (self.per_tipo, tipo),
+                  (self.per_cliente, cliente), (self.per_tecnico, tecnico))
+
+        if segno > 0:
+            self.totale.aggiungi(costo)
+            for indice, chiave in gruppi:
+                gruppo = indice.get(chiave)
+                if gruppo is None:
+                    gruppo = indice[chiave] = AccumulatoreCosti()
+                gruppo.aggiungi(costo)
+            if ore_lavorazione is not None:
+                if tipo not in self.tempi_per_tipo:
+                    self.tempi_per_tipo[tipo] = SketchQuantili()
+                self.tempi_per_tipo[tipo].aggiungi(ore_lavorazione)
+        else:
+            self.totale.rimuovi(costo)
+            for indice, chiave in gruppi:
+                indice[chiave].rimuovi(costo)
+                if not indice[chiave].conteggio:
+                    del indice[chiave]
+            if ore_lavorazione is not None:
+                self.tempi_per_tipo[tipo].rimuovi(ore_lavorazione)
+                if not self.tempi_per_tipo[tipo].conteggio:
+                    del self.tempi_per_tipo[tipo]
+
+    def aggiorna(self, richiesta: 'RichiestaRiparazione'):
+        self.aggiorna_contributo(richiesta.id_richiesta, self.contributo(richiesta))
+
+    def aggiorna_contributo(self, id_richiesta: str, nuovo: tuple):
+        vecchio = self.contributi.get(id_richiesta)
+        if vecchio == nuovo:
+            return
+        if vecchio is not None:
+            self._applica(vecchio, -1)
+        self._applica(nuovo, +1)
+        self.contributi[id_richiesta] = nuovo
+
+    @staticmethod
+    def contributo_in_lista(contributo: tuple) -> list:
+        """Forma serializzabile in JSON (usata dall'indice dell'archivio freddo)"""
+        stato, tipo, *resto = contributo
+        return [stato.value, tipo.value, *resto]
+
+    @staticmethod
+    def contributo_da_lista(valori: list) -> tuple:
+        stato, tipo, *resto = valori
+        return (StatoRiparazione(stato), TipoIntervento(tipo), *resto)
+
+    def rimuovi(self, id_richiesta: str):
+        vecchio = self.contributi.pop(id_richiesta, None)
+        if vecchio is not None:
+            self._applica(vecchio, -1)
+
+    def quantili_lavorazione(self, tipo: TipoIntervento) -> Dict[float, Optional[float]]:
+        sketch = self.tempi_per_tipo.get(tipo)
+        return {q: sketch.quantile(q) if sketch else None for q in self.QUANTILI}
+
+    @classmethod
+    def da_richieste(cls, richieste) -> 'StatisticheIncrementali':
+        statistiche = cls()
+        for richiesta in richieste:
+            statistiche.aggiorna(richiesta)
+        return statistiche
+
+    def verifica(self, richieste) -> List[str]:
+        """Confronta i valori incrementali con una ricostruzione da zero; restituisce le differenze"""
+        attese = self.da_richieste(richieste)
+        differenze = []
+
+        def confronta(nome: str, attuale: AccumulatoreCosti, atteso: AccumulatoreCosti):
+            if attuale is None or atteso is None:
+                if attuale is not atteso:
+                    differenze.append(f"{nome}: gruppo presente solo da una parte")
+                return
+            if (attuale.conteggio, attuale.fatturate) != (atteso.conteggio, atteso.fatturate):
+                differenze.append(f"{nome}: conteggi {attuale.conteggio}/{attuale.fatturate} "
+                                  f"invece di {atteso.conteggio}/{atteso.fatturate}")
+            if not math.isclose(attuale.somma, atteso.somma, rel_tol=1e-9, abs_tol=1e-6):
+                differenze.append(f"{nome}: somma {attuale.somma:.2f} invece di {atteso.somma:.2f}")
+            if (attuale.minimo, attuale.massimo) != (atteso.minimo, atteso.massimo):
+                differenze.append(f"{nome}: min/max {attuale.minimo}/{attuale.massimo} "
+                                  f"invece di {atteso.minimo}/{atteso.massimo}")
+
+        confronta("totale", self.totale, attese.totale)
+        for etichetta, attuale, atteso in (("stato", self.per_stato, attese.per_stato),
+                                           ("tipo", self.per_tipo, attese.per_tipo),
+                                           ("cliente", self.per_cliente, attese.per_cliente),
+                                           ("tecnico", self.per_tecnico, attese.per_tecnico)):
+            for chiave in set(attuale) | set(atteso):
+                confronta(f"{etichetta} {chiave}", attuale.get(chiave), atteso.get(chiave))
+
+        for tipo in set(self.tempi_per_tipo) | set(attese.tempi_per_tipo):
+            attuale = self.tempi_per_tipo.get(tipo)
+            atteso = attese.tempi_per_tipo.get(tipo)
+            if (attuale and atteso and (attuale.bucket, attuale.zeri) != (atteso.bucket, atteso.zeri)) \
+                    or (attuale is None) != (atteso is None):
+                differenze.append(f"tempi di lavorazione {tipo.value}: distribuzione diversa")
+
+        return differenze
+
+
+# Stati in cui una richiesta impegna il tecnico assegnato; solo quelle ricevute
+# e non ancora iniziate aspettano in coda
+STATI_APERTI = (StatoRiparazione.RICEVUTO, StatoRiparazione.IN_LAVORAZIONE,
+                StatoRiparazione.IN_ATTESA_PEZZI)
+STATO_IN_CODA = StatoRiparazione.RICEVUTO
+# A parità di priorità prima le riparazioni (apparato fermo), per ultime le ispezioni
+PESO_TIPO = {TipoIntervento.RIPARAZIONE: 0, TipoIntervento.SOSTITUZIONE: 1,
+             TipoIntervento.MANUTENZIONE: 2, TipoIntervento.ISPEZIONE: 3}
+
+
+class CodaLavori:
+    """Code di priorità dei lavori da iniziare: una per tecnico più una per quelli non assegnati.
+
+    Ogni coda è un heap di (-priorità, peso del tipo, data richiesta, ordinale, id):
+    prima l'urgenza, poi il tipo di intervento, poi l'anzianità. Una voce
+    superata da un aggiornamento non viene cercata nell'heap: viene scartata
+    quando affiora in cima (cancellazione pigra), così ogni operazione costa
+    O(log N). Tiene anche il carico di ogni tecnico (richieste aperte assegnate).
+    """
+
+    NON_ASSEGNATI = ""
+
+    def __init__(self):
+        self.code: Dict[str, List[tuple]] = {}
+        # id -> voce valida attualmente in una delle code
+        self.voci: Dict[str, tuple] = {}
+        self.carico: Dict[str, int] = {}
+        self.tecnico_di: Dict[str, str] = {}
+        self._ordinale = 0
+        self._scartate = 0
+
+    def __len__(self) -> int:
+        return len(self.voci)
+
+    def aggiorna(self, richiesta: 'RichiestaRiparazione'):
+        id_richiesta = richiesta.id_richiesta
+        tecnico = richiesta.tecnico_assegnato
+        stato = richiesta.stato
+
+        vecchio = self.tecnico_di.get(id_richiesta)
+        nuovo = tecnico if tecnico and stato in STATI_APERTI else None
+        if vecchio != nuovo:
+            if vecchio is not None:
+                self.carico[vecchio] -= 1
+                del self.tecnico_di[id_richiesta]
+            if nuovo is not None:
+                self.carico[nuovo] = self.carico.get(nuovo, 0) + 1
+                self.tecnico_di[id_richiesta] = nuovo
+
+        attuale = self.voci.get(id_richiesta)
+        if stato is not STATO_IN_CODA:
+            if attuale is not None:
+                del self.voci[id_richiesta]
+                self._scartata()
+            return
+
+        chiave = (-CODICE_PRIORITA.get(richiesta.priorita, 1), PESO_TIPO[richiesta.tipo_intervento],
+                  richiesta.data_richiesta)
+        if attuale is not None:
+            if attuale[0] == tecnico and attuale[1][:3] == chiave:
+                return
+            self._scartata()
+        voce = (*chiave, self._ordinale, id_richiesta)
+        self._ordinale += 1
+        self.voci[id_richiesta] = (tecnico, voce)
+        heapq.heappush(self.code.setdefault(tecnico, []), voce)
+
+    def _scartata(self):
+        self._scartate += 1
+        # Se le voci superate diventano la maggioranza, le code vengono ricostruite
+        if self._scartate > 1024 and self._scartate > len(self.voci):
+            for tecnico, coda in self.code.items():
+                coda[:] = [voce for voce in coda if self._valida(tecnico, voce)]
+                heapq.heapify(coda)
+            self._scartate = 0
+
+    def _valida(self, tecnico: str, voce: tuple) -> bool:
+        attuale = self.voci.get(voce[-1])
+        return attuale is not None and attuale[1] is voce and attuale[0] == tecnico
+
+    def _cima(self, tecnico: str) -> Optional[tuple]:
+        coda = self.code.get(tecnico)
+        if not coda:
+            return None
+        while coda and not self._valida(tecnico, coda[0]):
+            heapq.heappop(coda)
+            self._scartate -= 1
+        return coda[0] if coda else None
+
+    def prossimo(self, tecnico: str) -> Optional[str]:
+        """Il lavoro più urgente per il tecnico, tra i suoi e quelli non ancora assegnati"""
+        candidati = [voce for voce in (self._cima(tecnico), self._cima(self.NON_ASSEGNATI)) if voce]
+        return min(candidati)[-1] if candidati else None
+
+    def prossimo_non_assegnato(self) -> Optional[str]:
+        voce = self._cima(self.NON_ASSEGNATI)
+        return voce[-1] if voce else None
+
+    def meno_carico(self, tecnici: List[str]) -> str:
+        return min(tecnici, key=lambda tecnico: (self.carico.get(tecnico, 0), tecnico))
+
+    @classmethod
+    def da_richieste(cls, richieste) -> 'CodaLavori':
+        coda = cls()
+        for richiesta in richieste:
+            coda.aggiorna(richiesta)
+        return coda
+
+
+class RegistroDispositivi:
+    """Apparati identificati da (modello, numero di serie) con lo storico delle loro richieste.
+
+    Per ogni apparato tiene le richieste ordinate per data di arrivo, quindi
+    lo storico di un numero di serie si legge senza scandire l'archivio e
+    un apparato che torna in assistenza può riusare il Pezzo già registrato.
+    Modello e numero di serie vengono confrontati senza maiuscole e spazi;
+    i numeri di serie vuoti o senza cifre né lettere non identificano nulla.
+    """
+
+    def __init__(self):
+        # chiave -> [(data richiesta in µs, id richiesta)], in ordine di data
+        self.storico: Dict[tuple, List[tuple]] = {}
+        # chiave -> (modello, numero di serie) come scritti la prima volta
+        self.etichette: Dict[tuple, tuple] = {}
+        # numero di serie normalizzato -> chiavi (lo stesso S/N su modelli diversi)
+        self.per_numero_serie: Dict[str, set] = {}
+        self.chiave_di: Dict[str, tuple] = {}
+
+    def __len__(self) -> int:
+        return len(self.storico)
+
+    @staticmethod
+    def normalizza_numero_serie(numero_serie: str) -> str:
+        return "".join(numero_serie.split()).casefold()
+
+    @classmethod
+    def chiave(cls, modello: str, numero_serie: str) -> Optional[tuple]:
+        numero_serie = cls.normalizza_numero_serie(numero_serie)
+        if not any(carattere.isalnum() for carattere in numero_serie):
+            return None
+        return " ".join(modello.split()).casefold(), numero_serie
+
+    def aggiorna(self, richiesta: 'RichiestaRiparazione'):
+        pezzo = richiesta.pezzo
+        self.registra(richiesta.id_richiesta, pezzo.modello, pezzo.numero_serie, richiesta._data_richiesta)
+
+    def registra(self, id_richiesta: str, modello: str, numero_serie: str, data_richiesta: int):
+        chiave = self.chiave(modello, numero_serie)
+        vecchia = self.chiave_di.get(id_richiesta)
+        if vecchia == chiave:
+            return
+        if vecchia is not None:
+            self.rimuovi(id_richiesta)
+        if chiave is None:
+            return
+        self.chiave_di[id_richiesta] = chiave
+        richieste = self.storico.get(chiave)
+        if richieste is None:
+            richieste = self.storico[chiave] = []
+            self.etichette[chiave] = (modello, numero_serie)
+            self.per_numero_serie.setdefault(chiave[1], set()).add(chiave)
+        bisect.insort(richieste, (data_richiesta, id_richiesta))
+
+    def rimuovi(self, id_richiesta: str):
+        chiave = self.chiave_di.pop(id_richiesta, None)
+        if chiave is None:
+            return
+        richieste = self.storico[chiave]
+        richieste[:] = [voce for voce in richieste if voce[1] != id_richiesta]
+        if not richieste:
+            del self.storico[chiave]
+            del self.etichette[chiave]
+            self.per_numero_serie[chiave[1]].discard(chiave)
+            if not self.per_numero_serie[chiave[1]]:
+                del self.per_numero_serie[chiave[1]]
+
+    def richieste_di(self, modello: str, numero_serie: str) -> List[str]:
+        """ID delle richieste dell'apparato, dalla più vecchia"""
+        return [id_richiesta for _, id_richiesta in self.storico.get(self.chiave(modello, numero_serie), ())]
+
+    def apparati_con_numero_serie(self, numero_serie: str) -> List[tuple]:
+        """(modello, numero di serie) di ogni apparato con quel numero di serie"""
+        chiavi = self.per_numero_serie.get(self.normalizza_numero_serie(numero_serie), ())
+        return sorted(self.etichette[chiave] for chiave in chiavi)
+
+    def guasti_ripetuti(self, giorni: int = 90, minimo_rientri: int = 1) -> List[tuple]:
+        """Apparati tornati in assistenza entro `giorni` dalla richiesta precedente.
+
+        Restituisce (modello, numero di serie, richieste, rientri, giorni del
+        rientro più rapido), dai più rientri ai meno.
+        """
+        finestra = giorni * 86_400_000_000
+        risultati = []
+        for chiave, richieste in self.storico.items():
+            if len(richieste) < 2:
+                continue
+            intervalli = [dopo[0] - prima[0] for prima, dopo in zip(richieste, richieste[1:])]
+            rientri = sum(1 for intervallo in intervalli if intervallo <= finestra)
+            if rientri >= minimo_rientri:
+                modello, numero_serie = self.etichette[chiave]
+                risultati.append((modello, numero_serie, len(richieste), rientri,
+                                  round(min(intervalli) / 86_400_000_000, 1)))
+        risultati.sort(key=lambda riga: (-riga[3], -riga[2], riga[0], riga[1]))
+        return risultati
+
+    def rientri_per_modello(self, giorni: int = 90) -> Dict[str, tuple]:
+        """Per modello: (apparati, apparati con almeno un rientro entro `giorni`, quota)"""
+        finestra = giorni * 86_400_000_000
+        conteggi: Dict[str, list] = {}
+        for chiave, richieste in self.storico.items():
+            modello = self.etichette[chiave][0]
+            conteggio = conteggi.setdefault(modello, [0, 0])
+            conteggio[0] += 1
+            if any(dopo[0] - prima[0] <= finestra for prima, dopo in zip(richieste, richieste[1:])):
+                conteggio[1] += 1
+        return {modello: (apparati, con_rientri, con_rientri / apparati)
+                for modello, (apparati, con_rientri) in sorted(conteggi.items())}
+
+
+def alternative_cliente(cliente) -> List[str]:
+    """Il filtro cliente (un testo o un elenco di alternative) in minuscolo, senza voci vuote"""
+    if isinstance(cliente, str):
+        cliente = [cliente]
+    return [alternativa.lower() for alternativa in cliente if alternativa]
+
+
+class ArchivioSQLite:
+    """Persistenza su database SQLite locale con indici sulle colonne di ricerca"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS pezzi (
+            id_pezzo TEXT PRIMARY KEY,
+            nome TEXT NOT NULL,
+            modello TEXT NOT NULL,
+            numero_serie TEXT NOT NULL,
+            cliente TEXT NOT NULL,
+            data_creazione TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS richieste (
+            id_richiesta TEXT PRIMARY KEY,
+            id_pezzo TEXT NOT NULL REFERENCES pezzi(id_pezzo),
+            descrizione_problema TEXT NOT NULL,
+            tipo_intervento TEXT NOT NULL,
+            stato TEXT NOT NULL,
+            priorita TEXT NOT NULL,
+            data_richiesta TEXT NOT NULL,
+            data_completamento TEXT,
+            costo_stimato REAL NOT NULL DEFAULT 0,
+            costo_finale REAL NOT NULL DEFAULT 0,
+            tecnico_assegnato TEXT NOT NULL DEFAULT '',
+            versione INTEGER NOT NULL DEFAULT 1
+        );
+        CREATE TABLE IF NOT EXISTS note_tecniche (
+            id_nota INTEGER PRIMARY KEY AUTOINCREMENT,
+            id_richiesta TEXT NOT NULL REFERENCES richieste(id_richiesta),
+            timestamp TEXT NOT NULL,
+            nota TEXT NOT NULL,
+            tecnico TEXT NOT NULL DEFAULT ''
+        );
+        CREATE INDEX IF NOT EXISTS idx_richieste_stato ON richieste(stato);
+        CREATE INDEX IF NOT EXISTS idx_richieste_tipo ON richieste(tipo_intervento);
+        CREATE INDEX IF NOT EXISTS idx_richieste_data ON richieste(data_richiesta);
+        CREATE INDEX IF NOT EXISTS idx_richieste_pezzo ON richieste(id_pezzo);
+        CREATE INDEX IF NOT EXISTS idx_pezzi_cliente ON pezzi(cliente);
+        CREATE INDEX IF NOT EXISTS idx_pezzi_numero_serie ON pezzi(numero_serie);
+        CREATE INDEX IF NOT EXISTS idx_pezzi_apparato
+            ON pezzi(replace(lower(numero_serie), ' ', ''), replace(lower(modello), ' ', ''), cliente);
+        CREATE INDEX IF NOT EXISTS idx_note_richiesta ON note_tecniche(id_richiesta);
+        CREATE TABLE IF NOT EXISTS sequenze (
+            prefisso TEXT PRIMARY KEY,
+            ultimo INTEGER NOT NULL
+        );
+    """
+
+    # Testo cercabile per sottostringa: il tokenizzatore a trigrammi di FTS5
+    # risponde a una frase di almeno 3 caratteri senza scandire le richieste.
+    # I trigger lo tengono allineato a richieste e pezzi.
+    SCHEMA_TESTO = """
+        CREATE VIRTUAL TABLE testo_richieste USING fts5(
+            id_richiesta, nome, modello, numero_serie, descrizione, cliente, tokenize = 'trigram');
+        CREATE TRIGGER testo_richieste_crea AFTER INSERT ON richieste BEGIN
+            INSERT INTO testo_richieste (rowid, id_richiesta, nome, modello, numero_serie, descrizione, cliente)
+            SELECT new.rowid, new.id_richiesta, p.nome, p.modello, p.numero_serie,
+                   new.descrizione_problema, p.cliente
+            FROM pezzi p WHERE p.id_pezzo = new.id_pezzo;
+        END;
+        CREATE TRIGGER testo_richieste_modifica AFTER UPDATE OF id_pezzo, descrizione_problema ON richieste
+        WHEN old.id_pezzo IS NOT new.id_pezzo OR old.descrizione_problema IS NOT new.descrizione_problema
+        BEGIN
+            DELETE FROM testo_richieste WHERE rowid = old.rowid;
+            INSERT INTO testo_richieste (rowid, id_richiesta, nome, modello, numero_serie, descrizione, cliente)
+            SELECT new.rowid, new.id_richiesta, p.nome, p.modello, p.numero_serie,
+                   new.descrizione_problema, p.cliente
+            FROM pezzi p WHERE p.id_pezzo = new.id_pezzo;
+        END;
+        CREATE TRIGGER testo_richieste_elimina AFTER DELETE ON richieste BEGIN
+            DELETE FROM testo_richieste WHERE rowid = old.rowid;
+        END;
+        CREATE TRIGGER testo_pezzi_modifica AFTER UPDATE OF nome, modello, numero_serie, cliente ON pezzi
+        WHEN old.nome IS NOT new.nome OR old.modello IS NOT new.modello
+             OR old.numero_serie IS NOT new.numero_serie OR old.cliente IS NOT new.cliente
+        BEGIN
+            DELETE FROM testo_richieste
+            WHERE rowid IN (SELECT rowid FROM richieste WHERE id_pezzo = new.id_pezzo);
+            INSERT INTO testo_richieste (rowid, id_richiesta, nome, modello, numero_serie, descrizione, cliente)
+            SELECT r.rowid, r.id_richiesta, new.nome, new.modello, new.numero_serie,
+                   r.descrizione_problema, new.cliente
+            FROM richieste r WHERE r.id_pezzo = new.id_pezzo;
+        END;
+        INSERT INTO testo_richieste (rowid, id_richiesta, nome, modello, numero_serie, descrizione, cliente)
+        SELECT r.rowid, r.id_richiesta, p.nome, p.modello, p.numero_serie, r.descrizione_problema, p.cliente
+        FROM richieste r JOIN pezzi p ON p.id_pezzo = r.id_pezzo;
+    """
+
+    SELECT_RICHIESTE = """
+        SELECT r.id_richiesta, r.descrizione_problema, r.tipo_intervento, r.stato,
+               r.priorita, r.data_richiesta, r.data_completamento, r.costo_stimato,
+               r.costo_finale, r.tecnico_assegnato,
+               p.id_pezzo, p.nome, p.modello, p.numero_serie, p.cliente, p.data_creazione,
+               r.versione
+        FROM richieste r JOIN pezzi p ON p.id_pezzo = r.id_pezzo
+    """
+
+    def __init__(self, percorso: str, sola_lettura: bool = False):
+        self.percorso = percorso
+        self.sola_lettura = sola_lettura
+        if sola_lettura:
+            # Il database deve esistere già e non viene toccato (niente schema né migrazioni)
+            uri = "file:" + urllib.request.pathname2url(os.path.abspath(percorso)) + "?mode=ro"
+            self.connessione = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        else:
+            self.connessione = sqlite3.connect(percorso, check_same_thread=False)
+        self.connessione.execute("PRAGMA foreign_keys = ON")
+        # Stessa semantica di str.lower() + "in" usata dalla ricerca in memoria
+        self.connessione.create_function(
+            "contiene", 2,
+            lambda testo, termine: termine in testo.lower(),
+            deterministic=True)
+        if sola_lettura:
+            self.testo_indicizzato = self.connessione.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'testo_richieste'").fetchone() is not None
+            return
+        with self.connessione:
+            self.connessione.executescript(self.SCHEMA)
+            # Database creati prima dell'introduzione delle versioni
+            colonne = {riga[1] for riga in self.connessione.execute("PRAGMA table_info(richieste)")}
+            if 'versione' not in colonne:
+                self.connessione.execute(
+                    "ALTER TABLE richieste ADD COLUMN versione INTEGER NOT NULL DEFAULT 1")
+        self.testo_indicizzato = self._prepara_testo()
+
+    def _prepara_testo(self) -> bool:
+        """Crea (e riempie, per i database esistenti) l'indice a trigrammi se SQLite ha FTS5.
+
+        Senza FTS5 (SQLite < 3.34) le ricerche per testo scandiscono le righe.
+        """
+        if self.connessione.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'testo_richieste'").fetchone():
+            return True
+        try:
+            self.connessione.executescript("BEGIN IMMEDIATE;" + self.SCHEMA_TESTO + "COMMIT;")
+        except sqlite3.OperationalError:
+            self.connessione.rollback()
+            # Un altro processo può averlo appena creato
+            return self.connessione.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'testo_richieste'").fetchone() is not None
+        return True
+
+    def chiudi(self):
+        self.connessione.close()
+
+    @staticmethod
+    def _dict_da_riga(riga, note: List[dict]) -> dict:
+        return {
+            'id_richiesta': riga[0],
+            'pezzo': {
+                'id_pezzo': riga[10],
+                'nome': riga[11],
+                'modello': riga[12],
+                'numero_serie': riga[13],
+                'cliente': riga[14],
+                'data_creazione': riga[15]
+            },
+            'descrizione_problema': riga[1],
+            'tipo_intervento': riga[2],
+            'stato': riga[3],
+            'priorita': riga[4],
+            'data_richiesta': riga[5],
+            'data_completamento': riga[6],
+            'note_tecniche': note,
+            'costo_stimato': riga[7],
+            'costo_finale': riga[8],
+            'tecnico_assegnato': riga[9],
+            'versione': riga[16]
+        }
+
+    def _note(self, id_richiesta: str) -> List[dict]:
+        cursore = self.connessione.execute(
+            "SELECT timestamp, nota, tecnico FROM note_tecniche "
+            "WHERE id_richiesta = ? ORDER BY id_nota", (id_richiesta,))
+        return [{'timestamp': t, 'nota': n, 'tecnico': tec} for t, n, tec in cursore]
+
+    def carica_richiesta(self, id_richiesta: str) -> Optional[RichiestaRiparazione]:
+        """Legge una singola richiesta (con pezzo e note) dal database"""
+        riga = self.connessione.execute(
+            self.SELECT_RICHIESTE + " WHERE r.id_richiesta = ?", (id_richiesta,)).fetchone()
+        if riga is None:
+            return None
+        return RichiestaRiparazione.from_dict(self._dict_da_riga(riga, self._note(id_richiesta)))
+
+    def carica_pezzo(self, id_pezzo: str) -> Optional[Pezzo]:
+        riga = self.connessione.execute(
+            "SELECT id_pezzo, nome, modello, numero_serie, cliente, data_creazione "
+            "FROM pezzi WHERE id_pezzo = ?", (id_pezzo,)).fetchone()
+        if riga is None:
+            return None
+        return Pezzo.from_dict(dict(zip(
+            ('id_pezzo', 'nome', 'modello', 'numero_serie', 'cliente', 'data_creazione'), riga)))
+
+    def carica_tutte(self):
+        """Scorre tutte le richieste con due sole query (righe e note)"""
+        note: Dict[str, List[dict]] = {}
+        for id_richiesta, t, n, tec in self.connessione.execute(
+                "SELECT id_richiesta, timestamp, nota, tecnico FROM note_tecniche ORDER BY id_nota"):
+            note.setdefault(id_richiesta, []).append({'timestamp': t, 'nota': n, 'tecnico': tec})
+
+        for riga in self.connessione.execute(self.SELECT_RICHIESTE):
+            yield RichiestaRiparazione.from_dict(self._dict_da_riga(riga, note.get(riga[0], [])))
+
+    def id_richieste(self) -> List[str]:
+        return [riga[0] for riga in self.connessione.execute("SELECT id_richiesta FROM richieste")]
+
+    def nomi(self):
+        """(cliente, modello, nome del pezzo) distinti con il numero di richieste di ciascuna terna"""
+        return self.connessione.execute(
+            "SELECT p.cliente, p.modello, p.nome, COUNT(*) "
+            "FROM richieste r JOIN pezzi p ON p.id_pezzo = r.id_pezzo "
+            "GROUP BY p.cliente, p.modello, p.nome")
+
+    def apparati(self):
+        """(id richiesta, modello, numero di serie, data richiesta) di tutte le richieste"""
+        return self.connessione.execute(
+            "SELECT r.id_richiesta, p.modello, p.numero_serie, r.data_richiesta "
+            "FROM richieste r JOIN pezzi p ON p.id_pezzo = r.id_pezzo")
+
+    def pezzi_apparato(self, modello: str, numero_serie: str):
+        """(id pezzo, modello, numero di serie, cliente) dei pezzi con quel modello e numero di serie,
+        dalla richiesta più recente.
+
+        Il confronto ignora maiuscole e spazi come RegistroDispositivi.chiave()
+        (con lower() di SQLite, solo ASCII): chi chiama verifica la chiave esatta.
+        """
+        return self.connessione.execute(
+            "SELECT p.id_pezzo, p.modello, p.numero_serie, p.cliente "
+            "FROM pezzi p JOIN richieste r ON r.id_pezzo = p.id_pezzo "
+            "WHERE replace(lower(p.numero_serie), ' ', '') = replace(lower(?), ' ', '') "
+            "AND replace(lower(p.modello), ' ', '') = replace(lower(?), ' ', '') "
+            "ORDER BY r.data_richiesta DESC", (numero_serie, modello))
+
+    def unisci_pezzi(self, sostituzioni: Dict[str, str]):
+        """Sposta le richieste sui pezzi conservati (vecchio id -> nuovo id) ed elimina i doppioni"""
+        with self.connessione:
+            self.connessione.executemany("UPDATE richieste SET id_pezzo = ? WHERE id_pezzo = ?",
+                                         [(nuovo, vecchio) for vecchio, nuovo in sostituzioni.items()])
+            self.connessione.executemany("DELETE FROM pezzi WHERE id_pezzo = ?",
+                                         [(vecchio,) for vecchio in sostituzioni])
+
+    def id_pezzi(self) -> List[str]:
+        return [riga[0] for riga in self.connessione.execute("SELECT id_pezzo FROM pezzi")]
+
+    def conta(self, tabella: str) -> int:
+        return self.connessione.execute(f"SELECT COUNT(*) FROM {tabella}").fetchone()[0]
+
+    def esiste_richiesta(self, id_richiesta: str) -> bool:
+        return self.connessione.execute(
+            "SELECT 1 FROM richieste WHERE id_richiesta = ?", (id_richiesta,)).fetchone() is not None
+
+    def esiste_pezzo(self, id_pezzo: str) -> bool:
+        return self.connessione.execute(
+            "SELECT 1 FROM pezzi WHERE id_pezzo = ?", (id_pezzo,)).fetchone() is not None
+
+    def _inserisci(self, dati: dict):
+        pezzo = dati['pezzo']
+        # Upsert invece di INSERT OR REPLACE: la riga conserva il suo rowid e
+        # i trigger dell'indice del testo vedono un aggiornamento, non una cancellazione
+        self.connessione.execute(
+            "INSERT INTO pezzi VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (id_pezzo) DO UPDATE SET nome = excluded.nome, modello = excluded.modello, "
+            "numero_serie = excluded.numero_serie, cliente = excluded.cliente, "
+            "data_creazione = excluded.data_creazione",
+            (pezzo['id_pezzo'], pezzo['nome'], pezzo['modello'], pezzo['numero_serie'],
+             pezzo['cliente'], pezzo['data_creazione']))
+        self.connessione.execute(
+            "INSERT INTO richieste VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (id_richiesta) DO UPDATE SET id_pezzo = excluded.id_pezzo, "
+            "descrizione_problema = excluded.descrizione_problema, "
+            "tipo_intervento = excluded.tipo_intervento, stato = excluded.stato, "
+            "priorita = excluded.priorita, data_richiesta = excluded.data_richiesta, "
+            "data_completamento = excluded.data_completamento, costo_stimato = excluded.costo_stimato, "
+            "costo_finale = excluded.costo_finale, tecnico_assegnato = excluded.tecnico_assegnato, "
+            "versione = excluded.versione",
+            (dati['id_richiesta'], pezzo['id_pezzo'], dati['descrizione_problema'],
+             dati['tipo_intervento'], dati['stato'], dati['priorita'], dati['data_richiesta'],
+             dati['data_completamento'], dati['costo_stimato'], dati['costo_finale'],
+             dati['tecnico_assegnato'], dati.get('versione', 1)))
+        self.connessione.execute("DELETE FROM note_tecniche WHERE id_richiesta = ?",
+                                 (dati['id_richiesta'],))
+        self.connessione.executemany(
+            "INSERT INTO note_tecniche (id_richiesta, timestamp, nota, tecnico) VALUES (?, ?, ?, ?)",
+            [(dati['id_richiesta'], n['timestamp'], n['nota'], n['tecnico'])
+             for n in dati['note_tecniche']])
+
+    def _aggiorna(self, id_richiesta: str, campi: dict):
+        colonne = {}
+        if 'stato' in campi:
+            colonne['stato'] = campi['stato']
+            colonne['data_completamento'] = campi['data_completamento']
+        for campo in ('tecnico_assegnato', 'costo_stimato', 'costo_finale', 'versione'):
+            if campo in campi:
+                colonne[campo] = campi[campo]
+        if 'versione' in colonne:
+            # Compare-and-swap: la riga viene aggiornata solo se nessun altro
+            # processo l'ha modificata dopo la versione da cui si è partiti
+            assegnazioni = ", ".join(f"{colonna} = ?" for colonna in colonne)
+            cursore = self.connessione.execute(
+                f"UPDATE richieste SET {assegnazioni} WHERE id_richiesta = ? AND versione = ?",
+                (*colonne.values(), id_richiesta, colonne['versione'] - 1))
+            if cursore.rowcount == 0:
+                riga = self.connessione.execute(
+                    "SELECT versione FROM richieste WHERE id_richiesta = ?", (id_richiesta,)).fetchone()
+                raise ConflittoVersione(id_richiesta, colonne['versione'] - 1, riga[0] if riga else 0)
+        elif colonne:
+            assegnazioni = ", ".join(f"{colonna} = ?" for colonna in colonne)
+            self.connessione.execute(
+                f"UPDATE richieste SET {assegnazioni} WHERE id_richiesta = ?",
+                (*colonne.values(), id_richiesta))
+        if 'nota' in campi:
+            nota = campi['nota']
+            self.connessione.execute(
+                "INSERT INTO note_tecniche (id_richiesta, timestamp, nota, tecnico) VALUES (?, ?, ?, ?)",
+                (id_richiesta, nota['timestamp'], nota['nota'], nota['tecnico']))
+
+    def applica(self, record: dict):
+        """Applica in una transazione un record nello stesso formato del journal"""
+        self.applica_molti([record])
+
+    def applica_molti(self, records: List[dict]):
+        """Applica più record del journal in un'unica transazione"""
+        with self.connessione:
+            for record in records:
+                if record['op'] == 'crea':
+                    self._inserisci(record['richiesta'])
+                elif record['op'] == 'aggiorna':
+                    self._aggiorna(record['id'], record['campi'])
+
+    def inserisci_molte(self, richieste) -> int:
+        """Inserisce molte richieste in un'unica transazione"""
+        conteggio = 0
+        with self.connessione:
+            for richiesta in richieste:
+                self._inserisci(richiesta.to_dict(con_versione=True))
+                conteggio += 1
+        return conteggio
+
+    def _ultimo_esistente(self, prefisso: str) -> int:
+        """Numero più alto già usato con il prefisso (database creati prima della tabella sequenze)"""
+        tabella, colonna = ('pezzi', 'id_pezzo') if prefisso.startswith('PZ') else ('richieste', 'id_richiesta')
+        # Intervallo sulla chiave primaria: usa l'indice invece di scorrere la tabella
+        riga = self.connessione.execute(
+            f"SELECT MAX(CAST(substr({colonna}, ?) AS INTEGER)) FROM {tabella} "
+            f"WHERE {colonna} >= ? AND {colonna} < ?",
+            (len(prefisso) + 1, prefisso + '0', prefisso + ':')).fetchone()
+        return riga[0] or 0
+
+    def riserva_sequenza(self, prefisso: str, quantita: int, minimo: int) -> int:
+        """Riserva numeri consecutivi in una transazione IMMEDIATE, sicura tra processi"""
+        self.connessione.execute("BEGIN IMMEDIATE")
+        try:
+            riga = self.connessione.execute(
+                "SELECT ultimo FROM sequenze WHERE prefisso = ?", (prefisso,)).fetchone()
+            ultimo = riga[0] if riga else self._ultimo_esistente(prefisso)
+            primo = max(ultimo, minimo) + 1
+            self.connessione.execute(
+                "INSERT OR REPLACE INTO sequenze VALUES (?, ?)", (prefisso, primo + quantita - 1))
+            self.connessione.commit()
+        except BaseException:
+            self.connessione.rollback()
+            raise
+        return primo
+
+    @staticmethod
+    def _frase(testo: str) -> str:
+        """Il testo come frase FTS5, cioè come sottostringa per il tokenizzatore a trigrammi"""
+        return '"' + testo.replace('"', '""') + '"'
+
+    def cerca(self, termine_ricerca: str = "", stato: Optional[StatoRiparazione] = None,
+              cliente="", tipo: Optional[TipoIntervento] = None, con_date: bool = False) -> list:
+        """Restituisce gli ID che soddisfano i filtri, dal più recente.
+
+        `cliente` può essere un elenco di alternative; con con_date=True
+        restituisce (data_richiesta ISO, id) per unire i risultati ad altri.
+        """
+        clienti = alternative_cliente(cliente)
+        condizioni = []
+        parametri = []
+        if stato:
+            condizioni.append("r.stato = ?")
+            parametri.append(stato.value)
+        if tipo:
+            condizioni.append("r.tipo_intervento = ?")
+            parametri.append(tipo.value)
+        # L'indice del testo sceglie le righe candidate, contiene() conferma
+        # la semantica di str.lower() + "in" della ricerca in memoria
+        frasi = []
+        if clienti:
+            condizioni.append("(" + " OR ".join(["contiene(p.cliente, ?)"] * len(clienti)) + ")")
+            parametri.extend(clienti)
+            if all(len(alternativa) >= 3 for alternativa in clienti):
+                frasi.append("cliente : (" + " OR ".join(self._frase(alternativa) for alternativa in clienti) + ")")
+        if termine_ricerca:
+            termine = termine_ricerca.lower()
+            if len(termine) >= 3:
+                frasi.append("{id_richiesta nome modello numero_serie descrizione} : " + self._frase(termine))
+            condizioni.append("(contiene(r.id_richiesta, ?) OR contiene(p.nome, ?) OR "
+                              "contiene(p.modello, ?) OR contiene(p.numero_serie, ?) OR "
+                              "contiene(r.descrizione_problema, ?))")
+            parametri.extend([termine] * 5)
+
+        if frasi and self.testo_indicizzato:
+            condizioni.insert(0, "r.rowid IN (SELECT rowid FROM testo_richieste WHERE testo_richieste MATCH ?)")
+            parametri.insert(0, " AND ".join(frasi))
+
+        query = ("SELECT r.data_richiesta, r.id_richiesta FROM richieste r JOIN pezzi p ON p.id_pezzo = r.id_pezzo")
+        if condizioni:
+            query += " WHERE " + " AND ".join(condizioni)
+        query += " ORDER BY r.data_richiesta DESC"
+        righe = self.connessione.execute(query, parametri)
+        return righe.fetchall() if con_date else [riga[1] for riga in righe]
+
+
+class _MappaSQLite(Mapping):
+    """Vista dict-like su una tabella SQLite: gli oggetti vengono letti solo quando servono
+    e tenuti in una piccola cache LRU, così la memoria non cresce con l'archivio.
+
+    Non si cancella nulla: le righe si scrivono solo con ArchivioSQLite.applica()."""
+
+    def __init__(self, carica, esiste, elenca, conta, dimensione_cache: int = 1024):
+        self._carica = carica
+        self._esiste = esiste
+        self._elenca = elenca
+        self._conta = conta
+        self._cache = OrderedDict()
+        self.dimensione_cache = dimensione_cache
+        # Oggetti con modifiche non ancora scritte nel database: restano qui,
+        # fuori dalla LRU, finché non vengono rilasciati (chiave -> [valore, record in attesa])
+        self._fissati: Dict[str, list] = {}
+
+    def __getitem__(self, chiave):
+        voce = self._fissati.get(chiave)
+        if voce is not None:
+            return voce[0]
+        if chiave in self._cache:
+            self._cache.move_to_end(chiave)
+            return self._cache[chiave]
+        valore = self._carica(chiave)
+        if valore is None:
+            raise KeyError(chiave)
+        self._memorizza(chiave, valore)
+        return valore
+
+    def _memorizza(self, chiave, valore):
+        self._cache[chiave] = valore
+        self._cache.move_to_end(chiave)
+        while len(self._cache) > self.dimensione_cache:
+            self._cache.popitem(last=False)
+
+    def __setitem__(self, chiave, valore):
+        # La scrittura su disco passa da ArchivioSQLite.applica(): qui si aggiorna solo la cache
+        voce = self._fissati.get(chiave)
+        if voce is not None:
+            voce[0] = valore
+        self._memorizza(chiave, valore)
+
+    def fissato(self, chiave) -> bool:
+        return chiave in self._fissati
+
+    def fissa(self, chiave, valore):
+        """Tiene l'oggetto in memoria finché il record che lo modifica non è scritto"""
+        voce = self._fissati.get(chiave)
+        if voce is None:
+            self._fissati[chiave] = [valore, 1]
+        else:
+            voce[0] = valore
+            voce[1] += 1
+
+    def rilascia(self, chiave):
+        """Un record dell'oggetto è stato scritto; restituisce l'oggetto se era fissato"""
+        voce = self._fissati.get(chiave)
+        if voce is None:
+            return None
+        voce[1] -= 1
+        if not voce[1]:
+            del self._fissati[chiave]
+            self._memorizza(chiave, voce[0])
+        return voce[0]
+
+    def in_sospeso(self) -> dict:
+        """Gli oggetti fissati, con modifiche che il database non ha ancora"""
+        return {chiave: voce[0] for chiave, voce in self._fissati.items()}
+
+    def dimentica(self, chiave):
+        """Scarta la copia in cache: la prossima lettura torna al database"""
+        self._cache.pop(chiave, None)
+        self._fissati.pop(chiave, None)
+
+    def __contains__(self, chiave):
+        return chiave in self._fissati or chiave in self._cache or self._esiste(chiave)
+
+    def _solo_in_memoria(self) -> List[str]:
+        # Creati ma non ancora scritti: pochi, limitati ai record in coda
+        return [chiave for chiave in self._fissati if not self._esiste(chiave)]
+
+    def __iter__(self):
+        chiavi = self._elenca()
+        if self._fissati:
+            chiavi.extend(self._solo_in_memoria())
+        return iter(chiavi)
+
+    def __len__(self):
+        return self._conta() + (len(self._solo_in_memoria()) if self._fissati else 0)
+
+
+class RichiesteSQLite(_MappaSQLite):
+    def __init__(self, archivio: ArchivioSQLite, dimensione_cache: int = 1024):
+        super().__init__(archivio.carica_richiesta, archivio.esiste_richiesta,
+                         archivio.id_richieste, lambda: archivio.conta('richieste'),
+                         dimensione_cache)
+        self.archivio = archivio
+
+    def values(self):
+        # Una sola scansione del database invece di una query per ogni ID
+        for richiesta in self.archivio.carica_tutte():
+            voce = self._fissati.get(richiesta.id_richiesta)
+            yield voce[0] if voce is not None else self._cache.get(richiesta.id_richiesta, richiesta)
+        if self._fissati:
+            for id_richiesta in self._solo_in_memoria():
+                yield self._fissati[id_richiesta][0]
+
+
+class PezziSQLite(_MappaSQLite):
+    def __init__(self, archivio: ArchivioSQLite, dimensione_cache: int = 1024):
+        super().__init__(archivio.carica_pezzo, archivio.esiste_pezzo,
+                         archivio.id_pezzi, lambda: archivio.conta('pezzi'),
+                         dimensione_cache)
+
+
+class EsitoImportazione:
+    """Riepilogo di un'importazione massiva"""
+
+    def __init__(self):
+        self.importate: List[str] = []
+        self.errori: List[tuple] = []  # (numero di riga, messaggio)
+        self.durata = 0.0
+
+    @property
+    def righe_al_secondo(self) -> float:
+        righe = len(self.importate) + len(self.errori)
+        return righe / self.durata if self.durata else 0.0
+
+    def riepilogo(self) -> str:
+        return (f"{len(self.importate)} richieste importate, {len(self.errori)} righe scartate "
+                f"in {self.durata:.2f} s ({self.righe_al_secondo:.0f} righe/s)")
+
+
+# Nomi di colonna accettati nei file di importazione (il primo è quello canonico)
+COLONNE_IMPORTAZIONE = {
+    'nome_pezzo': ('nome_pezzo', 'nome'),
+    'modello': ('modello',),
+    'numero_serie': ('numero_serie', 'serie', 's/n'),
+    'cliente': ('cliente',),
+    'descrizione_problema': ('descrizione_problema', 'descrizione'),
+    'tipo_intervento': ('tipo_intervento', 'tipo'),
+    'priorita': ('priorita', 'priorità'),
+    'tecnico_assegnato': ('tecnico_assegnato', 'tecnico'),
+    'costo_stimato': ('costo_stimato',),
+}
+COLONNE_OBBLIGATORIE = ('nome_pezzo', 'modello', 'numero_serie', 'cliente',
+                        'descrizione_problema', 'tipo_intervento')
+
+
+def leggi_righe_importazione(percorso: str):
+    """Genera (numero di riga, dizionario) da un file CSV o JSONL, una riga alla volta"""
+    if percorso.lower().endswith(('.jsonl', '.ndjson')):
+        with open(percorso, 'r', encoding='utf-8') as f:
+            for numero, riga in enumerate(f, 1):
+                if not riga.strip():
+                    continue
+                try:
+                    dati = json.loads(riga)
+                except json.JSONDecodeError as e:
+                    yield numero, ValueError(f"JSON non valido: {e.msg}")
+                    continue
+                yield numero, dati
+        return
+
+    with open(percorso, 'r', encoding='utf-8-sig', newline='') as f:
+        campione = f.read(4096)
+        f.seek(0)
+        try:
+            dialetto = csv.Sniffer().sniff(campione, delimiters=',;\t')
+        except csv.Error:
+            dialetto = csv.excel
+        # La riga 1 è l'intestazione
+        for numero, dati in enumerate(csv.DictReader(f, dialect=dialetto), 2):
+            yield numero, dati
+
+
+def valida_riga_importazione(dati: dict) -> dict:
+    """Normalizza una riga di importazione; solleva ValueError con un messaggio leggibile"""
+    if not isinstance(dati, dict):
+        raise ValueError("la riga non è un oggetto")
+    normalizzati = {str(chiave).strip().lower(): valore for chiave, valore in dati.items() if chiave}
+
+    riga = {}
+    for campo, alias in COLONNE_IMPORTAZIONE.items():
+        valore = next((normalizzati[a] for a in alias if normalizzati.get(a) not in (None, "")), "")
+        riga[campo] = str(valore).strip()
+
+    mancanti = [campo for campo in COLONNE_OBBLIGATORIE if not riga[campo]]
+    if mancanti:
+        raise ValueError(f"campi obbligatori mancanti: {', '.join(mancanti)}")
+
+    tipo = riga['tipo_intervento'].lower()
+    for tipo_intervento in TipoIntervento:
+        if tipo in (tipo_intervento.value.lower(), tipo_intervento.name.lower()):
+            riga['tipo_intervento'] = tipo_intervento
+            break
+    else:
+        raise ValueError(f"tipo intervento sconosciuto: {riga['tipo_intervento']}")
+
+    if riga['priorita']:
+        priorita = riga['priorita'].capitalize()
+        if priorita not in CODICE_PRIORITA:
+            raise ValueError(f"priorità non valida: {riga['priorita']}")
+        riga['priorita'] = priorita
+    else:
+        riga['priorita'] = "Media"
+
+    if riga['costo_stimato']:
+        try:
+            riga['costo_stimato'] = float(riga['costo_stimato'].replace(',', '.'))
+        except ValueError:
+            raise ValueError(f"costo stimato non numerico: {riga['costo_stimato']}")
+        if riga['costo_stimato'] < 0:
+            raise ValueError("costo stimato negativo")
+    else:
+        riga['costo_stimato'] = None
+
+    return riga
+
+
+def chiave_shard(criterio: str, numero_shard: int, id_richiesta: str, data_richiesta: datetime.datetime) -> str:
+    """Lo shard di una richiesta: il mese della richiesta ("2024-05") o un hash stabile dell'ID ("h03")"""
+    if criterio == 'mese':
+        return f"{data_richiesta.year:04d}-{data_richiesta.month:02d}"
+    # crc32 e non hash(): deve dare lo stesso risultato in ogni processo
+    return f"h{zlib.crc32(id_richiesta.encode('utf-8')) % numero_shard:02d}"
+
+
+def _richieste_da_file_shard(percorso: str, tollerante: bool) -> tuple:
+    """Richieste valide, seq del journal consolidato e voci scartate di un file shard"""
+    with open(percorso, 'r', encoding='utf-8') as f:
+        dati = json.load(f)
+    richieste = []
+    scartate = []
+    for id_richiesta, valore in dati.get('richieste', {}).items():
+        try:
+            richieste.append(RichiestaRiparazione.from_dict(valore))
+        except (KeyError, TypeError, ValueError) as e:
+            if not tollerante:
+                raise ValueError(f"richiesta {id_richiesta} non valida ({e!r})")
+            print(f"Richiesta {id_richiesta} scartata: {e!r}")
+            scartate.append((id_richiesta, repr(e), valore))
+    versioni = dati.get('versioni', {})
+    for richiesta in richieste:
+        richiesta.versione = versioni.get(richiesta.id_richiesta, richiesta.versione)
+    return richieste, dati.get('seq_journal', 0), scartate
+
+
+def _leggi_file_shard(percorso: str, tollerante: bool) -> tuple:
+    """Eseguita in un processo separato: legge uno shard e lo restituisce in formato colonnare.
+
+    Il formato colonnare passa tra i processi molto più in fretta degli
+    oggetti serializzati con pickle, e il processo principale lo ricostruisce
+    con SnapshotColonnare.richieste() senza rifare il parsing del JSON.
+    """
+    richieste, seq_journal, scartate = _richieste_da_file_shard(percorso, tollerante)
+    contenuto = io.BytesIO()
+    SnapshotColonnare.scrivi(contenuto, SnapshotColonnare.prepara(richieste, {}))
+    return contenuto.getvalue(), seq_journal, scartate
+
+
+class SistemaGestioneRiparazioni:
+    def __init__(self, file_dati: str = "riparazioni.json", journal: bool = False,
+                 soglia_compattazione: int = 500, backend: str = "json",
+                 sequenze_condivise: bool = False, caricamento_tollerante: bool = False,
+                 avanzamento_caricamento: Optional[Callable[[int, int], None]] = None,
+                 archivio_freddo: bool = False, condiviso: bool = False,
+                 strumentazione: bool = False, feed_modifiche: bool = False,
+                 shard: Optional[str] = None, numero_shard: int = 16, processi: Optional[int] = None,
+                 sola_lettura: bool = False):
+        self.file_dati = file_dati
+        self.backend = backend
+        # Con sola_lettura=True i file vengono solo letti: niente salvataggi,
+        # compattazioni, riparazioni del journal né archiviazioni (es. per i report)
+        self.sola_lettura = sola_lettura
+        # Misure delle operazioni principali, accendibili e spegnibili in
+        # qualsiasi momento con sistema.strumentazione.attiva
+        self.strumentazione = Strumentazione(attiva=strumentazione)
+
+        # Con backend "sqlite" i dati restano nel database: richieste e pezzi sono
+        # viste che leggono le righe solo quando vengono richieste
+        self.archivio_sqlite: Optional[ArchivioSQLite] = None
+        # Con l'archivio freddo le richieste chiuse (Consegnato, Annullato) escono
+        # dallo snapshot e vengono lette da file_dati + ".freddo" solo quando servono
+        self.archivio_freddo: Optional[ArchivioFreddo] = None
+        if backend == "sqlite":
+            self.archivio_sqlite = ArchivioSQLite(file_dati, sola_lettura=sola_lettura)
+            self.richieste = RichiesteSQLite(self.archivio_sqlite)
+            self.pezzi = PezziSQLite(self.archivio_sqlite)
+        elif backend == "json" and archivio_freddo:
+            self.archivio_freddo = ArchivioFreddo(file_dati + ".freddo")
+            self.richieste = RichiesteStratificate(self.archivio_freddo)
+            self.pezzi: Dict[str, Pezzo] = {}
+        elif backend == "json":
+            self.richieste: Dict[str, RichiestaRiparazione] = {}
+            self.pezzi: Dict[str, Pezzo] = {}
+        else:
+            raise ValueError(f"Backend non supportato: {backend}")
+        # Con estensione .ripc lo snapshot è salvato a colonne (SnapshotColonnare) invece che in JSON
+        self.formato_colonnare = backend == "json" and file_dati.endswith(ESTENSIONE_COLONNARE)
+
+        # Con shard="mese" o "hash" le richieste sono divise in più file JSON
+        # (riparazioni.2024-05.json, riparazioni.h03.json, ...) e file_dati
+        # diventa l'indice degli shard: all'avvio gli shard vengono letti in
+        # parallelo da `processi` processi, e un salvataggio riscrive solo gli
+        # shard che contengono richieste modificate
+        if shard is not None:
+            if shard not in CRITERI_SHARD:
+                raise ValueError(f"Criterio di shard non supportato: {shard}")
+            if backend != "json" or self.formato_colonnare or archivio_freddo or condiviso:
+                raise ValueError("Gli shard sono disponibili solo con lo snapshot JSON, "
+                                 "senza archivio freddo e senza modalità condivisa")
+            if numero_shard < 1:
+                raise ValueError("numero_shard deve essere almeno 1")
+        self.shard = shard
+        self.numero_shard = numero_shard
+        self.processi = processi or os.cpu_count() or 1
+        # Chiave shard -> ID delle richieste, costruito al primo uso
+        self._per_shard: Optional[Dict[str, set]] = None
+        self._shard_modificati: set = set()
+        self._riscrivi_tutti_shard = False
+        # File degli shard come scritti nell'ultimo indice, e seq consolidato in ciascuno
+        self._file_shard: Dict[str, str] = {}
+        self._seq_shard: Dict[str, int] = {}
+        # Voci scartate al caricamento, da riscrivere nello shard da cui provengono
+        self._scartate_shard: Dict[str, list] = {}
+
+        # Indici usati solo con i dati in memoria (SQLite ha i propri)
+        self.indice_testo = IndiceTestuale()
+        self.indici = IndiciSecondari()
+        # Statistiche incrementali: con SQLite vengono costruite alla prima lettura
+        self._statistiche: Optional[StatisticheIncrementali] = None
+        # Code dei lavori per tecnico, costruite al primo uso e poi tenute aggiornate
+        self._coda_lavori: Optional[CodaLavori] = None
+        # Apparati (modello, numero di serie) con lo storico delle richieste, costruito al primo uso
+        self._registro_dispositivi: Optional[RegistroDispositivi] = None
+        # Con SQLite, i pezzi di richieste non ancora nel database per (modello, S/N, cliente):
+        # _pezzo_registrato() li trova senza costruire il registro dei dispositivi
+        self._pezzi_in_sospeso: Dict[tuple, Pezzo] = {}
+        # Clienti, modelli e nomi dei pezzi già usati, cercabili con errori di battitura
+        self._nomi: Optional[Dict[str, IndiceApprossimato]] = None
+        # Cresce a ogni modifica: chi tiene copie derivate dei dati (es. i report)
+        # lo confronta con quello visto l'ultima volta per sapere se ricalcolarle
+        self.generazione = 0
+
+        # Con il journal attivo ogni modifica viene accodata a file_dati + ".journal"
+        # invece di riscrivere tutto il file; lo snapshot viene aggiornato solo
+        # durante la compattazione (ogni soglia_compattazione record)
+        self.journal = JournalModifiche(file_dati + ".journal", self.strumentazione)
+
+        # Ogni creazione e aggiornamento reso durevole produce un evento: gli
+        # iscritti al bus lo ricevono in processo, e con feed_modifiche=True
+        # finisce anche in file_dati + ".eventi", leggibile per offset
+        self.eventi = BusEventi()
+        self.feed_modifiche: Optional[FeedModifiche] = None
+        if feed_modifiche:
+            self.feed_modifiche = FeedModifiche(file_dati + ".eventi", self.strumentazione)
+        self._eventi_in_sospeso: List[dict] = []
+        self.usa_journal = journal
+        self.soglia_compattazione = soglia_compattazione
+        self.seq_journal = 0
+        self.record_non_compattati = 0
+
+        # Con condiviso=True più processi lavorano sullo stesso file JSON: ogni
+        # modifica passa dal journal sotto il lock file_dati + ".lock" e, prima
+        # di scrivere, ogni processo legge solo i record accodati dagli altri
+        self.condiviso = condiviso
+        self._lock_tenuto = 0
+        self._posizione_journal = 0
+        self._compattazioni_viste = 0
+        if condiviso and backend == "json":
+            self.usa_journal = True
+            sequenze_condivise = True
+
+        # Con il caricamento tollerante le voci malformate vengono saltate e
+        # annotate in voci_scartate invece di interrompere tutto il caricamento
+        self.caricamento_tollerante = caricamento_tollerante
+        self.avanzamento_caricamento = avanzamento_caricamento
+        self.voci_scartate: List[tuple] = []  # (id, errore, dati originali)
+        self.caricamento_fallito = False
+
+        # Dentro operazioni_in_blocco() le modifiche si accumulano qui e
+        # vengono rese durevoli tutte insieme all'uscita dal blocco
+        self._blocchi_aperti = 0
+        self._record_in_sospeso: List[dict] = []
+        # Con scrittura_differita=True i record restano in coda finché qualcuno
+        # non li preleva con preleva_record_in_sospeso() (es. il servizio HTTP)
+        self.scrittura_differita = False
+
+        # Contatori degli ID: con SQLite stanno nel database, con più processi
+        # sullo stesso file JSON in file_dati + ".sequenze" protetto da lock
+        if self.archivio_sqlite:
+            self.sequenze = AllocatoreSequenze(self.archivio_sqlite.riserva_sequenza)
+        elif sequenze_condivise:
+            self.sequenze = AllocatoreSequenze(FileSequenze(file_dati + ".sequenze").riserva)
+        else:
+            self.sequenze = AllocatoreSequenze()
+
+        with self._transazione(aggiorna=False):
+            self.carica_dati()
+
+    @strumentato("carica_dati")
+    def carica_dati(self):
+        """Carica lo snapshot (JSON o colonnare) e riapplica le modifiche del journal"""
+        if self.archivio_sqlite:
+            # Niente da caricare: le righe vengono lette su richiesta
+            return
+
+        if os.path.exists(self.file_dati):
+            # Gli oggetti vengono raccolti a parte e resi visibili solo a
+            # caricamento concluso: un errore non lascia il sistema a metà
+            richieste: Dict[str, RichiestaRiparazione] = {}
+            pezzi: Dict[str, Pezzo] = {}
+            campi = {}
+            try:
+                if self.formato_colonnare:
+                    campi = self._leggi_snapshot_colonnare(richieste, pezzi)
+                else:
+                    campi = self._leggi_snapshot_json(richieste, pezzi)
+                    if 'shard' in campi:
+                        self._leggi_shard(campi, richieste, pezzi)
+                    elif self.shard is not None:
+                        # Archivio in un solo file: il primo salvataggio lo divide in shard
+                        self._riscrivi_tutti_shard = True
+                        if self.voci_scartate:
+                            self._scartate_shard['scartate'] = list(self.voci_scartate)
+            except Exception as e:
+                print(f"Errore nel caricamento dei dati: {e}")
+                # Salvare ora sovrascriverebbe il file con un archivio vuoto
+                self.caricamento_fallito = True
+                return
+
+            for id_req, versione in campi.get('versioni', {}).items():
+                if id_req in richieste:
+                    richieste[id_req].versione = versione
+            self.richieste.update(richieste)
+            self.pezzi.update(pezzi)
+            self.seq_journal = campi.get('seq_journal', 0)
+            self.sequenze.contatori.update(campi.get('sequenze', {}))
+
+        self._riapplica_journal()
+        if self._seq_shard:
+            # Uno shard può essere più avanti dell'indice se un salvataggio si è
+            # interrotto prima di riscriverlo: la numerazione riparte dal massimo
+            self.seq_journal = max(self.seq_journal, max(self._seq_shard.values()))
+
+        # Gli ID già presenti (anche quelli creati dopo l'ultimo snapshot) non vanno riassegnati
+        for id_richiesta in self.richieste:
+            self.sequenze.osserva(id_richiesta)
+        for id_pezzo in self.pezzi:
+            self.sequenze.osserva(id_pezzo)
+
+        if self.condiviso:
+            self._compattazioni_viste = self._leggi_stato_condiviso()['compattazioni']
+
+        self.ricostruisci_indici()
+
+    def _leggi_snapshot_json(self, richieste: dict, pezzi: dict) -> dict:
+        campi = {}
+        lettore = LettoreJSONIncrementale(self.file_dati, avanzamento=self.avanzamento_caricamento)
+        for tipo_voce, chiave, valore in lettore.voci():
+            if tipo_voce == 'campo':
+                campi[chiave] = valore
+                continue
+
+            # Ricostruisce gli oggetti dai dati salvati, una richiesta alla volta
+            try:
+                richiesta = RichiestaRiparazione.from_dict(valore)
+            except (KeyError, TypeError, ValueError) as e:
+                if not self.caricamento_tollerante:
+                    raise ValueError(f"richiesta {chiave} non valida ({e!r})")
+                print(f"Richiesta {chiave} scartata: {e!r}")
+                self.voci_scartate.append((chiave, repr(e), valore))
+                continue
+            # Le richieste dello stesso pezzo condividono un solo oggetto
+            richiesta.pezzo = pezzi.setdefault(richiesta.pezzo.id_pezzo, richiesta.pezzo)
+            richieste[chiave] = richiesta
+        return campi
+
+    def _leggi_shard(self, campi: dict, richieste: dict, pezzi: dict):
+        """Legge gli shard elencati nell'indice, in parallelo se ci sono più processi a disposizione"""
+        descrizione = campi.pop('shard')
+        if self.archivio_freddo is not None or self.condiviso:
+            raise ValueError("archivio diviso in shard: aprirlo senza archivio freddo e senza modalità condivisa")
+        criterio, numero = descrizione['criterio'], descrizione['numero']
+        if self.shard is None:
+            self.shard, self.numero_shard = criterio, numero
+        # Con un criterio diverso da quello salvato le richieste vengono ridistribuite
+        stesso_criterio = criterio == self.shard and (criterio == 'mese' or numero == self.numero_shard)
+        cartella = os.path.dirname(self.file_dati)
+        chiavi = list(descrizione['file'])
+        percorsi = [os.path.join(cartella, descrizione['file'][chiave]) for chiave in chiavi]
+
+        processi = min(self.processi, len(percorsi))
+        if processi > 1:
+            with ProcessPoolExecutor(processi) as esecutore:
+                letti = esecutore.map(_leggi_file_shard, percorsi,
+                                      [self.caricamento_tollerante] * len(percorsi))
+                gruppi = []
+                for percorso, (contenuto, seq_journal, scartate) in zip(percorsi, letti):
+                    with SnapshotColonnare(percorso, contenuto) as snapshot:
+                        gruppi.append((list(snapshot.richieste()), seq_journal, scartate))
+        else:
+            gruppi = [_richieste_da_file_shard(percorso, self.caricamento_tollerante) for percorso in percorsi]
+
+        per_shard = {}
+        for chiave, percorso, (gruppo, seq_journal, scartate) in zip(chiavi, percorsi, gruppi):
+            for richiesta in gruppo:
+                richiesta.pezzo = pezzi.setdefault(richiesta.pezzo.id_pezzo, richiesta.pezzo)
+                richieste[richiesta.id_richiesta] = richiesta
+            per_shard[chiave] = {richiesta.id_richiesta for richiesta in gruppo}
+            self._seq_shard[chiave] = seq_journal
+            if scartate:
+                self.voci_scartate.extend(scartate)
+                self._scartate_shard[chiave] = scartate
+
+        self._file_shard = dict(descrizione['file'])
+        if stesso_criterio:
+            self._per_shard = {chiave: ids for chiave, ids in per_shard.items() if ids}
+        else:
+            self._seq_shard = {}
+            self._riscrivi_tutti_shard = True
+            if self._scartate_shard:
+                self._scartate_shard = {'scartate': [voce for voci in self._scartate_shard.values()
+                                                     for voce in voci]}
+
+    def _leggi_snapshot_colonnare(self, richieste: dict, pezzi: dict) -> dict:
+        with SnapshotColonnare(self.file_dati) as snapshot:
+            for richiesta in snapshot.richieste():
+                richiesta.pezzo = pezzi.setdefault(richiesta.pezzo.id_pezzo, richiesta.pezzo)
+                richieste[richiesta.id_richiesta] = richiesta
+            campi = snapshot.metadati
+        self.voci_scartate.extend(tuple(voce) for voce in campi.pop('scartate', []))
+        if self.avanzamento_caricamento:
+            dimensione = os.path.getsize(self.file_dati)
+            self.avanzamento_caricamento(dimensione, dimensione)
+        return campi
+
+    @contextmanager
+    def _transazione(self, aggiorna: bool = True):
+        """Sezione critica tra processi per le modifiche in modalità condivisa"""
+        if not self.condiviso or self.archivio_sqlite or self._lock_tenuto:
+            yield
+            return
+        with blocco_file(self.file_dati + ".lock"):
+            self._lock_tenuto += 1
+            try:
+                if aggiorna:
+                    self.aggiorna_da_disco()
+                yield
+            finally:
+                self._lock_tenuto -= 1
+
+    def _verifica_caricamento(self):
+        """Rifiuta le modifiche se l'archivio non è stato caricato: il journal
+        ripartirebbe da seq 1 e gli ID già usati verrebbero riassegnati"""
+        if self.caricamento_fallito:
+            raise ErroreSalvataggio(f"{self.file_dati} non è stato caricato correttamente: "
+                                    f"modifiche non consentite")
+        if self.sola_lettura:
+            raise ErroreSalvataggio(f"{self.file_dati} è aperto in sola lettura: modifiche non consentite")
+
+    def _fuori_transazione(self) -> bool:
+        return self.condiviso and not self.archivio_sqlite and not self._lock_tenuto
+
+    def _leggi_stato_condiviso(self) -> dict:
+        """Numero di compattazioni fatte sul file e ultimo seq consolidato nello snapshot"""
+        try:
+            with open(self.file_dati + ".stato", 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'compattazioni': 0, 'seq_journal': 0}
+
+    def _scrivi_stato_condiviso(self, stato: dict):
+        file_temporaneo = self.file_dati + ".stato.tmp"
+        with open(file_temporaneo, 'w', encoding='utf-8') as f:
+            json.dump(stato, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(file_temporaneo, self.file_dati + ".stato")
+
+    def aggiorna_da_disco(self):
+        """Porta in memoria le modifiche fatte da altri processi sullo stesso file.
+
+        Di norma legge solo i record accodati al journal dopo l'ultima lettura.
+        Ricarica tutto solo se un altro processo ha compattato il journal prima
+        che questo ne avesse letto tutti i record (o se c'è l'archivio freddo,
+        che la compattazione riorganizza).
+        """
+        if not self.condiviso or self.archivio_sqlite:
+            return
+        if self._fuori_transazione():
+            # _transazione() prende il lock e richiama questo metodo
+            with self._transazione():
+                return
+
+        stato = self._leggi_stato_condiviso()
+        if stato['compattazioni'] != self._compattazioni_viste:
+            if stato['seq_journal'] != self.seq_journal or self.archivio_freddo is not None:
+                self._ricarica()
+                return
+            # Lo snapshot contiene esattamente quanto già in memoria: si riparte
+            # semplicemente dall'inizio del journal svuotato
+            self._compattazioni_viste = stato['compattazioni']
+            self._posizione_journal = 0
+            self.record_non_compattati = 0
+
+        records, self._posizione_journal = self.journal.leggi_da(self._posizione_journal)
+        for record in records:
+            if record['seq'] <= self.seq_journal:
+                continue
+            richiesta = self._applica_record(record)
+            self.seq_journal = record['seq']
+            self.record_non_compattati += 1
+            if richiesta is not None:
+                self.sequenze.osserva(richiesta.id_richiesta)
+                self.sequenze.osserva(richiesta.pezzo.id_pezzo)
+                self._indicizza(richiesta)
+
+    def _ricarica(self):
+        """Scarta lo stato in memoria e ricarica snapshot e journal da capo"""
+        if self.archivio_freddo is not None:
+            self.archivio_freddo = ArchivioFreddo(self.archivio_freddo.percorso)
+            self.richieste = RichiesteStratificate(self.archivio_freddo)
+        else:
+            self.richieste = {}
+        self.pezzi = {}
+        self.voci_scartate = []
+        self.caricamento_fallito = False
+        self.seq_journal = 0
+        self.record_non_compattati = 0
+        self.carica_dati()
+
+    def _riapplica_journal(self):
+        """Riapplica allo snapshot le modifiche registrate nel journal"""
+        try:
+            record_journal = self.journal.leggi(ripara=not self.sola_lettura)
+        except Exception as e:
+            print(f"Errore nella lettura del journal: {e}")
+            return
+
+        for record in record_journal:
+            # I record già consolidati nello snapshot vengono saltati: una
+            # compattazione interrotta prima di svuotare il journal non
+            # duplica le note tecniche
+            if record['seq'] <= self.seq_journal:
+                continue
+            if self._seq_shard and record['seq'] <= self._seq_shard.get(self._chiave_shard_record(record), 0):
+                # Già scritto nel suo shard da un salvataggio interrotto prima dell'indice
+                self.seq_journal = record['seq']
+                self.record_non_compattati += 1
+                continue
+            richiesta = self._applica_record(record)
+            if richiesta is not None and self.shard is not None:
+                self._segna_shard(richiesta)
+            self.seq_journal = record['seq']
+            self.record_non_compattati += 1
+        # Il journal è appena stato riparato: la prossima lettura incrementale parte dalla fine
+        self._posizione_journal = (os.path.getsize(self.journal.percorso)
+                                   if os.path.exists(self.journal.percorso) else 0)
+
+        if self.record_non_compattati and not self.usa_journal and not self.sola_lettura:
+            # Journal rimasto da una sessione precedente: lo consolida subito
+            self.compatta_journal()
 
+    def ricostruisci_indici(self):
+        """Ricostruisce da zero gli indici in memoria a partire dalle richieste caricate"""
+        self._coda_lavori = None
+        self._registro_dispositivi = None
+        self._nomi = None
+        self.generazione += 1
+        if self.archivio_sqlite:
+            self._statistiche = None
+            return
+        self.indice_testo = IndiceTestuale()
+        self.indici = IndiciSecondari()
+        self._statistiche = StatisticheIncrementali()
+        for richiesta in self.richieste_attive().values():
+            self._aggiorna_indici(richiesta)
+        if self.archivio_freddo is not None:
+            # Le richieste archiviate contano nelle statistiche senza essere caricate
+            for id_richiesta, voce in self.archivio_freddo.indice.items():
+                self._statistiche.aggiorna_contributo(
+                    id_richiesta, StatisticheIncrementali.contributo_da_lista(voce[4]))
 
-class Pezzo:
-    def __init__(self, id_pezzo: str, nome: str, modello: str,
-                 numero_serie: str, cliente: str):
-        self.id_pezzo = id_pezzo
-        self.nome = nome
-        self.modello = modello
-        self.numero_serie = numero_serie
-        self.cliente = cliente
-        self.data_creazione = datetime.datetime.now()
+    def richieste_attive(self) -> Dict[str, RichiestaRiparazione]:
+        """Le richieste tenute in memoria (con l'archivio freddo, solo quelle non chiuse)"""
+        if self.archivio_freddo is not None:
+            return self.richieste.attive
+        return self.richieste
 
-    def to_dict(self):
-        return {
-            'id_pezzo': self.id_pezzo,
-            'nome': self.nome,
-            'modello': self.modello,
-            'numero_serie': self.numero_serie,
-            'cliente': self.cliente,
-            'data_creazione': self.data_creazione.isoformat()
+    def archivia_chiuse(self) -> int:
+        """Sposta nell'archivio freddo le richieste consegnate o annullate"""
+        if self.archivio_freddo is None:
+            return 0
+        ids = set()
+        for stato in STATI_CHIUSI:
+            ids |= self.indici.per_stato.get(stato, set())
+        if not ids:
+            return 0
+
+        richieste = [self.richieste.attive[id_richiesta] for id_richiesta in sorted(ids)]
+        contributi = [StatisticheIncrementali.contributo_in_lista(StatisticheIncrementali.contributo(r))
+                      for r in richieste]
+        self.strumentazione.conta_byte('archivio_freddo', self.archivio_freddo.archivia(richieste, contributi))
+
+        for richiesta in richieste:
+            del self.richieste.attive[richiesta.id_richiesta]
+            self.indice_testo.rimuovi(richiesta.id_richiesta)
+            richiesta.osservatore = None
+        self.indici.rimuovi_molti(ids)
+        # Un pezzo resta in memoria finché lo usa una richiesta attiva (apparato tornato in assistenza)
+        in_uso = {richiesta.pezzo.id_pezzo for richiesta in self.richieste.attive.values()}
+        for richiesta in richieste:
+            if richiesta.pezzo.id_pezzo not in in_uso:
+                self.pezzi.pop(richiesta.pezzo.id_pezzo, None)
+        return len(richieste)
+
+    @property
+    def statistiche(self) -> StatisticheIncrementali:
+        if self._statistiche is None:
+            self._statistiche = StatisticheIncrementali.da_richieste(self.richieste.values())
+        return self._statistiche
+
+    @property
+    def coda_lavori(self) -> CodaLavori:
+        if self._coda_lavori is None:
+            if self.archivio_sqlite:
+                aperte = (richiesta for stato in STATI_APERTI
+                          for richiesta in self.cerca_richieste(stato=stato))
+            else:
+                aperte = (self.richieste[id_richiesta] for stato in STATI_APERTI
+                          for id_richiesta in self.indici.per_stato.get(stato, ()))
+            self._coda_lavori = CodaLavori.da_richieste(aperte)
+        return self._coda_lavori
+
+    @property
+    def registro_dispositivi(self) -> RegistroDispositivi:
+        if self._registro_dispositivi is None:
+            registro = RegistroDispositivi()
+            if self.archivio_sqlite:
+                for id_richiesta, modello, numero_serie, data_richiesta in self.archivio_sqlite.apparati():
+                    registro.registra(id_richiesta, modello, numero_serie,
+                                      in_microsecondi(datetime.datetime.fromisoformat(data_richiesta)))
+                for richiesta in self.richieste.in_sospeso().values():
+                    registro.aggiorna(richiesta)
+            else:
+                for richiesta in self.richieste_attive().values():
+                    registro.aggiorna(richiesta)
+                if self.archivio_freddo is not None:
+                    # Le richieste archiviate entrano nello storico senza essere caricate
+                    for id_richiesta in self.archivio_freddo.indice:
+                        registro.registra(id_richiesta, *self.archivio_freddo.apparato(id_richiesta))
+            self._registro_dispositivi = registro
+        return self._registro_dispositivi
+
+    def storico_apparato(self, numero_serie: str, modello: Optional[str] = None) -> List[RichiestaRiparazione]:
+        """Le richieste di un apparato dalla più vecchia; senza modello, di ogni apparato con quel S/N"""
+        registro = self.registro_dispositivi
+        if modello is not None:
+            apparati = [(modello, numero_serie)]
+        else:
+            apparati = registro.apparati_con_numero_serie(numero_serie)
+        ids = [id_richiesta for apparato in apparati for id_richiesta in registro.richieste_di(*apparato)]
+        richieste = [self.richieste[id_richiesta] for id_richiesta in ids]
+        if len(apparati) > 1:
+            richieste.sort(key=lambda richiesta: richiesta._data_richiesta)
+        return richieste
+
+    @property
+    def nomi(self) -> Dict[str, IndiceApprossimato]:
+        """Indici approssimati dei valori già usati per 'cliente', 'modello' e 'nome' (del pezzo)"""
+        if self._nomi is None:
+            nomi = {campo: IndiceApprossimato() for campo in ('cliente', 'modello', 'nome')}
+            if self.archivio_sqlite:
+                for cliente, modello, nome, volte in self.archivio_sqlite.nomi():
+                    nomi['cliente'].aggiungi(cliente, volte)
+                    nomi['modello'].aggiungi(modello, volte)
+                    nomi['nome'].aggiungi(nome, volte)
+            else:
+                for richiesta in self.richieste_attive().values():
+                    self._registra_nomi(nomi, richiesta.pezzo)
+                if self.archivio_freddo is not None:
+                    # Dall'indice dell'archivio: cliente (nel contributo) e modello (nell'apparato)
+                    for voce in self.archivio_freddo.indice.values():
+                        nomi['cliente'].aggiungi(voce[4][2])
+                        if len(voce) > 5:
+                            nomi['modello'].aggiungi(voce[5][0])
+            self._nomi = nomi
+        return self._nomi
+
+    @staticmethod
+    def _registra_nomi(nomi: Dict[str, IndiceApprossimato], pezzo: Pezzo):
+        nomi['cliente'].aggiungi(pezzo.cliente)
+        nomi['modello'].aggiungi(pezzo.modello)
+        nomi['nome'].aggiungi(pezzo.nome)
+
+    def suggerisci_nomi(self, campo: str, testo: str, limite: int = 5) -> List[tuple]:
+        """Valori già usati per il campo ('cliente', 'modello', 'nome') simili al testo.
+
+        Restituisce (valore, distanza di modifica, numero di richieste).
+        """
+        return self.nomi[campo].suggerisci(testo, limite)
+
+    def _pezzo_registrato(self, modello: str, numero_serie: str, cliente: str) -> Optional[Pezzo]:
+        """Il pezzo più recente dello stesso apparato registrato per lo stesso cliente.
+
+        Se l'apparato è passato a un altro cliente se ne crea uno nuovo: il
+        vecchio pezzo resta alle richieste precedenti. Con SQLite, finché il
+        registro dei dispositivi non serve ad altro, basta una query indicizzata.
+        """
+        cliente = cliente.strip().casefold()
+        if self.archivio_sqlite and self._registro_dispositivi is None:
+            chiave = RegistroDispositivi.chiave(modello, numero_serie)
+            if chiave is None:
+                return None
+            # Le richieste ancora in coda sono le più recenti
+            pezzo = self._pezzi_in_sospeso.get(chiave + (cliente,))
+            if pezzo is not None:
+                return pezzo
+            for id_pezzo, modello_pezzo, numero_serie_pezzo, cliente_pezzo in \
+                    self.archivio_sqlite.pezzi_apparato(modello, numero_serie):
+                if (cliente_pezzo.casefold() == cliente and
+                        RegistroDispositivi.chiave(modello_pezzo, numero_serie_pezzo) == chiave):
+                    return self.pezzi[id_pezzo]
+            return None
+
+        for id_richiesta in reversed(self.registro_dispositivi.richieste_di(modello, numero_serie)):
+            pezzo = self.richieste[id_richiesta].pezzo
+            if pezzo.cliente.casefold() == cliente:
+                return self.pezzi.get(pezzo.id_pezzo, pezzo)
+        return None
+
+    def unisci_pezzi_duplicati(self) -> int:
+        """Migrazione: le richieste dello stesso apparato e dello stesso cliente passano a un solo pezzo.
+
+        Si conserva il pezzo creato per primo; restituisce quanti pezzi sono
+        stati eliminati. Le richieste archiviate toccate tornano tra le attive
+        e vengono riarchiviate con il salvataggio che chiude la migrazione.
+        """
+        if self._fuori_transazione():
+            with self._transazione():
+                return self.unisci_pezzi_duplicati()
+        self._verifica_caricamento()
+
+        sostituzioni: Dict[str, str] = {}
+        modificate = []
+        for storico in list(self.registro_dispositivi.storico.values()):
+            if len(storico) < 2:
+                continue
+            richieste = sorted((self.richieste[id_richiesta] for _, id_richiesta in storico),
+                               key=lambda richiesta: (richiesta.pezzo._data_creazione, richiesta.pezzo.id_pezzo))
+            conservati: Dict[str, Pezzo] = {}
+            for richiesta in richieste:
+                pezzo = conservati.setdefault(richiesta.pezzo.cliente.casefold(), richiesta.pezzo)
+                if pezzo.id_pezzo != richiesta.pezzo.id_pezzo:
+                    sostituzioni[richiesta.pezzo.id_pezzo] = pezzo.id_pezzo
+                    richiesta.pezzo = pezzo
+                    modificate.append(richiesta)
+        if not sostituzioni:
+            return 0
+
+        if self.archivio_sqlite:
+            self.archivio_sqlite.unisci_pezzi(sostituzioni)
+            for id_pezzo in sostituzioni:
+                self.pezzi.dimentica(id_pezzo)
+            return len(sostituzioni)
+
+        for richiesta in modificate:
+            self.pezzi.setdefault(richiesta.pezzo.id_pezzo, richiesta.pezzo)
+        record = {'op': 'unisci',
+                  'pezzi': {richiesta.id_richiesta: richiesta.pezzo.to_dict() for richiesta in modificate},
+                  'eliminati': sorted(sostituzioni)}
+        self._applica_record(record)
+        # Con il journal il record fa avanzare seq_journal: gli altri processi che
+        # vedono la compattazione trovano un seq diverso dal loro e ricaricano tutto
+        self._scrivi_record([record])
+        if self.usa_journal:
+            self.compatta_journal()
+        return len(sostituzioni)
+
+    def prossimo_lavoro(self, tecnico: str, prendi_in_carico: bool = True) -> Optional[RichiestaRiparazione]:
+        """Il prossimo lavoro da iniziare per il tecnico (suo o non ancora assegnato).
+
+        Con prendi_in_carico un lavoro non assegnato viene assegnato al tecnico.
+        """
+        id_richiesta = self.coda_lavori.prossimo(tecnico)
+        if id_richiesta is None:
+            return None
+        richiesta = self.richieste[id_richiesta]
+        if prendi_in_carico and not richiesta.tecnico_assegnato:
+            self.aggiorna_richiesta(id_richiesta, tecnico_assegnato=tecnico)
+        return richiesta
+
+    def assegna_lavori(self, tecnici: List[str], limite: Optional[int] = None) -> List[tuple]:
+        """Assegna i lavori non assegnati, dal più urgente, al tecnico meno carico.
+
+        Restituisce le coppie (id richiesta, tecnico); tutte le assegnazioni
+        vengono salvate con una sola scrittura.
+        """
+        assegnati = []
+        tecnici = [tecnico for tecnico in tecnici if tecnico]
+        if not tecnici:
+            return assegnati
+        coda = self.coda_lavori
+        with self.operazioni_in_blocco():
+            while limite is None or len(assegnati) < limite:
+                id_richiesta = coda.prossimo_non_assegnato()
+                if id_richiesta is None:
+                    break
+                tecnico = coda.meno_carico(tecnici)
+                self.aggiorna_richiesta(id_richiesta, tecnico_assegnato=tecnico)
+                assegnati.append((id_richiesta, tecnico))
+        return assegnati
+
+    def verifica_statistiche(self) -> List[str]:
+        """Ricalcola le statistiche con una scansione completa e le confronta con quelle incrementali"""
+        return self.statistiche.verifica(self.richieste.values())
+
+    def _indicizza(self, richiesta: RichiestaRiparazione):
+        """Aggiorna gli indici in memoria dopo la creazione o la modifica di una richiesta"""
+        self._aggiorna_indici(richiesta)
+        if self.shard is not None:
+            self._segna_shard(richiesta)
+
+    def _aggiorna_indici(self, richiesta: RichiestaRiparazione):
+        """Gli indici di una richiesta; ricostruisci_indici() lo usa senza segnare gli shard come modificati"""
+        # I cambi di stato fatti direttamente sulla richiesta tengono allineati gli indici
+        richiesta.osservatore = self._indicizza
+        self.generazione += 1
+        if self._statistiche is not None:
+            self._statistiche.aggiorna(richiesta)
+        if self._coda_lavori is not None:
+            self._coda_lavori.aggiorna(richiesta)
+        if self._registro_dispositivi is not None:
+            self._registro_dispositivi.aggiorna(richiesta)
+        if self.archivio_sqlite:
+            return
+        self.indice_testo.aggiorna(richiesta)
+        self.indici.aggiorna(richiesta)
+
+    def _chiave_shard(self, richiesta: RichiestaRiparazione) -> str:
+        return chiave_shard(self.shard, self.numero_shard, richiesta.id_richiesta, richiesta.data_richiesta)
+
+    def _chiave_shard_record(self, record: dict) -> Optional[str]:
+        """Lo shard toccato da un record del journal (None se la richiesta non esiste)"""
+        if record['op'] == 'unisci':
+            return None
+        if record['op'] == 'crea':
+            dati = record['richiesta']
+            return chiave_shard(self.shard, self.numero_shard, dati['id_richiesta'],
+                                datetime.datetime.fromisoformat(dati['data_richiesta']))
+        richiesta = self.richieste.get(record['id'])
+        return None if richiesta is None else self._chiave_shard(richiesta)
+
+    def _segna_shard(self, richiesta: RichiestaRiparazione):
+        """Annota lo shard della richiesta come da riscrivere al prossimo salvataggio"""
+        chiave = self._chiave_shard(richiesta)
+        self._shard_modificati.add(chiave)
+        if self._per_shard is not None:
+            self._per_shard.setdefault(chiave, set()).add(richiesta.id_richiesta)
+
+    @property
+    def richieste_per_shard(self) -> Dict[str, set]:
+        """ID delle richieste di ogni shard; costruito al primo uso e poi tenuto aggiornato"""
+        if self._per_shard is None:
+            per_shard: Dict[str, set] = {}
+            for richiesta in self.richieste.values():
+                per_shard.setdefault(self._chiave_shard(richiesta), set()).add(richiesta.id_richiesta)
+            self._per_shard = per_shard
+        return self._per_shard
+
+    def richieste_per_data(self) -> List[RichiestaRiparazione]:
+        """Tutte le richieste dalla più recente, senza riordinare l'archivio"""
+        if self.archivio_sqlite:
+            return self.cerca_richieste()
+        return [self.richieste[id_richiesta] for id_richiesta in self.indici.ids_per_data()]
+
+    @staticmethod
+    def _applica_campi(richiesta: RichiestaRiparazione, campi: dict):
+        """Riporta sulla richiesta i campi di un record 'aggiorna' del journal"""
+        if 'stato' in campi:
+            richiesta.stato = StatoRiparazione(campi['stato'])
+            richiesta.data_completamento = (
+                datetime.datetime.fromisoformat(campi['data_completamento'])
+                if campi['data_completamento'] else None)
+        if 'tecnico_assegnato' in campi:
+            richiesta.tecnico_assegnato = campi['tecnico_assegnato']
+        if 'costo_stimato' in campi:
+            richiesta.costo_stimato = campi['costo_stimato']
+        if 'costo_finale' in campi:
+            richiesta.costo_finale = campi['costo_finale']
+        if 'nota' in campi:
+            richiesta.note_tecniche.append(NotaTecnica.from_dict(campi['nota']))
+        # I journal scritti prima delle versioni non riportano il campo
+        richiesta.versione = campi.get('versione', richiesta.versione + 1)
+
+    def _applica_record(self, record: dict) -> Optional[RichiestaRiparazione]:
+        """Riapplica in memoria un record del journal e restituisce la richiesta toccata"""
+        if record['op'] == 'crea':
+            richiesta = RichiestaRiparazione.from_dict(record['richiesta'])
+            richiesta.pezzo = self.pezzi.setdefault(richiesta.pezzo.id_pezzo, richiesta.pezzo)
+            self.richieste[richiesta.id_richiesta] = richiesta
+            if self._nomi is not None:
+                self._registra_nomi(self._nomi, richiesta.pezzo)
+            return richiesta
+
+        elif record['op'] == 'aggiorna':
+            richiesta = self.richieste.get(record['id'])
+            if richiesta is None:
+                print(f"Journal: richiesta {record['id']} non trovata, record ignorato")
+                return None
+
+            self._applica_campi(richiesta, record['campi'])
+            # Una richiesta archiviata che viene modificata torna tra le attive
+            self.richieste[richiesta.id_richiesta] = richiesta
+            self.pezzi[richiesta.pezzo.id_pezzo] = richiesta.pezzo
+            return richiesta
+
+        elif record['op'] == 'unisci':
+            # Tocca più richieste (anche di shard diversi): gli indici si aggiornano qui
+            for id_richiesta, dati_pezzo in record['pezzi'].items():
+                richiesta = self.richieste.get(id_richiesta)
+                if richiesta is None:
+                    continue
+                richiesta.pezzo = self.pezzi.setdefault(dati_pezzo['id_pezzo'], Pezzo.from_dict(dati_pezzo))
+                # Con l'archivio freddo la richiesta torna tra le attive fino al salvataggio
+                self.richieste[id_richiesta] = richiesta
+                self._indicizza(richiesta)
+            for id_pezzo in record['eliminati']:
+                self.pezzi.pop(id_pezzo, None)
+        return None
+
+    @strumentato("salva_dati")
+    def salva_dati(self):
+        """Salva i dati nello snapshot (JSON o colonnare)"""
+        if self.archivio_sqlite:
+            # Ogni modifica è già confermata nel database da _persisti()
+            return True
+        if self._fuori_transazione():
+            # Prima di riscrivere lo snapshot vanno incorporate le modifiche degli altri processi
+            with self._transazione():
+                return self.salva_dati()
+        if self.caricamento_fallito:
+            print(f"Salvataggio annullato: {self.file_dati} non è stato caricato correttamente")
+            return False
+        if self.sola_lettura:
+            print(f"Salvataggio annullato: {self.file_dati} è aperto in sola lettura")
+            return False
+
+        try:
+            self.scrivi_snapshot(self.prepara_snapshot())
+            return True
+        except Exception as e:
+            print(f"Errore nel salvataggio dei dati: {e}")
+            if self.shard is not None:
+                # Non si sa quali shard siano stati scritti: il prossimo salvataggio li riscrive tutti
+                self._riscrivi_tutti_shard = True
+            return False
+
+    def prepara_snapshot(self) -> dict:
+        """Copia serializzabile dello stato in memoria, da passare a scrivi_snapshot()"""
+        if self.archivio_freddo is not None:
+            # Prima l'archivio, poi lo snapshot: dopo un crash tra i due
+            # passi la copia nello snapshot prevale su quella archiviata
+            self.archivia_chiuse()
+            self.archivio_freddo.salva_indice()
+
+        if self.shard is not None:
+            return self._prepara_shard()
+
+        if self.formato_colonnare:
+            metadati = {'seq_journal': self.seq_journal, 'sequenze': dict(self.sequenze.contatori),
+                        'scartate': [list(voce) for voce in self.voci_scartate]}
+            return SnapshotColonnare.prepara(self.richieste_attive().values(), metadati)
+
+        dati = {
+            'richieste': {id_req: req.to_dict() for id_req, req in self.richieste_attive().items()}
         }
+        # Le voci scartate al caricamento vengono riscritte così come sono, per non perderle
+        for id_req, _, dati_originali in self.voci_scartate:
+            dati['richieste'].setdefault(id_req, dati_originali)
+        versioni = self._versioni(self.richieste_attive().values())
+        if versioni:
+            dati['versioni'] = versioni
+        if self.seq_journal:
+            dati['seq_journal'] = self.seq_journal
+        if self.sequenze.contatori:
+            dati['sequenze'] = dict(self.sequenze.contatori)
+        return dati
 
+    @staticmethod
+    def _versioni(richieste) -> Dict[str, int]:
+        """Le versioni delle richieste modificate almeno una volta (senza voce valgono 1)"""
+        return {richiesta.id_richiesta: richiesta.versione for richiesta in richieste if richiesta.versione != 1}
 
-class RichiestaRiparazione:
-    def __init__(self, id_richiesta: str, pezzo: Pezzo,
-                 descrizione_problema: str, tipo_intervento: TipoIntervento,
-                 priorita: str = "Media"):
-        self.id_richiesta = id_richiesta
-        self.pezzo = pezzo
-        self.descrizione_problema = descrizione_problema
-        self.tipo_intervento = tipo_intervento
-        self.stato = StatoRiparazione.RICEVUTO
-        self.priorita = priorita
-        self.data_richiesta = datetime.datetime.now()
-        self.data_completamento = None
-        self.note_tecniche = []
-        self.costo_stimato = 0.0
-        self.costo_finale = 0.0
-        self.tecnico_assegnato = ""
+    def _prepara_shard(self) -> dict:
+        """Come prepara_snapshot(), ma con i soli shard modificati più l'indice di tutti gli shard"""
+        per_shard = self.richieste_per_shard
+        radice, estensione = os.path.splitext(os.path.basename(self.file_dati))
+        file_shard = {chiave: f"{radice}.{chiave}{estensione or '.json'}"
+                      for chiave in sorted(set(per_shard) | set(self._scartate_shard))}
+        modificati = file_shard if self._riscrivi_tutti_shard else self._shard_modificati
+        shard = {}
+        for chiave in modificati:
+            richieste = {id_req: self.richieste[id_req].to_dict() for id_req in sorted(per_shard.get(chiave, ()))}
+            for id_req, _, dati_originali in self._scartate_shard.get(chiave, ()):
+                richieste.setdefault(id_req, dati_originali)
+            # Ogni shard ricorda fin dove arriva il journal consolidato al suo interno
+            shard[file_shard[chiave]] = {'seq_journal': self.seq_journal, 'richieste': richieste}
+            versioni = self._versioni(self.richieste[id_req] for id_req in per_shard.get(chiave, ()))
+            if versioni:
+                shard[file_shard[chiave]]['versioni'] = versioni
+        self._shard_modificati = set()
+        self._riscrivi_tutti_shard = False
 
-    def aggiungi_nota(self, nota: str, tecnico: str = ""):
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
-        self.note_tecniche.append({
-            'timestamp': timestamp,
-            'nota': nota,
-            'tecnico': tecnico
-        })
+        indice = {'shard': {'criterio': self.shard, 'numero': self.numero_shard, 'file': file_shard}}
+        if self.seq_journal:
+            indice['seq_journal'] = self.seq_journal
+        if self.sequenze.contatori:
+            indice['sequenze'] = dict(self.sequenze.contatori)
+        obsoleti = sorted(set(self._file_shard.values()) - set(file_shard.values()))
+        self._file_shard = file_shard
+        return {'shard': shard, 'indice': indice, 'obsoleti': obsoleti}
 
-    def aggiorna_stato(self, nuovo_stato: StatoRiparazione):
-        self.stato = nuovo_stato
-        if nuovo_stato == StatoRiparazione.COMPLETATO:
-            self.data_completamento = datetime.datetime.now()
+    def _scrivi_shard(self, dati: dict):
+        """Prima gli shard modificati, poi l'indice, infine si eliminano gli shard non più elencati"""
+        cartella = os.path.dirname(self.file_dati)
+        scritti = 0
+        da_scrivere = [(os.path.join(cartella, nome), contenuto) for nome, contenuto in dati['shard'].items()]
+        da_scrivere.append((self.file_dati, dati['indice']))
+        for percorso, contenuto in da_scrivere:
+            file_temporaneo = percorso + ".tmp"
+            with open(file_temporaneo, 'w', encoding='utf-8') as f:
+                json.dump(contenuto, f, indent=2, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(file_temporaneo, percorso)
+            scritti += os.path.getsize(percorso)
+        for nome in dati['obsoleti']:
+            try:
+                os.remove(os.path.join(cartella, nome))
+            except FileNotFoundError:
+                pass
+        if self.strumentazione.attiva:
+            self.strumentazione.conta_byte('snapshot', scritti)
 
-    def to_dict(self):
+    @strumentato("scrivi_snapshot")
+    def scrivi_snapshot(self, dati: dict):
+        """Scrive lo snapshot preparato; non legge lo stato in memoria, quindi può girare in un altro thread"""
+        if self.shard is not None:
+            self._scrivi_shard(dati)
+            return
+        # Scrive su un file temporaneo e lo sostituisce in modo atomico:
+        # un crash a metà scrittura non lascia uno snapshot corrotto
+        file_temporaneo = self.file_dati + ".tmp"
+        if self.formato_colonnare:
+            with open(file_temporaneo, 'wb') as f:
+                SnapshotColonnare.scrivi(f, dati)
+                f.flush()
+                os.fsync(f.fileno())
+        else:
+            with open(file_temporaneo, 'w', encoding='utf-8') as f:
+                json.dump(dati, f, indent=2, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(file_temporaneo, self.file_dati)
+        if self.strumentazione.attiva:
+            self.strumentazione.conta_byte('snapshot', os.path.getsize(self.file_dati))
+
+    @strumentato("compatta_journal")
+    def compatta_journal(self):
+        """Consolida il journal in un nuovo snapshot e lo svuota"""
+        if self.archivio_sqlite:
+            return
+        if self._fuori_transazione():
+            with self._transazione():
+                return self.compatta_journal()
+        if self.salva_dati():
+            if self.condiviso:
+                # Lo stato va scritto prima di svuotare il journal: se il processo
+                # si interrompe in mezzo, gli altri rileggono il journal da capo
+                # e saltano i record già visti grazie al seq
+                self._compattazioni_viste += 1
+                self._scrivi_stato_condiviso({'compattazioni': self._compattazioni_viste,
+                                              'seq_journal': self.seq_journal})
+                self._posizione_journal = 0
+            self.journal.svuota()
+            self.record_non_compattati = 0
+
+    def _persisti(self, record: dict, evento: Optional[dict] = None):
+        """Rende durevole una modifica, oppure la accoda se è aperto un blocco di operazioni"""
+        if self._blocchi_aperti or self.scrittura_differita:
+            self._record_in_sospeso.append(record)
+            if evento is not None:
+                self._eventi_in_sospeso.append(evento)
+            if self.archivio_sqlite:
+                # Finché il record non è nel database la richiesta esiste solo in
+                # memoria: la cache LRU non deve poterla scartare
+                richiesta = self.richieste[record.get('id') or record['richiesta']['id_richiesta']]
+                self.richieste.fissa(richiesta.id_richiesta, richiesta)
+                self.pezzi.fissa(richiesta.pezzo.id_pezzo, richiesta.pezzo)
+                chiave = self._chiave_pezzo_in_sospeso(richiesta.pezzo)
+                if chiave is not None:
+                    self._pezzi_in_sospeso[chiave] = richiesta.pezzo
+            return
+        self._scrivi_record([record])
+        if evento is not None:
+            self.pubblica_eventi([evento])
+
+    @property
+    def eventi_attivi(self) -> bool:
+        """Vero se qualcuno riceve gli eventi di modifica (iscritti al bus o feed)"""
+        return self.feed_modifiche is not None or bool(self.eventi)
+
+    @staticmethod
+    def _valori_per_evento(richiesta: RichiestaRiparazione) -> dict:
+        """I campi modificabili con aggiorna_richiesta(), come compaiono nei record"""
         return {
-            'id_richiesta': self.id_richiesta,
-            'pezzo': self.pezzo.to_dict(),
-            'descrizione_problema': self.descrizione_problema,
-            'tipo_intervento': self.tipo_intervento.value,
-            'stato': self.stato.value,
-            'priorita': self.priorita,
-            'data_richiesta': self.data_richiesta.isoformat(),
-            'data_completamento': self.data_completamento.isoformat() if self.data_completamento else None,
-            'note_tecniche': self.note_tecniche,
-            'costo_stimato': self.costo_stimato,
-            'costo_finale': self.costo_finale,
-            'tecnico_assegnato': self.tecnico_assegnato
+            'stato': richiesta.stato.value,
+            'data_completamento': (richiesta.data_completamento.isoformat()
+                                   if richiesta.data_completamento else None),
+            'tecnico_assegnato': richiesta.tecnico_assegnato,
+            'costo_stimato': richiesta.costo_stimato,
+            'costo_finale': richiesta.costo_finale,
         }
 
+    @staticmethod
+    def _evento_modifica(richiesta: RichiestaRiparazione, prima: dict, campi: dict) -> Optional[dict]:
+        """Evento con i soli campi cambiati rispetto a `prima` (vuoto per una creazione).
 
-class SistemaGestioneRiparazioni:
-    def __init__(self, file_dati: str = "riparazioni.json"):
-        self.file_dati = file_dati
-        self.richieste: Dict[str, RichiestaRiparazione] = {}
-        self.pezzi: Dict[str, Pezzo] = {}
-        self.carica_dati()
+        Un aggiornamento che non cambia nessun valore non produce eventi.
+        """
+        cambiati = {nome: valore for nome, valore in campi.items()
+                    if nome != 'versione' and (nome not in prima or prima[nome] != valore)}
+        if prima and not cambiati:
+            return None
+        stato_precedente = prima.get('stato')
+        if not prima:
+            tipo = 'creazione'
+        elif 'stato' in cambiati:
+            tipo = 'cambio_stato'
+        else:
+            tipo = 'aggiornamento'
+        return {
+            'tipo': tipo,
+            'id_richiesta': richiesta.id_richiesta,
+            'timestamp': datetime.datetime.now().isoformat(),
+            'stato_precedente': stato_precedente,
+            'stato_nuovo': richiesta.stato.value,
+            'versione': richiesta.versione,
+            'campi': cambiati,
+            'precedenti': {nome: prima[nome] for nome in cambiati if nome in prima},
+        }
 
-    def carica_dati(self):
-        """Carica i dati dal file JSON"""
-        if os.path.exists(self.file_dati):
+    def pubblica_eventi(self, eventi: List[dict]):
+        """Scrive gli eventi di modifiche già durevoli nel feed e li passa al bus.
+
+        Il feed viene scritto dopo i dati: un'interruzione tra le due
+        scritture può perdere gli eventi dell'ultimo gruppo, mai inventarne
+        di modifiche non salvate.
+        """
+        if not eventi:
+            return
+        if self.feed_modifiche is not None:
             try:
-                with open(self.file_dati, 'r', encoding='utf-8') as f:
-                    dati = json.load(f)
-
-                # Ricostruisce gli oggetti dai dati salvati
-                for id_richiesta, dati_richiesta in dati.get('richieste', {}).items():
-                    # Ricostruisce il pezzo
-                    dati_pezzo = dati_richiesta['pezzo']
-                    pezzo = Pezzo(
-                        dati_pezzo['id_pezzo'],
-                        dati_pezzo['nome'],
-                        dati_pezzo['modello'],
-                        dati_pezzo['numero_serie'],
-                        dati_pezzo['cliente']
-                    )
-
-                    # Ricostruisce la richiesta
-                    richiesta = RichiestaRiparazione(
-                        id_richiesta,
-                        pezzo,
-                        dati_richiesta['descrizione_problema'],
-                        TipoIntervento(dati_richiesta['tipo_intervento'])
-                    )
-
-                    # Ripristina i dati aggiuntivi
-                    richiesta.stato = StatoRiparazione(dati_richiesta['stato'])
-                    richiesta.priorita = dati_richiesta['priorita']
-                    richiesta.data_richiesta = datetime.datetime.fromisoformat(dati_richiesta['data_richiesta'])
-                    if dati_richiesta['data_completamento']:
-                        richiesta.data_completamento = datetime.datetime.fromisoformat(
-                            dati_richiesta['data_completamento'])
-                    richiesta.note_tecniche = dati_richiesta['note_tecniche']
-                    richiesta.costo_stimato = dati_richiesta['costo_stimato']
-                    richiesta.costo_finale = dati_richiesta['costo_finale']
-                    richiesta.tecnico_assegnato = dati_richiesta['tecnico_assegnato']
-
-                    self.richieste[id_richiesta] = richiesta
-                    self.pezzi[pezzo.id_pezzo] = pezzo
+                self.feed_modifiche.aggiungi_molti(eventi)
+            except OSError as e:
+                print(f"Errore nella scrittura del feed delle modifiche: {e}")
+        self.eventi.pubblica(eventi)
 
-            except Exception as e:
-                print(f"Errore nel caricamento dei dati: {e}")
+    def preleva_eventi_in_sospeso(self) -> List[dict]:
+        """Come preleva_record_in_sospeso(), per gli eventi delle stesse modifiche"""
+        eventi, self._eventi_in_sospeso = self._eventi_in_sospeso, []
+        return eventi
 
-    def salva_dati(self):
-        """Salva i dati nel file JSON"""
+    def leggi_modifiche(self, dopo: int = 0, massimo: int = 1000) -> tuple:
+        """Eventi del feed successivi all'offset `dopo` e l'offset da cui ripartire"""
+        if self.feed_modifiche is None:
+            raise ValueError("Il feed delle modifiche non è attivo (feed_modifiche=True)")
+        return self.feed_modifiche.leggi(dopo, massimo)
+
+    def _scrivi_record(self, records: List[dict]):
+        """Una sola scrittura durevole per tutti i record: transazione, journal o snapshot.
+
+        Se la scrittura fallisce solleva ErroreSalvataggio (o ConflittoVersione):
+        chi chiama non deve considerare le modifiche salvate né pubblicarne gli eventi.
+        """
+        if not records:
+            return
+
+        if self.archivio_sqlite:
+            try:
+                self.archivio_sqlite.applica_molti(records)
+            except (sqlite3.Error, ConflittoVersione) as e:
+                # La transazione è stata annullata: le copie in memoria non valgono più
+                self.dimentica_modifiche(record.get('id') or record['richiesta']['id_richiesta']
+                                         for record in records)
+                if isinstance(e, ConflittoVersione):
+                    raise
+                raise ErroreSalvataggio(f"Errore nel salvataggio sul database: {e}") from e
+            finally:
+                self.rilascia_record_scritti(records)
+            return
+
+        if self._fuori_transazione():
+            with self._transazione():
+                return self._scrivi_record(records)
+        self._verifica_caricamento()
+
+        if not self.usa_journal:
+            if not self.salva_dati():
+                raise ErroreSalvataggio(f"{self.file_dati} non è stato salvato")
+            return
+
+        self._numera_record(records)
         try:
-            dati = {
-                'richieste': {id_req: req.to_dict() for id_req, req in self.richieste.items()}
-            }
-            with open(self.file_dati, 'w', encoding='utf-8') as f:
-                json.dump(dati, f, indent=2, ensure_ascii=False)
+            self.journal.aggiungi_molti(records)
         except Exception as e:
-            print(f"Errore nel salvataggio dei dati: {e}")
+            print(f"Errore nella scrittura del journal: {e}")
+            if not self.salva_dati():
+                raise ErroreSalvataggio(f"{self.file_dati} non è stato salvato né il journal scritto")
+            return
+
+        if self.record_non_compattati >= self.soglia_compattazione:
+            self.compatta_journal()
+
+    def rilascia_record_scritti(self, records: List[dict]):
+        """Con SQLite, le richieste dei record ormai nel database tornano nella sola cache LRU"""
+        if not self.archivio_sqlite:
+            return
+        for record in records:
+            richiesta = self.richieste.rilascia(record.get('id') or record['richiesta']['id_richiesta'])
+            if richiesta is None:
+                continue
+            pezzo = richiesta.pezzo
+            self.pezzi.rilascia(pezzo.id_pezzo)
+            if not self.pezzi.fissato(pezzo.id_pezzo):
+                # Ora il pezzo si trova con la query su pezzi_apparato()
+                chiave = self._chiave_pezzo_in_sospeso(pezzo)
+                if self._pezzi_in_sospeso.get(chiave) is pezzo:
+                    del self._pezzi_in_sospeso[chiave]
+
+    @staticmethod
+    def _chiave_pezzo_in_sospeso(pezzo: Pezzo) -> Optional[tuple]:
+        chiave = RegistroDispositivi.chiave(pezzo.modello, pezzo.numero_serie)
+        return None if chiave is None else chiave + (pezzo.cliente.casefold(),)
+
+    def dimentica_modifiche(self, ids):
+        """Con SQLite, scarta le copie in memoria di richieste la cui scrittura è fallita"""
+        for id_richiesta in ids:
+            self.richieste.dimentica(id_richiesta)
+        # Alcuni pezzi in coda potrebbero non arrivare mai nel database
+        self._pezzi_in_sospeso.clear()
+        # Statistiche e code includono le modifiche annullate: verranno ricostruite
+        self._statistiche = None
+        self._coda_lavori = None
+        self._registro_dispositivi = None
+        self._nomi = None
+        self.generazione += 1
+
+    def _numera_record(self, records: List[dict]):
+        for record in records:
+            self.seq_journal += 1
+            record['seq'] = self.seq_journal
+        self.record_non_compattati += len(records)
+
+    def preleva_record_in_sospeso(self) -> List[dict]:
+        """Toglie dalla coda i record non ancora scritti, già numerati per il journal.
+
+        Serve con scrittura_differita=True: la numerazione avviene nel thread
+        che modifica la memoria, mentre la scrittura (journal.aggiungi_molti(),
+        scrivi_snapshot() o ArchivioSQLite.applica_molti()) può girare altrove.
+        """
+        records, self._record_in_sospeso = self._record_in_sospeso, []
+        if records and self.usa_journal and not self.archivio_sqlite:
+            self._numera_record(records)
+        return records
+
+    @contextmanager
+    def operazioni_in_blocco(self):
+        """Raggruppa creazioni e aggiornamenti in un'unica scrittura durevole.
+
+        Le modifiche sono subito visibili in memoria; all'uscita dal blocco più
+        esterno vengono salvate insieme (una transazione SQLite, un solo fsync
+        del journal o una sola riscrittura del file). Non c'è rollback: anche se
+        il blocco termina con un'eccezione, quanto già applicato viene salvato.
+        """
+        with self._transazione():
+            self._blocchi_aperti += 1
+            try:
+                yield self
+            finally:
+                self._blocchi_aperti -= 1
+                if not self._blocchi_aperti and not self.scrittura_differita:
+                    records, self._record_in_sospeso = self._record_in_sospeso, []
+                    eventi = self.preleva_eventi_in_sospeso()
+                    # Se la scrittura fallisce l'eccezione esce dal blocco e gli eventi vanno persi
+                    self._scrivi_record(records)
+                    self.pubblica_eventi(eventi)
 
     def genera_id_richiesta(self) -> str:
         """Genera un ID univoco per la richiesta"""
-        today = datetime.datetime.now().strftime("%Y%m%d")
-        counter = len([r for r in self.richieste.keys() if r.startswith(f"RIP{today}")]) + 1
-        return f"RIP{today}{counter:03d}"
+        return self.riserva_id_richieste(1)[0]
 
     def genera_id_pezzo(self) -> str:
         """Genera un ID univoco per il pezzo"""
+        return self.riserva_id_pezzi(1)[0]
+
+    def riserva_id_richieste(self, quantita: int) -> List[str]:
+        """Riserva in un colpo solo un blocco di ID richiesta consecutivi"""
+        today = datetime.datetime.now().strftime("%Y%m%d")
+        return [f"RIP{today}{counter:03d}" for counter in self.sequenze.riserva(f"RIP{today}", quantita)]
+
+    def riserva_id_pezzi(self, quantita: int) -> List[str]:
+        """Riserva in un colpo solo un blocco di ID pezzo consecutivi"""
         today = datetime.datetime.now().strftime("%Y%m%d")
-        counter = len([p for p in self.pezzi.keys() if p.startswith(f"PZ{today}")]) + 1
-        return f"PZ{today}{counter:03d}"
+        return [f"PZ{today}{counter:03d}" for counter in self.sequenze.riserva(f"PZ{today}", quantita)]
 
+    @strumentato("crea_richiesta_riparazione")
     def crea_richiesta_riparazione(self, nome_pezzo: str, modello: str,
                                    numero_serie: str, cliente: str,
                                    descrizione_problema: str, tipo_intervento: TipoIntervento,
-                                   priorita: str = "Media") -> str:
-        """Crea una nuova richiesta di riparazione"""
+                                   priorita: str = "Media", id_richiesta: Optional[str] = None,
+                                   id_pezzo: Optional[str] = None, riusa_pezzo: bool = False) -> str:
+        """Crea una nuova richiesta di riparazione (gli ID possono essere già riservati).
 
-        # Crea il pezzo
-        id_pezzo = self.genera_id_pezzo()
-        pezzo = Pezzo(id_pezzo, nome_pezzo, modello, numero_serie, cliente)
+        Di norma si crea sempre un pezzo nuovo. Con riusa_pezzo=True un
+        apparato (modello e numero di serie) già in assistenza per lo stesso
+        cliente riusa il Pezzo registrato: nome e id_pezzo passati vengono
+        ignorati, e chi chiama trova quelli usati in richieste[id].pezzo.
+        """
+        if self._fuori_transazione():
+            # Il lock va preso prima di toccare la memoria: una ricarica completa
+            # fatta dopo cancellerebbe la richiesta appena creata
+            with self._transazione():
+                return self.crea_richiesta_riparazione(nome_pezzo, modello, numero_serie, cliente,
+                                                       descrizione_problema, tipo_intervento,
+                                                       priorita, id_richiesta, id_pezzo, riusa_pezzo)
+        self._verifica_caricamento()
+
+        # Un apparato già visto in assistenza riusa il suo pezzo, altrimenti se ne crea uno
+        pezzo = self._pezzo_registrato(modello, numero_serie, cliente) if riusa_pezzo else None
+        if pezzo is None:
+            id_pezzo = id_pezzo or self.genera_id_pezzo()
+            pezzo = Pezzo(id_pezzo, nome_pezzo, modello, numero_serie, cliente)
 
         # Crea la richiesta
-        id_richiesta = self.genera_id_richiesta()
+        id_richiesta = id_richiesta or self.genera_id_richiesta()
         richiesta = RichiestaRiparazione(id_richiesta, pezzo, descrizione_problema,
                                          tipo_intervento, priorita)
 
         # Salva nella memoria
-        self.pezzi[id_pezzo] = pezzo
+        self.pezzi[pezzo.id_pezzo] = pezzo
         self.richieste[id_richiesta] = richiesta
+        self._indicizza(richiesta)
+        if self._nomi is not None:
+            self._registra_nomi(self._nomi, pezzo)
 
         # Salva su file
-        self.salva_dati()
+        record = {'op': 'crea', 'richiesta': richiesta.to_dict()}
+        evento = self._evento_modifica(richiesta, {}, record['richiesta']) if self.eventi_attivi else None
+        self._persisti(record, evento)
 
         return id_richiesta
 
+    def importa_richieste(self, percorso: str, dimensione_lotto: int = 1000,
+                          riusa_pezzi: bool = False) -> EsitoImportazione:
+        """Importa richieste da un file CSV o JSONL.
+
+        Le righe vengono lette in streaming e validate; ogni lotto di righe
+        valide riceve un blocco di ID e viene salvato con una sola scrittura.
+        Le righe non valide o non importabili finiscono nel riepilogo senza
+        fermare le altre; se la scrittura di un lotto fallisce, tutte le sue
+        righe vi finiscono con l'errore del salvataggio.
+        Ogni riga crea un pezzo nuovo; con riusa_pezzi=True le righe di un
+        apparato già registrato per lo stesso cliente riusano il suo pezzo.
+        """
+        self._verifica_caricamento()
+        esito = EsitoImportazione()
+        inizio = time.perf_counter()
+        lotto = []
+
+        def pezzi_nuovi() -> int:
+            """Quante righe del lotto creeranno un pezzo (le altre riusano quello registrato)"""
+            if not riusa_pezzi:
+                return len(lotto)
+            nuovi = 0
+            apparati = set()   # apparati nuovi già contati: le righe successive li riusano
+            for _, riga in lotto:
+                chiave = RegistroDispositivi.chiave(riga['modello'], riga['numero_serie'])
+                if chiave is not None:
+                    chiave += (riga['cliente'].strip().casefold(),)
+                    if chiave in apparati:
+                        continue
+                if self._pezzo_registrato(riga['modello'], riga['numero_serie'], riga['cliente']) is None:
+                    nuovi += 1
+                    if chiave is not None:
+                        apparati.add(chiave)
+            return nuovi
+
+        def importa_lotto():
+            ids_richiesta = self.riserva_id_richieste(len(lotto))
+            ids_pezzo = iter(self.riserva_id_pezzi(pezzi_nuovi()))
+            importate = []
+            try:
+                with self.operazioni_in_blocco():
+                    for (numero, riga), id_richiesta in zip(lotto, ids_richiesta):
+                        creata = False
+                        try:
+                            id_pezzo = None
+                            if not riusa_pezzi or self._pezzo_registrato(
+                                    riga['modello'], riga['numero_serie'], riga['cliente']) is None:
+                                # Finiti gli ID riservati (una riga precedente è fallita) ne genera uno
+                                id_pezzo = next(ids_pezzo, None)
+                            self.crea_richiesta_riparazione(
+                                riga['nome_pezzo'], riga['modello'], riga['numero_serie'], riga['cliente'],
+                                riga['descrizione_problema'], riga['tipo_intervento'], riga['priorita'],
+                                id_richiesta=id_richiesta, id_pezzo=id_pezzo, riusa_pezzo=riusa_pezzi)
+                            creata = True
+                            aggiornamenti = {}
+                            if riga['tecnico_assegnato']:
+                                aggiornamenti['tecnico_assegnato'] = riga['tecnico_assegnato']
+                            if riga['costo_stimato'] is not None:
+                                aggiornamenti['costo_stimato'] = riga['costo_stimato']
+                            if aggiornamenti:
+                                self.aggiorna_richiesta(id_richiesta, **aggiornamenti)
+                        except Exception as e:
+                            if not creata:
+                                esito.errori.append((numero, str(e) or repr(e)))
+                                continue
+                            esito.errori.append((numero, f"{id_richiesta} creata senza tecnico e costo: {e}"))
+                        importate.append((numero, id_richiesta))
+            except Exception as e:
+                # La scrittura del lotto non è riuscita: nessuna sua riga è stata salvata
+                esito.errori.extend((numero, f"salvataggio non riuscito: {e}") for numero, _ in importate)
+            else:
+                esito.importate.extend(id_richiesta for _, id_richiesta in importate)
+            lotto.clear()
+
+        try:
+            for numero, dati in leggi_righe_importazione(percorso):
+                try:
+                    if isinstance(dati, Exception):
+                        raise dati
+                    lotto.append((numero, valida_riga_importazione(dati)))
+                except Exception as e:
+                    esito.errori.append((numero, str(e) or repr(e)))
+                    continue
+                if len(lotto) >= dimensione_lotto:
+                    importa_lotto()
+            if lotto:
+                importa_lotto()
+        except (OSError, UnicodeDecodeError, csv.Error) as e:
+            esito.errori.append((0, f"lettura del file interrotta: {e}"))
+
+        esito.errori.sort(key=lambda errore: errore[0])
+        esito.durata = time.perf_counter() - inizio
+        return esito
+
+    def varianti_cliente(self, cliente: str) -> List[str]:
+        """Il cliente cercato più quelli già in archivio scritti in modo simile (es. "Cremonessi")"""
+        return [cliente] + [valore for valore, _, _ in self.suggerisci_nomi('cliente', cliente)
+                            if cliente.lower() not in valore.lower()]
+
+    @strumentato("cerca_richieste")
     def cerca_richieste(self, termine_ricerca: str = "",
                         stato: Optional[StatoRiparazione] = None,
-                        cliente: str = "", tipo: Optional[TipoIntervento] = None) -> List[RichiestaRiparazione]:
-        """Cerca richieste di riparazione con diversi criteri"""
+                        cliente: str = "", tipo: Optional[TipoIntervento] = None,
+                        includi_archivio: bool = False,
+                        tolleranza_refusi: bool = False,
+                        per_rilevanza: bool = False) -> List[RichiestaRiparazione]:
+        """Cerca richieste di riparazione con diversi criteri, dalla più recente.
+
+        Con tolleranza_refusi il filtro cliente comprende anche i clienti
+        scritti in modo simile (es. "Cremonessi" per "Cremonesi"). Con
+        per_rilevanza e un termine di ricerca, prima i risultati in cui il
+        termine è una parola intera (vedi IndiceTestuale.punteggio()), a
+        parità di punteggio dalla più recente.
+        """
+        if cliente and tolleranza_refusi:
+            cliente = self.varianti_cliente(cliente)
+        attive = [self.richieste[id_richiesta]
+                  for id_richiesta in self.cerca_id_richieste(termine_ricerca, stato, cliente, tipo)]
+        if includi_archivio and self.archivio_freddo is not None:
+            archiviate = self.cerca_nell_archivio(termine_ricerca, stato, cliente, tipo)
+            attive = list(heapq.merge(attive, archiviate, key=lambda r: r.data_richiesta, reverse=True))
+        if per_rilevanza and termine_ricerca:
+            # Ordinamento stabile: a parità di punteggio resta l'ordine per data
+            attive.sort(key=lambda richiesta: -IndiceTestuale.punteggio(
+                IndiceTestuale.testo_indicizzato(richiesta), termine_ricerca))
+        return attive
+
+    def cerca_id_richieste(self, termine_ricerca: str = "",
+                           stato: Optional[StatoRiparazione] = None,
+                           cliente="", tipo: Optional[TipoIntervento] = None) -> List[str]:
+        """Gli ID delle richieste attive che soddisfano i filtri, dalla più recente.
+
+        Non carica le richieste: chi mostra i risultati a pagine legge solo
+        quelle della pagina. `cliente` può essere un elenco di alternative
+        (vedi varianti_cliente()).
+        """
+        if self.archivio_sqlite:
+            # I filtri diventano una query sulle colonne indicizzate
+            in_sospeso = self.richieste.in_sospeso()
+            if not in_sospeso:
+                return self.archivio_sqlite.cerca(termine_ricerca, stato, cliente, tipo)
+            # Le richieste con modifiche non ancora scritte si filtrano in memoria,
+            # dove sono aggiornate, e si uniscono per data ai risultati del database
+            righe = self.archivio_sqlite.cerca(termine_ricerca, stato, cliente, tipo, con_date=True)
+            dal_database = [riga for riga in righe if riga[1] not in in_sospeso]
+            in_memoria = [(richiesta.data_richiesta.isoformat(), richiesta.id_richiesta)
+                          for richiesta in self._filtra_richieste(in_sospeso.values(), termine_ricerca,
+                                                                  stato, cliente, tipo)]
+            return [riga[1] for riga in heapq.merge(dal_database, in_memoria,
+                                                    key=lambda riga: riga[0], reverse=True)]
+
+        # Ogni filtro attivo fornisce l'insieme degli ID che lo soddisfano
+        insiemi = []
+        if stato:
+            insiemi.append(self.indici.per_stato.get(stato, set()))
+        if tipo:
+            insiemi.append(self.indici.per_tipo.get(tipo, set()))
+        clienti = alternative_cliente(cliente)
+        if len(clienti) == 1:
+            insiemi.append(self.indici.clienti_che_contengono(clienti[0]))
+        elif clienti:
+            insiemi.append(set().union(*(self.indici.clienti_che_contengono(alternativa)
+                                         for alternativa in clienti)))
+        if termine_ricerca:
+            insiemi.append(self.indice_testo.cerca(termine_ricerca))
+
+        if not insiemi:
+            return self.indici.ids_per_data()
+
+        # Si scorre l'insieme più piccolo: il costo dipende dal numero di risultati
+        insiemi.sort(key=len)
+        ids = insiemi[0]
+        for altro in insiemi[1:]:
+            ids = ids & altro
+        return self.indici.ordina_per_data(ids)
+
+    def cerca_nell_archivio(self, termine_ricerca: str = "",
+                            stato: Optional[StatoRiparazione] = None,
+                            cliente="", tipo: Optional[TipoIntervento] = None) -> List[RichiestaRiparazione]:
+        """Le richieste dell'archivio freddo che soddisfano i filtri, dalla più recente.
+
+        L'archivio non è indicizzato: lettura sequenziale del segmento. Può
+        girare in un altro thread mentre si continua a modificare l'archivio.
+        """
+        if self.archivio_freddo is None:
+            return []
+        return self._filtra_richieste(self.archivio_freddo.scorri(), termine_ricerca, stato, cliente, tipo)
+
+    @staticmethod
+    def _filtra_richieste(richieste, termine_ricerca: str = "",
+                          stato: Optional[StatoRiparazione] = None,
+                          cliente="", tipo: Optional[TipoIntervento] = None) -> List[RichiestaRiparazione]:
+        """Scansione lineare con tutti i filtri, ordinata dalla richiesta più recente"""
 
         risultati = []
+        clienti = alternative_cliente(cliente)
 
-        for richiesta in self.richieste.values():
+        for richiesta in richieste:
             match = True
 
             # Filtra per termine di ricerca
@@ -212,8 +4372,8 @@ class SistemaGestioneRiparazioni:
             if stato and richiesta.stato != stato:
                 match = False
 
-            # Filtra per cliente
-            if cliente and cliente.lower() not in richiesta.pezzo.cliente.lower():
+            # Filtra per cliente (basta una delle alternative)
+            if clienti and not any(alternativa in richiesta.pezzo.cliente.lower() for alternativa in clienti):
                 match = False
 
             # Filtra per tipo intervento
@@ -227,26 +4387,62 @@ class SistemaGestioneRiparazioni:
         risultati.sort(key=lambda r: r.data_richiesta, reverse=True)
         return risultati
 
-    def aggiorna_richiesta(self, id_richiesta: str, **kwargs) -> bool:
-        """Aggiorna i dati di una richiesta"""
+    @strumentato("aggiorna_richiesta")
+    def aggiorna_richiesta(self, id_richiesta: str, versione_attesa: Optional[int] = None,
+                           **kwargs) -> bool:
+        """Aggiorna i dati di una richiesta.
+
+        Con `versione_attesa` la modifica viene applicata solo se la richiesta è
+        ancora alla versione letta dal chiamante; altrimenti solleva
+        ConflittoVersione senza toccare nulla.
+        """
+        if self._fuori_transazione():
+            with self._transazione():
+                return self.aggiorna_richiesta(id_richiesta, versione_attesa, **kwargs)
+        self._verifica_caricamento()
+        if self.archivio_sqlite and self.condiviso:
+            # Un altro processo può aver modificato la riga: si rilegge quella sola
+            self.richieste.dimentica(id_richiesta)
+
         if id_richiesta not in self.richieste:
             return False
 
         richiesta = self.richieste[id_richiesta]
+        if versione_attesa is not None and richiesta.versione != versione_attesa:
+            raise ConflittoVersione(id_richiesta, versione_attesa, richiesta.versione)
+        prima = self._valori_per_evento(richiesta) if self.eventi_attivi else None
+        campi = {}
 
         if 'stato' in kwargs:
             richiesta.aggiorna_stato(kwargs['stato'])
+            campi['stato'] = richiesta.stato.value
+            campi['data_completamento'] = (richiesta.data_completamento.isoformat()
+                                           if richiesta.data_completamento else None)
         if 'tecnico_assegnato' in kwargs:
             richiesta.tecnico_assegnato = kwargs['tecnico_assegnato']
+            campi['tecnico_assegnato'] = richiesta.tecnico_assegnato
         if 'costo_stimato' in kwargs:
             richiesta.costo_stimato = float(kwargs['costo_stimato'])
+            campi['costo_stimato'] = richiesta.costo_stimato
         if 'costo_finale' in kwargs:
             richiesta.costo_finale = float(kwargs['costo_finale'])
+            campi['costo_finale'] = richiesta.costo_finale
         if 'nota' in kwargs:
             tecnico = kwargs.get('tecnico_nota', '')
             richiesta.aggiungi_nota(kwargs['nota'], tecnico)
+            campi['nota'] = richiesta.note_tecniche[-1].to_dict()
+        richiesta.versione += 1
+        campi['versione'] = richiesta.versione
 
-        self.salva_dati()
+        # Una richiesta archiviata che viene modificata torna tra le attive
+        self.richieste[id_richiesta] = richiesta
+        if self.archivio_sqlite:
+            self.pezzi[richiesta.pezzo.id_pezzo] = richiesta.pezzo
+        else:
+            richiesta.pezzo = self.pezzi.setdefault(richiesta.pezzo.id_pezzo, richiesta.pezzo)
+        self._indicizza(richiesta)
+        evento = self._evento_modifica(richiesta, prima, campi) if prima is not None else None
+        self._persisti({'op': 'aggiorna', 'id': id_richiesta, 'campi': campi}, evento)
         return True
 
     def stampa_richiesta(self, richiesta: RichiestaRiparazione):
@@ -282,8 +4478,142 @@ class SistemaGestioneRiparazioni:
                 print(f"    {nota['nota']}")
 
 
-def menu_principale():
-    sistema = SistemaGestioneRiparazioni()
+def migra_json_in_sqlite(file_json: str, file_db: str) -> int:
+    """Copia in un database SQLite tutte le richieste di un archivio JSON (snapshot + journal)"""
+    sistema_json = SistemaGestioneRiparazioni(file_json)
+    archivio = ArchivioSQLite(file_db)
+    try:
+        inserite = archivio.inserisci_molte(sistema_json.richieste.values())
+        with archivio.connessione:
+            archivio.connessione.executemany(
+                "INSERT OR REPLACE INTO sequenze VALUES (?, ?)",
+                sistema_json.sequenze.contatori.items())
+        return inserite
+    finally:
+        archivio.chiudi()
+
+
+def converti_snapshot(origine: str, destinazione: str) -> int:
+    """Riscrive uno snapshot (con il suo journal) nel formato indicato dall'estensione di destinazione"""
+    sistema = SistemaGestioneRiparazioni(origine, journal=True)
+    if sistema.caricamento_fallito:
+        raise ValueError(f"{origine} non è stato caricato correttamente")
+    sistema.file_dati = destinazione
+    sistema.formato_colonnare = destinazione.endswith(ESTENSIONE_COLONNARE)
+    # Un archivio diviso in shard viene riunito in un solo file
+    sistema.shard = None
+    sistema.scrivi_snapshot(sistema.prepara_snapshot())
+    return len(sistema.richieste)
+
+
+def _ids_record(record: dict) -> List[str]:
+    """Le richieste toccate da un record del journal"""
+    if record['op'] == 'crea':
+        return [record['richiesta']['id_richiesta']]
+    if record['op'] == 'unisci':
+        return list(record['pezzi'])
+    return [record['id']]
+
+
+def _cerca_in_shard(percorso: str, filtri: tuple, escluse: set) -> tuple:
+    """Le richieste di uno shard che soddisfano i filtri, tranne quelle in `escluse`,
+    le richieste escluse presenti nello shard e il seq del journal consolidato"""
+    richieste, seq_journal, _ = _richieste_da_file_shard(percorso, True)
+    toccate = [richiesta for richiesta in richieste if richiesta.id_richiesta in escluse]
+    if toccate:
+        richieste = [richiesta for richiesta in richieste if richiesta.id_richiesta not in escluse]
+    return SistemaGestioneRiparazioni._filtra_richieste(richieste, *filtri), toccate, seq_journal
+
+
+def _cerca_in_file_shard(percorso: str, filtri: tuple, escluse: set) -> tuple:
+    """Eseguita in un processo separato: _cerca_in_shard() con i risultati in formato colonnare"""
+    risultati, toccate, seq_journal = _cerca_in_shard(percorso, filtri, escluse)
+    contenuto = io.BytesIO()
+    SnapshotColonnare.scrivi(contenuto, SnapshotColonnare.prepara(risultati, {}))
+    return contenuto.getvalue(), [richiesta.to_dict(con_versione=True) for richiesta in toccate], seq_journal
+
+
+def cerca_negli_shard(file_dati: str, termine_ricerca: str = "",
+                      stato: Optional[StatoRiparazione] = None, cliente="",
+                      tipo: Optional[TipoIntervento] = None,
+                      processi: Optional[int] = None) -> List[RichiestaRiparazione]:
+    """Cerca direttamente nei file di un archivio diviso in shard, senza caricarlo.
+
+    Ogni shard viene filtrato in un processo separato; i risultati tornano
+    uniti dalla richiesta più recente, come con cerca_richieste(). Le
+    richieste toccate da record del journal non ancora compattati vengono
+    aggiornate e filtrate nel processo principale, così i risultati sono gli
+    stessi di un sistema che ha caricato l'archivio. Serve a chi non tiene
+    l'archivio in memoria (script, report): un sistema già caricato cerca
+    più in fretta con i propri indici.
+    """
+    with open(file_dati, 'r', encoding='utf-8') as f:
+        indice = json.load(f)
+    if 'shard' not in indice:
+        raise ValueError(f"{file_dati} non è un archivio diviso in shard")
+    cartella = os.path.dirname(file_dati)
+    percorsi = [os.path.join(cartella, nome) for nome in indice['shard']['file'].values()]
+    filtri = (termine_ricerca, stato, cliente, tipo)
+
+    # Il journal viene solo letto: un'eventuale riga troncata in coda resta dov'è
+    record_journal = [record for record in JournalModifiche(file_dati + ".journal").leggi(ripara=False)
+                      if record['seq'] > indice.get('seq_journal', 0)]
+    escluse = {id_richiesta for record in record_journal for id_richiesta in _ids_record(record)}
+
+    processi = min(processi or os.cpu_count() or 1, len(percorsi))
+    if processi > 1:
+        with ProcessPoolExecutor(processi) as esecutore:
+            letti = esecutore.map(_cerca_in_file_shard, percorsi, [filtri] * len(percorsi),
+                                  [escluse] * len(percorsi))
+            gruppi = []
+            for percorso, (contenuto, toccate, seq_journal) in zip(percorsi, letti):
+                with SnapshotColonnare(percorso, contenuto) as snapshot:
+                    gruppi.append((list(snapshot.richieste()),
+                                   [RichiestaRiparazione.from_dict(dati) for dati in toccate], seq_journal))
+    else:
+        gruppi = [_cerca_in_shard(percorso, filtri, escluse) for percorso in percorsi]
+
+    # Richieste toccate dal journal, con il seq già consolidato nel loro shard
+    toccate: Dict[str, RichiestaRiparazione] = {}
+    seq_consolidato: Dict[str, int] = {}
+    for _, richieste, seq_journal in gruppi:
+        for richiesta in richieste:
+            toccate[richiesta.id_richiesta] = richiesta
+            seq_consolidato[richiesta.id_richiesta] = seq_journal
+    for record in record_journal:
+        if record['op'] == 'unisci':
+            for id_richiesta, dati_pezzo in record['pezzi'].items():
+                if id_richiesta in toccate:
+                    toccate[id_richiesta].pezzo = Pezzo.from_dict(dati_pezzo)
+            continue
+        id_richiesta = _ids_record(record)[0]
+        if record['seq'] <= seq_consolidato.get(id_richiesta, 0):
+            # Già scritto nello shard da un salvataggio interrotto prima dell'indice
+            continue
+        if record['op'] == 'crea':
+            toccate[id_richiesta] = RichiestaRiparazione.from_dict(record['richiesta'])
+        elif id_richiesta in toccate:
+            SistemaGestioneRiparazioni._applica_campi(toccate[id_richiesta], record['campi'])
+
+    risultati = [gruppo[0] for gruppo in gruppi]
+    risultati.append(SistemaGestioneRiparazioni._filtra_richieste(toccate.values(), *filtri))
+    return list(heapq.merge(*risultati, key=lambda r: r.data_richiesta, reverse=True))
+
+
+def stampa_avanzamento(letti: int, totale: int):
+    if totale > 5_000_000:
+        print(f"\rCaricamento dati: {letti * 100 // totale:3d}%", end="" if letti < totale else "\n")
+
+
+def menu_principale(journal: bool = False, archivio_freddo: bool = False, condiviso: bool = False):
+    """Menu interattivo. Senza opzioni l'archivio resta un solo riparazioni.json
+    riscritto a ogni modifica; journal, archivio freddo e modalità condivisa
+    creano file accanto ad esso e vanno chiesti esplicitamente."""
+    sistema = SistemaGestioneRiparazioni(journal=journal, caricamento_tollerante=True,
+                                         avanzamento_caricamento=stampa_avanzamento,
+                                         archivio_freddo=archivio_freddo, condiviso=condiviso)
+    if sistema.voci_scartate:
+        print(f"⚠️ {len(sistema.voci_scartate)} richieste non valide sono state saltate")
 
     while True:
         print(f"\n{'=' * 60}")
@@ -294,10 +4624,21 @@ def menu_principale():
         print("3. Visualizza tutte le richieste")
         print("4. Aggiorna richiesta")
         print("5. Statistiche")
+        print("6. Importa richieste da file (CSV/JSONL)")
+        print("7. Prossimo lavoro per tecnico")
+        print("8. Assegna le richieste non assegnate")
+        print("9. Storico apparato (numero di serie)")
+        print("10. Unisci i pezzi duplicati")
+        print("11. Diagnostica prestazioni")
         print("0. Esci")
         print(f"{'=' * 60}")
 
         scelta = input("Seleziona un'opzione: ").strip()
+        # Le altre postazioni possono aver modificato l'archivio nel frattempo
+        sistema.aggiorna_da_disco()
+        if sistema.caricamento_fallito and scelta in ("1", "4", "6", "7", "8", "10"):
+            print(f"❌ {sistema.file_dati} non è stato caricato correttamente: modifiche non consentite")
+            continue
 
         if scelta == "1":
             crea_nuova_richiesta(sistema)
@@ -309,22 +4650,62 @@ def menu_principale():
             aggiorna_richiesta_menu(sistema)
         elif scelta == "5":
             mostra_statistiche(sistema)
+        elif scelta == "6":
+            importa_richieste_menu(sistema)
+        elif scelta == "7":
+            prossimo_lavoro_menu(sistema)
+        elif scelta == "8":
+            assegna_lavori_menu(sistema)
+        elif scelta == "9":
+            storico_apparato_menu(sistema)
+        elif scelta == "10":
+            unisci_pezzi_menu(sistema)
+        elif scelta == "11":
+            diagnostica_menu(sistema)
         elif scelta == "0":
+            if sistema.usa_journal:
+                sistema.compatta_journal()
             print("Arrivederci!")
             break
         else:
             print("Opzione non valida!")
 
 
+def chiedi_nome(sistema: SistemaGestioneRiparazioni, campo: str, domanda: str) -> str:
+    """Chiede un cliente, modello o nome di pezzo e propone quelli già in archivio se è scritto diversamente"""
+    valore = input(domanda).strip()
+    if not valore:
+        return valore
+    simili = sistema.suggerisci_nomi(campo, valore, limite=3)
+    if not simili:
+        return valore
+    if simili[0][1] == 0:
+        # Stesso valore a meno di maiuscole e spazi: si usa la grafia già registrata
+        return simili[0][0]
+    print("   Forse intendevi:")
+    for i, (simile, _, volte) in enumerate(simili, 1):
+        print(f"   {i}. {simile} ({volte} richieste)")
+    scelta = input(f"   Scegli 1-{len(simili)} o premi Invio per tenere \"{valore}\": ").strip()
+    if scelta.isdigit() and 1 <= int(scelta) <= len(simili):
+        return simili[int(scelta) - 1][0]
+    return valore
+
+
 def crea_nuova_richiesta(sistema: SistemaGestioneRiparazioni):
     print(f"\n{'=' * 40}")
     print("📝 NUOVA RICHIESTA DI RIPARAZIONE")
     print(f"{'=' * 40}")
 
-    nome_pezzo = input("Nome del pezzo: ").strip()
-    modello = input("Modello: ").strip()
+    nome_pezzo = chiedi_nome(sistema, 'nome', "Nome del pezzo: ")
+    modello = chiedi_nome(sistema, 'modello', "Modello: ")
     numero_serie = input("Numero di serie: ").strip()
-    cliente = input("Cliente: ").strip()
+    precedenti = sistema.registro_dispositivi.richieste_di(modello, numero_serie)
+    if precedenti:
+        ultima = sistema.richieste[precedenti[-1]]
+        print(f"ℹ️ Apparato già in archivio: {len(precedenti)} richieste precedenti, "
+              f"l'ultima {ultima.id_richiesta} del {ultima.data_richiesta.strftime('%d/%m/%Y')} "
+              f"({ultima.pezzo.cliente})")
+    cliente = chiedi_nome(sistema, 'cliente', "Cliente: ")
     descrizione = input("Descrizione del problema: ").strip()
 
     print("\nTipi di intervento disponibili:")
@@ -347,10 +4728,17 @@ def crea_nuova_richiesta(sistema: SistemaGestioneRiparazioni):
     scelta_priorita = input("Priorità (default Media): ").strip()
     priorita = priorita_map.get(scelta_priorita, "Media")
 
-    id_richiesta = sistema.crea_richiesta_riparazione(
-        nome_pezzo, modello, numero_serie, cliente,
-        descrizione, tipo_intervento, priorita
-    )
+    try:
+        id_richiesta = sistema.crea_richiesta_riparazione(
+            nome_pezzo, modello, numero_serie, cliente,
+            descrizione, tipo_intervento, priorita, riusa_pezzo=True
+        )
+    except ErroreSalvataggio as e:
+        print(f"❌ {e}")
+        return
+    pezzo = sistema.richieste[id_richiesta].pezzo
+    if pezzo.nome.strip().casefold() != nome_pezzo.strip().casefold():
+        print(f"ℹ️ Apparato già registrato come '{pezzo.nome}' ({pezzo.id_pezzo}): si usa quel pezzo")
 
     print(f"\n✅ Richiesta creata con successo!")
     print(f"ID Richiesta: {id_richiesta}")
@@ -374,7 +4762,18 @@ def cerca_richieste_menu(sistema: SistemaGestioneRiparazioni):
     if scelta_stato.isdigit() and 1 <= int(scelta_stato) <= len(StatoRiparazione):
         stato_filtro = list(StatoRiparazione)[int(scelta_stato) - 1]
 
-    risultati = sistema.cerca_richieste(termine, stato_filtro, cliente)
+    tolleranza_refusi = False
+    if cliente:
+        risposta = input("Includere i clienti scritti in modo simile? (s/N): ").strip().lower()
+        tolleranza_refusi = risposta == 's'
+
+    includi_archivio = False
+    if sistema.archivio_freddo and len(sistema.archivio_freddo):
+        risposta = input("Includere le richieste chiuse archiviate? (s/N): ").strip().lower()
+        includi_archivio = risposta == 's'
+
+    risultati = sistema.cerca_richieste(termine, stato_filtro, cliente, includi_archivio=includi_archivio,
+                                        tolleranza_refusi=tolleranza_refusi)
 
     if not risultati:
         print("\n❌ Nessuna richiesta trovata con i criteri specificati.")
@@ -396,8 +4795,7 @@ def visualizza_tutte_richieste(sistema: SistemaGestioneRiparazioni):
         print("\n❌ Nessuna richiesta presente nel sistema.")
         return
 
-    richieste = list(sistema.richieste.values())
-    richieste.sort(key=lambda r: r.data_richiesta, reverse=True)
+    richieste = sistema.richieste_per_data()
 
     print(f"\n📋 TUTTE LE RICHIESTE ({len(richieste)} totali)")
     print(f"{'=' * 80}")
@@ -428,6 +4826,18 @@ def aggiorna_richiesta_menu(sistema: SistemaGestioneRiparazioni):
 
     richiesta = sistema.richieste[id_richiesta]
     print(f"\nRichiesta corrente: {richiesta.pezzo.nome} - {richiesta.stato.value}")
+    versione = richiesta.versione
+
+    def aggiorna(**campi) -> bool:
+        # Se un'altra postazione ha modificato la richiesta nel frattempo, non la sovrascrive
+        try:
+            return sistema.aggiorna_richiesta(id_richiesta, versione_attesa=versione, **campi)
+        except ConflittoVersione as e:
+            print(f"❌ {e}: riaprire la richiesta e riprovare")
+            return False
+        except ErroreSalvataggio as e:
+            print(f"❌ {e}")
+            return False
 
     print("\nCosa vuoi aggiornare?")
     print("1. Stato")
@@ -449,8 +4859,8 @@ def aggiorna_richiesta_menu(sistema: SistemaGestioneRiparazioni):
                 scelta_stato = int(input("Seleziona nuovo stato: "))
                 if 1 <= scelta_stato <= len(StatoRiparazione):
                     nuovo_stato = list(StatoRiparazione)[scelta_stato - 1]
-                    sistema.aggiorna_richiesta(id_richiesta, stato=nuovo_stato)
-                    print(f"✅ Stato aggiornato a: {nuovo_stato.value}")
+                    if aggiorna(stato=nuovo_stato):
+                        print(f"✅ Stato aggiornato a: {nuovo_stato.value}")
                     break
                 else:
                     print("Scelta non valida!")
@@ -459,30 +4869,186 @@ def aggiorna_richiesta_menu(sistema: SistemaGestioneRiparazioni):
 
     elif scelta == "2":
         tecnico = input("Nome tecnico: ").strip()
-        sistema.aggiorna_richiesta(id_richiesta, tecnico_assegnato=tecnico)
-        print(f"✅ Tecnico assegnato: {tecnico}")
+        if aggiorna(tecnico_assegnato=tecnico):
+            print(f"✅ Tecnico assegnato: {tecnico}")
 
     elif scelta == "3":
         try:
             costo = float(input("Costo stimato (€): "))
-            sistema.aggiorna_richiesta(id_richiesta, costo_stimato=costo)
-            print(f"✅ Costo stimato aggiornato: €{costo:.2f}")
+            if aggiorna(costo_stimato=costo):
+                print(f"✅ Costo stimato aggiornato: €{costo:.2f}")
         except ValueError:
             print("❌ Valore non valido!")
 
     elif scelta == "4":
         try:
             costo = float(input("Costo finale (€): "))
-            sistema.aggiorna_richiesta(id_richiesta, costo_finale=costo)
-            print(f"✅ Costo finale aggiornato: €{costo:.2f}")
+            if aggiorna(costo_finale=costo):
+                print(f"✅ Costo finale aggiornato: €{costo:.2f}")
         except ValueError:
             print("❌ Valore non valido!")
 
     elif scelta == "5":
         nota = input("Nota tecnica: ").strip()
         tecnico = input("Nome tecnico (opzionale): ").strip()
-        sistema.aggiorna_richiesta(id_richiesta, nota=nota, tecnico_nota=tecnico)
-        print("✅ Nota aggiunta!")
+        if aggiorna(nota=nota, tecnico_nota=tecnico):
+            print("✅ Nota aggiunta!")
+
+
+def importa_richieste_menu(sistema: SistemaGestioneRiparazioni):
+    print(f"\n{'=' * 40}")
+    print("📥 IMPORTAZIONE RICHIESTE")
+    print(f"{'=' * 40}")
+    print("Colonne: nome_pezzo, modello, numero_serie, cliente, descrizione_problema,")
+    print("tipo_intervento, priorita (opz.), tecnico_assegnato (opz.), costo_stimato (opz.)")
+
+    percorso = input("Percorso del file CSV o JSONL: ").strip().strip('"')
+    if not os.path.exists(percorso):
+        print("❌ File non trovato!")
+        return
+
+    esito = sistema.importa_richieste(percorso)
+    print(f"\n✅ {esito.riepilogo()}")
+    for numero, messaggio in esito.errori[:20]:
+        print(f"  ❌ Riga {numero}: {messaggio}")
+    if len(esito.errori) > 20:
+        print(f"  ... e altre {len(esito.errori) - 20} righe con errori")
+
+
+def prossimo_lavoro_menu(sistema: SistemaGestioneRiparazioni):
+    print(f"\n{'=' * 40}")
+    print("👷 PROSSIMO LAVORO")
+    print(f"{'=' * 40}")
+
+    tecnico = input("Nome tecnico: ").strip()
+    if not tecnico:
+        print("❌ Il nome del tecnico è obbligatorio!")
+        return
+
+    richiesta = sistema.prossimo_lavoro(tecnico, prendi_in_carico=False)
+    if richiesta is None:
+        print("✅ Nessun lavoro in attesa.")
+        return
+
+    sistema.stampa_richiesta(richiesta)
+    if input("Iniziare questo lavoro? (s/N): ").strip().lower() == 's':
+        try:
+            sistema.aggiorna_richiesta(richiesta.id_richiesta, tecnico_assegnato=tecnico,
+                                       stato=StatoRiparazione.IN_LAVORAZIONE)
+        except ErroreSalvataggio as e:
+            print(f"❌ {e}")
+            return
+        print(f"✅ {richiesta.id_richiesta} in lavorazione da {tecnico}")
+
+
+def assegna_lavori_menu(sistema: SistemaGestioneRiparazioni):
+    print(f"\n{'=' * 40}")
+    print("📋 ASSEGNAZIONE AUTOMATICA")
+    print(f"{'=' * 40}")
+
+    noti = sorted(tecnico for tecnico, carico in sistema.coda_lavori.carico.items() if carico)
+    suggeriti = f" [{', '.join(noti)}]" if noti else ""
+    risposta = input(f"Tecnici disponibili, separati da virgola{suggeriti}: ").strip()
+    tecnici = [tecnico.strip() for tecnico in risposta.split(",") if tecnico.strip()] if risposta else noti
+    if not tecnici:
+        print("❌ Nessun tecnico indicato!")
+        return
+
+    try:
+        assegnati = sistema.assegna_lavori(tecnici)
+    except ErroreSalvataggio as e:
+        print(f"❌ {e}")
+        return
+    if not assegnati:
+        print("✅ Nessuna richiesta da assegnare.")
+        return
+    print(f"✅ Assegnate {len(assegnati)} richieste:")
+    for tecnico in tecnici:
+        print(f"  👷 {tecnico}: {sum(1 for _, t in assegnati if t == tecnico)} nuove, "
+              f"{sistema.coda_lavori.carico.get(tecnico, 0)} aperte in totale")
+
+
+def storico_apparato_menu(sistema: SistemaGestioneRiparazioni):
+    print(f"\n{'=' * 40}")
+    print("🗂️ STORICO APPARATO")
+    print(f"{'=' * 40}")
+
+    numero_serie = input("Numero di serie: ").strip()
+    modello = input("Modello (vuoto = tutti): ").strip() or None
+    richieste = sistema.storico_apparato(numero_serie, modello)
+    if not richieste:
+        print("❌ Nessuna richiesta per questo apparato.")
+        return
+    print(f"\n{len(richieste)} richieste:")
+    for richiesta in richieste:
+        print(f"  {richiesta.data_richiesta.strftime('%d/%m/%Y')}  {richiesta.id_richiesta}  "
+              f"{richiesta.pezzo.modello}  {richiesta.stato.value:<18} {richiesta.descrizione_problema}")
+
+    ripetuti = sistema.registro_dispositivi.guasti_ripetuti()[:10]
+    if ripetuti:
+        print("\nAPPARATI CON PIÙ RIENTRI ENTRO 90 GIORNI:")
+        for modello, numero_serie, totale, rientri, minimo in ripetuti:
+            print(f"  🔁 {modello} S/N {numero_serie}: {rientri} rientri su {totale} richieste "
+                  f"(il più rapido dopo {minimo} giorni)")
+
+
+def unisci_pezzi_menu(sistema: SistemaGestioneRiparazioni):
+    conferma = input("Unire i pezzi duplicati dello stesso apparato e cliente? (s/N): ").strip().lower()
+    if conferma != "s":
+        return
+    try:
+        uniti = sistema.unisci_pezzi_duplicati()
+    except ErroreSalvataggio as e:
+        print(f"❌ {e}")
+        return
+    print(f"✅ {uniti} pezzi duplicati uniti." if uniti else "✅ Nessun pezzo duplicato.")
+
+
+def diagnostica_menu(sistema: SistemaGestioneRiparazioni):
+    strumentazione = sistema.strumentazione
+    print(f"\n{'=' * 60}")
+    print("⏱️  DIAGNOSTICA PRESTAZIONI")
+    print(f"{'=' * 60}")
+    print(f"Misure: {'attive' if strumentazione.attiva else 'spente'} - "
+          f"soglia operazioni lente: {strumentazione.soglia_lenta_ms:.0f} ms")
+
+    riepilogo = strumentazione.riepilogo()
+    if riepilogo['operazioni']:
+        print(f"\n{'operazione':<28} {'n':>7} {'media ms':>9} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>9}")
+        for operazione, misure in riepilogo['operazioni'].items():
+            print(f"{operazione:<28} {misure['conteggio']:>7} {misure['media_ms']:>9.2f} "
+                  f"{misure['p90_ms']:>8.2f} {misure['p99_ms']:>8.2f} {misure['max_ms']:>9.2f}")
+    for destinazione, quantita in riepilogo['byte_scritti'].items():
+        print(f"Byte scritti ({destinazione}): {quantita:,}")
+    if riepilogo['operazioni_lente']:
+        print("\nUltime operazioni lente:")
+        for voce in riepilogo['operazioni_lente'][-5:]:
+            print(f"  [{voce['quando']}] {voce['operazione']} {voce['ms']:.0f} ms {voce['parametri']}")
+
+    print("\n1. Attiva/disattiva le misure")
+    print("2. Cambia la soglia delle operazioni lente")
+    print("3. Avvia/ferma il profilo (a campionamento, per flamegraph)")
+    print("4. Azzera le misure")
+    print("0. Indietro")
+    scelta = input("Scegli: ").strip()
+    if scelta == "1":
+        strumentazione.attiva = not strumentazione.attiva
+        print(f"✅ Misure {'attivate' if strumentazione.attiva else 'disattivate'}")
+    elif scelta == "2":
+        try:
+            strumentazione.soglia_lenta_ms = float(input("Soglia in ms: "))
+        except ValueError:
+            print("❌ Soglia non valida!")
+    elif scelta == "3":
+        if strumentazione.profilo_in_corso:
+            percorso = strumentazione.ferma_profilo(sistema.file_dati + ".folded")
+            print(f"✅ Profilo scritto in {percorso}")
+        else:
+            strumentazione.avvia_profilo("campionamento")
+            print("✅ Profilo avviato: torna qui per fermarlo")
+    elif scelta == "4":
+        strumentazione.azzera()
+        print("✅ Misure azzerate")
 
 
 def mostra_statistiche(sistema: SistemaGestioneRiparazioni):
@@ -494,36 +5060,53 @@ def mostra_statistiche(sistema: SistemaGestioneRiparazioni):
     print("📊 STATISTICHE SISTEMA")
     print(f"{'=' * 50}")
 
-    # Conteggio per stato
-    stati_count = {}
-    for richiesta in sistema.richieste.values():
-        stato = richiesta.stato.value
-        stati_count[stato] = stati_count.get(stato, 0) + 1
+    statistiche = sistema.statistiche
 
+    # Conteggio per stato
     print("RICHIESTE PER STATO:")
-    for stato, count in stati_count.items():
-        print(f"  📍 {stato}: {count}")
+    for stato, gruppo in statistiche.per_stato.items():
+        print(f"  📍 {stato.value}: {gruppo.conteggio}")
 
     # Conteggio per tipo intervento
-    tipi_count = {}
-    for richiesta in sistema.richieste.values():
-        tipo = richiesta.tipo_intervento.value
-        tipi_count[tipo] = tipi_count.get(tipo, 0) + 1
-
     print("\nRICHIESTE PER TIPO INTERVENTO:")
-    for tipo, count in tipi_count.items():
-        print(f"  🔧 {tipo}: {count}")
+    for tipo, gruppo in statistiche.per_tipo.items():
+        print(f"  🔧 {tipo.value}: {gruppo.conteggio}")
 
     # Statistiche sui costi
-    costi_finali = [r.costo_finale for r in sistema.richieste.values() if r.costo_finale > 0]
-    if costi_finali:
+    totale = statistiche.totale
+    if totale.fatturate:
         print(f"\nSTATISTICHE COSTI:")
-        print(f"  💰 Costo medio: €{sum(costi_finali) / len(costi_finali):.2f}")
-        print(f"  💰 Costo totale: €{sum(costi_finali):.2f}")
-        print(f"  📊 Riparazioni fatturate: {len(costi_finali)}")
+        print(f"  💰 Costo medio: €{totale.media:.2f}")
+        print(f"  💰 Costo totale: €{totale.somma:.2f}")
+        print(f"  💰 Costo minimo / massimo: €{totale.minimo:.2f} / €{totale.massimo:.2f}")
+        print(f"  📊 Riparazioni fatturate: {totale.fatturate}")
+
+    tecnici = {tecnico: gruppo for tecnico, gruppo in statistiche.per_tecnico.items() if tecnico}
+    if tecnici:
+        print("\nRICHIESTE PER TECNICO:")
+        for tecnico, gruppo in sorted(tecnici.items()):
+            fatturato = f" | fatturato €{gruppo.somma:.2f}" if gruppo.fatturate else ""
+            print(f"  👷 {tecnico}: {gruppo.conteggio}{fatturato}")
+
+    if statistiche.tempi_per_tipo:
+        print("\nTEMPI DI LAVORAZIONE (ore, p50 / p90 / p99):")
+        for tipo in statistiche.tempi_per_tipo:
+            p50, p90, p99 = statistiche.quantili_lavorazione(tipo).values()
+            print(f"  ⏱️ {tipo.value}: {p50:.1f} / {p90:.1f} / {p99:.1f}")
 
     print(f"\nTOTALE RICHIESTE: {len(sistema.richieste)}")
 
 
 if __name__ == "__main__":
-    menu_principale()
\ No newline at end of file
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Sistema gestione riparazioni")
+    parser.add_argument("--journal", action="store_true",
+                        help="accoda le modifiche a riparazioni.json.journal invece di riscrivere il file")
+    parser.add_argument("--archivio-freddo", action="store_true",
+                        help="sposta le richieste consegnate o annullate in riparazioni.json.freddo")
+    parser.add_argument("--condiviso", action="store_true",
+                        help="più postazioni sullo stesso file (journal con lock e versioni)")
+    argomenti = parser.parse_args()
+    menu_principale(journal=argomenti.journal, archivio_freddo=argomenti.archivio_freddo,
+                    condiviso=argomenti.condiviso)
\ No newline at end of file
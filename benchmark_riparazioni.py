@@ -0,0 +1,873 @@
+"""Benchmark del gestionale riparazioni su archivi sintetici.
+
+Uso:
+    python benchmark_riparazioni.py ricerca [--dimensioni 10000 100000 1000000]
+    python benchmark_riparazioni.py memoria [--dimensioni 10000 100000]
+    python benchmark_riparazioni.py avvio [--dimensioni 10000 100000 1000000]
+    python benchmark_riparazioni.py report [--dimensioni 100000 1000000]
+    python benchmark_riparazioni.py refusi [--nomi 100000] [--ricerche 500]
+    python benchmark_riparazioni.py coda [--dimensione 100000] [--passi 20000]
+    python benchmark_riparazioni.py servizio [--dimensione 100000] [--connessioni 32] [--durata 10]
+                                             [--indirizzo 127.0.0.1:8080]
+    python benchmark_riparazioni.py suite [--dimensioni 1000 10000 100000 1000000] [--journal]
+                                          [--risultati suite.json] [--riferimento riferimento.json]
+                                          [--tolleranza 0.25] [--aggiorna-riferimento]
+    python benchmark_riparazioni.py shard [--dimensioni 100000 1000000] [--criterio hash] [--numero-shard 16]
+                                          [--processi N]
+
+La suite misura tempo e picco di memoria di carica_dati, salva_dati, crea,
+aggiorna, cerca_richieste, generazione degli ID e statistiche; con
+--riferimento esce con codice 1 se qualche misura è peggiorata.
+"""
+import argparse
+import asyncio
+import contextlib
+import datetime
+import gc
+import io
+import json
+import os
+import platform
+import random
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from typing import List
+from urllib.parse import urlencode
+
+from report_riparazioni import MotoreReport, np
+from Gestionale_riparazioni_azienda import (
+    SistemaGestioneRiparazioni, RichiestaRiparazione, Pezzo, SnapshotColonnare,
+    StatoRiparazione, TipoIntervento, CODICE_PRIORITA, PESO_TIPO, converti_snapshot,
+    IndiceApprossimato, StatisticheIncrementali, distanza_modifica, cerca_negli_shard
+)
+
+CLIENTI = ["Merani", "Cremonesi", "Bianchi", "Rossi", "Ferrari", "Esposito", "Romano",
+           "Colombo", "Ricci", "Marino", "Greco", "Bruno", "Gallo", "Conti", "De Luca",
+           "Mancini", "Costa", "Giordano", "Rizzo", "Lombardi", "Moretti", "Barbieri"]
+PEZZI = [("kp 832", "kp 832"), ("pannello interfonico", "kp 12"), ("centralino", "cx 400"),
+         ("cuffia", "hs 20"), ("tastiera", "kp 832"), ("alimentatore", "pw 75"),
+         ("modulo audio", "am 3"), ("display", "ds 7"), ("scheda di rete", "nx 10")]
+PROBLEMI = ["tasti {} e {} rotti", "non funziona l'audio della cuffia", "display spento",
+            "non si accende", "rumore di fondo sul canale {}", "connettore {} danneggiato",
+            "firmware da aggiornare", "retroilluminazione difettosa", "surriscaldamento"]
+TECNICI = ["", "", "Marco", "Giulia", "Luca", "Sara"]
+PRIORITA = ["Bassa", "Media", "Media", "Alta", "Urgente"]
+
+
+def genera_richieste(n: int, seme: int = 42):
+    """Genera n richieste con la stessa forma di riparazioni.json"""
+    rnd = random.Random(seme)
+    stati = list(StatoRiparazione)
+    tipi = list(TipoIntervento)
+    inizio = datetime.datetime(2023, 1, 1)
+    for i in range(n):
+        nome, modello = rnd.choice(PEZZI)
+        data = inizio + datetime.timedelta(seconds=rnd.randrange(3 * 365 * 86400),
+                                           microseconds=rnd.randrange(1000000))
+        giorno = data.strftime("%Y%m%d")
+        pezzo = Pezzo(f"PZ{giorno}{i:07d}", nome, modello,
+                      str(rnd.randrange(1000000, 9999999)), rnd.choice(CLIENTI))
+        pezzo.data_creazione = data
+        problema = rnd.choice(PROBLEMI).format(rnd.randrange(10), rnd.randrange(10))
+        richiesta = RichiestaRiparazione(f"RIP{giorno}{i:07d}", pezzo, problema,
+                                         rnd.choice(tipi), rnd.choice(PRIORITA))
+        richiesta.data_richiesta = data
+        richiesta.stato = rnd.choice(stati)
+        richiesta.tecnico_assegnato = rnd.choice(TECNICI)
+        richiesta.costo_stimato = round(rnd.uniform(20, 400), 2)
+        if richiesta.stato in (StatoRiparazione.COMPLETATO, StatoRiparazione.CONSEGNATO):
+            richiesta.data_completamento = data + datetime.timedelta(hours=rnd.randrange(1, 24 * 30))
+            richiesta.costo_finale = round(richiesta.costo_stimato * rnd.uniform(0.8, 1.3), 2)
+        yield richiesta
+
+
+def sistema_sintetico(n: int, cartella: str) -> SistemaGestioneRiparazioni:
+    """Sistema in memoria (file non ancora esistente) popolato con n richieste"""
+    sistema = SistemaGestioneRiparazioni(os.path.join(cartella, f"sintetico_{n}.json"))
+    for richiesta in genera_richieste(n):
+        sistema.richieste[richiesta.id_richiesta] = richiesta
+        sistema.pezzi[richiesta.pezzo.id_pezzo] = richiesta.pezzo
+    sistema.ricostruisci_indici()
+    return sistema
+
+
+def cronometra(funzione, ripetizioni: int = 5) -> float:
+    """Tempo medio in millisecondi (garbage collector sospeso, come fa timeit)"""
+    gc_attivo = gc.isenabled()
+    gc.disable()
+    try:
+        inizio = time.perf_counter()
+        for _ in range(ripetizioni):
+            funzione()
+        return (time.perf_counter() - inizio) / ripetizioni * 1000
+    finally:
+        if gc_attivo:
+            gc.enable()
+
+
+# (etichetta, termine, stato, cliente, tipo)
+CASI_RICERCA = [
+    ("'kp 8'", "kp 8", None, "", None),
+    ("'audio'", "audio", None, "", None),
+    ("'1926'", "1926", None, "", None),
+    ("'rip2024'", "rip2024", None, "", None),
+    ("'connettore 3'", "connettore 3", None, "", None),
+    ("'xyz'", "xyz", None, "", None),
+    ("attesa+cliente", "", StatoRiparazione.IN_ATTESA_PEZZI, "cremonesi", None),
+    ("stato+tipo", "", StatoRiparazione.RICEVUTO, "", TipoIntervento.ISPEZIONE),
+    ("'audio'+cliente", "audio", None, "merani", None),
+]
+
+
+def benchmark_ricerca(dimensioni):
+    with tempfile.TemporaryDirectory() as cartella:
+        for n in dimensioni:
+            inizio = time.perf_counter()
+            sistema = sistema_sintetico(n, cartella)
+            costruzione = time.perf_counter() - inizio
+            print(f"\n{n} richieste (archivio + indici costruiti in {costruzione:.1f} s)")
+            print(f"  {'ricerca':<16} {'risultati':>9} {'lineare ms':>11} {'indice ms':>10} {'speedup':>8}")
+            for etichetta, *filtri in CASI_RICERCA:
+                lineare = sistema._filtra_richieste(sistema.richieste.values(), *filtri)
+                indicizzata = sistema.cerca_richieste(*filtri)
+                assert [r.id_richiesta for r in lineare] == [r.id_richiesta for r in indicizzata]
+
+                t_lineare = cronometra(lambda: sistema._filtra_richieste(sistema.richieste.values(), *filtri), 1)
+                t_indice = cronometra(lambda: sistema.cerca_richieste(*filtri), 3)
+                print(f"  {etichetta:<16} {len(indicizzata):>9} {t_lineare:>11.1f} {t_indice:>10.1f} "
+                      f"{t_lineare / max(t_indice, 1e-6):>7.1f}x")
+
+
+class _PezzoConDict:
+    """Pezzo come era prima della rappresentazione compatta (attributi in __dict__)"""
+
+    def __init__(self, dati: dict):
+        self.id_pezzo = dati['id_pezzo']
+        self.nome = dati['nome']
+        self.modello = dati['modello']
+        self.numero_serie = dati['numero_serie']
+        self.cliente = dati['cliente']
+        self.data_creazione = datetime.datetime.fromisoformat(dati['data_creazione'])
+
+
+class _RichiestaConDict:
+    """Richiesta come era prima: enum, stringhe duplicate, datetime e note come dizionari"""
+
+    def __init__(self, dati: dict):
+        self.id_richiesta = dati['id_richiesta']
+        self.pezzo = _PezzoConDict(dati['pezzo'])
+        self.descrizione_problema = dati['descrizione_problema']
+        self.tipo_intervento = TipoIntervento(dati['tipo_intervento'])
+        self.stato = StatoRiparazione(dati['stato'])
+        self.priorita = dati['priorita']
+        self.data_richiesta = datetime.datetime.fromisoformat(dati['data_richiesta'])
+        self.data_completamento = (datetime.datetime.fromisoformat(dati['data_completamento'])
+                                   if dati['data_completamento'] else None)
+        self.note_tecniche = dati['note_tecniche']
+        self.costo_stimato = dati['costo_stimato']
+        self.costo_finale = dati['costo_finale']
+        self.tecnico_assegnato = dati['tecnico_assegnato']
+        self.osservatore = None
+
+
+def byte_per_richiesta(righe_json, costruttore) -> float:
+    """Memoria trattenuta dagli oggetti costruiti riga per riga, come fa il caricamento"""
+    gc.collect()
+    tracemalloc.start()
+    oggetti = [costruttore(json.loads(riga)) for riga in righe_json]
+    gc.collect()
+    trattenuti = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del oggetti
+    return trattenuti / len(righe_json)
+
+
+def benchmark_memoria(dimensioni):
+    print(f"  {'richieste':>10} {'prima B/rich':>13} {'dopo B/rich':>12} {'risparmio':>10}")
+    for n in dimensioni:
+        righe = []
+        for richiesta in genera_richieste(n):
+            # Due note per richiesta, come una lavorazione tipica
+            richiesta.aggiungi_nota("smontato e verificato", richiesta.tecnico_assegnato)
+            richiesta.aggiungi_nota("in attesa di conferma preventivo", richiesta.tecnico_assegnato)
+            righe.append(json.dumps(richiesta.to_dict(), ensure_ascii=False))
+
+        prima = byte_per_richiesta(righe, _RichiestaConDict)
+        dopo = byte_per_richiesta(righe, RichiestaRiparazione.from_dict)
+        print(f"  {n:>10} {prima:>13.0f} {dopo:>12.0f} {1 - dopo / prima:>9.0%}")
+
+
+def _secondi(funzione) -> float:
+    gc.collect()
+    inizio = time.perf_counter()
+    funzione()
+    return time.perf_counter() - inizio
+
+
+def _conteggio_stati_colonnare(percorso: str):
+    with SnapshotColonnare(percorso) as snapshot:
+        return snapshot.conteggi('stato')
+
+
+def _sola_lettura(percorso: str, cartella: str) -> float:
+    """Secondi per ricostruire le richieste dallo snapshot, senza journal né indici"""
+    sistema = SistemaGestioneRiparazioni(os.path.join(cartella, "vuoto" + os.path.splitext(percorso)[1]))
+    sistema.file_dati = percorso
+    if sistema.formato_colonnare:
+        return _secondi(lambda: sistema._leggi_snapshot_colonnare({}, {}))
+    return _secondi(lambda: sistema._leggi_snapshot_json({}, {}))
+
+
+def benchmark_avvio(dimensioni):
+    """Avvio e conteggio per stato: snapshot JSON contro colonnare.
+
+    "lettura" è la sola ricostruzione delle richieste; "avvio" comprende
+    anche journal e indici, che sono uguali per i due formati.
+    """
+    print(f"  {'richieste':>10} {'JSON MB':>8} {'ripc MB':>8} {'lettura JSON s':>15} {'lettura ripc s':>15} "
+          f"{'avvio JSON s':>13} {'avvio ripc s':>13} {'stati JSON s':>13} {'stati ripc ms':>14}")
+    with tempfile.TemporaryDirectory() as cartella:
+        for n in dimensioni:
+            file_json = os.path.join(cartella, f"sintetico_{n}.json")
+            file_ripc = os.path.join(cartella, f"sintetico_{n}.ripc")
+            sistema = sistema_sintetico(n, cartella)
+            sistema.salva_dati()
+            del sistema
+            converti_snapshot(file_json, file_ripc)
+
+            l_json = _sola_lettura(file_json, cartella)
+            l_ripc = _sola_lettura(file_ripc, cartella)
+            t_json = _secondi(lambda: SistemaGestioneRiparazioni(file_json))
+            t_ripc = _secondi(lambda: SistemaGestioneRiparazioni(file_ripc))
+            # Analisi senza costruire gli oggetti: basta la colonna degli stati
+            t_stati_json = _secondi(lambda: Counter(
+                r.stato.value for r in SistemaGestioneRiparazioni(file_json).richieste.values()))
+            assert (_conteggio_stati_colonnare(file_ripc) ==
+                    Counter(r.stato.value for r in SistemaGestioneRiparazioni(file_ripc).richieste.values()))
+            t_stati_ripc = _secondi(lambda: _conteggio_stati_colonnare(file_ripc))
+            print(f"  {n:>10} {os.path.getsize(file_json) / 1e6:>8.1f} {os.path.getsize(file_ripc) / 1e6:>8.1f} "
+                  f"{l_json:>15.2f} {l_ripc:>15.2f} {t_json:>13.2f} {t_ripc:>13.2f} "
+                  f"{t_stati_json:>13.2f} {t_stati_ripc * 1000:>14.1f}")
+
+
+def _fatturato_mensile_lineare(sistema):
+    """Il report mensile scritto come ciclo sugli oggetti, per confronto"""
+    mesi = {}
+    for richiesta in sistema.richieste.values():
+        if richiesta.data_completamento and richiesta.costo_finale > 0:
+            mese = richiesta.data_completamento.strftime("%Y-%m")
+            conteggio, somma = mesi.get(mese, (0, 0.0))
+            mesi[mese] = (conteggio + 1, somma + richiesta.costo_finale)
+    return sorted(mesi.items())
+
+
+def benchmark_report(dimensioni):
+    print(f"  NumPy {'disponibile' if np is not None else 'non installato: report con cicli Python'}")
+    print(f"  {'richieste':>10} {'ciclo ms':>9} {'colonne ms':>11} {'report ms':>10} {'in cache ms':>12}")
+    with tempfile.TemporaryDirectory() as cartella:
+        for n in dimensioni:
+            sistema = sistema_sintetico(n, cartella)
+            motore = MotoreReport(sistema)
+            t_colonne = cronometra(lambda: motore.colonne, 1)
+            t_report = cronometra(lambda: motore.fatturato("mese"), 1)
+            t_cache = cronometra(lambda: motore.fatturato("mese"), 100)
+            t_ciclo = cronometra(lambda: _fatturato_mensile_lineare(sistema), 1)
+            assert [(mese, n) for mese, (n, _) in _fatturato_mensile_lineare(sistema)] == \
+                [(riga[0], riga[1]) for riga in motore.fatturato("mese")]
+            print(f"  {n:>10} {t_ciclo:>9.1f} {t_colonne:>11.1f} {t_report:>10.1f} {t_cache:>12.4f}")
+
+
+SILLABE = ["ro", "ssi", "bian", "chi", "fer", "ra", "ri", "co", "lom", "bo", "mar", "ti", "ni",
+           "gal", "lo", "con", "te", "de", "lu", "ca", "man", "ci", "cre", "mo", "ne", "si", "gio",
+           "dan", "bar", "be", "pe", "sca", "to", "va", "le", "tri", "mi", "sa", "no", "ve"]
+NOMI_PROPRI = ["Mario", "Luca", "Giulia", "Anna", "Marco", "Paolo", "Chiara", "Sara", "Giorgio",
+               "Elena", "Franco", "Laura", "Andrea", "Silvia", "Stefano", "Marta", "Davide", "Rita"]
+FORME = ["srl", "spa", "snc", "impianti", "telecomunicazioni", "& figli", "elettronica"]
+
+
+def nomi_clienti(n: int, seme: int = 7) -> List[str]:
+    """n nomi di cliente distinti: cognomi fatti di sillabe italiane seguiti da
+    un nome proprio (privati) o da una forma societaria (aziende)"""
+    rnd = random.Random(seme)
+    nomi = set()
+    while len(nomi) < n:
+        cognome = "".join(rnd.choice(SILLABE) for _ in range(rnd.randint(2, 4))).capitalize()
+        nomi.add(f"{cognome} {rnd.choice(NOMI_PROPRI if rnd.random() < 0.6 else FORME)}")
+    return sorted(nomi)
+
+
+def con_refusi(testo: str, modifiche: int, rnd: random.Random) -> str:
+    """Il testo con `modifiche` errori di battitura casuali (sostituzione, omissione, aggiunta, scambio)"""
+    lettere = "abcdefghilmnopqrstuvz"
+    for _ in range(modifiche):
+        i = rnd.randrange(len(testo))
+        errore = rnd.randrange(4)
+        if errore == 0:
+            testo = testo[:i] + rnd.choice(lettere) + testo[i + 1:]
+        elif errore == 1 and len(testo) > 3:
+            testo = testo[:i] + testo[i + 1:]
+        elif errore == 2:
+            testo = testo[:i] + rnd.choice(lettere) + testo[i:]
+        elif i + 1 < len(testo):
+            testo = testo[:i] + testo[i + 1] + testo[i] + testo[i + 2:]
+    return testo
+
+
+def _vicini_lineare(nomi_normalizzati: List[str], testo: str) -> set:
+    """Tutti i nomi entro la distanza predefinita, confrontandoli uno per uno"""
+    chiave = IndiceApprossimato.normalizza(testo)
+    massimo = IndiceApprossimato.distanza_predefinita(chiave)
+    return {nome for nome in nomi_normalizzati if distanza_modifica(chiave, nome, massimo) <= massimo}
+
+
+def benchmark_refusi(numero_nomi: int, ricerche: int):
+    rnd = random.Random(11)
+    nomi = nomi_clienti(numero_nomi)
+    indice = IndiceApprossimato()
+    t_costruzione = cronometra(lambda: [indice.aggiungi(nome) for nome in nomi], 1)
+    casi = [(nome, con_refusi(nome, rnd.randint(1, 2), rnd)) for nome in rnd.sample(nomi, ricerche)]
+
+    t_indice = cronometra(lambda: [indice.suggerisci(refuso) for _, refuso in casi], 1) / len(casi)
+    ritrovati = sum(1 for nome, refuso in casi
+                    if nome in [valore for valore, _, _ in indice.suggerisci(refuso)])
+    # La scansione lineare (stessa distanza massima) su un campione fa da
+    # riferimento, sia per il tempo sia per controllare che il filtro non perda nomi
+    normalizzati = [IndiceApprossimato.normalizza(nome) for nome in nomi]
+    campione = casi[:10]
+    inizio = time.perf_counter()
+    attesi = [_vicini_lineare(normalizzati, refuso) for _, refuso in campione]
+    t_lineare = (time.perf_counter() - inizio) * 1000 / len(campione)
+    for (_, refuso), vicini in zip(campione, attesi):
+        trovati = {IndiceApprossimato.normalizza(valore)
+                   for valore, _, _ in indice.suggerisci(refuso, limite=len(nomi))}
+        assert trovati == vicini, (refuso, trovati ^ vicini)
+
+    print(f"  {len(nomi)} clienti distinti, indice costruito in {t_costruzione:.0f} ms "
+          f"({len(set().union(*indice.postings.values()))} trigrammi)")
+    print(f"  ricerca con 1-2 refusi: indice {t_indice:.2f} ms, scansione lineare {t_lineare:.1f} ms "
+          f"({t_lineare / t_indice:.0f}x)")
+    print(f"  nome corretto tra i primi 5 suggerimenti: {ritrovati / len(casi):.1%}")
+
+
+def _chiave_lavoro(richiesta):
+    return (-CODICE_PRIORITA[richiesta.priorita], PESO_TIPO[richiesta.tipo_intervento],
+            richiesta.data_richiesta)
+
+
+def _lavoro_lineare(sistema, tecnico: str):
+    """Come si trova il prossimo lavoro senza coda: scansione di tutte le richieste"""
+    candidati = (richiesta for richiesta in sistema.richieste.values()
+                 if richiesta.stato == StatoRiparazione.RICEVUTO
+                 and richiesta.tecnico_assegnato in ("", tecnico))
+    return min(candidati, key=_chiave_lavoro, default=None)
+
+
+def benchmark_coda(dimensione: int, passi: int):
+    tecnici = [tecnico for tecnico in TECNICI if tecnico]
+    with tempfile.TemporaryDirectory() as cartella:
+        sistema = SistemaGestioneRiparazioni(os.path.join(cartella, "coda.json"))
+        for richiesta in genera_richieste(dimensione):
+            richiesta.stato = StatoRiparazione.RICEVUTO
+            richiesta.data_completamento = None
+            richiesta.costo_finale = 0.0
+            richiesta.tecnico_assegnato = ""
+            sistema.richieste[richiesta.id_richiesta] = richiesta
+            sistema.pezzi[richiesta.pezzo.id_pezzo] = richiesta.pezzo
+        sistema.ricostruisci_indici()
+
+        inizio = time.perf_counter()
+        coda = sistema.coda_lavori
+        costruzione = time.perf_counter() - inizio
+        print(f"\n{dimensione} lavori in attesa, {len(tecnici)} tecnici "
+              f"(code costruite in {costruzione * 1000:.0f} ms)")
+
+        # Tutte le modifiche restano in memoria fino alla fine del blocco
+        with sistema.operazioni_in_blocco():
+            inizio = time.perf_counter()
+            assegnati = sistema.assegna_lavori(tecnici, limite=dimensione // 2)
+            durata = time.perf_counter() - inizio
+            carichi = sorted(coda.carico.get(tecnico, 0) for tecnico in tecnici)
+            print(f"  assegnazione automatica: {len(assegnati)} lavori in {durata * 1000:.0f} ms "
+                  f"({len(assegnati) / durata:.0f}/s), carico per tecnico {carichi[0]}-{carichi[-1]}")
+
+            for tecnico in tecnici:
+                attesa = _lavoro_lineare(sistema, tecnico)
+                trovata = sistema.prossimo_lavoro(tecnico, prendi_in_carico=False)
+                assert _chiave_lavoro(attesa) == _chiave_lavoro(trovata)
+
+            # Simulazione: a ogni passo un tecnico prende il prossimo lavoro e lo
+            # inizia, uno dei suoi lavori in corso si chiude e arriva una richiesta nuova
+            rnd = random.Random(7)
+            in_corso = {tecnico: [] for tecnico in tecnici}
+            nuove = genera_richieste(passi, seme=99)
+            inizio = time.perf_counter()
+            for _ in range(passi):
+                tecnico = rnd.choice(tecnici)
+                richiesta = sistema.prossimo_lavoro(tecnico)
+                if richiesta is not None:
+                    sistema.aggiorna_richiesta(richiesta.id_richiesta, stato=StatoRiparazione.IN_LAVORAZIONE)
+                    in_corso[tecnico].append(richiesta.id_richiesta)
+                if len(in_corso[tecnico]) > 3:
+                    sistema.aggiorna_richiesta(in_corso[tecnico].pop(0), stato=StatoRiparazione.COMPLETATO)
+                modello = next(nuove)
+                sistema.crea_richiesta_riparazione(
+                    modello.pezzo.nome, modello.pezzo.modello, modello.pezzo.numero_serie,
+                    modello.pezzo.cliente, modello.descrizione_problema, modello.tipo_intervento,
+                    modello.priorita)
+            durata = time.perf_counter() - inizio
+            print(f"  simulazione: {passi} passi in {durata * 1000:.0f} ms ({passi / durata:.0f} passi/s, "
+                  f"ognuno prossimo lavoro + 2 cambi di stato + 1 creazione)")
+
+            t_coda = cronometra(lambda: coda.prossimo(tecnici[0]), 1000)
+            t_lineare = cronometra(lambda: _lavoro_lineare(sistema, tecnici[0]), 3)
+            print(f"  prossimo lavoro: coda {t_coda * 1000:.1f} µs, scansione lineare {t_lineare:.1f} ms "
+                  f"({t_lineare / max(t_coda, 1e-9):.0f}x)")
+
+
+class ClienteHTTP:
+    """Connessione keep-alive minimale per il generatore di carico"""
+
+    def __init__(self, host: str, porta: int):
+        self.host = host
+        self.porta = porta
+
+    async def apri(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.porta)
+
+    def chiudi(self):
+        self.writer.close()
+
+    async def richiesta(self, metodo: str, percorso: str, corpo=None):
+        dati = json.dumps(corpo).encode('utf-8') if corpo is not None else b""
+        self.writer.write(f"{metodo} {percorso} HTTP/1.1\r\nHost: {self.host}\r\n"
+                          f"Content-Type: application/json\r\nContent-Length: {len(dati)}\r\n\r\n"
+                          .encode('latin-1') + dati)
+        await self.writer.drain()
+        intestazione = (await self.reader.readuntil(b"\r\n\r\n")).decode('latin-1').split("\r\n")
+        stato = int(intestazione[0].split(" ")[1])
+        lunghezza = next(int(riga.split(":", 1)[1]) for riga in intestazione
+                         if riga.lower().startswith("content-length:"))
+        return stato, await self.reader.readexactly(lunghezza)
+
+
+# (operazione, peso): traffico tipico dello sportello, soprattutto letture
+MISCELA_SERVIZIO = [("cerca", 50), ("dettaglio", 25), ("aggiorna", 20), ("crea", 5)]
+
+
+async def _lavoratore_carico(cliente: ClienteHTTP, ids, scadenza: float, seme: int, latenze, errori):
+    rnd = random.Random(seme)
+    operazioni = [operazione for operazione, peso in MISCELA_SERVIZIO for _ in range(peso)]
+    await cliente.apri()
+    try:
+        while time.perf_counter() < scadenza:
+            operazione = rnd.choice(operazioni)
+            if operazione == "cerca":
+                _, termine, stato, cliente_filtro, tipo = rnd.choice(CASI_RICERCA)
+                parametri = {'termine': termine, 'cliente': cliente_filtro, 'per_pagina': 20}
+                if stato:
+                    parametri['stato'] = stato.value
+                if tipo:
+                    parametri['tipo'] = tipo.value
+                argomenti = ("GET", "/richieste?" + urlencode(parametri))
+            elif operazione == "dettaglio":
+                argomenti = ("GET", f"/richieste/{rnd.choice(ids)}")
+            elif operazione == "aggiorna":
+                argomenti = ("PATCH", f"/richieste/{rnd.choice(ids)}",
+                             {'nota': "verifica in corso", 'tecnico_nota': rnd.choice(TECNICI)})
+            else:
+                nome, modello = rnd.choice(PEZZI)
+                argomenti = ("POST", "/richieste",
+                             {'nome_pezzo': nome, 'modello': modello,
+                              'numero_serie': str(rnd.randrange(1000000, 9999999)),
+                              'cliente': rnd.choice(CLIENTI), 'descrizione_problema': "non si accende",
+                              'tipo_intervento': rnd.choice(list(TipoIntervento)).value})
+
+            inizio = time.perf_counter()
+            stato, _ = await cliente.richiesta(*argomenti)
+            latenze[operazione].append((time.perf_counter() - inizio) * 1000)
+            if stato >= 400:
+                errori[operazione] += 1
+    finally:
+        cliente.chiudi()
+
+
+async def _genera_carico(host: str, porta: int, ids, connessioni: int, durata: float):
+    latenze = {operazione: [] for operazione, _ in MISCELA_SERVIZIO}
+    errori = {operazione: 0 for operazione, _ in MISCELA_SERVIZIO}
+    scadenza = time.perf_counter() + durata
+    await asyncio.gather(*(_lavoratore_carico(ClienteHTTP(host, porta), ids, scadenza, seme,
+                                              latenze, errori)
+                           for seme in range(connessioni)))
+    return latenze, errori
+
+
+def _percentile(valori_ordinati, q: float) -> float:
+    return valori_ordinati[min(len(valori_ordinati) - 1, int(q * len(valori_ordinati)))]
+
+
+def _avvia_servizio(file_dati: str):
+    """Avvia il servizio in un processo separato su una porta libera"""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        porta = s.getsockname()[1]
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "servizio_http_riparazioni.py")
+    processo = subprocess.Popen([sys.executable, script, "--porta", str(porta), "--file-dati", file_dati],
+                                stdout=subprocess.PIPE, text=True)
+    # Il servizio stampa una riga quando è in ascolto
+    processo.stdout.readline()
+    return processo, porta
+
+
+def benchmark_servizio(dimensione: int, connessioni: int, durata: float, indirizzo: str = ""):
+    with tempfile.TemporaryDirectory() as cartella:
+        processo = None
+        if indirizzo:
+            host, porta = indirizzo.rsplit(":", 1)
+            porta = int(porta)
+            ids = asyncio.run(_ids_remoti(host, porta))
+        else:
+            host = "127.0.0.1"
+            sistema = sistema_sintetico(dimensione, cartella)
+            sistema.salva_dati()
+            ids = list(sistema.richieste)
+            del sistema
+            processo, porta = _avvia_servizio(os.path.join(cartella, f"sintetico_{dimensione}.json"))
+
+        try:
+            latenze, errori = asyncio.run(_genera_carico(host, porta, ids, connessioni, durata))
+        finally:
+            if processo:
+                # Con SIGINT il servizio scrive le ultime modifiche e compatta il journal
+                processo.send_signal(signal.SIGINT if os.name != "nt" else signal.SIGTERM)
+                processo.wait()
+
+    print(f"\n{len(ids)} richieste nell'archivio, {connessioni} connessioni keep-alive, {durata:.0f} s")
+    print(f"  {'operazione':<10} {'richieste':>9} {'errori':>7} {'p50 ms':>8} {'p90 ms':>8} "
+          f"{'p99 ms':>8} {'max ms':>8}")
+    tutte = []
+    for operazione, _ in MISCELA_SERVIZIO:
+        valori = sorted(latenze[operazione])
+        tutte.extend(valori)
+        if valori:
+            print(f"  {operazione:<10} {len(valori):>9} {errori[operazione]:>7} "
+                  f"{_percentile(valori, 0.5):>8.2f} {_percentile(valori, 0.9):>8.2f} "
+                  f"{_percentile(valori, 0.99):>8.2f} {valori[-1]:>8.2f}")
+    tutte.sort()
+    print(f"  {'totale':<10} {len(tutte):>9} {sum(errori.values()):>7} "
+          f"{_percentile(tutte, 0.5):>8.2f} {_percentile(tutte, 0.9):>8.2f} "
+          f"{_percentile(tutte, 0.99):>8.2f} {tutte[-1]:>8.2f}")
+    print(f"  richieste al secondo: {len(tutte) / durata:.0f}")
+
+
+async def _ids_remoti(host: str, porta: int):
+    cliente = ClienteHTTP(host, porta)
+    await cliente.apri()
+    try:
+        _, corpo = await cliente.richiesta("GET", "/richieste?per_pagina=1000")
+    finally:
+        cliente.chiudi()
+    return [richiesta['id_richiesta'] for richiesta in json.loads(corpo)['risultati']]
+
+
+# Versione del formato dei risultati della suite: cambia se cambiano i campi
+FORMATO_SUITE = 1
+
+
+def _misura(funzione, ripetizioni: int, operazioni: int = 1) -> dict:
+    """Tempo mediano per operazione e picco di memoria di una funzione che ne esegue `operazioni`.
+
+    I tempi sono presi senza tracemalloc, che rallenta molto le allocazioni;
+    il picco (memoria allocata in più durante la chiamata) viene da
+    un'esecuzione a parte.
+    """
+    tempi = []
+    for _ in range(ripetizioni):
+        gc.collect()
+        inizio = time.perf_counter()
+        funzione()
+        tempi.append((time.perf_counter() - inizio) * 1000 / operazioni)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        funzione()
+        _, picco = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"ms": round(statistics.median(tempi), 4), "picco_kb": round(picco / 1024, 1),
+            "ripetizioni": ripetizioni, "operazioni": operazioni}
+
+
+def _misure_suite(n: int, cartella: str, journal: bool, ripetizioni: int):
+    """(operazione, misura) per un archivio di n richieste salvato su file"""
+    rnd = random.Random(n)
+    sistema = sistema_sintetico(n, cartella)
+    percorso = sistema.file_dati
+    yield "salva_dati", _misura(sistema.salva_dati, ripetizioni)
+    del sistema
+
+    # Avvio completo: lettura dello snapshot, journal e indici
+    yield "carica_dati", _misura(lambda: SistemaGestioneRiparazioni(percorso, journal=journal), ripetizioni)
+    sistema = SistemaGestioneRiparazioni(percorso, journal=journal)
+
+    for etichetta, *filtri in CASI_RICERCA:
+        yield f"cerca_richieste {etichetta}", _misura(lambda: sistema.cerca_richieste(*filtri), ripetizioni)
+
+    yield "genera_id_richiesta", _misura(
+        lambda: [sistema.genera_id_richiesta() for _ in range(1000)], ripetizioni, 1000)
+    yield "statistiche", _misura(
+        lambda: StatisticheIncrementali.da_richieste(sistema.richieste.values()), ripetizioni)
+
+    # Senza journal ogni modifica riscrive lo snapshot: sugli archivi grandi
+    # bastano poche operazioni per avere una media stabile
+    operazioni = max(3, min(100, 100000 // n))
+    tipi = list(TipoIntervento)
+
+    def crea():
+        # I messaggi stampati dal gestionale non devono finire nella tabella
+        with contextlib.redirect_stdout(io.StringIO()):
+            _crea()
+
+    def _crea():
+        for _ in range(operazioni):
+            nome, modello = rnd.choice(PEZZI)
+            sistema.crea_richiesta_riparazione(nome, modello, str(rnd.randrange(1000000, 9999999)),
+                                               rnd.choice(CLIENTI), rnd.choice(PROBLEMI).format(1, 2),
+                                               rnd.choice(tipi), rnd.choice(PRIORITA))
+
+    ids = list(sistema.richieste)
+    stati = list(StatoRiparazione)
+
+    def aggiorna():
+        with contextlib.redirect_stdout(io.StringIO()):
+            for id_richiesta in rnd.sample(ids, operazioni):
+                sistema.aggiorna_richiesta(id_richiesta, stato=rnd.choice(stati),
+                                           tecnico_assegnato=rnd.choice(TECNICI))
+
+    yield "crea_richiesta_riparazione", _misura(crea, ripetizioni, operazioni)
+    yield "aggiorna_richiesta", _misura(aggiorna, ripetizioni, operazioni)
+
+
+def _confronta_riferimento(risultati: dict, riferimento: dict, tolleranza: float) -> List[str]:
+    """Le misure peggiorate oltre la tolleranza rispetto al riferimento.
+
+    Sotto le soglie assolute (0.01 ms, 64 KB) le differenze sono rumore e
+    non contano come regressioni.
+    """
+    precedenti = {(voce["dimensione"], voce["operazione"]): voce for voce in riferimento["misure"]}
+    regressioni = []
+    for voce in risultati["misure"]:
+        prima = precedenti.get((voce["dimensione"], voce["operazione"]))
+        if prima is None:
+            continue
+        for campo, unita, soglia in (("ms", "ms", 0.01), ("picco_kb", "KB", 64)):
+            if voce[campo] > prima[campo] * (1 + tolleranza) and voce[campo] - prima[campo] > soglia:
+                regressioni.append(f"{voce['dimensione']} richieste, {voce['operazione']}: "
+                                   f"{prima[campo]:.3f} -> {voce[campo]:.3f} {unita}")
+    return regressioni
+
+
+def benchmark_suite(dimensioni, journal: bool, ripetizioni: int, file_risultati: str,
+                    file_riferimento: str, tolleranza: float, aggiorna_riferimento: bool) -> int:
+    """Tempi e picchi di memoria delle operazioni principali su archivi di dimensione crescente.
+
+    I risultati vanno in `file_risultati` (JSON) e, se c'è, vengono
+    confrontati con `file_riferimento`: il codice di uscita è 1 quando
+    qualche misura è peggiorata oltre la tolleranza.
+    """
+    riferimento = None
+    if file_riferimento and os.path.exists(file_riferimento) and not aggiorna_riferimento:
+        with open(file_riferimento, encoding="utf-8") as f:
+            riferimento = json.load(f)
+        if riferimento.get("formato") != FORMATO_SUITE:
+            print(f"⚠️  {file_riferimento} ha un formato diverso: nessun confronto")
+            riferimento = None
+        elif riferimento.get("journal") != journal:
+            print(f"⚠️  {file_riferimento} è stato misurato con journal={riferimento.get('journal')}")
+    precedenti = {(voce["dimensione"], voce["operazione"]): voce
+                  for voce in (riferimento or {}).get("misure", [])}
+
+    risultati = {
+        "formato": FORMATO_SUITE,
+        "data": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "piattaforma": platform.platform(),
+        "processori": os.cpu_count(),
+        "journal": journal,
+        "misure": [],
+    }
+    with tempfile.TemporaryDirectory() as cartella:
+        for n in dimensioni:
+            print(f"\n{n} richieste (journal {'attivo' if journal else 'spento'})")
+            print(f"  {'operazione':<36} {'ms/op':>10} {'picco KB':>10} {'rif. ms':>10} {'variazione':>10}")
+            for operazione, misura in _misure_suite(n, cartella, journal, ripetizioni):
+                risultati["misure"].append({"dimensione": n, "operazione": operazione, **misura})
+                prima = precedenti.get((n, operazione))
+                confronto = ""
+                if prima:
+                    confronto = (f"{prima['ms']:>10.3f} "
+                                 f"{(misura['ms'] / max(prima['ms'], 1e-9) - 1) * 100:>+9.0f}%")
+                print(f"  {operazione:<36} {misura['ms']:>10.3f} {misura['picco_kb']:>10.0f} {confronto}")
+            for nome in os.listdir(cartella):
+                os.remove(os.path.join(cartella, nome))
+
+    with open(file_risultati, "w", encoding="utf-8") as f:
+        json.dump(risultati, f, indent=2)
+    print(f"\nRisultati scritti in {file_risultati}")
+    if aggiorna_riferimento and file_riferimento:
+        with open(file_riferimento, "w", encoding="utf-8") as f:
+            json.dump(risultati, f, indent=2)
+        print(f"Nuovo riferimento: {file_riferimento}")
+        return 0
+    if riferimento is None:
+        return 0
+
+    regressioni = _confronta_riferimento(risultati, riferimento, tolleranza)
+    if regressioni:
+        print(f"\n❌ {len(regressioni)} misure peggiorate di oltre il {tolleranza:.0%}:")
+        for riga in regressioni:
+            print(f"  {riga}")
+        return 1
+    print(f"\n✅ Nessuna regressione rispetto a {file_riferimento} (tolleranza {tolleranza:.0%})")
+    return 0
+
+
+def _crea_una(sistema) -> tuple:
+    """Millisecondi e byte di snapshot scritti per creare e salvare una richiesta (senza journal)"""
+    sistema.strumentazione.attiva = True
+    sistema.strumentazione.azzera()
+    inizio = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        sistema.crea_richiesta_riparazione("cuffia", "hs 20", "1234567", "Rossi", "audio assente",
+                                           TipoIntervento.RIPARAZIONE, "Media")
+    durata = (time.perf_counter() - inizio) * 1000
+    sistema.strumentazione.attiva = False
+    return durata, sistema.strumentazione.byte_scritti.get('snapshot', 0)
+
+
+def benchmark_shard(dimensioni, criterio: str, numero_shard: int, processi: int):
+    """Archivio in un solo file contro archivio diviso in shard.
+
+    Il caricamento e la ricerca sugli shard sono misurati con un solo processo
+    e con `processi` processi: il guadagno dipende dai core disponibili, e con
+    un solo core il parallelo costa solo l'avvio dei processi.
+    """
+    print(f"  core disponibili: {os.cpu_count()}, processi: {processi}, criterio: {criterio}"
+          + (f" ({numero_shard} shard)" if criterio == 'hash' else ""))
+    print(f"  {'richieste':>10} {'shard':>6} {'avvio 1 file s':>15} {'avvio shard 1p s':>17} "
+          f"{'avvio shard {}p s'.format(processi):>17} {'cerca 1p s':>11} {'cerca {}p s'.format(processi):>11} "
+          f"{'crea 1 file ms':>15} {'crea shard ms':>14} {'KB scritti 1 file':>18} {'KB scritti shard':>17}")
+    with tempfile.TemporaryDirectory() as cartella:
+        for n in dimensioni:
+            file_unico = os.path.join(cartella, f"sintetico_{n}.json")
+            file_shard = os.path.join(cartella, f"shard_{n}.json")
+            sistema = sistema_sintetico(n, cartella)
+            sistema.salva_dati()
+            del sistema
+            gc.collect()
+            sistema = SistemaGestioneRiparazioni(file_unico, shard=criterio, numero_shard=numero_shard)
+            sistema.file_dati = file_shard
+            sistema.salva_dati()
+            del sistema
+
+            t_unico = _secondi(lambda: SistemaGestioneRiparazioni(file_unico))
+            t_seriale = _secondi(lambda: SistemaGestioneRiparazioni(file_shard, processi=1))
+            t_parallelo = _secondi(lambda: SistemaGestioneRiparazioni(file_shard, processi=processi))
+
+            seriale = cerca_negli_shard(file_shard, "audio", processi=1)
+            parallelo = cerca_negli_shard(file_shard, "audio", processi=processi)
+            assert [r.id_richiesta for r in seriale] == [r.id_richiesta for r in parallelo]
+            c_seriale = _secondi(lambda: cerca_negli_shard(file_shard, "audio", processi=1))
+            c_parallelo = _secondi(lambda: cerca_negli_shard(file_shard, "audio", processi=processi))
+
+            ms_unico, byte_unico = _crea_una(SistemaGestioneRiparazioni(file_unico))
+            sistema = SistemaGestioneRiparazioni(file_shard, processi=processi)
+            numero = len(sistema.richieste_per_shard)
+            ms_shard, byte_shard = _crea_una(sistema)
+            del sistema
+            print(f"  {n:>10} {numero:>6} {t_unico:>15.2f} {t_seriale:>17.2f} {t_parallelo:>17.2f} "
+                  f"{c_seriale:>11.2f} {c_parallelo:>11.2f} {ms_unico:>15.1f} {ms_shard:>14.1f} "
+                  f"{byte_unico / 1024:>18.0f} {byte_shard / 1024:>17.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    sotto = parser.add_subparsers(dest="comando", required=True)
+
+    p_ricerca = sotto.add_parser("ricerca", help="cerca_richieste con gli indici contro la scansione lineare")
+    p_ricerca.add_argument("--dimensioni", type=int, nargs="+", default=[10000, 100000, 1000000])
+
+    p_memoria = sotto.add_parser("memoria", help="byte per richiesta: rappresentazione con __dict__ contro compatta")
+    p_memoria.add_argument("--dimensioni", type=int, nargs="+", default=[10000, 100000])
+
+    p_avvio = sotto.add_parser("avvio", help="tempo di avvio con snapshot JSON contro colonnare (.ripc)")
+    p_avvio.add_argument("--dimensioni", type=int, nargs="+", default=[10000, 100000, 1000000])
+
+    p_report = sotto.add_parser("report", help="report mensili sulle colonne contro ciclo sugli oggetti")
+    p_report.add_argument("--dimensioni", type=int, nargs="+", default=[100000, 1000000])
+
+    p_refusi = sotto.add_parser("refusi", help="suggerimenti con errori di battitura: indice contro scansione")
+    p_refusi.add_argument("--nomi", type=int, default=100000)
+    p_refusi.add_argument("--ricerche", type=int, default=500)
+
+    p_coda = sotto.add_parser("coda", help="code dei lavori per tecnico: assegnazione e simulazione")
+    p_coda.add_argument("--dimensione", type=int, default=100000)
+    p_coda.add_argument("--passi", type=int, default=20000)
+
+    p_servizio = sotto.add_parser("servizio", help="richieste al secondo e latenze del servizio HTTP")
+    p_servizio.add_argument("--dimensione", type=int, default=100000)
+    p_servizio.add_argument("--connessioni", type=int, default=32)
+    p_servizio.add_argument("--durata", type=float, default=10.0)
+    p_servizio.add_argument("--indirizzo", default="",
+                            help="host:porta di un servizio già avviato (altrimenti ne avvia uno)")
+
+    p_suite = sotto.add_parser("suite", help="tempi e memoria delle operazioni principali, con confronto")
+    p_suite.add_argument("--dimensioni", type=int, nargs="+", default=[1000, 10000, 100000, 1000000])
+    p_suite.add_argument("--journal", action="store_true", help="modifiche accodate al journal")
+    p_suite.add_argument("--ripetizioni", type=int, default=3)
+    p_suite.add_argument("--risultati", default="suite.json", help="file JSON con i risultati")
+    p_suite.add_argument("--riferimento", default="", help="risultati precedenti da confrontare")
+    p_suite.add_argument("--tolleranza", type=float, default=0.25,
+                         help="peggioramento relativo oltre il quale una misura è una regressione")
+    p_suite.add_argument("--aggiorna-riferimento", action="store_true",
+                         help="salva questi risultati come nuovo riferimento")
+
+    p_shard = sotto.add_parser("shard", help="caricamento, ricerca e salvataggio con l'archivio diviso in shard")
+    p_shard.add_argument("--dimensioni", type=int, nargs="+", default=[100000, 1000000])
+    p_shard.add_argument("--criterio", choices=["mese", "hash"], default="hash")
+    p_shard.add_argument("--numero-shard", type=int, default=16)
+    p_shard.add_argument("--processi", type=int, default=os.cpu_count() or 1)
+
+    argomenti = parser.parse_args()
+    if argomenti.comando == "ricerca":
+        benchmark_ricerca(argomenti.dimensioni)
+    elif argomenti.comando == "memoria":
+        benchmark_memoria(argomenti.dimensioni)
+    elif argomenti.comando == "avvio":
+        benchmark_avvio(argomenti.dimensioni)
+    elif argomenti.comando == "report":
+        benchmark_report(argomenti.dimensioni)
+    elif argomenti.comando == "refusi":
+        benchmark_refusi(argomenti.nomi, argomenti.ricerche)
+    elif argomenti.comando == "coda":
+        benchmark_coda(argomenti.dimensione, argomenti.passi)
+    elif argomenti.comando == "servizio":
+        benchmark_servizio(argomenti.dimensione, argomenti.connessioni, argomenti.durata,
+                           argomenti.indirizzo)
+    elif argomenti.comando == "suite":
+        sys.exit(benchmark_suite(argomenti.dimensioni, argomenti.journal, argomenti.ripetizioni,
+                                 argomenti.risultati, argomenti.riferimento, argomenti.tolleranza,
+                                 argomenti.aggiorna_riferimento))
+    elif argomenti.comando == "shard":
+        benchmark_shard(argomenti.dimensioni, argomenti.criterio, argomenti.numero_shard, argomenti.processi)
+
+
+if __name__ == "__main__":
+    main()
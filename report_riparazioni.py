@@ -0,0 +1,402 @@
+"""Report periodici del gestionale riparazioni.
+
+Uso:
+    python report_riparazioni.py fatturato [--periodo mese] [--csv fatturato.csv]
+    python report_riparazioni.py scostamento [--periodo mese]
+    python report_riparazioni.py tempi [--per cliente|modello|tipo] [--periodo anno]
+    python report_riparazioni.py arretrato [--periodo settimana]
+    (--giorni N raggruppa per intervalli di N giorni invece che per --periodo)
+
+Le richieste vengono copiate una sola volta in colonne parallele e i
+raggruppamenti sono calcolati sulle colonne intere con NumPy; senza NumPy
+gli stessi report vengono calcolati con cicli Python, più lentamente.
+I report già calcolati restano in cache finché l'archivio non cambia
+(SistemaGestioneRiparazioni.generazione).
+
+Requisiti: NumPy è una dipendenza opzionale (pip install numpy); i
+risultati sono gli stessi con e senza.
+"""
+import argparse
+import array
+import csv
+import datetime
+import itertools
+import os
+from typing import Dict, List, Optional
+
+from Gestionale_riparazioni_azienda import (
+    SistemaGestioneRiparazioni, SnapshotColonnare, EPOCA, UN_MICROSECONDO,
+    CODICE_STATO, STATI_CHIUSI, TIPI
+)
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+PERIODI = ("giorno", "settimana", "mese", "anno")
+MICROSECONDI_GIORNO = 86_400_000_000
+MICROSECONDI_ORA = 3_600_000_000
+MANCANTE = SnapshotColonnare.MANCANTE
+CODICI_CHIUSI = frozenset(CODICE_STATO[stato] for stato in STATI_CHIUSI)
+
+
+class ColonneRichieste:
+    """Le richieste copiate in colonne parallele: la posizione i è la stessa richiesta in ogni colonna.
+
+    Le date sono microsecondi dall'epoca (MANCANTE se assenti), clienti e
+    modelli sono indici in `dizionario`.
+    """
+
+    CODICI = {'stato': 'B', 'tipo': 'B', 'data_richiesta': 'q', 'data_completamento': 'q',
+              'costo_stimato': 'd', 'costo_finale': 'd', 'cliente': 'I', 'modello': 'I'}
+
+    def __init__(self, richieste):
+        colonne = {nome: array.array(codice) for nome, codice in self.CODICI.items()}
+        codici: Dict[str, int] = {}
+        for richiesta in richieste:
+            pezzo = richiesta.pezzo
+            stato, tipo, data_richiesta, completamento = richiesta.valori_colonnari()
+            colonne['stato'].append(stato)
+            colonne['tipo'].append(tipo)
+            colonne['data_richiesta'].append(data_richiesta)
+            colonne['data_completamento'].append(MANCANTE if completamento is None else completamento)
+            colonne['costo_stimato'].append(richiesta.costo_stimato)
+            colonne['costo_finale'].append(richiesta.costo_finale)
+            colonne['cliente'].append(codici.setdefault(pezzo.cliente, len(codici)))
+            colonne['modello'].append(codici.setdefault(pezzo.modello, len(codici)))
+        self.dizionario: List[str] = list(codici)
+        self.numero = len(colonne['stato'])
+
+        # Con NumPy le colonne sono viste sugli stessi buffer, senza copie
+        for nome, valori in colonne.items():
+            setattr(self, nome, np.asarray(memoryview(valori)) if np is not None else valori)
+
+    def __len__(self):
+        return self.numero
+
+
+class Report:
+    """Risultato di un report: intestazione e righe, esportabili in CSV"""
+
+    def __init__(self, titolo: str, intestazione: List[str], righe: List[tuple]):
+        self.titolo = titolo
+        self.intestazione = intestazione
+        self.righe = righe
+
+    def __iter__(self):
+        return iter(self.righe)
+
+    def __len__(self):
+        return len(self.righe)
+
+    def esporta_csv(self, percorso: str):
+        with open(percorso, 'w', newline='', encoding='utf-8') as f:
+            scrittore = csv.writer(f)
+            scrittore.writerow(self.intestazione)
+            scrittore.writerows(self.righe)
+
+    def stampa(self):
+        larghezze = [len(nome) for nome in self.intestazione]
+        for riga in self.righe:
+            larghezze = [max(larghezza, len(str(valore))) for larghezza, valore in zip(larghezze, riga)]
+        print(f"\n{self.titolo.upper()}")
+        print("  ".join(f"{nome:>{larghezza}}" for nome, larghezza in zip(self.intestazione, larghezze)))
+        for riga in self.righe:
+            print("  ".join(f"{valore:>{larghezza}}" for valore, larghezza in zip(riga, larghezze)))
+
+
+def _controlla_periodo(periodo):
+    if isinstance(periodo, datetime.timedelta):
+        if periodo < UN_MICROSECONDO:
+            raise ValueError(f"Periodo non valido: {periodo}")
+    elif periodo not in PERIODI:
+        raise ValueError(f"Periodo non supportato: {periodo}")
+
+
+def _chiave_periodo(microsecondi: int, periodo) -> int:
+    """Numero dell'intervallo che contiene la data (stessa numerazione di chiavi_periodo)"""
+    if isinstance(periodo, datetime.timedelta):
+        return microsecondi // (periodo // UN_MICROSECONDO)
+    giorno = microsecondi // MICROSECONDI_GIORNO
+    if periodo == "giorno":
+        return giorno
+    if periodo == "settimana":
+        # Le settimane iniziano di lunedì; il 1970-01-01 era un giovedì
+        return giorno - (giorno + 3) % 7
+    data = EPOCA + datetime.timedelta(microseconds=microsecondi)
+    if periodo == "mese":
+        return (data.year - 1970) * 12 + data.month - 1
+    return data.year - 1970
+
+
+def chiavi_periodo(microsecondi, periodo):
+    """Per ogni data (microsecondi dall'epoca) il numero dell'intervallo che la contiene"""
+    _controlla_periodo(periodo)
+    if np is None:
+        return [_chiave_periodo(valore, periodo) for valore in microsecondi]
+
+    if isinstance(periodo, datetime.timedelta):
+        return microsecondi // (periodo // UN_MICROSECONDO)
+    if periodo == "mese":
+        return microsecondi.astype('datetime64[us]').astype('datetime64[M]').astype(np.int64)
+    if periodo == "anno":
+        return microsecondi.astype('datetime64[us]').astype('datetime64[Y]').astype(np.int64)
+    giorni = microsecondi // MICROSECONDI_GIORNO
+    if periodo == "giorno":
+        return giorni
+    return giorni - (giorni + 3) % 7
+
+
+def etichetta_periodo(chiave: int, periodo) -> str:
+    if isinstance(periodo, datetime.timedelta):
+        return (EPOCA + chiave * periodo).isoformat(sep=" ")
+    if periodo == "mese":
+        return f"{1970 + chiave // 12}-{chiave % 12 + 1:02d}"
+    if periodo == "anno":
+        return str(1970 + chiave)
+    return (EPOCA + datetime.timedelta(days=chiave)).date().isoformat()
+
+
+def raggruppa(chiavi, valori, quantili=()):
+    """Conteggio, somma e quantili dei valori per chiave, in ordine di chiave.
+
+    Restituisce (chiavi, conteggi, somme, [valori del quantile q per ogni q]),
+    tutte liste Python. Il quantile q di un gruppo di n valori è l'elemento
+    di posizione int((n - 1) * q) tra i valori ordinati.
+    """
+    if np is None:
+        gruppi: Dict[int, list] = {}
+        for chiave, valore in zip(chiavi, valori):
+            gruppi.setdefault(chiave, []).append(valore)
+        ordinate = sorted(gruppi)
+        for chiave in ordinate:
+            gruppi[chiave].sort()
+        return (ordinate, [len(gruppi[chiave]) for chiave in ordinate],
+                [sum(gruppi[chiave]) for chiave in ordinate],
+                [[gruppi[chiave][int((len(gruppi[chiave]) - 1) * q)] for chiave in ordinate]
+                 for q in quantili])
+
+    chiavi_uniche, gruppo = np.unique(chiavi, return_inverse=True)
+    conteggi = np.bincount(gruppo, minlength=len(chiavi_uniche))
+    somme = np.bincount(gruppo, weights=valori, minlength=len(chiavi_uniche))
+    valori_quantili = []
+    if quantili:
+        # Ordinati per gruppo e, dentro il gruppo, per valore: ogni gruppo è un tratto contiguo
+        ordinati = valori[np.lexsort((valori, gruppo))]
+        inizi = np.cumsum(conteggi) - conteggi
+        for q in quantili:
+            valori_quantili.append(ordinati[inizi + ((conteggi - 1) * q).astype(np.int64)].tolist())
+    return chiavi_uniche.tolist(), conteggi.tolist(), somme.tolist(), valori_quantili
+
+
+class MotoreReport:
+    """Report raggruppati per intervalli di tempo sulle richieste di un SistemaGestioneRiparazioni.
+
+    Le colonne vengono ricostruite, e la cache dei report svuotata, solo
+    quando la generazione del sistema cambia, cioè dopo una modifica.
+    """
+
+    def __init__(self, sistema: SistemaGestioneRiparazioni):
+        self.sistema = sistema
+        self._generazione: Optional[int] = None
+        self._colonne: Optional[ColonneRichieste] = None
+        self._cache: Dict[tuple, Report] = {}
+
+    @property
+    def colonne(self) -> ColonneRichieste:
+        if self._generazione != self.sistema.generazione:
+            self._colonne = ColonneRichieste(self._tutte_le_richieste())
+            self._cache.clear()
+            self._generazione = self.sistema.generazione
+        return self._colonne
+
+    def _tutte_le_richieste(self):
+        """Attive e archiviate; l'archivio freddo si legge in sequenza invece che una richiesta alla volta"""
+        archivio = self.sistema.archivio_freddo
+        if archivio is None:
+            return self.sistema.richieste.values()
+        return itertools.chain(self.sistema.richieste_attive().values(), archivio.scorri())
+
+    def _in_cache(self, chiave: tuple, calcola) -> Report:
+        colonne = self.colonne
+        report = self._cache.get(chiave)
+        if report is None:
+            report = self._cache[chiave] = calcola(colonne)
+        return report
+
+    def fatturato(self, periodo="mese") -> Report:
+        """Riparazioni fatturate (costo_finale > 0) e incasso, per data di completamento"""
+        _controlla_periodo(periodo)
+
+        def calcola(c: ColonneRichieste) -> Report:
+            if np is not None:
+                scelte = (c.data_completamento != MANCANTE) & (c.costo_finale > 0)
+                date, costi = c.data_completamento[scelte], c.costo_finale[scelte]
+            else:
+                scelte = [i for i in range(len(c))
+                          if c.data_completamento[i] != MANCANTE and c.costo_finale[i] > 0]
+                date = [c.data_completamento[i] for i in scelte]
+                costi = [c.costo_finale[i] for i in scelte]
+            chiavi, conteggi, somme, _ = raggruppa(chiavi_periodo(date, periodo), costi)
+            righe = [(etichetta_periodo(chiave, periodo), n, round(somma, 2), round(somma / n, 2))
+                     for chiave, n, somma in zip(chiavi, conteggi, somme)]
+            return Report("Fatturato", ["periodo", "riparazioni", "fatturato", "medio"], righe)
+
+        return self._in_cache(("fatturato", periodo), calcola)
+
+    def scostamento_preventivi(self, periodo="mese") -> Report:
+        """Costo stimato contro costo finale delle riparazioni completate con entrambi i costi"""
+        _controlla_periodo(periodo)
+
+        def calcola(c: ColonneRichieste) -> Report:
+            if np is not None:
+                scelte = ((c.data_completamento != MANCANTE) & (c.costo_stimato > 0)
+                          & (c.costo_finale > 0))
+                date, stimati = c.data_completamento[scelte], c.costo_stimato[scelte]
+                finali = c.costo_finale[scelte]
+            else:
+                scelte = [i for i in range(len(c)) if c.data_completamento[i] != MANCANTE
+                          and c.costo_stimato[i] > 0 and c.costo_finale[i] > 0]
+                date = [c.data_completamento[i] for i in scelte]
+                stimati = [c.costo_stimato[i] for i in scelte]
+                finali = [c.costo_finale[i] for i in scelte]
+            chiavi_date = chiavi_periodo(date, periodo)
+            chiavi, conteggi, somme_stimate, _ = raggruppa(chiavi_date, stimati)
+            _, _, somme_finali, _ = raggruppa(chiavi_date, finali)
+            righe = [(etichetta_periodo(chiave, periodo), n, round(stimato, 2), round(finale, 2),
+                      round(finale - stimato, 2), round((finale - stimato) / stimato * 100, 1))
+                     for chiave, n, stimato, finale in zip(chiavi, conteggi, somme_stimate, somme_finali)]
+            return Report("Scostamento dai preventivi",
+                          ["periodo", "riparazioni", "stimato", "finale", "scostamento", "scostamento_%"],
+                          righe)
+
+        return self._in_cache(("scostamento", periodo), calcola)
+
+    def tempi_lavorazione(self, per: str = "cliente", periodo=None) -> Report:
+        """Ore tra richiesta e completamento per cliente, modello o tipo (e per intervallo, se indicato)"""
+        if per not in ("cliente", "modello", "tipo"):
+            raise ValueError(f"Raggruppamento non supportato: {per}")
+        if periodo is not None:
+            _controlla_periodo(periodo)
+
+        def calcola(c: ColonneRichieste) -> Report:
+            etichette = [tipo.value for tipo in TIPI] if per == "tipo" else c.dizionario
+            # Una sola chiave intera per (intervallo, gruppo): intervallo * numero gruppi + gruppo
+            numero_gruppi = max(len(etichette), 1)
+            gruppi = getattr(c, per)
+            if np is not None:
+                scelte = c.data_completamento != MANCANTE
+                completamenti, richieste = c.data_completamento[scelte], c.data_richiesta[scelte]
+                ore = (completamenti - richieste) / MICROSECONDI_ORA
+                chiavi = gruppi[scelte].astype(np.int64)
+                if periodo is not None:
+                    chiavi += chiavi_periodo(richieste, periodo) * numero_gruppi
+            else:
+                scelte = [i for i in range(len(c)) if c.data_completamento[i] != MANCANTE]
+                richieste = [c.data_richiesta[i] for i in scelte]
+                ore = [(c.data_completamento[i] - c.data_richiesta[i]) / MICROSECONDI_ORA for i in scelte]
+                chiavi = [gruppi[i] for i in scelte]
+                if periodo is not None:
+                    chiavi = [chiave + intervallo * numero_gruppi
+                              for chiave, intervallo in zip(chiavi, chiavi_periodo(richieste, periodo))]
+
+            chiavi, conteggi, somme, (p50, p90) = raggruppa(chiavi, ore, (0.5, 0.9))
+            ordinate = []
+            for chiave, n, somma, mediana, novantesimo in zip(chiavi, conteggi, somme, p50, p90):
+                intervallo, gruppo = divmod(chiave, numero_gruppi)
+                riga = (etichette[gruppo], n, round(somma / n, 1), round(mediana, 1), round(novantesimo, 1))
+                if periodo is not None:
+                    riga = (etichetta_periodo(intervallo, periodo),) + riga
+                # I codici di clienti e modelli seguono l'ordine di lettura delle
+                # richieste: le righe vanno in ordine alfabetico dentro l'intervallo
+                ordinate.append((intervallo, gruppo if per == "tipo" else etichette[gruppo], riga))
+            righe = [riga for _, _, riga in sorted(ordinate)]
+            intestazione = [per, "riparazioni", "media_ore", "p50_ore", "p90_ore"]
+            if periodo is not None:
+                intestazione.insert(0, "periodo")
+            return Report(f"Tempi di lavorazione per {per}", intestazione, righe)
+
+        return self._in_cache(("tempi", per, periodo), calcola)
+
+    def arretrato(self, periodo="settimana") -> Report:
+        """Richieste aperte e chiuse per intervallo e arretrato (ancora aperte) alla fine di ciascuno.
+
+        Una richiesta è chiusa alla data di completamento; quelle consegnate
+        o annullate senza data di completamento sono escluse, perché non si
+        sa quando sono uscite dall'arretrato.
+        """
+        _controlla_periodo(periodo)
+
+        def calcola(c: ColonneRichieste) -> Report:
+            if np is not None:
+                completate = c.data_completamento != MANCANTE
+                senza_data = np.isin(c.stato, list(CODICI_CHIUSI)) & ~completate
+                aperture = c.data_richiesta[~senza_data]
+                chiusure = c.data_completamento[completate]
+                uno_aperture = np.ones(len(aperture))
+                uno_chiusure = np.ones(len(chiusure))
+            else:
+                aperture = [c.data_richiesta[i] for i in range(len(c))
+                            if c.data_completamento[i] != MANCANTE or c.stato[i] not in CODICI_CHIUSI]
+                chiusure = [valore for valore in c.data_completamento if valore != MANCANTE]
+                uno_aperture = [1] * len(aperture)
+                uno_chiusure = [1] * len(chiusure)
+            chiavi_a, aperte, _, _ = raggruppa(chiavi_periodo(aperture, periodo), uno_aperture)
+            chiavi_c, chiuse, _, _ = raggruppa(chiavi_periodo(chiusure, periodo), uno_chiusure)
+            aperte_per_chiave = dict(zip(chiavi_a, aperte))
+            chiuse_per_chiave = dict(zip(chiavi_c, chiuse))
+
+            righe = []
+            in_arretrato = 0
+            for chiave in sorted(aperte_per_chiave.keys() | chiuse_per_chiave.keys()):
+                nuove = aperte_per_chiave.get(chiave, 0)
+                completate_ora = chiuse_per_chiave.get(chiave, 0)
+                in_arretrato += nuove - completate_ora
+                righe.append((etichetta_periodo(chiave, periodo), nuove, completate_ora, in_arretrato))
+            return Report("Arretrato", ["periodo", "aperte", "chiuse", "arretrato"], righe)
+
+        return self._in_cache(("arretrato", periodo), calcola)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("report", choices=["fatturato", "scostamento", "tempi", "arretrato"])
+    parser.add_argument("--periodo", choices=PERIODI, default=None)
+    parser.add_argument("--giorni", type=int, default=None, help="intervalli di N giorni")
+    parser.add_argument("--per", choices=["cliente", "modello", "tipo"], default="cliente")
+    parser.add_argument("--file-dati", default="riparazioni.json")
+    parser.add_argument("--backend", choices=["json", "sqlite"], default="json")
+    parser.add_argument("--csv", default="", help="esporta il report nel file CSV indicato")
+    argomenti = parser.parse_args()
+
+    periodo = argomenti.periodo
+    if argomenti.giorni:
+        periodo = datetime.timedelta(days=argomenti.giorni)
+
+    # Il report legge l'archivio senza modificarlo: l'archivio freddo viene
+    # letto solo se esiste già, così le richieste chiuse contano ma nessuna
+    # richiesta viene spostata
+    archivio_freddo = argomenti.backend == "json" and os.path.exists(argomenti.file_dati + ".freddo.indice")
+    sistema = SistemaGestioneRiparazioni(argomenti.file_dati, journal=True, backend=argomenti.backend,
+                                         caricamento_tollerante=True, archivio_freddo=archivio_freddo,
+                                         sola_lettura=True)
+    motore = MotoreReport(sistema)
+    if argomenti.report == "fatturato":
+        report = motore.fatturato(periodo or "mese")
+    elif argomenti.report == "scostamento":
+        report = motore.scostamento_preventivi(periodo or "mese")
+    elif argomenti.report == "tempi":
+        report = motore.tempi_lavorazione(argomenti.per, periodo)
+    else:
+        report = motore.arretrato(periodo or "settimana")
+
+    report.stampa()
+    if argomenti.csv:
+        report.esporta_csv(argomenti.csv)
+        print(f"\n{len(report)} righe esportate in {argomenti.csv}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,601 @@
+"""Servizio HTTP/JSON locale sopra SistemaGestioneRiparazioni.
+
+Uso:
+    python servizio_http_riparazioni.py [--host 127.0.0.1] [--porta 8080]
+                                        [--file-dati riparazioni.json] [--backend json|sqlite]
+                                        [--metriche] [--soglia-lenta-ms 200] [--log-lente lente.jsonl]
+                                        [--feed-modifiche]
+
+Endpoint:
+    POST  /richieste                  crea una richiesta (stessi campi dell'importazione)
+    GET   /richieste/<id>             dettaglio di una richiesta
+    PATCH /richieste/<id>             aggiorna stato, tecnico_assegnato, costi o aggiunge una nota;
+                                      con "versione" la modifica fallisce (409) se nel frattempo
+                                      la richiesta è cambiata
+    GET   /richieste?termine=&stato=&cliente=&tipo=&archivio=1&pagina=1&per_pagina=50
+                                      (con refusi=1 anche i clienti scritti in modo simile)
+    GET   /richieste?...&formato=ndjson   tutti i risultati in streaming, una richiesta per riga
+    GET   /statistiche
+    GET   /metriche                   conteggi, latenze, byte scritti e ultime operazioni lente
+    PATCH /metriche                   {"attiva": true|false, "soglia_lenta_ms": 200}
+    GET   /modifiche?dopo=0&massimo=1000  eventi del feed delle modifiche dopo l'offset indicato
+                                      (con --feed-modifiche); "ultimo_offset" è il prossimo "dopo"
+
+Tutto lo stato viene letto e modificato nel thread dell'event loop. Le
+scritture su disco invece vengono raggruppate (group commit) ed eseguite in
+un executor: la risposta a una modifica parte solo quando il gruppo che la
+contiene è durevole, mentre le letture vedono subito le modifiche in memoria.
+Con SQLite le richieste modificate restano fissate in memoria finché il loro
+gruppo non è nel database, e la ricerca le unisce ai risultati della query.
+Anche gli ID delle nuove richieste vengono riservati nell'executor, a blocchi,
+e la lettura dell'archivio freddo (archivio=1) gira in un executor a parte.
+Le ricerche producono solo gli ID: ogni pagina o blocco dello streaming
+legge le sole richieste che contiene.
+"""
+import argparse
+import asyncio
+import datetime
+import heapq
+import json
+import signal
+import sqlite3
+import sys
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from Gestionale_riparazioni_azienda import (
+    SistemaGestioneRiparazioni, ArchivioSQLite, ConflittoVersione,
+    StatoRiparazione, TipoIntervento, valida_riga_importazione
+)
+
+MOTIVI = {200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found",
+          405: "Method Not Allowed", 409: "Conflict", 413: "Payload Too Large",
+          500: "Internal Server Error"}
+
+DIMENSIONE_MASSIMA_CORPO = 1 << 20
+PER_PAGINA_PREDEFINITO = 50
+PER_PAGINA_MASSIMO = 1000
+RIGHE_PER_BLOCCO = 200
+# ID riservati per volta: con SQLite ogni prenotazione è una transazione IMMEDIATE
+BLOCCO_ID = 100
+
+
+class ErroreHTTP(Exception):
+    def __init__(self, stato: int, messaggio: str):
+        super().__init__(messaggio)
+        self.stato = stato
+        self.messaggio = messaggio
+
+
+class CommitDiGruppo:
+    """Rende durevoli in un'unica scrittura tutte le modifiche arrivate nel frattempo.
+
+    Mentre un gruppo viene scritto nell'executor, le nuove modifiche si
+    accumulano nella coda del sistema e formano il gruppo successivo: più
+    client scrivono in parallelo, meno fsync servono per ciascuno.
+    """
+
+    def __init__(self, sistema: SistemaGestioneRiparazioni):
+        self.sistema = sistema
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="persistenza")
+        # Con SQLite lo scrittore usa una connessione propria, separata da quella delle letture
+        self.archivio_scrittura: Optional[ArchivioSQLite] = None
+        self._riserva_originale = sistema.sequenze.riserva_esterna
+        if sistema.archivio_sqlite:
+            self.archivio_scrittura = ArchivioSQLite(sistema.archivio_sqlite.percorso)
+            # Gli ID si riservano solo nell'executor, quindi con la connessione dello scrittore
+            sistema.sequenze.riserva_esterna = self.archivio_scrittura.riserva_sequenza
+        self._attese: List[asyncio.Future] = []
+        self._segnale = asyncio.Event()
+        self._attivita: Optional[asyncio.Task] = None
+        self.gruppi_scritti = 0
+        self.record_scritti = 0
+        sistema.scrittura_differita = True
+
+    def avvia(self):
+        self._attivita = asyncio.get_running_loop().create_task(self._ciclo())
+
+    async def chiudi(self):
+        # Le modifiche ancora in coda vengono scritte prima di fermarsi
+        await self.conferma()
+        self._attivita.cancel()
+        self.executor.shutdown(wait=True)
+        self.sistema.sequenze.riserva_esterna = self._riserva_originale
+        if self.archivio_scrittura:
+            self.archivio_scrittura.chiudi()
+        self.sistema.scrittura_differita = False
+
+    def conferma(self) -> asyncio.Future:
+        """Future completato quando le modifiche già fatte in memoria sono su disco.
+
+        Il risultato è il dizionario dei conflitti di versione rilevati da
+        SQLite nel gruppo (id richiesta -> ConflittoVersione).
+        """
+        attesa = asyncio.get_running_loop().create_future()
+        self._attese.append(attesa)
+        self._segnale.set()
+        return attesa
+
+    async def _ciclo(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._segnale.wait()
+            self._segnale.clear()
+            attese, self._attese = self._attese, []
+            records = self.sistema.preleva_record_in_sospeso()
+            eventi = self.sistema.preleva_eventi_in_sospeso()
+            try:
+                conflitti = await self._scrivi(loop, records)
+                # Solo le modifiche confermate producono eventi
+                eventi = [evento for evento in eventi if evento['id_richiesta'] not in conflitti]
+                if eventi:
+                    await loop.run_in_executor(self.executor, self.sistema.pubblica_eventi, eventi)
+            except Exception as e:
+                for attesa in attese:
+                    if not attesa.done():
+                        attesa.set_exception(e)
+                continue
+            self.gruppi_scritti += 1
+            self.record_scritti += len(records)
+            for attesa in attese:
+                if not attesa.done():
+                    attesa.set_result(conflitti)
+
+    async def _scrivi(self, loop, records: List[dict]) -> Dict[str, ConflittoVersione]:
+        if not records:
+            return {}
+        sistema = self.sistema
+
+        if self.archivio_scrittura:
+            try:
+                conflitti = await loop.run_in_executor(self.executor, self._applica_sqlite, records)
+                if conflitti:
+                    sistema.dimentica_modifiche(conflitti)
+            except sqlite3.Error:
+                # Il gruppo non è (tutto) nel database: le richieste verranno rilette da lì
+                sistema.dimentica_modifiche(record.get('id') or record['richiesta']['id_richiesta']
+                                            for record in records)
+                raise
+            finally:
+                # Le richieste scritte (o scartate) non serve più tenerle fissate in memoria
+                sistema.rilascia_record_scritti(records)
+            return conflitti
+
+        if sistema.usa_journal and sistema.record_non_compattati < sistema.soglia_compattazione:
+            await loop.run_in_executor(self.executor, sistema.journal.aggiungi_molti, records)
+            return {}
+
+        # Compattazione (o salvataggio senza journal): la copia dello stato si
+        # prepara qui, così lo snapshot comprende esattamente i record già numerati
+        dati = sistema.prepara_snapshot()
+        await loop.run_in_executor(self.executor, self._scrivi_snapshot, dati)
+        sistema.record_non_compattati = 0
+        return {}
+
+    def _scrivi_snapshot(self, dati: dict):
+        self.sistema.scrivi_snapshot(dati)
+        if self.sistema.usa_journal:
+            self.sistema.journal.svuota()
+
+    def _applica_sqlite(self, records: List[dict]) -> Dict[str, ConflittoVersione]:
+        try:
+            self.archivio_scrittura.applica_molti(records)
+            return {}
+        except ConflittoVersione:
+            pass
+        # La transazione di gruppo è stata annullata: si riapplicano i record uno per
+        # uno, così solo quelli in conflitto vengono rifiutati
+        conflitti = {}
+        for record in records:
+            try:
+                self.archivio_scrittura.applica(record)
+            except ConflittoVersione as e:
+                conflitti[e.id_richiesta] = e
+        return conflitti
+
+
+class ServizioRiparazioni:
+    """Server HTTP/1.1 con connessioni keep-alive, scritto solo con asyncio"""
+
+    def __init__(self, sistema: SistemaGestioneRiparazioni, host: str = "127.0.0.1",
+                 porta: int = 8080, timeout_inattivita: float = 30.0):
+        if sistema.condiviso:
+            raise ValueError("Il servizio deve essere l'unico processo che scrive sull'archivio")
+        if sistema.caricamento_fallito:
+            raise ValueError(f"{sistema.file_dati} non è stato caricato correttamente")
+        self.sistema = sistema
+        self.host = host
+        self.porta = porta
+        self.timeout_inattivita = timeout_inattivita
+        self.commit: Optional[CommitDiGruppo] = None
+        self.server: Optional[asyncio.AbstractServer] = None
+        self._connessioni = set()
+        # (id richiesta, id pezzo) già riservati, con il giorno della prenotazione
+        self._id_liberi = deque()
+        self._giorno_id: Optional[datetime.date] = None
+        # Letture lunghe (archivio freddo) fuori dal loop e fuori dall'executor delle scritture
+        self.letture = ThreadPoolExecutor(max_workers=2, thread_name_prefix="letture")
+
+    async def avvia(self):
+        self.commit = CommitDiGruppo(self.sistema)
+        self.commit.avvia()
+        self.server = await asyncio.start_server(self._gestisci_connessione, self.host, self.porta)
+        # Con porta 0 il sistema operativo ne sceglie una libera
+        self.porta = self.server.sockets[0].getsockname()[1]
+
+    async def chiudi(self):
+        self.server.close()
+        # Le connessioni keep-alive inattive vengono chiuse: i loro gestori terminano da soli
+        for writer in list(self._connessioni):
+            writer.close()
+        await self.server.wait_closed()
+        await self.commit.chiudi()
+        self.letture.shutdown(wait=True)
+
+    # --- protocollo HTTP ---
+
+    async def _gestisci_connessione(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._connessioni.add(writer)
+        try:
+            while True:
+                try:
+                    intestazione = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"),
+                                                          self.timeout_inattivita)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    break
+                except asyncio.LimitOverrunError:
+                    await self._rispondi(writer, 413, {'errore': "intestazioni troppo lunghe"}, True)
+                    break
+
+                try:
+                    metodo, destinazione, versione, intestazioni = self._analizza(intestazione)
+                except ErroreHTTP as e:
+                    await self._rispondi(writer, e.stato, {'errore': e.messaggio}, True)
+                    break
+
+                chiudi = (intestazioni.get('connection', '').lower() == 'close' or
+                          (versione == 'HTTP/1.0' and
+                           intestazioni.get('connection', '').lower() != 'keep-alive'))
+                try:
+                    lunghezza = int(intestazioni.get('content-length', 0))
+                except ValueError:
+                    await self._rispondi(writer, 400, {'errore': "Content-Length non valido"}, True)
+                    break
+                if lunghezza > DIMENSIONE_MASSIMA_CORPO:
+                    await self._rispondi(writer, 413, {'errore': "corpo troppo grande"}, True)
+                    break
+                corpo = await reader.readexactly(lunghezza) if lunghezza else b""
+
+                await self._servi(writer, metodo, destinazione, corpo, chiudi)
+                if chiudi:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._connessioni.discard(writer)
+            writer.close()
+
+    @staticmethod
+    def _analizza(intestazione: bytes):
+        righe = intestazione.decode('latin-1').split("\r\n")
+        try:
+            metodo, destinazione, versione = righe[0].split(" ")
+        except ValueError:
+            raise ErroreHTTP(400, "riga di richiesta non valida")
+        intestazioni = {}
+        for riga in righe[1:]:
+            if riga:
+                nome, _, valore = riga.partition(":")
+                intestazioni[nome.strip().lower()] = valore.strip()
+        return metodo.upper(), destinazione, versione, intestazioni
+
+    async def _servi(self, writer, metodo: str, destinazione: str, corpo: bytes, chiudi: bool):
+        url = urlsplit(destinazione)
+        parametri = {chiave: valori[-1] for chiave, valori in parse_qs(url.query).items()}
+        parti = [unquote(parte) for parte in url.path.strip("/").split("/")]
+        try:
+            if parti == ["richieste"] and metodo == "GET":
+                if parametri.get('formato') == 'ndjson':
+                    await self._cerca_in_streaming(writer, parametri, chiudi)
+                    return
+                stato, dati = 200, await self._cerca(parametri)
+            elif parti == ["richieste"] and metodo == "POST":
+                stato, dati = 201, await self._crea(self._json(corpo))
+            elif len(parti) == 2 and parti[0] == "richieste" and metodo == "GET":
+                stato, dati = 200, self._richiesta(parti[1]).to_dict(con_versione=True)
+            elif len(parti) == 2 and parti[0] == "richieste" and metodo == "PATCH":
+                stato, dati = 200, await self._aggiorna(parti[1], self._json(corpo))
+            elif parti == ["statistiche"] and metodo == "GET":
+                stato, dati = 200, self._statistiche()
+            elif parti == ["modifiche"] and metodo == "GET":
+                stato, dati = 200, self._modifiche(parametri)
+            elif parti == ["metriche"] and metodo == "GET":
+                stato, dati = 200, self._metriche()
+            elif parti == ["metriche"] and metodo == "PATCH":
+                stato, dati = 200, self._imposta_metriche(self._json(corpo))
+            elif parti[0] in ("richieste", "statistiche", "metriche", "modifiche"):
+                raise ErroreHTTP(405, f"metodo {metodo} non consentito")
+            else:
+                raise ErroreHTTP(404, f"percorso {url.path} inesistente")
+        except ErroreHTTP as e:
+            stato, dati = e.stato, {'errore': e.messaggio}
+        except Exception:
+            # I dettagli restano nel log del servizio, non arrivano al client
+            print(f"Errore interno servendo {metodo} {url.path}:", file=sys.stderr)
+            traceback.print_exc()
+            stato, dati = 500, {'errore': "errore interno del servizio"}
+        await self._rispondi(writer, stato, dati, chiudi)
+
+    @staticmethod
+    async def _rispondi(writer, stato: int, dati, chiudi: bool):
+        corpo = json.dumps(dati, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        writer.write(
+            f"HTTP/1.1 {stato} {MOTIVI[stato]}\r\n"
+            f"Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(corpo)}\r\n"
+            f"Connection: {'close' if chiudi else 'keep-alive'}\r\n\r\n".encode('latin-1') + corpo)
+        await writer.drain()
+
+    @staticmethod
+    def _json(corpo: bytes) -> dict:
+        try:
+            dati = json.loads(corpo or b"{}")
+        except (ValueError, UnicodeDecodeError) as e:
+            raise ErroreHTTP(400, f"JSON non valido: {e}")
+        if not isinstance(dati, dict):
+            raise ErroreHTTP(400, "il corpo deve essere un oggetto JSON")
+        return dati
+
+    # --- operazioni ---
+
+    def _richiesta(self, id_richiesta: str):
+        if id_richiesta not in self.sistema.richieste:
+            raise ErroreHTTP(404, f"richiesta {id_richiesta} inesistente")
+        return self.sistema.richieste[id_richiesta]
+
+    async def _risultati(self, parametri: dict) -> list:
+        """ID delle richieste trovate, dalla più recente (richieste già lette se c'è l'archivio freddo)"""
+        stato = tipo = None
+        try:
+            if parametri.get('stato'):
+                stato = StatoRiparazione(parametri['stato'])
+            if parametri.get('tipo'):
+                tipo = TipoIntervento(parametri['tipo'])
+        except ValueError as e:
+            raise ErroreHTTP(400, str(e))
+        sistema = self.sistema
+        termine = parametri.get('termine', "")
+        cliente = parametri.get('cliente', "")
+        if cliente and parametri.get('refusi') == '1':
+            cliente = sistema.varianti_cliente(cliente)
+        ids = sistema.cerca_id_richieste(termine, stato, cliente, tipo)
+        if parametri.get('archivio') != '1' or sistema.archivio_freddo is None:
+            return ids
+
+        archiviate = await asyncio.get_running_loop().run_in_executor(
+            self.letture, sistema.cerca_nell_archivio, termine, stato, cliente, tipo)
+        # L'archivio freddo esiste solo con JSON: le richieste attive sono già in memoria
+        attive = [sistema.richieste[id_richiesta] for id_richiesta in ids]
+        return list(heapq.merge(attive, archiviate, key=lambda r: r.data_richiesta, reverse=True))
+
+    def _in_dict(self, voce) -> dict:
+        richiesta = self.sistema.richieste[voce] if isinstance(voce, str) else voce
+        return richiesta.to_dict(con_versione=True)
+
+    async def _cerca(self, parametri: dict) -> dict:
+        try:
+            pagina = max(1, int(parametri.get('pagina', 1)))
+            per_pagina = min(PER_PAGINA_MASSIMO,
+                             max(1, int(parametri.get('per_pagina', PER_PAGINA_PREDEFINITO))))
+        except ValueError:
+            raise ErroreHTTP(400, "pagina e per_pagina devono essere numeri interi")
+        risultati = await self._risultati(parametri)
+        inizio = (pagina - 1) * per_pagina
+        return {
+            'totale': len(risultati),
+            'pagina': pagina,
+            'per_pagina': per_pagina,
+            'risultati': [self._in_dict(voce) for voce in risultati[inizio:inizio + per_pagina]]
+        }
+
+    async def _cerca_in_streaming(self, writer, parametri: dict, chiudi: bool):
+        try:
+            risultati = await self._risultati(parametri)
+        except ErroreHTTP as e:
+            await self._rispondi(writer, e.stato, {'errore': e.messaggio}, chiudi)
+            return
+
+        writer.write(
+            f"HTTP/1.1 200 OK\r\n"
+            f"Content-Type: application/x-ndjson; charset=utf-8\r\n"
+            f"Transfer-Encoding: chunked\r\n"
+            f"Connection: {'close' if chiudi else 'keep-alive'}\r\n\r\n".encode('latin-1'))
+        # Un blocco ogni RIGHE_PER_BLOCCO richieste, lette solo quando tocca a loro:
+        # drain() lascia spazio alle altre connessioni e non accumula in memoria
+        # tutta la risposta
+        for inizio in range(0, len(risultati), RIGHE_PER_BLOCCO):
+            blocco = "".join(
+                json.dumps(self._in_dict(voce), ensure_ascii=False, separators=(',', ':')) + "\n"
+                for voce in risultati[inizio:inizio + RIGHE_PER_BLOCCO]).encode('utf-8')
+            writer.write(f"{len(blocco):x}\r\n".encode('latin-1') + blocco + b"\r\n")
+            await writer.drain()
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def _nuovi_id(self) -> tuple:
+        """(id richiesta, id pezzo) per una nuova richiesta, da un blocco riservato nell'executor.
+
+        Con SQLite la prenotazione tiene il database in scrittura: fatta sul
+        loop lo fermerebbe mentre lo scrittore sta confermando un gruppo. Gli
+        ID rimasti inutilizzati alla chiusura lasciano solo un buco nella numerazione.
+        """
+        oggi = datetime.date.today()
+        if oggi != self._giorno_id:
+            # Gli ID portano la data: quelli di ieri non si usano più
+            self._id_liberi.clear()
+            self._giorno_id = oggi
+        while not self._id_liberi:
+            self._id_liberi.extend(await asyncio.get_running_loop().run_in_executor(
+                self.commit.executor, self._riserva_id))
+        return self._id_liberi.popleft()
+
+    def _riserva_id(self) -> list:
+        return list(zip(self.sistema.riserva_id_richieste(BLOCCO_ID), self.sistema.riserva_id_pezzi(BLOCCO_ID)))
+
+    async def _crea(self, dati: dict) -> dict:
+        try:
+            riga = valida_riga_importazione(dati)
+        except ValueError as e:
+            raise ErroreHTTP(400, str(e))
+
+        sistema = self.sistema
+        id_richiesta, id_pezzo = await self._nuovi_id()
+        sistema.crea_richiesta_riparazione(
+            riga['nome_pezzo'], riga['modello'], riga['numero_serie'], riga['cliente'],
+            riga['descrizione_problema'], riga['tipo_intervento'], riga['priorita'],
+            id_richiesta=id_richiesta, id_pezzo=id_pezzo)
+        aggiornamenti = {}
+        if riga['tecnico_assegnato']:
+            aggiornamenti['tecnico_assegnato'] = riga['tecnico_assegnato']
+        if riga['costo_stimato'] is not None:
+            aggiornamenti['costo_stimato'] = riga['costo_stimato']
+        if aggiornamenti:
+            sistema.aggiorna_richiesta(id_richiesta, **aggiornamenti)
+
+        await self.commit.conferma()
+        return sistema.richieste[id_richiesta].to_dict(con_versione=True)
+
+    async def _aggiorna(self, id_richiesta: str, dati: dict) -> dict:
+        self._richiesta(id_richiesta)
+        modifiche = {}
+        try:
+            if 'stato' in dati:
+                modifiche['stato'] = StatoRiparazione(dati['stato'])
+            if 'tecnico_assegnato' in dati:
+                modifiche['tecnico_assegnato'] = str(dati['tecnico_assegnato']).strip()
+            for campo in ('costo_stimato', 'costo_finale'):
+                if campo in dati:
+                    modifiche[campo] = float(dati[campo])
+            if dati.get('nota'):
+                modifiche['nota'] = str(dati['nota'])
+                modifiche['tecnico_nota'] = str(dati.get('tecnico_nota', ""))
+            versione = int(dati['versione']) if 'versione' in dati else None
+        except (TypeError, ValueError) as e:
+            raise ErroreHTTP(400, str(e))
+        if not modifiche:
+            raise ErroreHTTP(400, "nessun campo da aggiornare")
+
+        try:
+            self.sistema.aggiorna_richiesta(id_richiesta, versione_attesa=versione, **modifiche)
+        except ConflittoVersione as e:
+            raise ErroreHTTP(409, str(e))
+
+        conflitti = await self.commit.conferma()
+        if id_richiesta in conflitti:
+            raise ErroreHTTP(409, str(conflitti[id_richiesta]))
+        return self.sistema.richieste[id_richiesta].to_dict(con_versione=True)
+
+    def _statistiche(self) -> dict:
+        statistiche = self.sistema.statistiche
+        totale = statistiche.totale
+        return {
+            'totale_richieste': len(self.sistema.richieste),
+            'per_stato': {stato.value: gruppo.conteggio for stato, gruppo in statistiche.per_stato.items()},
+            'per_tipo': {tipo.value: gruppo.conteggio for tipo, gruppo in statistiche.per_tipo.items()},
+            'costi': {
+                'fatturate': totale.fatturate,
+                'totale': totale.somma,
+                'medio': totale.media if totale.fatturate else None,
+                'minimo': totale.minimo if totale.fatturate else None,
+                'massimo': totale.massimo if totale.fatturate else None,
+            },
+            'per_tecnico': {tecnico: {'richieste': gruppo.conteggio, 'fatturato': gruppo.somma}
+                            for tecnico, gruppo in statistiche.per_tecnico.items() if tecnico},
+            'ore_lavorazione': {tipo.value: {f"p{round(q * 100)}": valore for q, valore in
+                                             statistiche.quantili_lavorazione(tipo).items()}
+                                for tipo in statistiche.tempi_per_tipo},
+        }
+
+    def _modifiche(self, parametri: dict) -> dict:
+        if self.sistema.feed_modifiche is None:
+            raise ErroreHTTP(404, "feed delle modifiche non attivo (avviare con --feed-modifiche)")
+        try:
+            dopo = int(parametri.get('dopo', 0))
+            massimo = min(int(parametri.get('massimo', 1000)), 10000)
+        except ValueError:
+            raise ErroreHTTP(400, "dopo e massimo devono essere numeri interi")
+        eventi, ultimo = self.sistema.leggi_modifiche(dopo, massimo)
+        return {'eventi': eventi, 'ultimo_offset': ultimo}
+
+    def _metriche(self) -> dict:
+        metriche = self.sistema.strumentazione.riepilogo()
+        metriche['gruppi_scritti'] = self.commit.gruppi_scritti
+        metriche['record_scritti'] = self.commit.record_scritti
+        return metriche
+
+    def _imposta_metriche(self, dati: dict) -> dict:
+        strumentazione = self.sistema.strumentazione
+        if 'attiva' in dati:
+            if not isinstance(dati['attiva'], bool):
+                raise ErroreHTTP(400, "attiva deve essere true o false")
+            strumentazione.attiva = dati['attiva']
+        if 'soglia_lenta_ms' in dati:
+            try:
+                strumentazione.soglia_lenta_ms = float(dati['soglia_lenta_ms'])
+            except (TypeError, ValueError):
+                raise ErroreHTTP(400, "soglia_lenta_ms deve essere un numero")
+        return self._metriche()
+
+
+async def esegui_servizio(sistema: SistemaGestioneRiparazioni, host: str, porta: int):
+    servizio = ServizioRiparazioni(sistema, host, porta)
+    await servizio.avvia()
+    print(f"Servizio in ascolto su http://{host}:{servizio.porta}", flush=True)
+
+    fermo = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for segnale in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(segnale, fermo.set)
+        except NotImplementedError:
+            # Windows: Ctrl+C arriva come KeyboardInterrupt
+            pass
+    try:
+        await fermo.wait()
+    finally:
+        await servizio.chiudi()
+        sistema.compatta_journal()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--porta", type=int, default=8080)
+    parser.add_argument("--file-dati", default="riparazioni.json")
+    parser.add_argument("--backend", choices=["json", "sqlite"], default="json")
+    parser.add_argument("--metriche", action="store_true",
+                        help="misure attive dall'avvio (altrimenti con PATCH /metriche)")
+    parser.add_argument("--soglia-lenta-ms", type=float, default=200.0)
+    parser.add_argument("--log-lente", default=None,
+                        help="file in cui accodare le operazioni lente, una riga JSON ciascuna")
+    parser.add_argument("--feed-modifiche", action="store_true",
+                        help="scrive gli eventi di modifica in <file-dati>.eventi (GET /modifiche)")
+    argomenti = parser.parse_args()
+
+    sistema = SistemaGestioneRiparazioni(argomenti.file_dati, journal=True, backend=argomenti.backend,
+                                         caricamento_tollerante=True, strumentazione=argomenti.metriche,
+                                         feed_modifiche=argomenti.feed_modifiche)
+    sistema.strumentazione.soglia_lenta_ms = argomenti.soglia_lenta_ms
+    sistema.strumentazione.file_lente = argomenti.log_lente
+    try:
+        asyncio.run(esegui_servizio(sistema, argomenti.host, argomenti.porta))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Dati di prova comuni ai test: le stesse operazioni, ripetibili su qualsiasi archivio"""
+import random
+
+from Gestionale_riparazioni_azienda import StatoRiparazione, TipoIntervento
+
+CLIENTI = ["Merani", "Cremonesi", "Bianchi", "Rossi", "Ferrari", "De Luca"]
+# Un solo nome per modello: un pezzo riusato ha lo stesso nome passato dal chiamante
+PEZZI = [("kp 832", "kp 832"), ("pannello interfonico", "kp 12"), ("centralino", "cx 400"),
+         ("cuffia", "hs 20"), ("alimentatore", "pw 75"), ("display", "ds 7")]
+PROBLEMI = ["tasti 3 e 7 rotti", "non funziona l'audio della cuffia", "display spento",
+            "non si accende", "connettore 2 danneggiato", "firmware da aggiornare"]
+TECNICI = ["", "Marco", "Giulia", "Luca"]
+PRIORITA = ["Bassa", "Media", "Alta", "Urgente"]
+
+# (termine, stato, cliente, tipo)
+CASI_RICERCA = [
+    ("", None, "", None),
+    ("audio", None, "", None),
+    ("kp 8", None, "", None),
+    ("rip", None, "", None),
+    ("sn1", None, "", None),
+    ("xyz", None, "", None),
+    ("", StatoRiparazione.RICEVUTO, "", None),
+    ("", None, "ross", None),
+    ("", StatoRiparazione.IN_LAVORAZIONE, "", TipoIntervento.RIPARAZIONE),
+    ("display", None, "bianchi", None),
+]
+
+
+def popola(sistema, n: int = 120, seme: int = 7) -> list:
+    """Crea n richieste (alcune sullo stesso apparato) e ne aggiorna metà"""
+    rnd = random.Random(seme)
+    stati = list(StatoRiparazione)
+    tipi = list(TipoIntervento)
+    ids = []
+    for _ in range(n):
+        nome, modello = rnd.choice(PEZZI)
+        ids.append(sistema.crea_richiesta_riparazione(
+            nome, modello, f"SN{rnd.randrange(n // 3)}", rnd.choice(CLIENTI),
+            rnd.choice(PROBLEMI), rnd.choice(tipi), rnd.choice(PRIORITA), riusa_pezzo=True))
+    for id_richiesta in rnd.sample(ids, n // 2):
+        aggiornamenti = {'stato': rnd.choice(stati), 'tecnico_assegnato': rnd.choice(TECNICI),
+                         'costo_stimato': round(rnd.uniform(20, 400), 2)}
+        if rnd.random() < 0.5:
+            aggiornamenti['costo_finale'] = round(rnd.uniform(20, 400), 2)
+        if rnd.random() < 0.5:
+            aggiornamenti['nota'] = "verificato al banco"
+        sistema.aggiorna_richiesta(id_richiesta, **aggiornamenti)
+    return ids
+
+
+def stato_archivio(sistema) -> dict:
+    """Tutte le richieste come dizionari, per confrontare due archivi"""
+    return {richiesta.id_richiesta: richiesta.to_dict() for richiesta in sistema.richieste.values()}
+
+
+def senza_date(dati: dict) -> dict:
+    """Le date dipendono dall'istante di esecuzione: vanno escluse confrontando backend diversi"""
+    risultato = {}
+    for id_richiesta, richiesta in dati.items():
+        richiesta = dict(richiesta, pezzo=dict(richiesta['pezzo']))
+        del richiesta['data_richiesta'], richiesta['data_completamento'], richiesta['pezzo']['data_creazione']
+        richiesta['note_tecniche'] = [{k: v for k, v in nota.items() if k != 'timestamp'}
+                                      for nota in richiesta['note_tecniche']]
+        risultato[id_richiesta] = richiesta
+    return risultato
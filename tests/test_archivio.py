@@ -0,0 +1,137 @@
+"""Persistenza: journal, formati dello snapshot e backend devono ridare lo stesso archivio"""
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+
+from Gestionale_riparazioni_azienda import (
+    SistemaGestioneRiparazioni, StatoRiparazione, TipoIntervento, cerca_negli_shard
+)
+
+from .supporto import CASI_RICERCA, popola, senza_date, stato_archivio
+
+# nome del file, argomenti del costruttore
+MODALITA = [
+    ("riparazioni.json", {}),
+    ("riparazioni.json", {'journal': True}),
+    ("riparazioni.ripc", {}),
+    ("riparazioni.ripc", {'journal': True}),
+    ("riparazioni.json", {'journal': True, 'archivio_freddo': True}),
+    ("riparazioni.json", {'condiviso': True}),
+    ("riparazioni.json", {'shard': 'mese'}),
+    ("riparazioni.json", {'shard': 'hash', 'numero_shard': 4, 'processi': 2}),
+    ("riparazioni.db", {'backend': 'sqlite'}),
+]
+
+
+class TestPersistenza(unittest.TestCase):
+    def setUp(self):
+        self._cartella = tempfile.TemporaryDirectory()
+        self.cartella = self._cartella.name
+
+    def tearDown(self):
+        self._cartella.cleanup()
+
+    def apri(self, nome: str, **argomenti) -> SistemaGestioneRiparazioni:
+        return SistemaGestioneRiparazioni(os.path.join(self.cartella, nome), **argomenti)
+
+    def test_riapertura_in_ogni_modalita(self):
+        for nome, argomenti in MODALITA:
+            with self.subTest(file=nome, **argomenti):
+                sottocartella = tempfile.mkdtemp(dir=self.cartella)
+                percorso = os.path.join(sottocartella, nome)
+                sistema = SistemaGestioneRiparazioni(percorso, **argomenti)
+                popola(sistema)
+                sistema.salva_dati()
+                atteso = stato_archivio(sistema)
+
+                riaperto = SistemaGestioneRiparazioni(percorso, **argomenti)
+                self.assertFalse(riaperto.caricamento_fallito)
+                self.assertEqual(stato_archivio(riaperto), atteso)
+                self.assertEqual(riaperto.verifica_statistiche(), [])
+
+    def test_journal_riapplicato_come_in_memoria(self):
+        sistema = self.apri("riparazioni.json", journal=True, soglia_compattazione=10 ** 6)
+        popola(sistema)
+        # Nessuna compattazione: lo snapshot non esiste, tutto è nel journal
+        self.assertFalse(os.path.exists(sistema.file_dati))
+        self.assertGreater(sistema.record_non_compattati, 0)
+        atteso = stato_archivio(sistema)
+
+        riaperto = self.apri("riparazioni.json", journal=True, soglia_compattazione=10 ** 6)
+        self.assertEqual(stato_archivio(riaperto), atteso)
+        self.assertEqual(riaperto.seq_journal, sistema.seq_journal)
+
+        # Una compattazione interrotta prima di svuotare il journal non duplica le note
+        riaperto.salva_dati()
+        dopo_crash = self.apri("riparazioni.json", journal=True, soglia_compattazione=10 ** 6)
+        self.assertEqual(stato_archivio(dopo_crash), atteso)
+
+    def test_stessi_risultati_con_json_e_sqlite(self):
+        json_ = self.apri("riparazioni.json")
+        sqlite = self.apri("riparazioni.db", backend="sqlite")
+        popola(json_)
+        popola(sqlite)
+
+        self.assertEqual(senza_date(stato_archivio(sqlite)), senza_date(stato_archivio(json_)))
+        for termine, stato, cliente, tipo in CASI_RICERCA:
+            with self.subTest(termine=termine, stato=stato, cliente=cliente, tipo=tipo):
+                self.assertEqual(
+                    [r.id_richiesta for r in sqlite.cerca_richieste(termine, stato, cliente, tipo)],
+                    [r.id_richiesta for r in json_.cerca_richieste(termine, stato, cliente, tipo)])
+        self.assertEqual(sqlite.verifica_statistiche(), [])
+
+    def test_sqlite_richieste_in_coda_restano_visibili(self):
+        sistema = self.apri("riparazioni.db", backend="sqlite")
+        sistema.richieste.dimensione_cache = sistema.pezzi.dimensione_cache = 4
+        sistema.scrittura_differita = True
+        ids = [sistema.crea_richiesta_riparazione("cuffia", "hs 20", f"SN{i}", "Rossi", "audio assente",
+                                                  TipoIntervento.RIPARAZIONE) for i in range(20)]
+        # Più richieste in coda che posti nella cache: nessuna va persa prima della scrittura
+        self.assertEqual(len(sistema.richieste), 20)
+        self.assertEqual(sorted(r.id_richiesta for r in sistema.cerca_richieste("audio")), sorted(ids))
+
+        records = sistema.preleva_record_in_sospeso()
+        sistema.archivio_sqlite.applica_molti(records)
+        sistema.rilascia_record_scritti(records)
+        self.assertEqual(sistema.richieste.in_sospeso(), {})
+        self.assertEqual(sorted(r.id_richiesta for r in sistema.cerca_richieste("audio")), sorted(ids))
+
+    def test_shard_riscrive_solo_lo_shard_modificato(self):
+        sistema = self.apri("riparazioni.json", shard='hash', numero_shard=4)
+        popola(sistema)
+        sistema.salva_dati()
+        shard = {nome: os.path.getmtime(os.path.join(self.cartella, nome))
+                 for nome in os.listdir(self.cartella) if nome.startswith("riparazioni.h")}
+        self.assertEqual(len(shard), 4)
+
+        for nome in shard:
+            os.utime(os.path.join(self.cartella, nome), (0, 0))
+        sistema.crea_richiesta_riparazione("cuffia", "hs 20", "NUOVO1", "Rossi", "audio assente",
+                                           TipoIntervento.RIPARAZIONE)
+        riscritti = [nome for nome in shard if os.path.getmtime(os.path.join(self.cartella, nome)) != 0]
+        self.assertEqual(len(riscritti), 1)
+        self.assertEqual(stato_archivio(self.apri("riparazioni.json")), stato_archivio(sistema))
+
+
+    def test_cerca_negli_shard_vede_il_journal(self):
+        sistema = self.apri("riparazioni.json", shard='hash', numero_shard=4, journal=True,
+                            soglia_compattazione=10 ** 6)
+        salvate = popola(sistema)
+        sistema.salva_dati()
+        # Modifiche solo nel journal: richieste nuove e aggiornamenti di richieste già negli shard
+        popola(sistema, n=30, seme=5)
+        for id_richiesta in salvate[:15]:
+            sistema.aggiorna_richiesta(id_richiesta, stato=StatoRiparazione.RICEVUTO, nota="audio ripristinato")
+        self.assertGreater(sistema.record_non_compattati, 0)
+
+        for termine, stato, cliente, tipo in CASI_RICERCA:
+            with self.subTest(termine=termine, stato=stato, cliente=cliente, tipo=tipo):
+                attesi = [r.id_richiesta for r in sistema.cerca_richieste(termine, stato, cliente, tipo)]
+                for processi in (1, 2):
+                    trovati = cerca_negli_shard(sistema.file_dati, termine, stato, cliente, tipo, processi=processi)
+                    self.assertEqual([r.id_richiesta for r in trovati], attesi)
+
+if __name__ == "__main__":
+    unittest.main()
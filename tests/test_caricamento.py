@@ -0,0 +1,82 @@
+"""Caricamento: voci malformate, file illeggibili e avanzamento"""
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+
+from Gestionale_riparazioni_azienda import ErroreSalvataggio, SistemaGestioneRiparazioni, TipoIntervento
+
+from .supporto import popola, stato_archivio
+
+
+class TestCaricamento(unittest.TestCase):
+    def setUp(self):
+        self._cartella = tempfile.TemporaryDirectory()
+        self.percorso = os.path.join(self._cartella.name, "riparazioni.json")
+
+    def tearDown(self):
+        self._cartella.cleanup()
+
+    def apri(self, **argomenti) -> SistemaGestioneRiparazioni:
+        with contextlib.redirect_stdout(io.StringIO()):
+            return SistemaGestioneRiparazioni(self.percorso, **argomenti)
+
+    def archivio_con_voce_malformata(self) -> dict:
+        sistema = self.apri()
+        popola(sistema, n=20)
+        with open(self.percorso, 'r', encoding='utf-8') as f:
+            dati = json.load(f)
+        dati['richieste']['RIP_ROTTA'] = {'id_richiesta': 'RIP_ROTTA', 'pezzo': {}}
+        with open(self.percorso, 'w', encoding='utf-8') as f:
+            json.dump(dati, f)
+        return stato_archivio(sistema)
+
+    def test_caricamento_tollerante_salta_solo_le_voci_malformate(self):
+        atteso = self.archivio_con_voce_malformata()
+        avanzamento = []
+        sistema = self.apri(caricamento_tollerante=True,
+                            avanzamento_caricamento=lambda letti, totale: avanzamento.append((letti, totale)))
+        self.assertFalse(sistema.caricamento_fallito)
+        self.assertEqual(stato_archivio(sistema), atteso)
+        self.assertEqual([voce[0] for voce in sistema.voci_scartate], ['RIP_ROTTA'])
+        self.assertTrue(avanzamento)
+        self.assertEqual(avanzamento[-1][0], avanzamento[-1][1])
+
+        # La voce scartata sopravvive al salvataggio, così com'era
+        sistema.salva_dati()
+        with open(self.percorso, 'r', encoding='utf-8') as f:
+            self.assertEqual(json.load(f)['richieste']['RIP_ROTTA'], {'id_richiesta': 'RIP_ROTTA', 'pezzo': {}})
+
+    def test_caricamento_rigoroso_fallisce_senza_dati_parziali(self):
+        self.archivio_con_voce_malformata()
+        sistema = self.apri()
+        self.assertTrue(sistema.caricamento_fallito)
+        self.assertEqual(len(sistema.richieste), 0)
+
+    def test_nessuna_modifica_dopo_un_caricamento_fallito(self):
+        for argomenti in ({}, {'journal': True}, {'condiviso': True}):
+            with self.subTest(**argomenti):
+                with open(self.percorso, 'w', encoding='utf-8') as f:
+                    f.write('{"richieste": {"RIP1": ')
+                for estensione in (".journal", ".stato", ".sequenze"):
+                    if os.path.exists(self.percorso + estensione):
+                        os.remove(self.percorso + estensione)
+                sistema = self.apri(**argomenti)
+                self.assertTrue(sistema.caricamento_fallito)
+
+                with self.assertRaises(ErroreSalvataggio):
+                    sistema.crea_richiesta_riparazione("kp 832", "kp 832", "SN1", "Merani",
+                                                       "tasti rotti", TipoIntervento.RIPARAZIONE)
+                with self.assertRaises(ErroreSalvataggio):
+                    sistema.aggiorna_richiesta("RIP1", stato="Consegnato")
+                self.assertEqual(len(sistema.richieste), 0)
+                journal = self.percorso + ".journal"
+                self.assertFalse(os.path.exists(journal) and os.path.getsize(journal))
+                with open(self.percorso, 'r', encoding='utf-8') as f:
+                    self.assertEqual(f.read(), '{"richieste": {"RIP1": ')
+
+
+if __name__ == "__main__":
+    unittest.main()
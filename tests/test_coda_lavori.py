@@ -0,0 +1,101 @@
+"""Code dei lavori: il prossimo lavoro e le assegnazioni automatiche contro una scansione completa"""
+import os
+import tempfile
+import unittest
+
+from Gestionale_riparazioni_azienda import (
+    CODICE_PRIORITA, PESO_TIPO, STATI_APERTI, STATO_IN_CODA, SistemaGestioneRiparazioni, StatoRiparazione
+)
+
+from .supporto import TECNICI, popola
+
+TECNICI_CODA = [tecnico for tecnico in TECNICI if tecnico] + ["Nuovo"]
+
+
+def in_coda_lineare(sistema, tecnico: str) -> list:
+    """I lavori in coda del tecnico e quelli non assegnati, dal più urgente"""
+    candidati = [(-CODICE_PRIORITA.get(r.priorita, 1), PESO_TIPO[r.tipo_intervento], r.data_richiesta, i,
+                  r.id_richiesta)
+                 for i, r in enumerate(sistema.richieste.values())
+                 if r.stato is STATO_IN_CODA and r.tecnico_assegnato in ("", tecnico)]
+    return [voce[-1] for voce in sorted(candidati)]
+
+
+def carico_lineare(sistema) -> dict:
+    carico = {}
+    for richiesta in sistema.richieste.values():
+        if richiesta.tecnico_assegnato and richiesta.stato in STATI_APERTI:
+            carico[richiesta.tecnico_assegnato] = carico.get(richiesta.tecnico_assegnato, 0) + 1
+    return carico
+
+
+class TestCodaLavori(unittest.TestCase):
+    def setUp(self):
+        self._cartella = tempfile.TemporaryDirectory()
+        self.file_dati = os.path.join(self._cartella.name, "riparazioni.json")
+        self.sistema = SistemaGestioneRiparazioni(self.file_dati, journal=True)
+        self.ids = popola(self.sistema, n=200)
+
+    def tearDown(self):
+        self._cartella.cleanup()
+
+    def confronta_prossimi(self):
+        for tecnico in TECNICI_CODA:
+            with self.subTest(tecnico=tecnico):
+                trovato = self.sistema.prossimo_lavoro(tecnico, prendi_in_carico=False)
+                attesi = in_coda_lineare(self.sistema, tecnico)
+                self.assertEqual(trovato and trovato.id_richiesta, attesi[0] if attesi else None)
+        carico = {tecnico: n for tecnico, n in self.sistema.coda_lavori.carico.items() if n}
+        self.assertEqual(carico, carico_lineare(self.sistema))
+
+    def test_prossimo_uguale_alla_scansione(self):
+        self.confronta_prossimi()
+        # Molti aggiornamenti: le voci superate vengono scartate e le code ricostruite
+        priorita = ["Bassa", "Urgente", "Media", "Alta"]
+        with self.sistema.operazioni_in_blocco():
+            for giro in range(8):
+                for i, id_richiesta in enumerate(self.ids[:200]):
+                    self.sistema.aggiorna_richiesta(id_richiesta, priorita=priorita[(giro + i) % 4])
+        for id_richiesta in self.ids[::5]:
+            self.sistema.aggiorna_richiesta(id_richiesta, stato=StatoRiparazione.RICEVUTO)
+        for id_richiesta in self.ids[1::9]:
+            self.sistema.aggiorna_richiesta(id_richiesta, stato=StatoRiparazione.COMPLETATO)
+        self.confronta_prossimi()
+
+    def test_prendi_in_carico_assegna_il_lavoro(self):
+        for id_richiesta in self.ids:
+            if self.sistema.richieste[id_richiesta].stato is STATO_IN_CODA:
+                self.sistema.aggiorna_richiesta(id_richiesta, tecnico_assegnato="")
+        richiesta = self.sistema.prossimo_lavoro("Nuovo")
+        self.assertEqual(richiesta.tecnico_assegnato, "Nuovo")
+        self.assertEqual(self.sistema.coda_lavori.carico["Nuovo"], 1)
+        riaperto = SistemaGestioneRiparazioni(self.file_dati, journal=True)
+        self.assertEqual(riaperto.richieste[richiesta.id_richiesta].tecnico_assegnato, "Nuovo")
+        # Lo stesso lavoro resta il primo per chi l'ha preso, finché non viene iniziato
+        self.assertEqual(riaperto.prossimo_lavoro("Nuovo").id_richiesta, richiesta.id_richiesta)
+        self.assertNotEqual(riaperto.prossimo_lavoro("Marco", prendi_in_carico=False).id_richiesta,
+                            richiesta.id_richiesta)
+
+    def test_assegna_lavori_al_meno_carico(self):
+        non_assegnati = in_coda_lineare(self.sistema, "")
+        self.assertGreater(len(non_assegnati), 3)
+        self.assertEqual([id_richiesta for id_richiesta, _ in self.sistema.assegna_lavori(["Marco", "Nuovo"],
+                                                                                          limite=3)],
+                         non_assegnati[:3])
+
+        # Dal più urgente, ognuno al tecnico che in quel momento ha meno lavori aperti
+        carico = carico_lineare(self.sistema)
+        attesi = []
+        for id_richiesta in in_coda_lineare(self.sistema, ""):
+            tecnico = min(["Marco", "Giulia", "Nuovo"], key=lambda t: (carico.get(t, 0), t))
+            carico[tecnico] = carico.get(tecnico, 0) + 1
+            attesi.append((id_richiesta, tecnico))
+        self.assertEqual(self.sistema.assegna_lavori(["Marco", "", "Giulia", "Nuovo"]), attesi)
+        self.assertIsNone(self.sistema.coda_lavori.prossimo_non_assegnato())
+        riaperto = SistemaGestioneRiparazioni(self.file_dati, journal=True)
+        for id_richiesta, tecnico in attesi:
+            self.assertEqual(riaperto.richieste[id_richiesta].tecnico_assegnato, tecnico)
+
+
+if __name__ == "__main__":
+    unittest.main()
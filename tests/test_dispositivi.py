@@ -0,0 +1,81 @@
+"""Registro dei dispositivi: riuso dei pezzi, storico degli apparati e unione dei duplicati"""
+import os
+import tempfile
+import unittest
+
+from Gestionale_riparazioni_azienda import SistemaGestioneRiparazioni, StatoRiparazione, TipoIntervento
+
+from .supporto import stato_archivio
+
+
+class TestDispositivi(unittest.TestCase):
+    def setUp(self):
+        self._cartella = tempfile.TemporaryDirectory()
+        self.percorso = os.path.join(self._cartella.name, "riparazioni.json")
+
+    def tearDown(self):
+        self._cartella.cleanup()
+
+    @staticmethod
+    def crea(sistema, numero_serie="SN 1926344", cliente="Merani", nome="kp 832", **argomenti) -> str:
+        return sistema.crea_richiesta_riparazione(nome, "KP 832", numero_serie, cliente, "tasti rotti",
+                                                  TipoIntervento.RIPARAZIONE, **argomenti)
+
+    def test_riuso_solo_su_richiesta(self):
+        sistema = SistemaGestioneRiparazioni(self.percorso)
+        primo = self.crea(sistema)
+        nuovo = self.crea(sistema, nome="tastiera")
+        riusato = self.crea(sistema, numero_serie="sn1926344", nome="tastiera", riusa_pezzo=True)
+        altro_cliente = self.crea(sistema, cliente="Rossi", riusa_pezzo=True)
+
+        pezzo = sistema.richieste[primo].pezzo
+        self.assertNotEqual(sistema.richieste[nuovo].pezzo.id_pezzo, pezzo.id_pezzo)
+        self.assertEqual(sistema.richieste[nuovo].pezzo.nome, "tastiera")
+        # Il pezzo più recente dello stesso apparato e cliente, con il nome registrato
+        self.assertIs(sistema.richieste[riusato].pezzo, sistema.richieste[nuovo].pezzo)
+        self.assertNotEqual(sistema.richieste[altro_cliente].pezzo.id_pezzo, pezzo.id_pezzo)
+
+        self.assertEqual(sistema.registro_dispositivi.richieste_di("kp  832", "SN1926344"),
+                         [primo, nuovo, riusato, altro_cliente])
+        self.assertEqual([r.id_richiesta for r in sistema.storico_apparato("sn 1926344")],
+                         [primo, nuovo, riusato, altro_cliente])
+
+    def test_unione_dei_duplicati(self):
+        for argomenti in ({}, {'journal': True}, {'journal': True, 'archivio_freddo': True}):
+            with self.subTest(**argomenti):
+                for nome in os.listdir(self._cartella.name):
+                    os.remove(os.path.join(self._cartella.name, nome))
+                sistema = SistemaGestioneRiparazioni(self.percorso, **argomenti)
+                ids = [self.crea(sistema) for _ in range(3)] + [self.crea(sistema, cliente="Rossi")]
+                sistema.aggiorna_richiesta(ids[0], stato=StatoRiparazione.CONSEGNATO)
+                sistema.salva_dati()
+
+                self.assertEqual(sistema.unisci_pezzi_duplicati(), 2)
+                self.assertEqual(sistema.unisci_pezzi_duplicati(), 0)
+                pezzi = {sistema.richieste[id_richiesta].pezzo.id_pezzo for id_richiesta in ids[:3]}
+                self.assertEqual(len(pezzi), 1)
+                self.assertNotIn(sistema.richieste[ids[3]].pezzo.id_pezzo, pezzi)
+
+                riaperto = SistemaGestioneRiparazioni(self.percorso, **argomenti)
+                self.assertEqual(stato_archivio(riaperto), stato_archivio(sistema))
+                self.assertEqual(len(riaperto.pezzi), len(sistema.pezzi))
+
+    def test_unione_vista_dagli_altri_processi(self):
+        primo = SistemaGestioneRiparazioni(self.percorso, condiviso=True)
+        ids = [self.crea(primo) for _ in range(3)]
+        secondo = SistemaGestioneRiparazioni(self.percorso, condiviso=True)
+
+        self.assertEqual(primo.unisci_pezzi_duplicati(), 2)
+        secondo.aggiorna_da_disco()
+        self.assertEqual(len({secondo.richieste[id_richiesta].pezzo.id_pezzo for id_richiesta in ids}), 1)
+
+        # La compattazione del secondo processo non riporta i pezzi eliminati
+        self.crea(secondo)
+        secondo.compatta_journal()
+        riaperto = SistemaGestioneRiparazioni(self.percorso)
+        self.assertEqual(len({riaperto.richieste[id_richiesta].pezzo.id_pezzo for id_richiesta in ids}), 1)
+        self.assertEqual(len(riaperto.pezzi), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+"""Eventi di modifica: bus in processo, feed durevole e niente eventi per le scritture fallite"""
+import contextlib
+import io
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from Gestionale_riparazioni_azienda import (
+    BusEventi, ErroreSalvataggio, FeedModifiche, SistemaGestioneRiparazioni, StatoRiparazione, TipoIntervento
+)
+
+
+class TestEventi(unittest.TestCase):
+    def setUp(self):
+        self._cartella = tempfile.TemporaryDirectory()
+        self.cartella = self._cartella.name
+
+    def tearDown(self):
+        self._cartella.cleanup()
+
+    def apri(self, nome: str = "riparazioni.json", **argomenti) -> SistemaGestioneRiparazioni:
+        sistema = SistemaGestioneRiparazioni(os.path.join(self.cartella, nome), feed_modifiche=True, **argomenti)
+        self.addCleanup(sistema.eventi.chiudi)
+        return sistema
+
+    @staticmethod
+    def crea(sistema, numero_serie: str = "SN1") -> str:
+        return sistema.crea_richiesta_riparazione("cuffia", "hs 20", numero_serie, "Rossi", "audio assente",
+                                                  TipoIntervento.RIPARAZIONE)
+
+    def test_feed_e_bus_ricevono_le_modifiche(self):
+        sistema = self.apri()
+        ricevuti, cambi_stato = [], []
+        sistema.eventi.iscrivi(ricevuti.extend)
+        sistema.eventi.iscrivi(cambi_stato.extend, tipi=['cambio_stato'])
+
+        id_richiesta = self.crea(sistema)
+        sistema.aggiorna_richiesta(id_richiesta, tecnico_assegnato="Marco")
+        sistema.aggiorna_richiesta(id_richiesta, stato=StatoRiparazione.IN_LAVORAZIONE)
+        # Un aggiornamento che non cambia niente non produce eventi
+        sistema.aggiorna_richiesta(id_richiesta, tecnico_assegnato="Marco")
+        self.assertTrue(sistema.eventi.attendi_consegna(5))
+
+        self.assertEqual([evento['tipo'] for evento in ricevuti], ['creazione', 'aggiornamento', 'cambio_stato'])
+        self.assertEqual([evento['stato_nuovo'] for evento in cambi_stato], ["In Lavorazione"])
+        self.assertEqual(cambi_stato[0]['precedenti'], {'stato': "Ricevuto"})
+
+        eventi, prossimo = sistema.leggi_modifiche()
+        self.assertEqual([evento['offset'] for evento in eventi], [1, 2, 3])
+        self.assertEqual([evento['tipo'] for evento in eventi], [evento['tipo'] for evento in ricevuti])
+        self.assertEqual(sistema.leggi_modifiche(dopo=prossimo), ([], prossimo))
+
+    def test_feed_letto_per_offset_dopo_la_riapertura(self):
+        percorso = os.path.join(self.cartella, "eventi")
+        with mock.patch.object(FeedModifiche, 'PASSO_INDICE', 4):
+            feed = FeedModifiche(percorso)
+            for i in range(5):
+                feed.aggiungi_molti([{'tipo': 'creazione', 'numero': 3 * i + j} for j in range(3)])
+            riaperto = FeedModifiche(percorso)
+            self.assertEqual(riaperto.ultimo_offset, 15)
+            for dopo in (0, 3, 4, 5, 11, 14):
+                with self.subTest(dopo=dopo):
+                    eventi, prossimo = riaperto.leggi(dopo, massimo=3)
+                    self.assertEqual([evento['offset'] for evento in eventi],
+                                     list(range(dopo + 1, min(dopo + 3, 15) + 1)))
+                    self.assertEqual(prossimo, eventi[-1]['offset'])
+
+    def test_iscritto_lento_perde_gli_eventi_piu_vecchi(self):
+        bus = BusEventi()
+        self.addCleanup(bus.chiudi)
+        iniziata, sblocca = threading.Event(), threading.Event()
+        ricevuti = []
+
+        def lento(lotto):
+            iniziata.set()
+            sblocca.wait(5)
+            ricevuti.extend(lotto)
+
+        iscrizione = bus.iscrivi(lento, dimensione_lotto=1, capacita=3)
+        bus.pubblica([{'tipo': 'creazione', 'numero': 0}])
+        # Il primo evento è in consegna: i successivi restano in coda, al più 3
+        self.assertTrue(iniziata.wait(5))
+        bus.pubblica([{'tipo': 'creazione', 'numero': numero} for numero in range(1, 6)])
+        sblocca.set()
+        self.assertTrue(bus.attendi_consegna(5))
+        self.assertEqual([evento['numero'] for evento in ricevuti], [0, 3, 4, 5])
+        self.assertEqual(iscrizione.persi, 2)
+
+    def test_nessun_evento_se_il_salvataggio_fallisce(self):
+        sistema = self.apri()
+        ricevuti = []
+        sistema.eventi.iscrivi(ricevuti.extend)
+        with mock.patch.object(sistema, 'scrivi_snapshot', side_effect=OSError("disco pieno")), \
+                contextlib.redirect_stdout(io.StringIO()):
+            with self.assertRaises(ErroreSalvataggio):
+                self.crea(sistema)
+            with self.assertRaises(ErroreSalvataggio):
+                with sistema.operazioni_in_blocco():
+                    self.crea(sistema, "SN2")
+                    self.crea(sistema, "SN3")
+        self.assertTrue(sistema.eventi.attendi_consegna(5))
+        self.assertEqual(ricevuti, [])
+        self.assertEqual(sistema.leggi_modifiche(), ([], 0))
+
+    def test_sqlite_errore_scarta_la_copia_in_memoria(self):
+        sistema = self.apri("riparazioni.db", backend="sqlite")
+        ricevuti = []
+        sistema.eventi.iscrivi(ricevuti.extend)
+        id_richiesta = self.crea(sistema)
+        self.assertTrue(sistema.eventi.attendi_consegna(5))
+        del ricevuti[:]
+
+        with mock.patch.object(sistema.archivio_sqlite, 'applica_molti',
+                               side_effect=sqlite3.OperationalError("database is locked")):
+            with self.assertRaises(ErroreSalvataggio):
+                sistema.aggiorna_richiesta(id_richiesta, costo_stimato=99.0)
+            with self.assertRaises(ErroreSalvataggio):
+                self.crea(sistema, "SN2")
+        self.assertTrue(sistema.eventi.attendi_consegna(5))
+        self.assertEqual(ricevuti, [])
+        self.assertEqual([evento['tipo'] for evento in sistema.leggi_modifiche()[0]], ['creazione'])
+        # Le letture tornano al database, dove la modifica non c'è
+        self.assertEqual(sistema.richieste[id_richiesta].costo_stimato, 0.0)
+        self.assertEqual(len(sistema.richieste), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
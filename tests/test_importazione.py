@@ -0,0 +1,123 @@
+"""Importazione massiva: righe scartate, lotti, pezzi riusati e scritture fallite"""
+import contextlib
+import datetime
+import io
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from Gestionale_riparazioni_azienda import ErroreSalvataggio, SistemaGestioneRiparazioni, TipoIntervento
+
+INTESTAZIONE = "nome_pezzo;modello;numero_serie;cliente;descrizione_problema;tipo_intervento;priorita;tecnico;costo_stimato\n"
+
+
+class TestImportazione(unittest.TestCase):
+    def setUp(self):
+        self._cartella = tempfile.TemporaryDirectory()
+        self.cartella = self._cartella.name
+
+    def tearDown(self):
+        self._cartella.cleanup()
+
+    def apri(self, nome: str = "riparazioni.json", **argomenti) -> SistemaGestioneRiparazioni:
+        with contextlib.redirect_stdout(io.StringIO()):
+            return SistemaGestioneRiparazioni(os.path.join(self.cartella, nome), **argomenti)
+
+    def file(self, nome: str, contenuto: str) -> str:
+        percorso = os.path.join(self.cartella, nome)
+        with open(percorso, 'w', encoding='utf-8') as f:
+            f.write(contenuto)
+        return percorso
+
+    def test_csv_righe_valide_e_scartate(self):
+        percorso = self.file("richieste.csv", INTESTAZIONE +
+                             "cuffia;hs 20;SN1;Rossi;audio assente;Riparazione;alta;Marco;12,50\n"
+                             "cuffia;hs 20;SN2;Rossi;;Riparazione;;;\n"
+                             "display;ds 7;SN3;Bianchi;spento;Sostituzione;;;\n"
+                             "display;ds 7;SN4;Bianchi;spento;Ispezione;;;-3\n"
+                             "centralino;cx 400;SN5;Ferrari;non si accende;diagnosi;;;\n")
+        sistema = self.apri(journal=True)
+        esito = sistema.importa_richieste(percorso, dimensione_lotto=2)
+
+        self.assertEqual(len(esito.importate), 2)
+        self.assertEqual([numero for numero, _ in esito.errori], [3, 5, 6])
+        self.assertIn("descrizione_problema", esito.errori[0][1])
+        self.assertEqual(esito.errori[1][1], "costo stimato negativo")
+        self.assertIn("diagnosi", esito.errori[2][1])
+        importata = sistema.richieste[esito.importate[0]]
+        self.assertEqual((importata.priorita, importata.tecnico_assegnato, importata.costo_stimato),
+                         ("Alta", "Marco", 12.5))
+        riaperto = self.apri(journal=True)
+        self.assertEqual(sorted(riaperto.richieste), sorted(esito.importate))
+
+    def test_jsonl_con_riga_non_valida(self):
+        righe = [json.dumps({'nome': "cuffia", 'modello': "hs 20", 's/n': f"SN{i}", 'cliente': "Rossi",
+                             'descrizione': "audio assente", 'tipo': "RIPARAZIONE"}) for i in range(3)]
+        righe.insert(1, '{"nome": "cuffia",')
+        sistema = self.apri()
+        esito = sistema.importa_richieste(self.file("richieste.jsonl", "\n".join(righe) + "\n"))
+        self.assertEqual(len(esito.importate), 3)
+        self.assertEqual(len(esito.errori), 1)
+        self.assertEqual(esito.errori[0][0], 2)
+        self.assertIn("JSON non valido", esito.errori[0][1])
+
+    def test_riuso_dei_pezzi_non_consuma_id(self):
+        sistema = self.apri()
+        with contextlib.redirect_stdout(io.StringIO()):
+            sistema.crea_richiesta_riparazione("cuffia", "hs 20", "SN1", "Rossi", "audio assente",
+                                               TipoIntervento.RIPARAZIONE)
+        percorso = self.file("richieste.csv", INTESTAZIONE +
+                             "cuffia;hs 20;SN1;Rossi;di nuovo muta;Riparazione;;;\n"
+                             "display;ds 7;SN9;Bianchi;spento;Riparazione;;;\n"
+                             "display;DS  7;sn 9;Bianchi;ancora spento;Riparazione;;;\n"
+                             "display;ds 7;SN9;Ferrari;spento;Riparazione;;;\n")
+        esito = sistema.importa_richieste(percorso, riusa_pezzi=True)
+        self.assertEqual(esito.errori, [])
+        pezzi = [sistema.richieste[id_richiesta].pezzo.id_pezzo for id_richiesta in esito.importate]
+        self.assertEqual(pezzi[1], pezzi[2])
+        self.assertEqual(len(set(pezzi)), 3)
+        # Due pezzi nuovi (SN9 di Bianchi e di Ferrari): nessun ID riservato e lasciato inutilizzato
+        oggi = datetime.datetime.now().strftime("%Y%m%d")
+        self.assertEqual(sorted(set(pezzi) - {pezzi[0]}), [f"PZ{oggi}002", f"PZ{oggi}003"])
+        self.assertEqual(sistema.genera_id_pezzo(), f"PZ{oggi}004")
+
+    def test_errore_di_una_riga_non_ferma_le_altre(self):
+        percorso = self.file("richieste.csv", INTESTAZIONE + "".join(
+            f"cuffia;hs 20;SN{i};Rossi;audio assente;Riparazione;;;\n" for i in range(4)))
+        sistema = self.apri()
+        originale = sistema.crea_richiesta_riparazione
+
+        def crea(*argomenti, **opzioni):
+            if argomenti[2] == "SN1":
+                raise RuntimeError("apparato bloccato")
+            return originale(*argomenti, **opzioni)
+
+        with mock.patch.object(sistema, 'crea_richiesta_riparazione', side_effect=crea):
+            esito = sistema.importa_richieste(percorso)
+        self.assertEqual(esito.errori, [(3, "apparato bloccato")])
+        self.assertEqual(sorted(r.pezzo.numero_serie for r in self.apri().richieste.values()),
+                         ["SN0", "SN2", "SN3"])
+
+    def test_lotto_non_salvato_finisce_tra_gli_errori(self):
+        percorso = self.file("richieste.csv", INTESTAZIONE + "".join(
+            f"cuffia;hs 20;SN{i};Rossi;audio assente;Riparazione;;;\n" for i in range(5)))
+        sistema = self.apri()
+        with mock.patch.object(sistema, 'scrivi_snapshot', side_effect=OSError("disco pieno")), \
+                contextlib.redirect_stdout(io.StringIO()):
+            esito = sistema.importa_richieste(percorso, dimensione_lotto=3)
+        self.assertEqual(esito.importate, [])
+        self.assertEqual([numero for numero, _ in esito.errori], [2, 3, 4, 5, 6])
+        self.assertTrue(all("salvataggio non riuscito" in messaggio for _, messaggio in esito.errori))
+
+    def test_archivio_non_caricato(self):
+        with open(os.path.join(self.cartella, "riparazioni.json"), 'w', encoding='utf-8') as f:
+            f.write("{rotto")
+        sistema = self.apri()
+        with self.assertRaises(ErroreSalvataggio):
+            sistema.importa_richieste(self.file("richieste.csv", INTESTAZIONE))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+"""Ricerca con errori di battitura: indice a trigrammi contro il confronto con tutti i valori"""
+import contextlib
+import io
+import os
+import random
+import tempfile
+import unittest
+from unittest import mock
+
+import Gestionale_riparazioni_azienda as gestionale
+from Gestionale_riparazioni_azienda import IndiceApprossimato, SistemaGestioneRiparazioni, distanza_modifica
+
+from .supporto import popola
+
+
+def vicini(valori, testo: str) -> set:
+    chiave = IndiceApprossimato.normalizza(testo)
+    massimo = IndiceApprossimato.distanza_predefinita(chiave)
+    return {valore for valore in valori if distanza_modifica(chiave, IndiceApprossimato.normalizza(valore),
+                                                             massimo) <= massimo}
+
+
+class TestIndiceApprossimato(unittest.TestCase):
+    def test_stessi_valori_del_confronto_lineare(self):
+        rnd = random.Random(5)
+        sillabe = ["ma", "ri", "ne", "cre", "mo", "si", "bian", "chi", "fer", "ra", "lu", "ca", "de"]
+        valori = sorted({"".join(rnd.choice(sillabe) for _ in range(rnd.randint(3, 6))).capitalize()
+                         for _ in range(400)})
+        indice = IndiceApprossimato()
+        for valore in valori:
+            indice.aggiungi(valore)
+
+        for valore in rnd.sample(valori, 40):
+            i = rnd.randrange(len(valore))
+            refuso = valore[:i] + valore[i + 1:] if rnd.random() < 0.5 else valore[:i] + "x" + valore[i + 1:]
+            with self.subTest(refuso=refuso):
+                trovati = {v for v, _, _ in indice.suggerisci(refuso, limite=len(valori))}
+                self.assertEqual(trovati, vicini(valori, refuso))
+                self.assertIn(valore, trovati)
+
+    def test_prima_i_piu_simili_poi_i_piu_usati(self):
+        indice = IndiceApprossimato()
+        indice.aggiungi("Cremonesi", 2)
+        indice.aggiungi("Cremonese", 5)
+        indice.aggiungi("cremonesi ", 1)
+        self.assertIn("CREMONESI", indice)
+        self.assertEqual(indice.suggerisci("Cremonesi"), [("Cremonesi", 0, 3), ("Cremonese", 1, 5)])
+        self.assertEqual(indice.suggerisci("  "), [])
+
+    def test_testo_corto_non_confronta_tutti_i_valori(self):
+        indice = IndiceApprossimato()
+        for i in range(2000):
+            indice.aggiungi(f"{chr(97 + i % 26)}{chr(97 + i // 26 % 26)}")
+        with mock.patch.object(gestionale, 'distanza_modifica', wraps=distanza_modifica) as confronti:
+            trovati = {valore for valore, _, _ in indice.suggerisci("ab", limite=1000)}
+        self.assertIn("ab", trovati)
+        self.assertTrue(trovati <= vicini(indice.valori, "ab"))
+        # Solo i valori con un trigramma in comune, non tutti i 676 di due lettere
+        self.assertLess(confronti.call_count, 60)
+
+
+class TestRicercaTollerante(unittest.TestCase):
+    def setUp(self):
+        self._cartella = tempfile.TemporaryDirectory()
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.sistema = SistemaGestioneRiparazioni(os.path.join(self._cartella.name, "riparazioni.json"))
+            popola(self.sistema, n=60)
+
+    def tearDown(self):
+        self._cartella.cleanup()
+
+    def test_cliente_scritto_male(self):
+        esatti = [r.id_richiesta for r in self.sistema.cerca_richieste(cliente="Cremonesi")]
+        self.assertTrue(esatti)
+        self.assertEqual(self.sistema.cerca_richieste(cliente="Cremonessi"), [])
+        self.assertEqual([r.id_richiesta for r in self.sistema.cerca_richieste(cliente="Cremonessi",
+                                                                               tolleranza_refusi=True)], esatti)
+        self.assertEqual(self.sistema.suggerisci_nomi('cliente', "cremonessi", limite=1)[0][0], "Cremonesi")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+"""Report: stessi risultati con e senza NumPy e con le richieste chiuse nell'archivio freddo"""
+import contextlib
+import datetime
+import io
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import report_riparazioni
+from Gestionale_riparazioni_azienda import ErroreSalvataggio, SistemaGestioneRiparazioni
+from report_riparazioni import MotoreReport
+
+from .supporto import popola
+
+
+def tutti_i_report(sistema) -> dict:
+    motore = MotoreReport(sistema)
+    return {
+        'fatturato': motore.fatturato("mese").righe,
+        'fatturato_10_giorni': motore.fatturato(datetime.timedelta(days=10)).righe,
+        'scostamento': motore.scostamento_preventivi("settimana").righe,
+        'tempi_cliente': motore.tempi_lavorazione("cliente").righe,
+        'tempi_tipo': motore.tempi_lavorazione("tipo", "mese").righe,
+        'arretrato': motore.arretrato("settimana").righe,
+    }
+
+
+class TestReport(unittest.TestCase):
+    def setUp(self):
+        self._cartella = tempfile.TemporaryDirectory()
+        self.percorso = os.path.join(self._cartella.name, "riparazioni.json")
+        with contextlib.redirect_stdout(io.StringIO()):
+            popola(SistemaGestioneRiparazioni(self.percorso), n=150)
+        # Date distribuite su un anno, così i raggruppamenti hanno più periodi
+        rnd = random.Random(3)
+        with open(self.percorso, 'r', encoding='utf-8') as f:
+            dati = json.load(f)
+        inizio = datetime.datetime(2024, 1, 1)
+        for richiesta in dati['richieste'].values():
+            data = inizio + datetime.timedelta(days=rnd.randrange(365), minutes=rnd.randrange(1440))
+            richiesta['data_richiesta'] = data.isoformat()
+            if richiesta['data_completamento']:
+                richiesta['data_completamento'] = (data + datetime.timedelta(hours=rnd.randrange(1, 500))).isoformat()
+        with open(self.percorso, 'w', encoding='utf-8') as f:
+            json.dump(dati, f)
+
+    def tearDown(self):
+        self._cartella.cleanup()
+
+    def apri(self, percorso=None, **argomenti) -> SistemaGestioneRiparazioni:
+        with contextlib.redirect_stdout(io.StringIO()):
+            return SistemaGestioneRiparazioni(percorso or self.percorso, **argomenti)
+
+    @unittest.skipIf(report_riparazioni.np is None, "NumPy non installato")
+    def test_stessi_report_con_e_senza_numpy(self):
+        sistema = self.apri()
+        con_numpy = tutti_i_report(sistema)
+        with mock.patch.object(report_riparazioni, 'np', None):
+            self.assertEqual(tutti_i_report(sistema), con_numpy)
+
+    def test_stessi_report_con_le_chiuse_archiviate(self):
+        attesi = tutti_i_report(self.apri())
+        self.assertTrue(attesi['fatturato'])
+
+        percorso = os.path.join(self._cartella.name, "stratificato.json")
+        shutil.copy(self.percorso, percorso)
+        sistema = self.apri(percorso, archivio_freddo=True)
+        self.assertTrue(sistema.salva_dati())
+        self.assertTrue(len(sistema.archivio_freddo))
+        self.assertEqual(tutti_i_report(sistema), attesi)
+        self.assertEqual(tutti_i_report(self.apri(percorso, archivio_freddo=True, sola_lettura=True)), attesi)
+
+    def test_report_ricalcolato_dopo_una_modifica(self):
+        sistema = self.apri()
+        motore = MotoreReport(sistema)
+        prima = motore.arretrato("anno").righe
+        self.assertIs(motore.arretrato("anno").righe, prima)
+        with contextlib.redirect_stdout(io.StringIO()):
+            sistema.crea_richiesta_riparazione("kp 832", "kp 832", "SN999", "Rossi", "non si accende",
+                                               sistema.richieste[next(iter(sistema.richieste))].tipo_intervento)
+        dopo = motore.arretrato("anno").righe
+        self.assertEqual(sum(riga[1] for riga in dopo), sum(riga[1] for riga in prima) + 1)
+
+    def test_main_non_modifica_l_archivio(self):
+        # Un journal non compattato e una richiesta chiusa: il report non deve
+        # compattare, riparare il journal né creare l'archivio freddo
+        sistema = self.apri(journal=True)
+        popola(sistema, n=10, seme=11)
+        with open(sistema.journal.percorso, 'ab') as f:
+            f.write(b'{"op":"aggiorna"')
+        file_prima = {nome: open(os.path.join(self._cartella.name, nome), 'rb').read()
+                      for nome in os.listdir(self._cartella.name)}
+
+        with mock.patch.object(sys, 'argv', ["report_riparazioni.py", "fatturato", "--file-dati", self.percorso]), \
+                contextlib.redirect_stdout(io.StringIO()) as uscita:
+            report_riparazioni.main()
+        self.assertIn("FATTURATO", uscita.getvalue())
+        file_dopo = {nome: open(os.path.join(self._cartella.name, nome), 'rb').read()
+                     for nome in os.listdir(self._cartella.name)}
+        self.assertEqual(file_dopo, file_prima)
+
+    def test_sola_lettura_rifiuta_le_modifiche(self):
+        sistema = self.apri(sola_lettura=True)
+        id_richiesta = next(iter(sistema.richieste))
+        with self.assertRaises(ErroreSalvataggio):
+            sistema.aggiorna_richiesta(id_richiesta, costo_stimato=10.0)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertFalse(sistema.salva_dati())
+
+
+if __name__ == '__main__':
+    unittest.main()
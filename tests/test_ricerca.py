@@ -0,0 +1,69 @@
+"""Indici e statistiche incrementali contro il ricalcolo con una scansione completa"""
+import os
+import tempfile
+import unittest
+
+from Gestionale_riparazioni_azienda import (IndiceTestuale, SistemaGestioneRiparazioni, StatoRiparazione,
+                                            TipoIntervento)
+
+from .supporto import CASI_RICERCA, popola
+
+
+class TestIndici(unittest.TestCase):
+    def setUp(self):
+        self._cartella = tempfile.TemporaryDirectory()
+        self.sistema = SistemaGestioneRiparazioni(os.path.join(self._cartella.name, "riparazioni.json"),
+                                                  journal=True)
+        self.ids = popola(self.sistema, n=300)
+
+    def tearDown(self):
+        self._cartella.cleanup()
+
+    def confronta_ricerche(self):
+        for termine, stato, cliente, tipo in CASI_RICERCA:
+            with self.subTest(termine=termine, stato=stato, cliente=cliente, tipo=tipo):
+                lineare = self.sistema._filtra_richieste(self.sistema.richieste.values(),
+                                                         termine, stato, cliente, tipo)
+                self.assertEqual([r.id_richiesta for r in self.sistema.cerca_richieste(termine, stato, cliente, tipo)],
+                                 [r.id_richiesta for r in lineare])
+
+    def test_ricerca_con_indici_uguale_alla_scansione(self):
+        self.confronta_ricerche()
+
+    def test_indici_aggiornati_dopo_le_modifiche(self):
+        for id_richiesta in self.ids[:50]:
+            self.sistema.aggiorna_richiesta(id_richiesta, stato=StatoRiparazione.COMPLETATO,
+                                            costo_finale=99.5)
+        # Anche i cambi di stato fatti direttamente sull'oggetto aggiornano gli indici
+        self.sistema.richieste[self.ids[60]].aggiorna_stato(StatoRiparazione.CONSEGNATO)
+        self.confronta_ricerche()
+
+    def test_ordine_per_rilevanza(self):
+        for termine, stato, cliente, tipo in CASI_RICERCA:
+            with self.subTest(termine=termine):
+                per_data = self.sistema.cerca_richieste(termine, stato, cliente, tipo)
+                per_rilevanza = self.sistema.cerca_richieste(termine, stato, cliente, tipo, per_rilevanza=True)
+                self.assertCountEqual([r.id_richiesta for r in per_rilevanza],
+                                      [r.id_richiesta for r in per_data])
+                punti = [IndiceTestuale.punteggio(IndiceTestuale.testo_indicizzato(r), termine)
+                         for r in per_rilevanza]
+                self.assertEqual(punti, sorted(punti, reverse=True))
+        # La parola intera viene prima dell'inizio di parola, qualunque sia la data
+        intera = self.sistema.crea_richiesta_riparazione("modulo", "mx 1", "SN-A", "Gialli",
+                                                          "porta seriale guasta", TipoIntervento.RIPARAZIONE)
+        dentro = self.sistema.crea_richiesta_riparazione("modulo", "mx 1", "SN-B", "Gialli",
+                                                          "portatile non carica", TipoIntervento.RIPARAZIONE)
+        self.assertEqual([r.id_richiesta for r in self.sistema.cerca_richieste("porta", cliente="gialli",
+                                                                               per_rilevanza=True)],
+                         [intera, dentro])
+
+    def test_statistiche_incrementali_coerenti(self):
+        self.assertEqual(self.sistema.verifica_statistiche(), [])
+        for id_richiesta in self.ids[::7]:
+            self.sistema.aggiorna_richiesta(id_richiesta, stato=StatoRiparazione.CONSEGNATO,
+                                            costo_finale=120.0)
+        self.assertEqual(self.sistema.verifica_statistiche(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
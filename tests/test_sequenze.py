@@ -0,0 +1,89 @@
+"""Sequenze degli ID: nessun numero riassegnato, né tra thread né tra processi né dopo una riapertura"""
+import os
+import tempfile
+import threading
+import unittest
+
+from Gestionale_riparazioni_azienda import (
+    AllocatoreSequenze, FileSequenze, SistemaGestioneRiparazioni, TipoIntervento
+)
+
+
+class TestAllocatore(unittest.TestCase):
+    def test_blocchi_consecutivi_e_osserva(self):
+        sequenze = AllocatoreSequenze()
+        self.assertEqual(sequenze.prossimo("RIP20250906"), 1)
+        self.assertEqual(sequenze.riserva("RIP20250906", 3), range(2, 5))
+        # Un ID già esistente più alto sposta il contatore, uno più basso no
+        sequenze.osserva("RIP202509061500")
+        sequenze.osserva("RIP20250906007")
+        sequenze.osserva("non-un-id")
+        self.assertEqual(sequenze.prossimo("RIP20250906"), 1501)
+        self.assertEqual(sequenze.prossimo("PZ20250906"), 1)
+        with self.assertRaises(ValueError):
+            sequenze.riserva("RIP20250906", 0)
+
+    def test_nessun_doppione_tra_thread(self):
+        sequenze = AllocatoreSequenze()
+        numeri = []
+
+        def alloca():
+            for _ in range(200):
+                numeri.extend(sequenze.riserva("RIP20250906", 2))
+
+        thread = [threading.Thread(target=alloca) for _ in range(8)]
+        for t in thread:
+            t.start()
+        for t in thread:
+            t.join()
+        self.assertEqual(sorted(numeri), list(range(1, 3201)))
+
+
+class TestSequenzePersistenti(unittest.TestCase):
+    def setUp(self):
+        self._cartella = tempfile.TemporaryDirectory()
+        self.cartella = self._cartella.name
+
+    def tearDown(self):
+        self._cartella.cleanup()
+
+    def test_file_condiviso_tra_allocatori(self):
+        percorso = os.path.join(self.cartella, "sequenze")
+        primo = AllocatoreSequenze(FileSequenze(percorso).riserva)
+        secondo = AllocatoreSequenze(FileSequenze(percorso).riserva)
+        self.assertEqual(primo.riserva("RIP20250906", 5), range(1, 6))
+        self.assertEqual(secondo.riserva("RIP20250906", 2), range(6, 8))
+        # Il minimo locale vale anche se il file è rimasto indietro
+        primo.osserva("RIP20250906100")
+        self.assertEqual(primo.prossimo("RIP20250906"), 101)
+        self.assertEqual(secondo.prossimo("RIP20250906"), 102)
+
+    def crea(self, sistema, quante: int) -> list:
+        return [sistema.crea_richiesta_riparazione("kp 832", "kp 832", f"SN{i}", "Merani", "tasto rotto",
+                                                   TipoIntervento.RIPARAZIONE) for i in range(quante)]
+
+    def test_id_unici_dopo_riapertura(self):
+        modalita = [("riparazioni.json", {}), ("riparazioni.json", {'journal': True}),
+                    ("riparazioni.db", {'backend': 'sqlite'})]
+        for i, (nome, argomenti) in enumerate(modalita):
+            with self.subTest(nome=nome, **argomenti):
+                os.mkdir(os.path.join(self.cartella, str(i)))
+                percorso = os.path.join(self.cartella, str(i), nome)
+                ids = self.crea(SistemaGestioneRiparazioni(percorso, **argomenti), 3)
+                riaperto = SistemaGestioneRiparazioni(percorso, **argomenti)
+                ids += self.crea(riaperto, 2)
+                ids += riaperto.riserva_id_richieste(4)
+                self.assertEqual(len(set(ids)), len(ids))
+                self.assertEqual([int(id_richiesta[-3:]) for id_richiesta in ids], list(range(1, 10)))
+
+    def test_id_unici_tra_istanze_sullo_stesso_file(self):
+        percorso = os.path.join(self.cartella, "riparazioni.json")
+        prima = SistemaGestioneRiparazioni(percorso, sequenze_condivise=True)
+        seconda = SistemaGestioneRiparazioni(percorso, sequenze_condivise=True)
+        ids = prima.riserva_id_richieste(3) + seconda.riserva_id_richieste(3) + prima.riserva_id_pezzi(2)
+        ids += seconda.riserva_id_pezzi(2)
+        self.assertEqual(len(set(ids)), len(ids))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,144 @@
+"""Servizio HTTP: endpoint, conflitti di versione, paginazione, streaming ed errori"""
+import asyncio
+import contextlib
+import http.client
+import io
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+from Gestionale_riparazioni_azienda import SistemaGestioneRiparazioni
+from servizio_http_riparazioni import ServizioRiparazioni
+
+from .supporto import stato_archivio
+
+
+class ServizioInThread:
+    """Il servizio su una porta libera, con il suo event loop in un thread a parte"""
+
+    def __init__(self, sistema: SistemaGestioneRiparazioni):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.servizio = ServizioRiparazioni(sistema, porta=0)
+        asyncio.run_coroutine_threadsafe(self.servizio.avvia(), self.loop).result(10)
+
+    def chiama(self, metodo: str, percorso: str, corpo=None):
+        connessione = http.client.HTTPConnection("127.0.0.1", self.servizio.porta, timeout=10)
+        try:
+            dati = json.dumps(corpo).encode('utf-8') if corpo is not None else None
+            connessione.request(metodo, percorso, body=dati)
+            risposta = connessione.getresponse()
+            testo = risposta.read().decode('utf-8')
+        finally:
+            connessione.close()
+        if risposta.getheader('Content-Type', '').startswith('application/x-ndjson'):
+            return risposta.status, [json.loads(riga) for riga in testo.splitlines()]
+        return risposta.status, json.loads(testo)
+
+    def chiudi(self):
+        if self.loop.is_closed():
+            return
+        asyncio.run_coroutine_threadsafe(self.servizio.chiudi(), self.loop).result(10)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+def nuova(i: int) -> dict:
+    return {'nome_pezzo': "kp 832", 'modello': "kp 832", 'numero_serie': f"SN{i}",
+            'cliente': "Merani" if i % 2 else "Rossi", 'descrizione_problema': "tasti rotti",
+            'tipo_intervento': "Riparazione", 'tecnico_assegnato': "Marco" if i % 3 == 0 else ""}
+
+
+class TestServizio(unittest.TestCase):
+    def setUp(self):
+        self._cartella = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self._cartella.cleanup()
+
+    def avvia(self, nome: str, **argomenti):
+        sistema = SistemaGestioneRiparazioni(os.path.join(self._cartella.name, nome), journal=True, **argomenti)
+        servizio = ServizioInThread(sistema)
+        self.addCleanup(servizio.chiudi)
+        return sistema, servizio
+
+    def test_endpoint_con_entrambi_i_backend(self):
+        for nome, argomenti in (("riparazioni.json", {}), ("riparazioni.db", {'backend': 'sqlite'})):
+            with self.subTest(backend=nome):
+                sistema, servizio = self.avvia(nome, **argomenti)
+                thread_prenotazioni = set()
+                riserva = sistema.riserva_id_richieste
+
+                def riserva_tracciata(quantita):
+                    thread_prenotazioni.add(threading.current_thread().name)
+                    return riserva(quantita)
+                sistema.riserva_id_richieste = riserva_tracciata
+
+                creati = []
+                for i in range(7):
+                    stato, dati = servizio.chiama("POST", "/richieste", nuova(i))
+                    self.assertEqual(stato, 201)
+                    creati.append(dati['id_richiesta'])
+                self.assertEqual(len(set(creati)), 7)
+                # Gli ID arrivano da un blocco riservato nell'executor, non dal loop
+                self.assertEqual(len(thread_prenotazioni), 1)
+                self.assertTrue(thread_prenotazioni.pop().startswith("persistenza"))
+                self.assertEqual(servizio.chiama("GET", f"/richieste/{creati[0]}")[1]['tecnico_assegnato'], "Marco")
+
+                stato, dati = servizio.chiama("GET", "/richieste?cliente=merani&per_pagina=2&pagina=2")
+                self.assertEqual(stato, 200)
+                self.assertEqual(dati['totale'], 3)
+                attesi = [r.id_richiesta for r in sistema.cerca_richieste(cliente="merani")]
+                self.assertEqual([r['id_richiesta'] for r in dati['risultati']], attesi[2:])
+
+                stato, righe = servizio.chiama("GET", "/richieste?formato=ndjson")
+                self.assertEqual(stato, 200)
+                self.assertEqual([r['id_richiesta'] for r in righe], list(reversed(creati)))
+
+                # Aggiornamento con la versione letta: il secondo con la stessa versione è in conflitto
+                versione = servizio.chiama("GET", f"/richieste/{creati[1]}")[1]['versione']
+                stato, dati = servizio.chiama("PATCH", f"/richieste/{creati[1]}",
+                                              {'stato': "In Lavorazione", 'versione': versione})
+                self.assertEqual((stato, dati['stato']), (200, "In Lavorazione"))
+                stato, _ = servizio.chiama("PATCH", f"/richieste/{creati[1]}",
+                                           {'costo_stimato': 10, 'versione': versione})
+                self.assertEqual(stato, 409)
+
+                self.assertEqual(servizio.chiama("GET", "/richieste/RIP000")[0], 404)
+                self.assertEqual(servizio.chiama("DELETE", "/richieste")[0], 405)
+                self.assertEqual(servizio.chiama("POST", "/richieste", {'modello': "x"})[0], 400)
+                self.assertEqual(servizio.chiama("GET", "/statistiche")[1]['totale_richieste'], 7)
+
+                servizio.chiudi()
+                self.assertEqual(stato_archivio(SistemaGestioneRiparazioni(sistema.file_dati, journal=True,
+                                                                           **argomenti)),
+                                 stato_archivio(sistema))
+
+    def test_errori_interni_senza_dettagli(self):
+        sistema, servizio = self.avvia("riparazioni.json")
+        sistema.cerca_id_richieste = lambda *argomenti: 1 / 0
+        errori = io.StringIO()
+        with contextlib.redirect_stderr(errori):
+            stato, dati = servizio.chiama("GET", "/richieste")
+        self.assertEqual(stato, 500)
+        self.assertNotIn("ZeroDivision", json.dumps(dati))
+        self.assertIn("ZeroDivisionError", errori.getvalue())
+
+    def test_ricerca_nell_archivio_freddo(self):
+        sistema, servizio = self.avvia("riparazioni.json", archivio_freddo=True)
+        creati = [servizio.chiama("POST", "/richieste", nuova(i))[1]['id_richiesta'] for i in range(4)]
+        servizio.chiama("PATCH", f"/richieste/{creati[0]}", {'stato': "Consegnato"})
+        sistema.salva_dati()
+        self.assertIn(creati[0], sistema.archivio_freddo)
+
+        self.assertEqual(servizio.chiama("GET", "/richieste")[1]['totale'], 3)
+        stato, dati = servizio.chiama("GET", "/richieste?archivio=1&per_pagina=10")
+        self.assertEqual([r['id_richiesta'] for r in dati['risultati']], list(reversed(creati)))
+
+
+if __name__ == "__main__":
+    unittest.main()
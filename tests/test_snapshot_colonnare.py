@@ -0,0 +1,66 @@
+"""Snapshot colonnare: stesse richieste dello snapshot JSON, colonne leggibili senza ricostruirle"""
+import io
+import os
+import tempfile
+import unittest
+from collections import Counter
+
+from Gestionale_riparazioni_azienda import SistemaGestioneRiparazioni, SnapshotColonnare, TipoIntervento
+
+from .supporto import popola
+
+
+class TestSnapshotColonnare(unittest.TestCase):
+    def setUp(self):
+        self._cartella = tempfile.TemporaryDirectory()
+        self.sistema = SistemaGestioneRiparazioni(os.path.join(self._cartella.name, "riparazioni.json"))
+        popola(self.sistema, n=100)
+        # Testi non ASCII, una priorità fuori elenco e una richiesta con più note
+        speciale = self.sistema.crea_richiesta_riparazione("unità «centrale»", "ü 5", "SN-ß", "Caffè Città",
+                                                           "perde l'ora ☹", TipoIntervento.ISPEZIONE,
+                                                           priorita="Entro venerdì")
+        self.sistema.aggiorna_richiesta(speciale, nota="prima nota")
+        self.sistema.aggiorna_richiesta(speciale, nota="seconda — con «virgolette»")
+        self.richieste = list(self.sistema.richieste.values())
+
+    def tearDown(self):
+        self._cartella.cleanup()
+
+    def apri(self, metadati: dict = None) -> SnapshotColonnare:
+        f = io.BytesIO()
+        SnapshotColonnare.scrivi(f, SnapshotColonnare.prepara(self.richieste, metadati or {}))
+        snapshot = SnapshotColonnare("in memoria", f.getvalue())
+        self.addCleanup(snapshot.chiudi)
+        return snapshot
+
+    def test_richieste_uguali_all_originale(self):
+        snapshot = self.apri({'seq_journal': 12})
+        self.assertEqual(snapshot.numero, len(self.richieste))
+        self.assertEqual(snapshot.metadati, {'seq_journal': 12})
+        lette = list(snapshot.richieste())
+        # Le note restano JSON finché qualcuno non le legge
+        self.assertIsNone(lette[-1]._note)
+        self.assertEqual([r.to_dict(con_versione=True) for r in lette],
+                         [r.to_dict(con_versione=True) for r in self.richieste])
+
+    def test_colonne_allineate_e_conteggi(self):
+        snapshot = self.apri()
+        for nome, (offset, _) in snapshot.sezioni.items():
+            self.assertEqual(offset % 8, 0, nome)
+        self.assertEqual(list(snapshot.colonna('costo_stimato')), [r.costo_stimato for r in self.richieste])
+        self.assertEqual(list(snapshot.colonna('data_richiesta')), [r._data_richiesta for r in self.richieste])
+        self.assertEqual(snapshot.conteggi('stato'), Counter(r.stato.value for r in self.richieste))
+        self.assertEqual(snapshot.conteggi('tipo'), Counter(r.tipo_intervento.value for r in self.richieste))
+        self.assertEqual(snapshot.conteggi('cliente'), Counter(r.pezzo.cliente for r in self.richieste))
+        self.assertEqual(snapshot.conteggi('priorita'), Counter(r.priorita for r in self.richieste))
+
+    def test_file_non_valido(self):
+        percorso = os.path.join(self._cartella.name, "altro.ripc")
+        with open(percorso, 'wb') as f:
+            f.write(b"JSON" + bytes(64))
+        with self.assertRaises(ValueError):
+            SnapshotColonnare(percorso)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+"""Backend SQLite: indice del testo, migrazione dei database esistenti e mappe in sola lettura"""
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from Gestionale_riparazioni_azienda import ArchivioSQLite, SistemaGestioneRiparazioni, TipoIntervento
+
+from .supporto import CASI_RICERCA, popola
+
+
+class TestSQLite(unittest.TestCase):
+    def setUp(self):
+        self._cartella = tempfile.TemporaryDirectory()
+        self.percorso = os.path.join(self._cartella.name, "riparazioni.db")
+
+    def tearDown(self):
+        self._cartella.cleanup()
+
+    def ricerche(self, archivio: ArchivioSQLite) -> list:
+        return [archivio.cerca(termine, stato, cliente, tipo) for termine, stato, cliente, tipo in CASI_RICERCA]
+
+    def scansioni(self, archivio: ArchivioSQLite) -> list:
+        archivio.testo_indicizzato = False
+        try:
+            return self.ricerche(archivio)
+        finally:
+            archivio.testo_indicizzato = True
+
+    def test_indice_del_testo_uguale_alla_scansione(self):
+        sistema = SistemaGestioneRiparazioni(self.percorso, backend="sqlite")
+        popola(sistema)
+        archivio = sistema.archivio_sqlite
+        if not archivio.testo_indicizzato:
+            self.skipTest("SQLite senza FTS5")
+        self.assertEqual(self.ricerche(archivio), self.scansioni(archivio))
+        self.assertEqual(archivio.conta('testo_richieste'), archivio.conta('richieste'))
+
+        # L'unione dei pezzi cambia il pezzo delle richieste: i trigger riallineano il testo
+        for _ in range(2):
+            sistema.crea_richiesta_riparazione("tastierino", "KP 900", "SN-77", "Merani", "tasti duri",
+                                               TipoIntervento.RIPARAZIONE)
+        sistema.crea_richiesta_riparazione("tastiera kp", "KP 900", "SN-77", "Merani", "tasti duri",
+                                           TipoIntervento.RIPARAZIONE)
+        self.assertEqual(len(sistema.cerca_richieste("tastiera kp")), 1)
+        self.assertEqual(sistema.unisci_pezzi_duplicati(), 2)
+        self.assertEqual(len(sistema.cerca_richieste("tastierino")), 3)
+        self.assertEqual(sistema.cerca_richieste("tastiera kp"), [])
+        self.assertEqual(self.ricerche(archivio), self.scansioni(archivio))
+
+    def test_database_esistente_indicizzato_all_apertura(self):
+        sistema = SistemaGestioneRiparazioni(self.percorso, backend="sqlite")
+        popola(sistema)
+        sistema.archivio_sqlite.chiudi()
+        # Database creato prima dell'indice del testo
+        connessione = sqlite3.connect(self.percorso)
+        with connessione:
+            for (nome,) in connessione.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'trigger'").fetchall():
+                connessione.execute(f"DROP TRIGGER {nome}")
+            connessione.execute("DROP TABLE IF EXISTS testo_richieste")
+        connessione.close()
+
+        archivio = ArchivioSQLite(self.percorso)
+        try:
+            if not archivio.testo_indicizzato:
+                self.skipTest("SQLite senza FTS5")
+            self.assertEqual(archivio.conta('testo_richieste'), archivio.conta('richieste'))
+            self.assertEqual(self.ricerche(archivio), self.scansioni(archivio))
+        finally:
+            archivio.chiudi()
+
+    def test_mappe_in_sola_lettura(self):
+        sistema = SistemaGestioneRiparazioni(self.percorso, backend="sqlite")
+        id_richiesta = popola(sistema, n=3)[0]
+        with self.assertRaises(AttributeError):
+            del sistema.richieste[id_richiesta]
+        self.assertFalse(hasattr(sistema.richieste, 'pop'))
+        self.assertIn(id_richiesta, sistema.richieste)
+
+
+if __name__ == "__main__":
+    unittest.main()
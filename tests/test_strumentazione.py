@@ -0,0 +1,142 @@
+"""Strumentazione: conteggi, percentili, byte scritti, operazioni lente e profili"""
+import json
+import os
+import pstats
+import tempfile
+import threading
+import time
+import unittest
+
+from Gestionale_riparazioni_azienda import (
+    SistemaGestioneRiparazioni, StatoRiparazione, Strumentazione, TipoIntervento, strumentato
+)
+
+
+class Misurato:
+    """Il minimo che serve a strumentato(): un attributo strumentazione"""
+
+    def __init__(self, strumentazione: Strumentazione):
+        self.strumentazione = strumentazione
+
+    @strumentato("esterna")
+    def esterna(self, profondita: int, **opzioni):
+        if profondita:
+            return self.esterna(profondita - 1, **opzioni)
+        return opzioni
+
+    @strumentato("attesa")
+    def attesa(self, barriera: threading.Barrier):
+        barriera.wait(timeout=5)
+
+
+class TestStrumentazione(unittest.TestCase):
+    def setUp(self):
+        self._cartella = tempfile.TemporaryDirectory()
+        self.cartella = self._cartella.name
+
+    def tearDown(self):
+        self._cartella.cleanup()
+
+    def test_istogramma_e_percentili(self):
+        strumentazione = Strumentazione(attiva=True)
+        for _ in range(90):
+            strumentazione.registra("op", 0.0003)   # 300 µs: classe fino a 512 µs
+        for _ in range(10):
+            strumentazione.registra("op", 0.05)     # 50 ms: classe fino a 65536 µs
+        self.assertEqual(strumentazione.percentile("op", 0.5), 0.512)
+        self.assertEqual(strumentazione.percentile("op", 0.9), 0.512)
+        self.assertEqual(strumentazione.percentile("op", 0.99), 65.536)
+        self.assertIsNone(strumentazione.percentile("altra", 0.5))
+        riepilogo = strumentazione.riepilogo()['operazioni']['op']
+        self.assertEqual(riepilogo['conteggio'], 100)
+        self.assertEqual(riepilogo['max_ms'], 50.0)
+        self.assertAlmostEqual(riepilogo['totale_ms'], 527.0)
+        # Le durate enormi finiscono nell'ultima classe invece di uscire dall'istogramma
+        strumentazione.registra("op", 1e6)
+        self.assertEqual(strumentazione.istogrammi["op"][-1], 1)
+        strumentazione.azzera()
+        self.assertEqual(strumentazione.riepilogo()['operazioni'], {})
+
+    def test_chiamate_annidate_e_thread(self):
+        strumentazione = Strumentazione()
+        misurato = Misurato(strumentazione)
+        misurato.esterna(2)
+        self.assertEqual(strumentazione.conteggi, {})
+
+        strumentazione.attiva = True
+        self.assertEqual(misurato.esterna(3, formato="csv"), {'formato': "csv"})
+        self.assertEqual(strumentazione.conteggi, {"esterna": 1})
+        # La stessa operazione in corso in due thread conta due volte
+        barriera = threading.Barrier(2)
+        thread = threading.Thread(target=misurato.attesa, args=(barriera,))
+        thread.start()
+        misurato.attesa(barriera)
+        thread.join()
+        self.assertEqual(strumentazione.conteggi["attesa"], 2)
+
+    def test_operazioni_lente_con_parametri(self):
+        file_lente = os.path.join(self.cartella, "lente.jsonl")
+        strumentazione = Strumentazione(attiva=True, soglia_lenta_ms=0, massimo_lente=2, file_lente=file_lente)
+        misurato = Misurato(strumentazione)
+        for profondita in range(3):
+            misurato.esterna(profondita, stato=StatoRiparazione.RICEVUTO, filtro=[1, 2])
+        lente = strumentazione.riepilogo()['operazioni_lente']
+        self.assertEqual([voce['parametri']['profondita'] for voce in lente], [1, 2])
+        self.assertEqual(lente[-1]['parametri']['stato'], StatoRiparazione.RICEVUTO.value)
+        self.assertEqual(lente[-1]['parametri']['filtro'], "[1, 2]")
+        with open(file_lente, encoding='utf-8') as f:
+            righe = [json.loads(riga) for riga in f]
+        self.assertEqual([voce['parametri']['profondita'] for voce in righe], [0, 1, 2])
+
+    def test_misure_del_sistema(self):
+        file_dati = os.path.join(self.cartella, "riparazioni.json")
+        sistema = SistemaGestioneRiparazioni(file_dati, journal=True)
+        strumentazione = sistema.strumentazione
+        self.assertFalse(strumentazione.attiva)
+        sistema.crea_richiesta_riparazione("kp 832", "kp 832", "SN1", "Merani", "tasto rotto",
+                                           TipoIntervento.RIPARAZIONE)
+        self.assertEqual(strumentazione.riepilogo()['operazioni'], {})
+
+        # Accesa mentre il sistema è in uso
+        strumentazione.attiva = True
+        dimensione = os.path.getsize(file_dati + ".journal")
+        for i in range(3):
+            sistema.crea_richiesta_riparazione("kp 832", "kp 832", f"SN{i + 2}", "Merani", "tasto rotto",
+                                               TipoIntervento.RIPARAZIONE)
+        self.assertEqual(strumentazione.conteggi["crea_richiesta_riparazione"], 3)
+        self.assertEqual(strumentazione.byte_scritti['journal'], os.path.getsize(file_dati + ".journal") - dimensione)
+        sistema.compatta_journal()
+        self.assertEqual(strumentazione.byte_scritti['snapshot'], os.path.getsize(file_dati))
+        json.dumps(strumentazione.riepilogo())
+
+    def test_profili(self):
+        strumentazione = Strumentazione()
+        with self.assertRaises(ValueError):
+            strumentazione.avvia_profilo("perf")
+        with self.assertRaises(RuntimeError):
+            strumentazione.ferma_profilo(os.path.join(self.cartella, "niente"))
+
+        strumentazione.avvia_profilo()
+        with self.assertRaises(RuntimeError):
+            strumentazione.avvia_profilo()
+        sorted(range(10000), key=str)
+        percorso = strumentazione.ferma_profilo(os.path.join(self.cartella, "profilo.prof"))
+        self.assertFalse(strumentazione.profilo_in_corso)
+        self.assertGreater(pstats.Stats(percorso).total_calls, 0)
+
+        strumentazione.avvia_profilo("campionamento", intervallo=0.001)
+        fine = time.perf_counter() + 0.2
+        while time.perf_counter() < fine:
+            sorted(range(1000), key=str)
+        percorso = strumentazione.ferma_profilo(os.path.join(self.cartella, "profilo.folded"))
+        with open(percorso, encoding='utf-8') as f:
+            righe = f.read().splitlines()
+        self.assertTrue(righe)
+        for riga in righe:
+            stack, conteggio = riga.rsplit(" ", 1)
+            self.assertIn("test_profili", stack)
+            self.assertGreater(int(conteggio), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
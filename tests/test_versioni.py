@@ -0,0 +1,111 @@
+"""Versioni delle richieste: persistenza in ogni formato e modifiche concorrenti"""
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+
+from Gestionale_riparazioni_azienda import (
+    ConflittoVersione, SistemaGestioneRiparazioni, StatoRiparazione, TipoIntervento
+)
+
+from .supporto import popola
+
+# Campi di ogni richiesta in riparazioni.json, invariati rispetto al formato originale
+CAMPI_RICHIESTA = {'id_richiesta', 'pezzo', 'descrizione_problema', 'tipo_intervento', 'stato', 'priorita',
+                   'data_richiesta', 'data_completamento', 'note_tecniche', 'costo_stimato', 'costo_finale',
+                   'tecnico_assegnato'}
+
+MODALITA = [
+    ("riparazioni.json", {}),
+    ("riparazioni.json", {'journal': True}),
+    ("riparazioni.ripc", {}),
+    ("riparazioni.json", {'journal': True, 'archivio_freddo': True}),
+    ("riparazioni.json", {'shard': 'hash', 'numero_shard': 4}),
+    ("riparazioni.db", {'backend': 'sqlite'}),
+]
+
+
+def versioni(sistema) -> dict:
+    return {id_richiesta: richiesta.versione for id_richiesta, richiesta in sistema.richieste.items()}
+
+
+class TestVersioni(unittest.TestCase):
+    def setUp(self):
+        self._cartella = tempfile.TemporaryDirectory()
+        self.cartella = self._cartella.name
+
+    def tearDown(self):
+        self._cartella.cleanup()
+
+    def apri(self, nome: str = "riparazioni.json", **argomenti) -> SistemaGestioneRiparazioni:
+        with contextlib.redirect_stdout(io.StringIO()):
+            return SistemaGestioneRiparazioni(os.path.join(self.cartella, nome), **argomenti)
+
+    def test_formato_json_invariato(self):
+        sistema = self.apri()
+        ids = popola(sistema, n=20)
+        with open(sistema.file_dati, 'r', encoding='utf-8') as f:
+            dati = json.load(f)
+        for richiesta in dati['richieste'].values():
+            self.assertEqual(set(richiesta), CAMPI_RICHIESTA)
+        # Le versioni stanno a parte, solo per le richieste modificate
+        self.assertEqual(dati['versioni'], {id_richiesta: versione for id_richiesta, versione
+                                            in versioni(sistema).items() if versione > 1})
+        self.assertNotIn('versione', sistema.richieste[ids[0]].to_dict())
+        self.assertEqual(sistema.richieste[ids[0]].to_dict(con_versione=True)['versione'],
+                         sistema.richieste[ids[0]].versione)
+
+    def test_versioni_conservate_alla_riapertura(self):
+        for nome, argomenti in MODALITA:
+            with self.subTest(file=nome, **argomenti):
+                sottocartella = os.path.relpath(tempfile.mkdtemp(dir=self.cartella), self.cartella)
+                percorso = os.path.join(sottocartella, nome)
+                sistema = self.apri(percorso, **argomenti)
+                popola(sistema, n=40)
+                sistema.salva_dati()
+                attese = versioni(sistema)
+                self.assertTrue(any(versione > 1 for versione in attese.values()))
+                self.assertEqual(versioni(self.apri(percorso, **argomenti)), attese)
+
+    def test_versione_attesa(self):
+        sistema = self.apri(journal=True)
+        id_richiesta = sistema.crea_richiesta_riparazione("cuffia", "hs 20", "SN1", "Rossi", "audio assente",
+                                                          TipoIntervento.RIPARAZIONE)
+        self.assertTrue(sistema.aggiorna_richiesta(id_richiesta, versione_attesa=1, costo_stimato=50))
+        with self.assertRaises(ConflittoVersione) as errore:
+            sistema.aggiorna_richiesta(id_richiesta, versione_attesa=1, costo_stimato=80)
+        self.assertEqual((errore.exception.versione_attesa, errore.exception.versione_attuale), (1, 2))
+        # Il conflitto non tocca niente, né in memoria né nel journal
+        self.assertEqual(sistema.richieste[id_richiesta].costo_stimato, 50.0)
+        riaperto = self.apri(journal=True)
+        self.assertEqual((riaperto.richieste[id_richiesta].costo_stimato, riaperto.richieste[id_richiesta].versione),
+                         (50.0, 2))
+
+    def test_modifiche_concorrenti(self):
+        for nome, argomenti in [("riparazioni.json", {'condiviso': True}),
+                                ("riparazioni.db", {'backend': 'sqlite', 'condiviso': True})]:
+            with self.subTest(file=nome):
+                sottocartella = os.path.relpath(tempfile.mkdtemp(dir=self.cartella), self.cartella)
+                percorso = os.path.join(sottocartella, nome)
+                primo = self.apri(percorso, **argomenti)
+                id_richiesta = primo.crea_richiesta_riparazione("cuffia", "hs 20", "SN1", "Rossi", "audio assente",
+                                                                TipoIntervento.RIPARAZIONE)
+                secondo = self.apri(percorso, **argomenti)
+                letta = secondo.richieste[id_richiesta].versione
+
+                primo.aggiorna_richiesta(id_richiesta, versione_attesa=letta, stato=StatoRiparazione.IN_LAVORAZIONE)
+                with self.assertRaises(ConflittoVersione):
+                    secondo.aggiorna_richiesta(id_richiesta, versione_attesa=letta, tecnico_assegnato="Luca")
+                # Dopo il conflitto il secondo vede la modifica del primo e può riprovare
+                richiesta = secondo.richieste[id_richiesta]
+                self.assertEqual(richiesta.stato, StatoRiparazione.IN_LAVORAZIONE)
+                secondo.aggiorna_richiesta(id_richiesta, versione_attesa=richiesta.versione, tecnico_assegnato="Luca")
+                finale = self.apri(percorso, **argomenti).richieste[id_richiesta]
+                self.assertEqual((finale.stato, finale.tecnico_assegnato, finale.versione),
+                                 (StatoRiparazione.IN_LAVORAZIONE, "Luca", 3))
+
+
+if __name__ == "__main__":
+    unittest.main()